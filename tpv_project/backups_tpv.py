@@ -0,0 +1,97 @@
+"""
+Script para gestionar el repositorio de backups de la base de datos.
+
+Los backups se guardan deduplicados en `data/backup/repositorio`: cada
+copia solo añade los fragmentos que cambiaron desde las anteriores.
+
+Uso:
+    python backups_tpv.py listar
+    python backups_tpv.py crear
+    python backups_tpv.py verificar [copia]
+    python backups_tpv.py restaurar <copia> [destino]   # por defecto data/tpv_restaurada.db
+    python backups_tpv.py podar [conservar]
+"""
+
+import sys
+from pathlib import Path
+
+# Agregar directorio raíz al path
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from data.database_encrypted import DatabaseManagerEncrypted
+
+
+def main():
+    """Función principal de gestión de backups."""
+    argumentos = sys.argv[1:]
+    if not argumentos or argumentos[0] not in ('listar', 'crear', 'verificar', 'restaurar', 'podar'):
+        print(__doc__)
+        return 1
+    orden, parametros = argumentos[0], argumentos[1:]
+
+    print()
+    print("=" * 70)
+    print(f"  BACKUPS DE tpv.db: {orden.upper()}")
+    print("=" * 70)
+    print()
+
+    db_path = Path('data/tpv.db')
+    if not db_path.exists():
+        print(f"✗ No existe la base de datos {db_path}")
+        return 1
+
+    try:
+        db = DatabaseManagerEncrypted(str(db_path), modo_sesion=False)
+
+        if orden == 'listar':
+            copias = db.listar_backups()
+            for copia in copias:
+                print(f"  {copia['nombre']}  {copia['fecha'][:19]}  "
+                      f"{copia['tamano_bytes'] / 1024:.2f} KB")
+            print()
+            print(f"✓ {len(copias)} copias, {db.obtener_estadisticas()['tamano_backups_bytes'] / 1024:.2f} KB en disco")
+
+        elif orden == 'crear':
+            copia = db.crear_backup()
+            print(f"✓ Backup creado: {copia.stem}")
+            print(f"  - Fragmentos nuevos: {db._copias.ultimos_fragmentos_escritos}")
+            print(f"  - Escrito: {db._copias.ultimos_bytes_escritos / 1024:.2f} KB")
+
+        elif orden == 'verificar':
+            errores = db.verificar_backups(parametros[0] if parametros else None)
+            for error in errores:
+                print(f"  ✗ {error}")
+            if errores:
+                print()
+                print(f"✗ {len(errores)} errores encontrados")
+                return 1
+            print("✓ Backups verificados correctamente")
+
+        elif orden == 'restaurar':
+            if not parametros:
+                print("✗ Indique la copia a restaurar (python backups_tpv.py listar)")
+                return 1
+            destino = parametros[1] if len(parametros) > 1 else 'data/tpv_restaurada.db'
+            ruta = db.restaurar_backup(parametros[0], destino)
+            print(f"✓ Copia restaurada en {ruta}")
+            print("  Cierre el TPV y sustituya data/tpv.db (y data/tpv.db.auditoria)")
+            print("  por lo restaurado para recuperarla")
+
+        elif orden == 'podar':
+            conservar = int(parametros[0]) if parametros else None
+            copias, fragmentos = db.podar_backups(conservar)
+            print(f"✓ Eliminadas {copias} copias y {fragmentos} fragmentos sin uso")
+
+        print()
+        return 0
+
+    except Exception as e:
+        print(f"✗ Error en la operación de backup: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
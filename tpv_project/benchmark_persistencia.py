@@ -0,0 +1,478 @@
+"""
+Benchmark de persistencia de la base de datos encriptada.
+
+Mide el coste de confirmar un ticket (guardar_recibo + checkpoint) a medida
+que crece la base de datos, comparando el formato de token único, el
+formato fragmentado (solo se reescriben los fragmentos modificados) y el
+diario de commits (solo se añade el registro del ticket), el efecto de la
+compresión previa al cifrado, la importación masiva de histórico frente a
+un `guardar_recibo` por ticket y el rendimiento y pico de memoria de cada
+algoritmo de cifrado.
+
+Todas las pruebas se ejecutan sobre bases de datos temporales; no se toca
+`data/tpv.db`.
+
+Uso:
+    python benchmark_persistencia.py                 # 1, 10, 50, 100 y 200 MB
+    python benchmark_persistencia.py --max-mb 50     # limitar el tamaño máximo
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from pathlib import Path
+
+# Agregar directorio raíz al path
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from data.database_encrypted import DatabaseManagerEncrypted
+
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    END = '\033[0m'
+
+def print_header(msg):
+    print(f"\n{Colors.BLUE}{'='*70}{Colors.END}")
+    print(f"{Colors.BLUE}{msg}{Colors.END}")
+    print(f"{Colors.BLUE}{'='*70}{Colors.END}\n")
+
+
+TAMANOS_MB = [1, 10, 50, 100, 200]
+REPETICIONES = 5
+
+RECIBO = {
+    'fecha': '01/01/2025 - 12:00:00',
+    'cliente_nombre': 'Benchmark',
+    'camarero_nombre': 'Benchmark',
+    'estado': 'efectivo',
+    'subtotal': 3.0,
+    'iva_porcentaje': 21.0,
+    'total': 3.0,
+    'impreso': False
+}
+LINEAS = [{
+    'producto_nombre': 'Caña',
+    'cantidad': 2,
+    'precio_unitario': 1.5,
+    'familia': 'Bebida',
+    'subtotal': 3.0
+}]
+
+
+def rellenar_hasta(db: DatabaseManagerEncrypted, megas: int) -> None:
+    """Hace crecer la base de datos (tabla `relleno`) hasta `megas` MB."""
+    objetivo = megas * 1024 * 1024
+    with db.get_connection() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS relleno (datos TEXT)")
+        while True:
+            paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+            tamano = paginas * conn.execute("PRAGMA page_size").fetchone()[0]
+            if tamano >= objetivo:
+                break
+            filas = max(1, min(5000, (objetivo - tamano) // 1100))
+            conn.execute("""
+                WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                INSERT INTO relleno (datos)
+                SELECT hex(randomblob(512)) FROM n
+            """, (filas,))
+
+
+def rellenar_con_recibos(db: DatabaseManagerEncrypted, megas: int) -> None:
+    """Hace crecer la base de datos hasta `megas` MB con recibos verosímiles.
+
+    A diferencia de `rellenar_hasta` (datos aleatorios, incompresibles), el
+    contenido se parece al de un TPV real y refleja lo que gana la compresión.
+    """
+    objetivo = megas * 1024 * 1024
+    with db.get_connection() as conn:
+        while True:
+            paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+            tamano = paginas * conn.execute("PRAGMA page_size").fetchone()[0]
+            if tamano >= objetivo:
+                break
+            filas = max(1, min(5000, (objetivo - tamano) // 500))
+            inicio = conn.execute("SELECT COALESCE(MAX(id), 0) FROM recibos").fetchone()[0]
+            conn.execute("""
+                WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                INSERT INTO recibos (id, fecha, fecha_ts, cliente_nombre, camarero_nombre,
+                                     estado, subtotal, iva_porcentaje, total, impreso,
+                                     fecha_creacion, fecha_modificacion)
+                SELECT ? + i,
+                       printf('%02d/%02d/2025 - %02d:%02d:00',
+                              1 + i % 28, 1 + i % 12, 8 + i % 16, i % 60),
+                       1735689600 + i * 600,
+                       'Cliente ' || (i % 150),
+                       'Camarero ' || (i % 6),
+                       CASE i % 3 WHEN 0 THEN 'tarjeta' ELSE 'efectivo' END,
+                       (i % 40) + 2.5, 21.0, (i % 40) + 2.5, i % 2,
+                       '2025-01-01T12:00:00', '2025-01-01T12:00:00'
+                FROM n
+            """, (filas, inicio))
+            conn.execute("""
+                INSERT INTO lineas_recibo (recibo_id, producto_nombre, cantidad,
+                                           precio_unitario, familia, subtotal)
+                SELECT r.id, p.nombre, 1 + r.id % 3, p.precio, p.familia,
+                       (1 + r.id % 3) * p.precio
+                FROM recibos r
+                JOIN (SELECT 'Caña' AS nombre, 1.5 AS precio, 'Bebida' AS familia
+                      UNION ALL SELECT 'Café con leche', 1.4, 'Cafetería'
+                      UNION ALL SELECT 'Tostada con tomate', 2.8, 'Desayuno'
+                      UNION ALL SELECT 'Bocadillo de lomo', 4.5, 'Cocina') p
+                WHERE r.id > ?
+            """, (inicio,))
+
+
+def medir_commit(db: DatabaseManagerEncrypted) -> tuple:
+    """Devuelve (ms medios, KB medios escritos) por commit de un ticket."""
+    tiempos = []
+    escritos = []
+    for _ in range(REPETICIONES):
+        inicio = time.perf_counter()
+        db.guardar_recibo(RECIBO, LINEAS)
+        db.volcar()
+        db.checkpoint()
+        tiempos.append(time.perf_counter() - inicio)
+
+        if db.usar_diario:
+            escritos.append(db._diario.ultimos_bytes_escritos)
+        elif db.es_fragmentada():
+            escritos.append(db._contenedor.ultimos_bytes_escritos)
+        else:
+            escritos.append(db.db_path.stat().st_size)
+
+    return (sum(tiempos) / len(tiempos) * 1000,
+            sum(escritos) / len(escritos) / 1024)
+
+
+def benchmark_commit_fragmentado(tamanos) -> None:
+    """Compara el coste por commit entre token único, fragmentado y diario."""
+    print_header("COMMIT DE UN TICKET: TOKEN ÚNICO vs FRAGMENTADO vs DIARIO")
+    print(f"{'Tamaño DB':>9} | {'Único':>9} {'Escrito':>10} | "
+          f"{'Fragm.':>9} {'Escrito':>10} | {'Diario':>9} {'Escrito':>8}")
+    print("-" * 78)
+
+    variantes = [(False, False), (True, False), (True, True)]
+    for megas in tamanos:
+        resultados = []
+        for fragmentada, diario in variantes:
+            with tempfile.TemporaryDirectory() as tmp:
+                db = DatabaseManagerEncrypted(str(Path(tmp) / 'bench.db'),
+                                              modo_sesion=True, diario=diario)
+                db.convertir_formato(fragmentada=fragmentada)
+                rellenar_hasta(db, megas)
+                db.compactar()
+                resultados.append(medir_commit(db))
+                db.cerrar()
+
+        columnas = [f"{ms:>6.1f} ms {kb:>7.0f} KB" for ms, kb in resultados]
+        print(f"{megas:>6} MB | " + " | ".join(columnas))
+
+
+MB_COMPRESION = 10
+COMPRESIONES = [None, 'zlib', 'lzma']
+
+
+def benchmark_compresion(megas: int) -> None:
+    """Coste por commit y tamaño en disco con y sin compresión previa al cifrado."""
+    from config.settings import EncryptionConfig
+
+    print_header(f"COMPRESIÓN ANTES DE CIFRAR: DB DE {megas} MB CON RECIBOS")
+    print(f"{'Compresión':>10} | {'En disco':>9} | {'Único':>9} {'Escrito':>10} | "
+          f"{'Fragm.':>9} {'Escrito':>10}")
+    print("-" * 70)
+
+    compresion_original = EncryptionConfig.COMPRESION
+    try:
+        for compresion in COMPRESIONES:
+            EncryptionConfig.COMPRESION = compresion
+            resultados = []
+            for fragmentada in (False, True):
+                with tempfile.TemporaryDirectory() as tmp:
+                    db = DatabaseManagerEncrypted(str(Path(tmp) / 'bench.db'),
+                                                  modo_sesion=True, diario=False)
+                    db.convertir_formato(fragmentada=fragmentada)
+                    rellenar_con_recibos(db, megas)
+                    db.compactar()
+                    if not fragmentada:
+                        en_disco = db.db_path.stat().st_size
+                    resultados.append(medir_commit(db))
+                    db.cerrar()
+
+            columnas = [f"{ms:>6.1f} ms {kb:>7.0f} KB" for ms, kb in resultados]
+            print(f"{str(compresion):>10} | {en_disco / 1024 / 1024:>6.2f} MB | "
+                  + " | ".join(columnas))
+    finally:
+        EncryptionConfig.COMPRESION = compresion_original
+
+
+LINEAS_IMPORTACION = 500_000
+LINEAS_POR_RECIBO = 4
+MUESTRA_POR_TICKET = 2000
+
+
+def _historico(recibos: int):
+    """Generador de recibos históricos con LINEAS_POR_RECIBO líneas."""
+    lineas = LINEAS * LINEAS_POR_RECIBO
+    for i in range(recibos):
+        recibo = dict(RECIBO, fecha=f'{1 + i % 28:02d}/{1 + i % 12:02d}/2025 - 12:00:00',
+                      total=3.0 * LINEAS_POR_RECIBO)
+        yield recibo, lineas
+
+
+def benchmark_importacion(lineas: int = LINEAS_IMPORTACION) -> None:
+    """Importación de histórico: guardar_recibos_bulk frente a un guardar_recibo por ticket."""
+    recibos = lineas // LINEAS_POR_RECIBO
+    print_header(f"IMPORTACIÓN DE {recibos} RECIBOS ({lineas} LÍNEAS)")
+    print(f"{'Método':>22} | {'Recibos':>8} | {'Tiempo':>9} | {'Filas/s':>9} | {'Estimado total':>14}")
+    print("-" * 74)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManagerEncrypted(str(Path(tmp) / 'bench.db'), modo_sesion=True)
+        inicio = time.perf_counter()
+        for recibo, lineas_recibo in _historico(MUESTRA_POR_TICKET):
+            db.guardar_recibo(recibo, lineas_recibo)
+        db.volcar()
+        segundos = time.perf_counter() - inicio
+        db.cerrar()
+    filas = MUESTRA_POR_TICKET * (1 + LINEAS_POR_RECIBO)
+    print(f"{'guardar_recibo':>22} | {MUESTRA_POR_TICKET:>8} | {segundos:>7.2f} s | "
+          f"{filas / segundos:>9.0f} | {segundos * recibos / MUESTRA_POR_TICKET:>12.0f} s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManagerEncrypted(str(Path(tmp) / 'bench.db'), modo_sesion=True)
+        resultado = db.guardar_recibos_bulk(_historico(recibos))
+        db.cerrar()
+    print(f"{'guardar_recibos_bulk':>22} | {recibos:>8} | {resultado['segundos']:>7.2f} s | "
+          f"{resultado['filas_por_segundo']:>9} | {resultado['segundos']:>12.0f} s")
+
+
+RECIBOS_BACKENDS = 20_000
+TICKETS_BACKENDS = 200
+BACKENDS = ['archivo', 'sqlite', 'kv']
+
+
+def _crear_backend(nombre: str, directorio: Path):
+    """Gestor de datos `nombre` (ver `DatabaseConfig.BACKEND`) en `directorio`."""
+    from data.data_manager import DataManager
+    from data.data_manager_sqlite import DataManagerSQLite
+    from data.data_manager_kv import DataManagerKV
+
+    if nombre == 'archivo':
+        return DataManager(directorio)
+    if nombre == 'sqlite':
+        return DataManagerSQLite(DatabaseManagerEncrypted(str(directorio / 'tpv.db')))
+    return DataManagerKV(directorio / 'tpv.kv')
+
+
+def _ticket(i: int, estado: str):
+    from datetime import date
+    from models.receipt import Receipt, LineaRecibo
+
+    pedido = [LineaRecibo(1 + i % 3, 'Caña', 1.5, 'Bebida'),
+              LineaRecibo(1, 'Tostada con tomate', 2.8, 'Comida')]
+    return Receipt(pedido=pedido, nombre=f'Mesa {i % 20}', estado=estado,
+                   fecha=f'{1 + i % 28:02d}/{1 + i % 12:02d}/{date.today().year} - '
+                         f'{8 + i % 16:02d}:{i % 60:02d}:00',
+                   camarero='Luis')
+
+
+def benchmark_backends(recibos: int = RECIBOS_BACKENDS, tickets: int = TICKETS_BACKENDS) -> None:
+    """El mismo uso de la caja sobre los tres gestores de datos.
+
+    Con `recibos` pagados en el año mide, por ticket, lo que espera la caja
+    al dejarlo pendiente (agregar_recibo_pendiente + guardar_datos_generales)
+    y al cobrarlo (eliminar_recibo_pendiente + guardar_recibos_anuales +
+    guardar_datos_generales), y el arranque (datos generales y recibos del año).
+    """
+    from config.settings import DatabaseConfig
+
+    print_header(f"GESTORES DE DATOS: {tickets} TICKETS CON {recibos} RECIBOS EN EL AÑO")
+    print(f"{'Backend':>8} | {'Pendiente':>10} | {'Cobro':>10} | {'Arranque':>9} | {'En disco':>9}")
+    print("-" * 60)
+
+    backup_original = DatabaseConfig.BACKUP_AUTOMATICO
+    DatabaseConfig.BACKUP_AUTOMATICO = False
+    try:
+        for nombre in BACKENDS:
+            with tempfile.TemporaryDirectory() as tmp:
+                _medir_backend(nombre, Path(tmp), recibos, tickets)
+    finally:
+        DatabaseConfig.BACKUP_AUTOMATICO = backup_original
+
+
+def _medir_backend(nombre: str, directorio: Path, recibos: int, tickets: int) -> None:
+    from models.receipt import ReceiptManager
+
+    dm = _crear_backend(nombre, directorio)
+    dm.cargar_datos_generales()
+    anuales = ReceiptManager()
+    for i in range(recibos):
+        anuales.agregar_recibo(_ticket(i, 'efectivo'))
+    dm.guardar_recibos_anuales(anuales)
+    dm.guardar_datos_generales()
+
+    inicio = time.perf_counter()
+    for i in range(tickets):
+        dm.agregar_recibo_pendiente(_ticket(i, 'pendiente'))
+        dm.guardar_datos_generales()
+    pendiente = (time.perf_counter() - inicio) / tickets * 1000
+
+    inicio = time.perf_counter()
+    for recibo in list(dm.receipts_pending):
+        dm.eliminar_recibo_pendiente(recibo.fecha)
+        recibo.marcar_como_pagado('tarjeta')
+        anuales.agregar_recibo(recibo)
+        dm.guardar_recibos_anuales(anuales)
+        dm.guardar_datos_generales()
+    cobro = (time.perf_counter() - inicio) / tickets * 1000
+    dm.cerrar()
+
+    inicio = time.perf_counter()
+    dm = _crear_backend(nombre, directorio)
+    dm.cargar_datos_generales()
+    cargados = len(dm.cargar_recibos_anuales().obtener_todos_recibos())
+    arranque = time.perf_counter() - inicio
+    dm.cerrar()
+    if cargados != recibos + tickets:
+        print(f"{Colors.RED}✗ {nombre}: {cargados} recibos cargados "
+              f"de {recibos + tickets}{Colors.END}")
+
+    en_disco = sum(r.stat().st_size for r in directorio.rglob('*') if r.is_file())
+    print(f"{nombre:>8} | {pendiente:>7.2f} ms | {cobro:>7.2f} ms | "
+          f"{arranque:>7.2f} s | {en_disco / 1024 / 1024:>6.2f} MB")
+
+
+TICKETS_HORA_PUNTA = 500
+POLITICAS = ['sincrona', 'commit', 'commits', 'intervalo', 'inactividad']
+
+
+def benchmark_hora_punta(tickets: int = TICKETS_HORA_PUNTA) -> None:
+    """Ráfaga de tickets con cada política del hilo de persistencia.
+
+    Mide lo que espera quien confirma (el hilo de Tk) y la cola/retraso
+    máximos que acumula el hilo de persistencia.
+    """
+    from config.settings import DatabaseConfig
+
+    print_header(f"HORA PUNTA: {tickets} TICKETS SEGUIDOS POR POLÍTICA")
+    print(f"{'Política':>12} | {'Commit medio':>12} | {'Cola máx':>8} | "
+          f"{'Retraso máx':>11} | {'fsync':>6}")
+    print("-" * 70)
+
+    politica_original = DatabaseConfig.PERSISTENCIA
+    try:
+        for politica in POLITICAS:
+            DatabaseConfig.PERSISTENCIA = politica
+            with tempfile.TemporaryDirectory() as tmp:
+                db = DatabaseManagerEncrypted(str(Path(tmp) / 'bench.db'),
+                                              modo_sesion=True, diario=True)
+                inicio = time.perf_counter()
+                for _ in range(tickets):
+                    db.guardar_recibo(RECIBO, LINEAS)
+                medio = (time.perf_counter() - inicio) / tickets * 1000
+                time.sleep(DatabaseConfig.PERSISTENCIA_SEGUNDOS + 0.5)
+                estado = db.estado_persistencia()
+                db.cerrar()
+
+            print(f"{politica:>12} | {medio:>9.2f} ms | {estado['max_pendientes']:>8} | "
+                  f"{estado['max_retraso_s']:>9.3f} s | {estado['volcados']:>6}")
+    finally:
+        DatabaseConfig.PERSISTENCIA = politica_original
+
+
+MB_CIFRADO = 100
+ALGORITMOS = ['fernet', 'aesgcm', 'chacha20']
+
+
+def _medir_cifrado(algoritmo: str, megas: int) -> dict:
+    """Cifra y descifra una imagen de `megas` MB a disco (proceso aislado).
+
+    Se ejecuta en un subproceso propio para que el pico de memoria
+    (ru_maxrss) corresponda solo a este algoritmo.
+    """
+    import resource
+    from core.cipher import obtener_cifrador
+
+    cifrador = obtener_cifrador(algoritmo=algoritmo)
+    imagen = os.urandom(megas * 1024 * 1024)
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = Path(tmp) / 'imagen.cifrada'
+
+        inicio = time.perf_counter()
+        cifrador.cifrar_a_archivo(imagen, ruta)
+        t_cifrar = time.perf_counter() - inicio
+        tamano = ruta.stat().st_size
+
+        inicio = time.perf_counter()
+        recuperada = cifrador.descifrar_archivo(ruta)
+        t_descifrar = time.perf_counter() - inicio
+        assert recuperada == imagen
+
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'cifrar_mb_s': megas / t_cifrar,
+        'descifrar_mb_s': megas / t_descifrar,
+        'tamano_mb': tamano / 1024 / 1024,
+        # ru_maxrss está en KB en Linux; restamos la imagen ya cargada
+        'pico_extra_mb': (pico - base) / 1024
+    }
+
+
+def benchmark_cifrado(megas: int) -> None:
+    """Compara rendimiento y pico de memoria de cada algoritmo de cifrado."""
+    print_header(f"CIFRADO DE UNA IMAGEN DE {megas} MB: FERNET vs AEAD BINARIO")
+    try:
+        import resource  # noqa: F401
+    except ImportError:
+        print(f"{Colors.YELLOW}⚠ Módulo 'resource' no disponible en esta plataforma{Colors.END}")
+        return
+
+    print(f"{'Algoritmo':>10} | {'Cifrar':>11} {'Descifrar':>11} | "
+          f"{'En disco':>10} | {'Memoria extra':>13}")
+    print("-" * 70)
+
+    for algoritmo in ALGORITMOS:
+        salida = subprocess.run(
+            [sys.executable, __file__, '--cifrado-worker', algoritmo, str(megas)],
+            capture_output=True, text=True, check=True, cwd=str(ROOT_DIR)
+        ).stdout
+        r = json.loads(salida.strip().splitlines()[-1])
+        print(f"{algoritmo:>10} | {r['cifrar_mb_s']:>6.0f} MB/s {r['descifrar_mb_s']:>6.0f} MB/s | "
+              f"{r['tamano_mb']:>7.1f} MB | {r['pico_extra_mb']:>10.0f} MB")
+
+
+def main():
+    """Ejecuta los benchmarks."""
+    if '--cifrado-worker' in sys.argv:
+        indice = sys.argv.index('--cifrado-worker')
+        algoritmo, megas = sys.argv[indice + 1], int(sys.argv[indice + 2])
+        print(json.dumps(_medir_cifrado(algoritmo, megas)))
+        return 0
+
+    tamanos = TAMANOS_MB
+    if '--max-mb' in sys.argv:
+        maximo = int(sys.argv[sys.argv.index('--max-mb') + 1])
+        tamanos = [t for t in TAMANOS_MB if t <= maximo]
+
+    benchmark_commit_fragmentado(tamanos)
+    benchmark_compresion(min(MB_COMPRESION, max(tamanos)))
+    benchmark_importacion()
+    benchmark_backends()
+    benchmark_hora_punta()
+    benchmark_cifrado(MB_CIFRADO)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,6 +11,7 @@ from .settings import (
     TicketConfig,
     PrinterConfig,
     EncryptionConfig,
+    DatabaseConfig,
     ProductConfig,
     UIConfig,
     KeyboardConfig,
@@ -31,6 +32,7 @@ __all__ = [
     'TicketConfig',
     'PrinterConfig',
     'EncryptionConfig',
+    'DatabaseConfig',
     'ProductConfig',
     'UIConfig',
     'KeyboardConfig',
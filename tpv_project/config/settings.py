@@ -129,6 +129,145 @@ class EncryptionConfig:
     
     # IMPORTANTE: En producción, esta clave debería estar en variables de entorno
     ENCRYPTION_KEY = b'5-uvWBhTHRAk7Eq8wlzdnXZlLCZFj8rE44rUN49wztg='
+    
+    # Algoritmo para las escrituras NUEVAS: 'aesgcm' o 'chacha20' (formato
+    # binario por segmentos, ver core/cipher.py) o 'fernet' (formato
+    # original). La lectura detecta el formato, así que los archivos
+    # antiguos siguen siendo legibles.
+    ALGORITMO = 'aesgcm'
+    TAMANO_SEGMENTO = 1024 * 1024  # bytes por segmento cifrado
+    
+    # Compresión antes de cifrar (solo formato binario): 'zlib', 'lzma' o
+    # None. Las imágenes SQLite y las listas JSON de recibos se reducen
+    # varias veces; un flag en la cabecera indica si un archivo va
+    # comprimido, así que los archivos existentes siguen siendo legibles.
+    # Nivel 0-9 (zlib) o preset 0-9 (lzma): más alto, más lento.
+    COMPRESION = 'zlib'
+    NIVEL_COMPRESION = 1
+
+
+# ============================================================================
+# CONFIGURACIÓN DE BASE DE DATOS
+# ============================================================================
+
+class DatabaseConfig:
+    """Configuración de la base de datos SQLite encriptada."""
+    
+    # Modo sesión: la base de datos se descifra una sola vez al arrancar en
+    # una SQLite en memoria y solo se vuelve a cifrar en los checkpoints
+    # (guardado de datos generales, backup y cierre de la aplicación).
+    # Si es False, cada operación descifra y cifra el archivo completo.
+    MODO_SESION = True
+    
+    # Formato en disco de las bases de datos NUEVAS: fragmentos cifrados por
+    # separado (solo se reescriben los que cambian) en lugar de un único
+    # token. Los archivos existentes conservan su formato hasta convertirlos
+    # con `python convertir_db_fragmentada.py`.
+    FORMATO_FRAGMENTADO = True
+    TAMANO_FRAGMENTO = 64 * 1024  # bytes (se alinea al tamaño de página)
+    
+    # Diario de commits (solo en modo sesión): cada transacción confirmada
+    # se añade cifrada a `tpv.db.journal`, así que es durable sin reescribir
+    # la imagen completa. La imagen se compacta (diario volcado y vaciado)
+    # al superar el tamaño o la edad máximos, tras un periodo de
+    # inactividad y al cerrar.
+    DIARIO = True
+    DIARIO_FSYNC = True               # forzar cada registro a disco
+    DIARIO_MAX_BYTES = 4 * 1024 * 1024
+    DIARIO_MAX_EDAD = 10 * 60         # segundos
+    DIARIO_INACTIVIDAD = 60           # segundos sin commits
+    DIARIO_INTERVALO = 15             # segundos entre comprobaciones
+    
+    # Hilo de persistencia del diario: los commits vuelven al instante y
+    # sus registros se escriben en segundo plano según la política:
+    #   'sincrona'    - en el propio commit (el hilo que confirma espera)
+    #   'commit'      - tras cada commit, en el hilo de persistencia
+    #   'commits'     - cada PERSISTENCIA_COMMITS commits
+    #   'intervalo'   - cada PERSISTENCIA_SEGUNDOS segundos
+    #   'inactividad' - tras PERSISTENCIA_SEGUNDOS segundos sin commits
+    # Con cualquier política ningún commit espera más de
+    # PERSISTENCIA_RETRASO_MAX segundos. Al salir (atexit, SIGTERM/SIGINT)
+    # se vuelca todo lo pendiente.
+    PERSISTENCIA = 'commit'
+    PERSISTENCIA_COMMITS = 20
+    PERSISTENCIA_SEGUNDOS = 2.0
+    PERSISTENCIA_RETRASO_MAX = 5.0
+    
+    # Recibos leídos por consulta al recorrerlos (iter_recibos)
+    TAMANO_PAGINA_RECIBOS = 500
+    
+    # Importación masiva (guardar_recibos_bulk): recibos por executemany
+    TAMANO_BLOQUE_IMPORTACION = 5000
+    
+    # Instantáneas de lectura (informes, integridad, hilos de trabajo): copias
+    # en memoria de lo confirmado que se leen sin bloquear los commits. Se
+    # reutilizan mientras no haya commits nuevos; cada una ocupa lo que la
+    # base de datos en memoria.
+    INSTANTANEAS_MAX = 2
+    
+    # Páginas libres: los borrados (recibos eliminados, tickets pendientes
+    # que se unen) dejan páginas vacías que se cifran y escriben en cada
+    # volcado. Si superan VACUUM_RELACION del total (y al menos
+    # VACUUM_MIN_PAGINAS) se reconstruye la imagen con VACUUM: en modo
+    # sesión tras DIARIO_INACTIVIDAD sin commits y al cerrar; en modo por
+    # operación, en la escritura que lo detecta.
+    VACUUM_RELACION = 0.25
+    VACUUM_MIN_PAGINAS = 256
+    
+    # Auditoría: segmentos mensuales cifrados junto a la base de datos
+    # (`tpv.db.auditoria/`), un bloque comprimido por transacción. Los
+    # meses anteriores se sellan (recomprimen en un bloque) al rotar.
+    AUDITORIA_FSYNC = False
+    AUDITORIA_COMPRESION = 6          # nivel de zlib (0-9)
+    
+    # Backups: repositorio deduplicado en `data/backup/repositorio`. Cada
+    # copia guarda solo los fragmentos nuevos; se conservan las últimas
+    # BACKUP_CONSERVAR copias (ver `python backups_tpv.py`).
+    BACKUP_CONSERVAR = 30
+    
+    # Backups programados (hilo en segundo plano, ver data/backup_scheduler.py):
+    # una copia cada BACKUP_INTERVALO segundos y tras BACKUP_RECIBOS recibos
+    # confirmados, nunca más de una cada BACKUP_INTERVALO_MINIMO segundos.
+    # 0 desactiva el disparador correspondiente.
+    BACKUP_AUTOMATICO = True
+    BACKUP_INTERVALO = 6 * 3600
+    BACKUP_RECIBOS = 200
+    BACKUP_INTERVALO_MINIMO = 15 * 60
+    
+    # Archivo anual: los recibos de los años cerrados se pasan a archivos
+    # cifrados de solo lectura (`tpv.db.archivo/anio_AAAA.db`) con el primer
+    # ticket del año nuevo. Solo se descifran cuando una consulta toca su
+    # año y se mantienen en memoria los ARCHIVO_ANIOS_EN_MEMORIA más usados.
+    ARCHIVO_ANIOS_EN_MEMORIA = 2
+    
+    # Servicio de base de datos para varias cajas en la misma máquina (ver
+    # data/db_service.py): un proceso (`python servicio_db.py`) es el único
+    # que abre tpv.db y atiende a los TPV por un socket local (`tpv.db.sock`;
+    # TCP en 127.0.0.1:SERVICIO_PUERTO si no hay sockets Unix). Con SERVICIO
+    # activo el DataManager usa el servicio y lo arranca si no está en
+    # marcha; el servicio arrancado así termina SERVICIO_CIERRE segundos
+    # después de desconectarse el último TPV.
+    SERVICIO = False
+    SERVICIO_PUERTO = 47391
+    SERVICIO_MAX_CLIENTES = 8
+    SERVICIO_CIERRE = 30
+    SERVICIO_ESPERA_ARRANQUE = 15     # segundos esperando a que arranque
+    SERVICIO_ESPERA_LOTE = 30         # segundos de inactividad de un lote abierto
+                                      # antes de deshacerlo y liberar la base de datos
+    
+    # Gestor de datos que usa la aplicación (main.py, o `--backend=`):
+    #   'sqlite'  - esta base de datos SQLite cifrada (data/tpv.db)
+    #   'kv'      - almacén clave-valor cifrado en registro (data/tpv.kv/,
+    #               ver data/log_store.py): cada cambio añade un registro
+    #               cifrado y las lecturas por clave usan un índice en memoria
+    #   'archivo' - archivos cifrados completos (data.tpv, anual.AAAA.tpv)
+    BACKEND = 'sqlite'
+    
+    # Almacén clave-valor: segmentos de KV_TAMANO_SEGMENTO bytes; al haber
+    # KV_SEGMENTOS_FUSION cerrados se fusionan en segundo plano.
+    KV_FSYNC = True                   # forzar cada escritura a disco
+    KV_TAMANO_SEGMENTO = 4 * 1024 * 1024
+    KV_SEGMENTOS_FUSION = 4
 
 
 # ============================================================================
@@ -313,6 +452,7 @@ __all__ = [
     'TicketConfig',
     'PrinterConfig',
     'EncryptionConfig',
+    'DatabaseConfig',
     'ProductConfig',
     'UIConfig',
     'KeyboardConfig',
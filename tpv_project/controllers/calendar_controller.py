@@ -22,6 +22,10 @@ class CalendarController:
         """
         self.receipt_manager = receipt_manager
         self._fecha_actual: datetime.date = datetime.date.today()
+        
+        # Gestor de datos (lo asigna main.py); si ofrece
+        # `obtener_ventas_diarias` los totales se leen de los agregados
+        self.data_manager = None
     
     def obtener_fecha_actual(self) -> datetime.date:
         """
@@ -107,14 +111,7 @@ class CalendarController:
         Returns:
             float: Total de ventas
         """
-        recibos = self.obtener_recibos_dia(fecha)
-        
-        total = 0.0
-        for recibo in recibos:
-            if metodo_pago is None or recibo.estado == metodo_pago:
-                total += recibo.calcular_total()
-        
-        return total
+        return sum(self.obtener_ventas_por_dia(fecha, fecha, metodo_pago).values())
     
     def calcular_total_mes(self, fecha: datetime.date,
                           metodo_pago: Optional[str] = None) -> float:
@@ -128,14 +125,48 @@ class CalendarController:
         Returns:
             float: Total de ventas del mes
         """
-        recibos_mes = self.receipt_manager.obtener_recibos_mes(fecha.month)
+        inicio = datetime.date(fecha.year, fecha.month, 1)
+        fin = datetime.date(fecha.year, fecha.month, self.obtener_dias_mes(fecha))
+        return sum(self.obtener_ventas_por_dia(inicio, fin, metodo_pago).values())
+    
+    def obtener_ventas_por_dia(self, inicio: datetime.date, fin: datetime.date,
+                               metodo_pago: Optional[str] = None) -> Dict[datetime.date, float]:
+        """
+        Obtiene el total vendido cada día de un rango.
         
-        total = 0.0
-        for recibo in recibos_mes:
-            if metodo_pago is None or recibo.estado == metodo_pago:
-                total += recibo.calcular_total()
+        Con la base de datos encriptada se leen los agregados de
+        `ventas_diarias` (como mucho una fila por día); con el gestor de
+        datos original se suman los recibos cargados.
         
-        return total
+        Args:
+            inicio: Primer día (inclusive)
+            fin: Último día (inclusive)
+            metodo_pago: Filtrar por método de pago; si es None, todos los pagados
+            
+        Returns:
+            Dict[date, float]: Total por día (solo los días con ventas)
+        """
+        metodos = [metodo_pago] if metodo_pago else [
+            TicketConfig.ESTADO_EFECTIVO, TicketConfig.ESTADO_TARJETA
+        ]
+        
+        if hasattr(self.data_manager, 'obtener_ventas_diarias'):
+            return {
+                venta['fecha']: venta['total']
+                for venta in self.data_manager.obtener_ventas_diarias(inicio, fin, metodos)
+            }
+        
+        ventas: Dict[datetime.date, float] = {}
+        for mes in range(inicio.month, fin.month + 1):
+            for recibo in self.receipt_manager.obtener_recibos_mes(mes):
+                if recibo.estado not in metodos:
+                    continue
+                dia = datetime.datetime.strptime(
+                    recibo.fecha.split(' - ')[0], TicketConfig.DATE_FORMAT
+                ).date()
+                if inicio <= dia <= fin:
+                    ventas[dia] = ventas.get(dia, 0.0) + recibo.calcular_total()
+        return ventas
     
     def generar_reporte_diario(self, fecha: datetime.date, iva: float) -> str:
         """
@@ -233,10 +264,14 @@ class CalendarController:
         
         num_dias = self.obtener_dias_mes(fecha)
         total_general = 0.0
+        ventas = self.obtener_ventas_por_dia(
+            datetime.date(fecha.year, fecha.month, 1),
+            datetime.date(fecha.year, fecha.month, num_dias)
+        )
         
         for dia in range(1, num_dias + 1):
             fecha_dia = datetime.date(fecha.year, fecha.month, dia)
-            total_dia = self.calcular_total_dia(fecha_dia)
+            total_dia = ventas.get(fecha_dia, 0.0)
             total_general += total_dia
             
             fecha_str = fecha_dia.strftime("%d/%m/%Y")
@@ -281,10 +316,15 @@ class CalendarController:
         
         num_dias = self.obtener_dias_mes(fecha)
         total_general = 0.0
+        ventas = self.obtener_ventas_por_dia(
+            datetime.date(fecha.year, fecha.month, 1),
+            datetime.date(fecha.year, fecha.month, num_dias),
+            metodo
+        )
         
         for dia in range(1, num_dias + 1):
             fecha_dia = datetime.date(fecha.year, fecha.month, dia)
-            total_dia = self.calcular_total_dia(fecha_dia, metodo)
+            total_dia = ventas.get(fecha_dia, 0.0)
             total_general += total_dia
             
             fecha_str = fecha_dia.strftime("%d/%m/%Y")
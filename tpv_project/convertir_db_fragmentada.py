@@ -0,0 +1,86 @@
+"""
+Script para convertir la base de datos encriptada al formato fragmentado.
+
+Convierte `data/tpv.db` de un único token Fernet (formato original) a un
+contenedor de fragmentos cifrados por separado, en el que cada commit solo
+vuelve a cifrar los fragmentos cuyas páginas cambiaron.
+
+Antes de convertir se crea un backup en el repositorio de `data/backup/`.
+
+Uso:
+    python convertir_db_fragmentada.py            # token único -> fragmentado
+    python convertir_db_fragmentada.py --inverso  # fragmentado -> token único
+"""
+
+import sys
+from pathlib import Path
+
+# Agregar directorio raíz al path
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from data.database_encrypted import DatabaseManagerEncrypted
+
+
+def main():
+    """Función principal de conversión."""
+    inverso = '--inverso' in sys.argv[1:]
+    destino = 'token único' if inverso else 'fragmentado'
+
+    print()
+    print("=" * 70)
+    print(f"  CONVERSIÓN DE tpv.db AL FORMATO {destino.upper()}")
+    print("=" * 70)
+    print()
+
+    db_path = Path('data/tpv.db')
+    if not db_path.exists():
+        print(f"✗ No existe la base de datos {db_path}")
+        return 1
+
+    try:
+        db = DatabaseManagerEncrypted(str(db_path), modo_sesion=False)
+
+        if db.es_fragmentada() != inverso:
+            print(f"✓ La base de datos ya está en formato {destino}")
+            return 0
+
+        # PASO 1: Backup
+        print("PASO 1: Creando backup del archivo actual...")
+        backup_path = db.crear_backup()
+        print(f"✓ Backup creado: {backup_path.stem}")
+        print()
+
+        # PASO 2: Conversión
+        print(f"PASO 2: Convirtiendo a formato {destino}...")
+        antes = db.obtener_estadisticas()
+        db.convertir_formato(fragmentada=not inverso)
+        print("✓ Conversión completada")
+        print()
+
+        # PASO 3: Verificación
+        print("PASO 3: Verificando la base de datos convertida...")
+        despues = DatabaseManagerEncrypted(str(db_path), modo_sesion=False).obtener_estadisticas()
+
+        for clave in ('productos_activos', 'clientes', 'camareros', 'recibos'):
+            if antes[clave] != despues[clave]:
+                print(f"✗ Discrepancia en '{clave}': {antes[clave]} → {despues[clave]}")
+                print(f"  Restaure el backup si es necesario: "
+                      f"python backups_tpv.py restaurar {backup_path.stem}")
+                return 1
+
+        print("✓ Contenido verificado")
+        print(f"  - Tamaño antes: {antes['tamano_db_bytes'] / 1024:.2f} KB")
+        print(f"  - Tamaño después: {despues['tamano_db_bytes'] / 1024:.2f} KB")
+        print()
+        return 0
+
+    except Exception as e:
+        print(f"✗ Error durante la conversión: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
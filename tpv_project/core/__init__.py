@@ -5,10 +5,13 @@
 Paquete core con funcionalidades fundamentales.
 """
 
+from .cipher import Cipher, obtener_cifrador
 from .encryption import EncryptionManager, get_encryption_manager
 from .image_manager import ImageManager, get_image_manager
 
 __all__ = [
+    'Cipher',
+    'obtener_cifrador',
     'EncryptionManager',
     'get_encryption_manager',
     'ImageManager',
@@ -0,0 +1,387 @@
+"""
+Capa de cifrado intercambiable para los archivos de la aplicación TPV.
+
+Ofrece dos formatos, identificados en disco para que los archivos antiguos
+sigan siendo legibles:
+
+- Versión 0 (original): token Fernet (base64, sin cabecera propia).
+- Versión 1 (binario AEAD): cabecera `TPVX` + segmentos cifrados con
+  AES-256-GCM o ChaCha20-Poly1305. Sin inflación base64 y con cifrado en
+  flujo: se procesa por segmentos, sin necesidad de tener el texto en claro
+  y el cifrado completos en memoria a la vez.
+
+Formato binario (versión 1):
+
+    cabecera (20 bytes):
+        MAGIC 'TPVX' (4) | versión (1) | algoritmo (1) | flags (2)
+        | tamaño de segmento (4) | prefijo de nonce (8)
+    segmentos:
+        AEAD(segmento_i) = datos + tag (16); el último puede ser más corto
+
+El nonce de cada segmento es prefijo (8) + contador (3) + indicador de
+último segmento (1), y la cabecera se autentica como datos asociados, de
+modo que truncar, reordenar o recortar segmentos se detecta al descifrar.
+
+Compresión: con `compresion` = 'zlib' o 'lzma' el texto en claro se
+comprime (en flujo) antes de cifrarlo y la cabecera lo indica con
+`FLAG_ZLIB` / `FLAG_LZMA`; al descifrar se descomprime según los flags,
+así que los archivos sin compresión (flags 0) siguen siendo legibles. El
+formato Fernet no tiene cabecera y nunca se comprime.
+
+Las claves se derivan una sola vez por clave bruta y se cachean en un
+`ContextoClave` (ver `obtener_cifrador`).
+"""
+
+import io
+import os
+import base64
+import hashlib
+import lzma
+import struct
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Union
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from config.settings import EncryptionConfig
+
+
+MAGIC = b"TPVX"
+VERSION_BINARIA = 1
+
+ALGORITMO_AESGCM = 1
+ALGORITMO_CHACHA20 = 2
+
+_CABECERA = struct.Struct(">4sBBHI8s")
+TAMANO_TAG = 16
+
+# Flags de la cabecera: compresión aplicada antes de cifrar
+FLAG_ZLIB = 0x0001
+FLAG_LZMA = 0x0002
+
+
+class ErrorDescifrado(ValueError):
+    """Clave incorrecta o datos cifrados corruptos/alterados."""
+
+
+# ============================================================================
+# CONTEXTO DE CLAVE
+# ============================================================================
+
+def derivar_clave_fernet(raw_key: bytes) -> bytes:
+    """Deriva una clave Fernet a partir de una clave bruta.
+
+    Si `raw_key` ya parece una clave Fernet válida (44 bytes base64 urlsafe),
+    se usa tal cual. Si no, se deriva SHA256(raw_key) en base64 urlsafe.
+    """
+    if raw_key is None:
+        raise ValueError("No hay clave de encriptación configurada")
+
+    if len(raw_key) == 44:
+        try:
+            base64.urlsafe_b64decode(raw_key)
+            return raw_key
+        except Exception:
+            pass
+
+    h = hashlib.sha256(raw_key).digest()
+    return base64.urlsafe_b64encode(h)
+
+
+class ContextoClave:
+    """Material de clave derivado una sola vez y los objetos de cifrado listos."""
+
+    def __init__(self, raw_key: Union[bytes, str]):
+        if isinstance(raw_key, str):
+            raw_key = raw_key.encode("utf-8")
+
+        self.clave_fernet = derivar_clave_fernet(raw_key)
+        self.fernet = Fernet(self.clave_fernet)
+
+        # Clave AEAD independiente derivada con HKDF de la clave Fernet
+        material = base64.urlsafe_b64decode(self.clave_fernet)
+        self.clave_aead = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b"tpv-aead-v1"
+        ).derive(material)
+
+        self.aead = {
+            ALGORITMO_AESGCM: AESGCM(self.clave_aead),
+            ALGORITMO_CHACHA20: ChaCha20Poly1305(self.clave_aead)
+        }
+
+
+# ============================================================================
+# CIFRADOR
+# ============================================================================
+
+class Cipher:
+    """Cifra y descifra datos con el formato configurado.
+
+    Al descifrar detecta automáticamente el formato (Fernet o binario).
+    """
+
+    ALGORITMOS = {
+        'aesgcm': ALGORITMO_AESGCM,
+        'chacha20': ALGORITMO_CHACHA20
+    }
+
+    COMPRESIONES = {
+        'zlib': FLAG_ZLIB,
+        'lzma': FLAG_LZMA
+    }
+
+    def __init__(self, contexto: ContextoClave, algoritmo: str = 'aesgcm',
+                 tamano_segmento: int = 1024 * 1024,
+                 compresion: Optional[str] = None, nivel_compresion: int = 6):
+        """
+        Args:
+            contexto: Contexto de clave cacheado
+            algoritmo: 'aesgcm', 'chacha20' o 'fernet' (formato original)
+            tamano_segmento: Tamaño de segmento del formato binario
+            compresion: 'zlib', 'lzma' o None (solo formato binario)
+            nivel_compresion: Nivel de zlib (0-9) o preset de lzma (0-9)
+        """
+        if algoritmo != 'fernet' and algoritmo not in self.ALGORITMOS:
+            raise ValueError(f"Algoritmo de cifrado desconocido: {algoritmo}")
+        if compresion is not None and compresion not in self.COMPRESIONES:
+            raise ValueError(f"Compresión desconocida: {compresion}")
+
+        self.contexto = contexto
+        self.algoritmo = algoritmo
+        self.tamano_segmento = tamano_segmento
+        self.compresion = compresion
+        self.nivel_compresion = nivel_compresion
+
+    # -------------------------- Detección ------------------------------------
+    @staticmethod
+    def es_binario(datos: bytes) -> bool:
+        """Indica si `datos` empieza con la cabecera del formato binario."""
+        return datos[:len(MAGIC)] == MAGIC
+
+    # -------------------------- API en memoria -------------------------------
+    def cifrar(self, datos: bytes, flags: int = 0, comprimir: bool = True) -> bytes:
+        """Cifra `datos` con el formato configurado.
+
+        `comprimir=False` omite la compresión para datos que ya vienen comprimidos.
+        """
+        if self.algoritmo == 'fernet':
+            return self.contexto.fernet.encrypt(datos)
+
+        destino = io.BytesIO()
+        self.cifrar_flujo(io.BytesIO(datos), destino, flags, comprimir)
+        return destino.getvalue()
+
+    def descifrar(self, datos: bytes) -> bytes:
+        """Descifra `datos` en cualquiera de los formatos soportados.
+
+        Raises:
+            ErrorDescifrado: Si la clave no es correcta o los datos están alterados
+        """
+        return self.descifrar_con_flags(datos)[0]
+
+    def descifrar_con_flags(self, datos: bytes) -> tuple:
+        """Como `descifrar`, pero devuelve también los flags de la cabecera."""
+        if not self.es_binario(datos):
+            try:
+                return self.contexto.fernet.decrypt(datos), 0
+            except InvalidToken:
+                raise ErrorDescifrado("Clave de encriptación incorrecta o datos corruptos")
+
+        destino = io.BytesIO()
+        flags = self.descifrar_flujo(io.BytesIO(datos), destino)
+        return destino.getvalue(), flags
+
+    # -------------------------- API en flujo ---------------------------------
+    def cifrar_flujo(self, origen: BinaryIO, destino: BinaryIO, flags: int = 0,
+                     comprimir: bool = True) -> int:
+        """Cifra `origen` en `destino` segmento a segmento.
+
+        Con el algoritmo 'fernet' no hay flujo posible: se lee todo el origen.
+        Con compresión, `origen` se comprime en flujo y se añade su flag.
+
+        Returns:
+            int: Bytes escritos en destino
+        """
+        if self.algoritmo == 'fernet':
+            token = self.contexto.fernet.encrypt(origen.read())
+            destino.write(token)
+            return len(token)
+
+        if comprimir and self.compresion is not None:
+            flags |= self.COMPRESIONES[self.compresion]
+            origen = _LectorComprimido(origen, self._compresor())
+
+        id_algoritmo = self.ALGORITMOS[self.algoritmo]
+        aead = self.contexto.aead[id_algoritmo]
+        prefijo = os.urandom(8)
+        cabecera = _CABECERA.pack(MAGIC, VERSION_BINARIA, id_algoritmo, flags,
+                                  self.tamano_segmento, prefijo)
+        destino.write(cabecera)
+        escritos = len(cabecera)
+
+        indice = 0
+        segmento = origen.read(self.tamano_segmento)
+        while True:
+            siguiente = origen.read(self.tamano_segmento)
+            ultimo = not siguiente
+            cifrado = aead.encrypt(self._nonce(prefijo, indice, ultimo), segmento, cabecera)
+            destino.write(cifrado)
+            escritos += len(cifrado)
+            if ultimo:
+                return escritos
+            segmento = siguiente
+            indice += 1
+
+    def descifrar_flujo(self, origen: BinaryIO, destino: BinaryIO) -> int:
+        """Descifra un flujo en formato binario de `origen` a `destino`.
+
+        Returns:
+            int: Flags de la cabecera
+
+        Raises:
+            ErrorDescifrado: Si la cabecera, algún segmento o el final no son válidos
+        """
+        cabecera = origen.read(_CABECERA.size)
+        if len(cabecera) != _CABECERA.size:
+            raise ErrorDescifrado("Cabecera de cifrado incompleta")
+
+        magic, version, id_algoritmo, flags, tamano, prefijo = _CABECERA.unpack(cabecera)
+        if magic != MAGIC or version != VERSION_BINARIA or id_algoritmo not in self.contexto.aead:
+            raise ErrorDescifrado("Formato de cifrado no soportado")
+        aead = self.contexto.aead[id_algoritmo]
+
+        descompresor = None
+        if flags & FLAG_ZLIB:
+            descompresor = zlib.decompressobj()
+        elif flags & FLAG_LZMA:
+            descompresor = lzma.LZMADecompressor()
+
+        indice = 0
+        bloque = origen.read(tamano + TAMANO_TAG)
+        while True:
+            siguiente = origen.read(tamano + TAMANO_TAG)
+            ultimo = not siguiente
+            try:
+                claro = aead.decrypt(self._nonce(prefijo, indice, ultimo), bloque, cabecera)
+            except InvalidTag:
+                raise ErrorDescifrado("Clave de encriptación incorrecta o datos corruptos")
+            if descompresor is not None:
+                try:
+                    claro = descompresor.decompress(claro)
+                except (zlib.error, lzma.LZMAError):
+                    raise ErrorDescifrado("Datos comprimidos corruptos")
+            destino.write(claro)
+            if ultimo:
+                if descompresor is not None and not descompresor.eof:
+                    raise ErrorDescifrado("Datos comprimidos incompletos")
+                return flags
+            bloque = siguiente
+            indice += 1
+
+    # -------------------------- Archivos -------------------------------------
+    def cifrar_a_archivo(self, datos: bytes, ruta: Path) -> int:
+        """Cifra `datos` directamente en el archivo `ruta` (sin copia cifrada en memoria)."""
+        with open(ruta, 'wb') as archivo:
+            return self.cifrar_flujo(io.BytesIO(datos), archivo)
+
+    def descifrar_archivo(self, ruta: Path) -> bytes:
+        """Descifra el archivo `ruta` detectando su formato.
+
+        En formato binario se lee por segmentos, así que en memoria solo
+        está el texto en claro más un segmento cifrado.
+        """
+        with open(ruta, 'rb') as archivo:
+            if archivo.read(len(MAGIC)) != MAGIC:
+                archivo.seek(0)
+                return self.descifrar(archivo.read())
+
+            archivo.seek(0)
+            destino = io.BytesIO()
+            self.descifrar_flujo(archivo, destino)
+            return destino.getvalue()
+
+    def _compresor(self):
+        if self.compresion == 'lzma':
+            return lzma.LZMACompressor(preset=self.nivel_compresion)
+        return zlib.compressobj(self.nivel_compresion)
+
+    @staticmethod
+    def _nonce(prefijo: bytes, indice: int, ultimo: bool) -> bytes:
+        if indice >= 1 << 24:
+            raise ValueError("Demasiados segmentos para un único flujo cifrado")
+        return prefijo + indice.to_bytes(3, 'big') + (b"\x01" if ultimo else b"\x00")
+
+
+class _LectorComprimido:
+    """Envuelve un flujo y devuelve su contenido comprimido con `read(n)`."""
+
+    def __init__(self, origen: BinaryIO, compresor):
+        self._origen = origen
+        self._compresor = compresor
+        self._buffer = bytearray()
+        self._fin = False
+
+    def read(self, n: int) -> bytes:
+        while len(self._buffer) < n and not self._fin:
+            datos = self._origen.read(max(n, 64 * 1024))
+            if datos:
+                self._buffer += self._compresor.compress(datos)
+            else:
+                self._buffer += self._compresor.flush()
+                self._fin = True
+        resultado = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return resultado
+
+
+# ============================================================================
+# INSTANCIAS CACHEADAS
+# ============================================================================
+
+_contextos: Dict[bytes, ContextoClave] = {}
+
+
+def obtener_cifrador(raw_key: Optional[Union[bytes, str]] = None,
+                     algoritmo: Optional[str] = None) -> Cipher:
+    """Devuelve un cifrador con el contexto de clave cacheado para `raw_key`.
+
+    Args:
+        raw_key: Clave bruta (None = `EncryptionConfig.ENCRYPTION_KEY`)
+        algoritmo: Algoritmo de escritura (None = `EncryptionConfig.ALGORITMO`)
+    """
+    if raw_key is None:
+        raw_key = EncryptionConfig.ENCRYPTION_KEY
+    if isinstance(raw_key, str):
+        raw_key = raw_key.encode("utf-8")
+
+    contexto = _contextos.get(raw_key)
+    if contexto is None:
+        contexto = ContextoClave(raw_key)
+        _contextos[raw_key] = contexto
+
+    return Cipher(
+        contexto,
+        algoritmo or EncryptionConfig.ALGORITMO,
+        EncryptionConfig.TAMANO_SEGMENTO,
+        EncryptionConfig.COMPRESION,
+        EncryptionConfig.NIVEL_COMPRESION
+    )
+
+
+__all__ = [
+    'Cipher',
+    'ContextoClave',
+    'ErrorDescifrado',
+    'FLAG_LZMA',
+    'FLAG_ZLIB',
+    'derivar_clave_fernet',
+    'obtener_cifrador'
+]
@@ -2,7 +2,8 @@
 Sistema de encriptación para datos sensibles de la aplicación TPV.
 
 Este módulo maneja la encriptación y desencriptación de datos
-utilizando Fernet (criptografía simétrica).
+utilizando criptografía simétrica (AES-GCM binario o Fernet, según
+`EncryptionConfig.ALGORITMO`; ver core/cipher.py).
 """
 
 import pickle
@@ -10,6 +11,7 @@ import json
 from typing import Any, Union
 from cryptography.fernet import Fernet
 from config.settings import EncryptionConfig
+from core.cipher import obtener_cifrador
 
 
 class EncryptionManager:
@@ -25,10 +27,12 @@ class EncryptionManager:
         """
         self.key = encryption_key or EncryptionConfig.ENCRYPTION_KEY
         self.fernet = Fernet(self.key)
+        # Cifrador con claves derivadas una sola vez; descifra ambos formatos
+        self.cifrador = obtener_cifrador(self.key)
     
     def encriptar_objeto(self, objeto: Any) -> bytes:
         """
-        Encripta un objeto Python utilizando pickle y Fernet.
+        Encripta un objeto Python utilizando pickle.
         
         Args:
             objeto: Objeto Python a encriptar
@@ -43,7 +47,7 @@ class EncryptionManager:
             # Serializar el objeto con pickle
             datos_serializados = pickle.dumps(objeto)
             # Encriptar los datos
-            datos_encriptados = self.fernet.encrypt(datos_serializados)
+            datos_encriptados = self.cifrador.cifrar(datos_serializados)
             return datos_encriptados
         except Exception as e:
             raise Exception(f"Error al encriptar objeto: {str(e)}")
@@ -63,7 +67,7 @@ class EncryptionManager:
         """
         try:
             # Desencriptar los datos
-            datos_serializados = self.fernet.decrypt(datos_encriptados)
+            datos_serializados = self.cifrador.descifrar(datos_encriptados)
             # Deserializar el objeto
             objeto = pickle.loads(datos_serializados)
             return objeto
@@ -87,7 +91,7 @@ class EncryptionManager:
             # Convertir a JSON y codificar
             datos_json = json.dumps(datos).encode('utf-8')
             # Encriptar los datos
-            datos_encriptados = self.fernet.encrypt(datos_json)
+            datos_encriptados = self.cifrador.cifrar(datos_json)
             return datos_encriptados
         except Exception as e:
             raise Exception(f"Error al encriptar JSON: {str(e)}")
@@ -107,7 +111,7 @@ class EncryptionManager:
         """
         try:
             # Desencriptar los datos
-            datos_json = self.fernet.decrypt(datos_encriptados).decode('utf-8')
+            datos_json = self.cifrador.descifrar(datos_encriptados).decode('utf-8')
             # Convertir de JSON a objeto Python
             datos = json.loads(datos_json)
             return datos
@@ -129,12 +133,12 @@ class EncryptionManager:
         """
         try:
             if usar_json:
-                datos_encriptados = self.encriptar_json(datos)
+                datos_serializados = json.dumps(datos).encode('utf-8')
             else:
-                datos_encriptados = self.encriptar_objeto(datos)
+                datos_serializados = pickle.dumps(datos)
             
-            with open(ruta, 'wb') as archivo:
-                archivo.write(datos_encriptados)
+            # Cifrado en flujo directamente al archivo
+            self.cifrador.cifrar_a_archivo(datos_serializados, ruta)
         except Exception as e:
             raise Exception(f"Error al guardar archivo encriptado: {str(e)}")
     
@@ -154,13 +158,12 @@ class EncryptionManager:
             Exception: Si hay error al cargar
         """
         try:
-            with open(ruta, 'rb') as archivo:
-                datos_encriptados = archivo.read()
+            datos_serializados = self.cifrador.descifrar_archivo(ruta)
             
             if usar_json:
-                return self.desencriptar_json(datos_encriptados)
+                return json.loads(datos_serializados.decode('utf-8'))
             else:
-                return self.desencriptar_objeto(datos_encriptados)
+                return pickle.loads(datos_serializados)
         except Exception as e:
             raise Exception(f"Error al cargar archivo encriptado: {str(e)}")
     
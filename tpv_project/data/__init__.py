@@ -7,6 +7,7 @@ Paquete de gestión de datos.
 
 from .data_manager import DataManager, get_data_manager
 from .data_manager_sqlite import DataManagerSQLite, get_data_manager_sqlite
+from .data_manager_kv import DataManagerKV, get_data_manager_kv
 from .database_encrypted import DatabaseManagerEncrypted, get_database_manager
 
 __all__ = [
@@ -14,6 +15,8 @@ __all__ = [
     'get_data_manager',
     'DataManagerSQLite',
     'get_data_manager_sqlite',
+    'DataManagerKV',
+    'get_data_manager_kv',
     'DatabaseManagerEncrypted',
     'get_database_manager'
 
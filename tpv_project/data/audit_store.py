@@ -0,0 +1,248 @@
+"""
+Almacén de auditoría cifrado, particionado por meses.
+
+Los registros de auditoría no se guardan en la base de datos principal:
+así `tpv.db` no crece indefinidamente ni encarece cada recifrado de la
+imagen completa. Cada transacción confirmada añade sus registros como un
+único bloque (JSON comprimido con zlib y cifrado) al segmento de su mes.
+
+Estructura en disco (para `data/tpv.db`):
+
+    data/tpv.db.auditoria/
+        auditoria_2025_05.seg
+        auditoria_2025_06.seg
+            MAGIC
+            bloque*:  longitud (4 bytes, big endian) | bloque cifrado
+
+Rotación: al empezar un mes nuevo, los segmentos de meses anteriores se
+sellan, es decir, se reescriben como un único bloque, que comprime mucho
+mejor que los bloques pequeños de cada transacción. Un último bloque
+incompleto (escritura interrumpida) se descarta al leer.
+"""
+from __future__ import annotations
+
+import os
+import json
+import re
+import threading
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+# Prefijo en claro que identifica un segmento de auditoría
+MAGIC = b"TPVAUD1\n"
+
+_LONGITUD = 4
+_NOMBRE = re.compile(r"auditoria_(\d{4})_(\d{2})\.seg$")
+
+
+class AuditStore:
+    """Segmentos mensuales cifrados con los registros de auditoría."""
+
+    def __init__(self, directorio: Path, cifrar: Callable[[bytes], bytes],
+                 descifrar: Callable[[bytes], bytes], fsync: bool = False,
+                 nivel_compresion: int = 6):
+        """
+        Args:
+            directorio: Carpeta de los segmentos (se crea al escribir)
+            cifrar: Función de cifrado de un bloque
+            descifrar: Función de descifrado de un bloque
+            fsync: Forzar cada bloque a disco antes de devolver
+            nivel_compresion: Nivel de zlib (0-9)
+        """
+        self.directorio = Path(directorio)
+        self._cifrar = cifrar
+        self._descifrar = descifrar
+        self.fsync = fsync
+        self.nivel_compresion = nivel_compresion
+
+        self._lock = threading.Lock()
+        # Mes (año, mes) del último bloque escrito, para detectar la rotación
+        self._mes_actual: Optional[Tuple[int, int]] = None
+        # Registros que no se pudieron escribir; se reintentan en el siguiente
+        self._pendientes: List[Dict] = []
+
+    # -------------------------- Segmentos ------------------------------------
+    def _ruta(self, mes: Tuple[int, int]) -> Path:
+        return self.directorio / f"auditoria_{mes[0]:04d}_{mes[1]:02d}.seg"
+
+    def segmentos(self) -> List[Tuple[Tuple[int, int], Path]]:
+        """Segmentos en disco como ((año, mes), ruta), del más antiguo al más reciente."""
+        if not self.directorio.exists():
+            return []
+        encontrados = []
+        for ruta in self.directorio.iterdir():
+            coincidencia = _NOMBRE.match(ruta.name)
+            if coincidencia:
+                encontrados.append(((int(coincidencia[1]), int(coincidencia[2])), ruta))
+        return sorted(encontrados)
+
+    def tamano(self) -> int:
+        """Bytes ocupados por todos los segmentos."""
+        return sum(ruta.stat().st_size for _, ruta in self.segmentos())
+
+    @staticmethod
+    def _mes(registro: Dict) -> Tuple[int, int]:
+        return int(registro['fecha'][:4]), int(registro['fecha'][5:7])
+
+    # -------------------------- Escritura ------------------------------------
+    def _bloque(self, registros: List[Dict]) -> bytes:
+        datos = json.dumps(registros, default=str).encode('utf-8')
+        cifrado = self._cifrar(zlib.compress(datos, self.nivel_compresion))
+        return len(cifrado).to_bytes(_LONGITUD, 'big') + cifrado
+
+    def anadir(self, registros: List[Dict]) -> int:
+        """Añade los registros de una transacción (un bloque por mes afectado).
+
+        Si la escritura falla, los registros se conservan en memoria y se
+        reintentan con la siguiente llamada.
+
+        Returns:
+            int: Bytes añadidos
+        """
+        with self._lock:
+            registros = self._pendientes + list(registros)
+            self._pendientes = []
+            if not registros:
+                return 0
+
+            por_mes: Dict[Tuple[int, int], List[Dict]] = {}
+            for registro in registros:
+                por_mes.setdefault(self._mes(registro), []).append(registro)
+
+            escritos = 0
+            try:
+                self.directorio.mkdir(parents=True, exist_ok=True)
+                for mes, grupo in sorted(por_mes.items()):
+                    datos = self._bloque(grupo)
+                    with open(self._ruta(mes), 'ab') as archivo:
+                        if archivo.tell() == 0:
+                            archivo.write(MAGIC)
+                        archivo.write(datos)
+                        archivo.flush()
+                        if self.fsync:
+                            os.fsync(archivo.fileno())
+                    escritos += len(datos)
+                    del por_mes[mes]
+            except OSError as e:
+                print(f"Error escribiendo la auditoría (se reintentará): {e}")
+                self._pendientes = [r for grupo in por_mes.values() for r in grupo]
+                return escritos
+
+            ultimo = max(self._mes(r) for r in registros)
+            if self._mes_actual is not None and ultimo > self._mes_actual:
+                self._rotar(ultimo)
+            self._mes_actual = max(ultimo, self._mes_actual or ultimo)
+            return escritos
+
+    def rotar(self) -> int:
+        """Sella los segmentos de meses anteriores al actual.
+
+        Returns:
+            int: Segmentos sellados
+        """
+        with self._lock:
+            hoy = datetime.now()
+            return self._rotar((hoy.year, hoy.month))
+
+    def _rotar(self, mes_actual: Tuple[int, int]) -> int:
+        sellados = 0
+        for mes, ruta in self.segmentos():
+            if mes < mes_actual and self._contar_bloques(ruta) > 1:
+                self._sellar(ruta)
+                sellados += 1
+        return sellados
+
+    def _sellar(self, ruta: Path) -> None:
+        """Reescribe un segmento como un único bloque comprimido."""
+        registros = [r for bloque in self._leer_bloques(ruta) for r in bloque]
+        tmp_write = ruta.with_suffix(ruta.suffix + ".write")
+        with open(tmp_write, 'wb') as archivo:
+            archivo.write(MAGIC + self._bloque(registros))
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        tmp_write.replace(ruta)
+
+    # -------------------------- Lectura --------------------------------------
+    @staticmethod
+    def _posiciones(datos: bytes) -> Iterator[Tuple[int, int]]:
+        """(inicio, fin) de cada bloque completo de un segmento."""
+        posicion = len(MAGIC)
+        while posicion + _LONGITUD <= len(datos):
+            longitud = int.from_bytes(datos[posicion:posicion + _LONGITUD], 'big')
+            inicio = posicion + _LONGITUD
+            if inicio + longitud > len(datos):
+                return  # último bloque incompleto: escritura interrumpida
+            yield inicio, inicio + longitud
+            posicion = inicio + longitud
+
+    def _contar_bloques(self, ruta: Path) -> int:
+        return sum(1 for _ in self._posiciones(ruta.read_bytes()))
+
+    def _leer_bloques(self, ruta: Path) -> List[List[Dict]]:
+        """Descifra los bloques de un segmento, en orden de escritura.
+
+        Raises:
+            ValueError: Si el archivo no es un segmento o un bloque está alterado
+        """
+        datos = ruta.read_bytes()
+        if not datos.startswith(MAGIC):
+            raise ValueError(f"{ruta} no es un segmento de auditoría")
+        return [
+            json.loads(zlib.decompress(self._descifrar(datos[inicio:fin])).decode('utf-8'))
+            for inicio, fin in self._posiciones(datos)
+        ]
+
+    def buscar(self, tabla: str = None, accion: str = None,
+               registro_id: int = None, usuario: str = None,
+               desde: datetime = None, hasta: datetime = None,
+               limit: int = None) -> List[Dict]:
+        """Busca en todos los segmentos, del registro más reciente al más antiguo.
+
+        Solo se descifran los segmentos de los meses dentro de [desde, hasta].
+
+        Args:
+            tabla / accion / registro_id / usuario: Filtros exactos
+            desde / hasta: Rango de fechas (inclusivo)
+            limit: Máximo de registros devueltos
+        """
+        mes_desde = (desde.year, desde.month) if desde else None
+        mes_hasta = (hasta.year, hasta.month) if hasta else None
+        iso_desde = desde.isoformat() if desde else None
+        iso_hasta = hasta.isoformat() if hasta else None
+
+        resultados = []
+        for mes, ruta in reversed(self.segmentos()):
+            if mes_hasta and mes > mes_hasta:
+                continue
+            if mes_desde and mes < mes_desde:
+                break
+
+            registros = [r for bloque in self._leer_bloques(ruta) for r in bloque]
+            for registro in reversed(registros):
+                if tabla is not None and registro['tabla'] != tabla:
+                    continue
+                if accion is not None and registro['accion'] != accion:
+                    continue
+                if registro_id is not None and registro['registro_id'] != registro_id:
+                    continue
+                if usuario is not None and registro['usuario'] != usuario:
+                    continue
+                if iso_desde and registro['fecha'] < iso_desde:
+                    continue
+                if iso_hasta and registro['fecha'] > iso_hasta:
+                    continue
+
+                resultados.append(registro)
+                if limit and len(resultados) >= limit:
+                    return resultados
+
+        return resultados
+
+
+__all__ = [
+    'AuditStore',
+    'MAGIC'
+]
@@ -0,0 +1,314 @@
+"""
+Repositorio de backups cifrado con deduplicación de fragmentos.
+
+En lugar de guardar una copia completa de `tpv.db` por backup, cada copia
+se divide en fragmentos definidos por su contenido y cada fragmento se
+guarda una sola vez, comprimido y cifrado. Una copia es solo un
+manifiesto pequeño (cifrado) con la lista de fragmentos de cada archivo,
+así que un backup en el que solo cambiaron los tickets del día escribe
+los pocos fragmentos nuevos y el manifiesto.
+
+Estructura en disco (para `data/backup/repositorio`):
+
+    repositorio/
+        copias/tpv_<AAAAMMDD_HHMMSS_ffffff>.snap   # MAGIC + manifiesto cifrado
+        fragmentos/<ab>/<id>.chk                   # fragmento comprimido y cifrado
+
+Los cortes se deciden por el contenido de cada unidad (página de SQLite):
+se corta tras una unidad cuyo CRC cumple una máscara, con un mínimo y un
+máximo de unidades por fragmento. Como la imagen SQLite se modifica página
+a página, una página cambiada solo altera su fragmento y, como mucho, los
+cortes vecinos.
+
+El identificador de un fragmento es un HMAC-SHA256 (truncado) de su
+contenido en claro con una clave derivada de la del TPV: permite
+deduplicar sin revelar nada del contenido y detectar al leer un fragmento
+sustituido. Restaurar una copia solo necesita su manifiesto y sus
+fragmentos.
+"""
+from __future__ import annotations
+
+import os
+import json
+import hmac
+import hashlib
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+# Prefijo en claro que identifica un manifiesto de copia
+MAGIC = b"TPVBAK1\n"
+
+VERSION_MANIFIESTO = 1
+
+# Caracteres hexadecimales del HMAC usados como identificador (128 bits)
+LONGITUD_ID = 32
+
+# Unidades por fragmento: mínimo, máximo y máscara del CRC (media ~8)
+UNIDADES_MIN = 2
+UNIDADES_MAX = 32
+MASCARA_CORTE = 0x7
+
+# Unidad de corte para archivos que no son imágenes SQLite
+UNIDAD_DEFECTO = 4096
+
+
+class BackupRepository:
+    """Copias de seguridad deduplicadas por fragmentos cifrados."""
+
+    def __init__(self, directorio: Path, cifrar: Callable[[bytes], bytes],
+                 descifrar: Callable[[bytes], bytes], clave_id: bytes,
+                 nivel_compresion: int = 6):
+        """
+        Args:
+            directorio: Carpeta del repositorio (se crea al escribir)
+            cifrar: Función de cifrado de un fragmento o manifiesto
+            descifrar: Función de descifrado
+            clave_id: Clave del HMAC que identifica los fragmentos
+            nivel_compresion: Nivel de zlib (0-9)
+        """
+        self.directorio = Path(directorio)
+        self.dir_copias = self.directorio / "copias"
+        self.dir_fragmentos = self.directorio / "fragmentos"
+        self._cifrar = cifrar
+        self._descifrar = descifrar
+        self._clave_id = clave_id
+        self.nivel_compresion = nivel_compresion
+
+        # Estadísticas de la última copia
+        self.ultimos_fragmentos_escritos = 0
+        self.ultimos_bytes_escritos = 0
+
+    # -------------------------- Fragmentos -----------------------------------
+    @staticmethod
+    def unidad(datos: bytes) -> int:
+        """Tamaño de página si `datos` es una imagen SQLite; si no, `UNIDAD_DEFECTO`."""
+        if datos[:16] == b"SQLite format 3\x00":
+            tamano = int.from_bytes(datos[16:18], 'big')
+            return 65536 if tamano == 1 else tamano
+        return UNIDAD_DEFECTO
+
+    @staticmethod
+    def cortes(datos: bytes, unidad: int) -> Iterator[Tuple[int, int]]:
+        """(inicio, fin) de cada fragmento definido por el contenido."""
+        vista = memoryview(datos)
+        inicio = 0
+        unidades = 0
+        for posicion in range(0, len(datos), unidad):
+            fin = min(posicion + unidad, len(datos))
+            unidades += 1
+            if unidades >= UNIDADES_MAX or (
+                    unidades >= UNIDADES_MIN
+                    and zlib.crc32(vista[posicion:fin]) & MASCARA_CORTE == 0):
+                yield inicio, fin
+                inicio = fin
+                unidades = 0
+        if inicio < len(datos):
+            yield inicio, len(datos)
+
+    def _id(self, fragmento: bytes) -> str:
+        return hmac.new(self._clave_id, fragmento, hashlib.sha256).hexdigest()[:LONGITUD_ID]
+
+    def _ruta_fragmento(self, id_fragmento: str) -> Path:
+        return self.dir_fragmentos / id_fragmento[:2] / f"{id_fragmento}.chk"
+
+    def _escribir_fragmento(self, id_fragmento: str, fragmento: bytes) -> int:
+        """Guarda un fragmento si no existe. Devuelve los bytes escritos."""
+        ruta = self._ruta_fragmento(id_fragmento)
+        if ruta.exists():
+            return 0
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        cifrado = self._cifrar(zlib.compress(fragmento, self.nivel_compresion))
+        tmp_write = ruta.with_suffix(ruta.suffix + ".write")
+        tmp_write.write_bytes(cifrado)
+        tmp_write.replace(ruta)
+        return len(cifrado)
+
+    def _leer_fragmento(self, id_fragmento: str) -> bytes:
+        """Descifra un fragmento y comprueba que corresponde a su identificador.
+
+        Raises:
+            ValueError: Si falta, está alterado o no corresponde al identificador
+        """
+        try:
+            cifrado = self._ruta_fragmento(id_fragmento).read_bytes()
+        except FileNotFoundError:
+            raise ValueError(f"Falta el fragmento {id_fragmento}")
+        fragmento = zlib.decompress(self._descifrar(cifrado))
+        if self._id(fragmento) != id_fragmento:
+            raise ValueError(f"Fragmento {id_fragmento} alterado o sustituido")
+        return fragmento
+
+    # -------------------------- Copias ---------------------------------------
+    def copias(self) -> List[Path]:
+        """Manifiestos de copia, de la más antigua a la más reciente."""
+        if not self.dir_copias.exists():
+            return []
+        return sorted(self.dir_copias.glob("tpv_*.snap"))
+
+    def _ruta_copia(self, copia) -> Path:
+        """Acepta la ruta del manifiesto o solo su nombre (con o sin extensión)."""
+        ruta = Path(copia)
+        if ruta.parent == Path('.'):
+            ruta = self.dir_copias / ruta.name
+        return ruta if ruta.suffix == ".snap" else ruta.with_name(ruta.name + ".snap")
+
+    def leer_manifiesto(self, copia) -> Dict:
+        """Descifra el manifiesto de una copia.
+
+        Raises:
+            ValueError: Si el archivo no es un manifiesto válido
+        """
+        datos = self._ruta_copia(copia).read_bytes()
+        if not datos.startswith(MAGIC):
+            raise ValueError(f"{copia} no es una copia del repositorio")
+        manifiesto = json.loads(self._descifrar(datos[len(MAGIC):]).decode('utf-8'))
+        if manifiesto.get('version') != VERSION_MANIFIESTO:
+            raise ValueError(f"Versión de manifiesto no soportada: {manifiesto.get('version')}")
+        return manifiesto
+
+    def crear(self, archivos: Dict[str, bytes]) -> Path:
+        """Crea una copia con los archivos dados (nombre relativo -> contenido en claro).
+
+        Primero se escriben los fragmentos nuevos y al final el manifiesto,
+        de forma atómica: una copia interrumpida no deja un manifiesto a medias.
+
+        Returns:
+            Path: Ruta del manifiesto de la copia
+        """
+        escritos = 0
+        bytes_escritos = 0
+        entradas = {}
+
+        for nombre, datos in archivos.items():
+            datos = bytes(datos)
+            ids = []
+            for inicio, fin in self.cortes(datos, self.unidad(datos)):
+                fragmento = datos[inicio:fin]
+                id_fragmento = self._id(fragmento)
+                tamano = self._escribir_fragmento(id_fragmento, fragmento)
+                if tamano:
+                    escritos += 1
+                    bytes_escritos += tamano
+                ids.append(id_fragmento)
+
+            entradas[nombre] = {
+                'longitud': len(datos),
+                'sha256': hashlib.sha256(datos).hexdigest(),
+                'fragmentos': ids
+            }
+
+        ahora = datetime.now()
+        manifiesto = {
+            'version': VERSION_MANIFIESTO,
+            'fecha': ahora.isoformat(),
+            'archivos': entradas
+        }
+        contenido = MAGIC + self._cifrar(json.dumps(manifiesto).encode('utf-8'))
+
+        self.dir_copias.mkdir(parents=True, exist_ok=True)
+        ruta = self.dir_copias / f"tpv_{ahora.strftime('%Y%m%d_%H%M%S_%f')}.snap"
+        tmp_write = ruta.with_suffix(ruta.suffix + ".write")
+        with open(tmp_write, 'wb') as archivo:
+            archivo.write(contenido)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        tmp_write.replace(ruta)
+
+        self.ultimos_fragmentos_escritos = escritos
+        self.ultimos_bytes_escritos = bytes_escritos + len(contenido)
+        return ruta
+
+    def restaurar(self, copia) -> Dict[str, bytes]:
+        """Reconstruye los archivos de una copia (nombre relativo -> contenido).
+
+        Raises:
+            ValueError: Si falta un fragmento o el resultado no coincide con el manifiesto
+        """
+        archivos = {}
+        for nombre, entrada in self.leer_manifiesto(copia)['archivos'].items():
+            datos = b"".join(self._leer_fragmento(i) for i in entrada['fragmentos'])
+            if (len(datos) != entrada['longitud']
+                    or hashlib.sha256(datos).hexdigest() != entrada['sha256']):
+                raise ValueError(f"{nombre}: el contenido restaurado no coincide con la copia")
+            archivos[nombre] = datos
+        return archivos
+
+    def verificar(self, copia=None) -> List[str]:
+        """Comprueba una copia (o todas) leyendo y validando sus fragmentos.
+
+        Cada fragmento compartido se valida una sola vez.
+
+        Returns:
+            List[str]: Errores encontrados (vacía si todo es correcto)
+        """
+        rutas = [self._ruta_copia(copia)] if copia is not None else self.copias()
+        errores = []
+        validos = set()
+
+        for ruta in rutas:
+            try:
+                manifiesto = self.leer_manifiesto(ruta)
+            except Exception as e:
+                errores.append(f"{ruta.name}: manifiesto ilegible ({e})")
+                continue
+
+            for nombre, entrada in manifiesto['archivos'].items():
+                sha = hashlib.sha256()
+                longitud = 0
+                for id_fragmento in entrada['fragmentos']:
+                    try:
+                        fragmento = self._leer_fragmento(id_fragmento)
+                    except Exception as e:
+                        errores.append(f"{ruta.name}/{nombre}: {e}")
+                        break
+                    validos.add(id_fragmento)
+                    sha.update(fragmento)
+                    longitud += len(fragmento)
+                else:
+                    if longitud != entrada['longitud'] or sha.hexdigest() != entrada['sha256']:
+                        errores.append(f"{ruta.name}/{nombre}: el contenido no coincide con la copia")
+
+        return errores
+
+    def podar(self, conservar: int) -> Tuple[int, int]:
+        """Elimina las copias más antiguas y los fragmentos que ya nadie usa.
+
+        Args:
+            conservar: Número de copias más recientes a conservar
+
+        Returns:
+            tuple: (copias eliminadas, fragmentos eliminados)
+        """
+        copias = self.copias()
+        sobrantes = copias[:-conservar] if conservar > 0 else copias
+        for ruta in sobrantes:
+            ruta.unlink()
+
+        # Fragmentos referenciados por las copias que quedan
+        vivos = set()
+        for ruta in self.copias():
+            for entrada in self.leer_manifiesto(ruta)['archivos'].values():
+                vivos.update(entrada['fragmentos'])
+
+        eliminados = 0
+        if self.dir_fragmentos.exists():
+            for ruta in self.dir_fragmentos.glob("*/*.chk"):
+                if ruta.stem not in vivos:
+                    ruta.unlink()
+                    eliminados += 1
+        return len(sobrantes), eliminados
+
+    def tamano(self) -> int:
+        """Bytes ocupados por manifiestos y fragmentos."""
+        if not self.directorio.exists():
+            return 0
+        return sum(p.stat().st_size for p in self.directorio.rglob("*") if p.is_file())
+
+
+__all__ = [
+    'BackupRepository',
+    'MAGIC'
+]
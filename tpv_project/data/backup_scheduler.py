@@ -0,0 +1,156 @@
+"""
+Programador de backups en segundo plano.
+
+Sustituye al backup que se hacía en el propio guardado de datos generales
+(en el hilo de Tk): un hilo dedicado crea las copias
+
+    - cada `intervalo` segundos de reloj desde la última copia, y
+    - tras `recibos` recibos confirmados,
+
+con como mucho una copia cada `intervalo_minimo` segundos. La copia se
+toma de una instantánea consistente de la sesión (ver
+`DatabaseManagerEncrypted.crear_backup`), así que el cobro nunca espera
+al cifrado ni a la escritura. La duración y el tamaño de cada copia se
+registran en la salida y en `estado()`.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+
+class BackupScheduler:
+    """Hilo que decide cuándo hacer backup y lo ejecuta."""
+
+    def __init__(self, crear: Callable[[], Tuple[str, int]], intervalo: float = 6 * 3600,
+                 recibos: int = 0, intervalo_minimo: float = 15 * 60,
+                 ultimo_backup: Optional[float] = None):
+        """
+        Args:
+            crear: Función que crea una copia y devuelve (nombre, bytes escritos)
+            intervalo: Segundos de reloj entre copias (0 = desactivado)
+            recibos: Recibos confirmados que fuerzan una copia (0 = desactivado)
+            intervalo_minimo: Segundos mínimos entre dos copias
+            ultimo_backup: Instante (time.time) de la última copia existente
+        """
+        self._crear = crear
+        self.intervalo = intervalo
+        self.recibos = recibos
+        self.intervalo_minimo = intervalo_minimo
+
+        self._cond = threading.Condition()
+        self._parar = False
+        self._ultimo = ultimo_backup if ultimo_backup is not None else time.time()
+        self._recibos_pendientes = 0
+
+        # Métricas
+        self.backups = 0
+        self.errores = 0
+        self.ultima_duracion = 0.0
+        self.ultimo_tamano = 0
+        self.ultimo_motivo: Optional[str] = None
+
+        self._hilo = threading.Thread(
+            target=self._bucle,
+            name="tpv-backups",
+            daemon=True
+        )
+        self._hilo.start()
+
+    # -------------------------- Avisos ---------------------------------------
+    def notificar_recibo(self, cantidad: int = 1) -> None:
+        """Cuenta recibos confirmados desde la última copia."""
+        with self._cond:
+            self._recibos_pendientes += cantidad
+            if self.recibos and self._recibos_pendientes >= self.recibos:
+                self._cond.notify()
+
+    # -------------------------- Política -------------------------------------
+    def _motivo(self, ahora: float) -> Optional[str]:
+        """Motivo para hacer ya una copia, o None si no toca."""
+        transcurrido = ahora - self._ultimo
+        if transcurrido < self.intervalo_minimo:
+            return None
+        if self.intervalo and transcurrido >= self.intervalo:
+            return 'intervalo'
+        if self.recibos and self._recibos_pendientes >= self.recibos:
+            return 'recibos'
+        return None
+
+    def _espera(self, ahora: float) -> float:
+        """Segundos hasta la próxima comprobación."""
+        limites = []
+        if self.intervalo:
+            limites.append(self._ultimo + max(self.intervalo, self.intervalo_minimo))
+        if self.recibos and self._recibos_pendientes >= self.recibos:
+            limites.append(self._ultimo + self.intervalo_minimo)
+        if not limites:
+            return 60.0
+        # Revisar al menos cada minuto (cambios de hora del sistema)
+        return min(max(min(limites) - ahora, 0.01), 60.0)
+
+    def _bucle(self) -> None:
+        while True:
+            with self._cond:
+                ahora = time.time()
+                if not self._parar and self._motivo(ahora) is None:
+                    self._cond.wait(self._espera(ahora))
+                if self._parar:
+                    return
+                motivo = self._motivo(time.time())
+                if motivo is None:
+                    continue
+                recibos = self._recibos_pendientes
+
+            self._ejecutar(motivo, recibos)
+
+    def _ejecutar(self, motivo: str, recibos: int) -> None:
+        inicio = time.perf_counter()
+        try:
+            nombre, escritos = self._crear()
+        except Exception as e:
+            self.errores += 1
+            print(f"Error en el backup programado ({motivo}): {e}")
+            # Reintentar tras el intervalo mínimo, no en bucle cerrado
+            with self._cond:
+                self._ultimo = time.time()
+            return
+
+        duracion = time.perf_counter() - inicio
+        with self._cond:
+            self._ultimo = time.time()
+            self._recibos_pendientes -= recibos
+            self.backups += 1
+            self.ultima_duracion = duracion
+            self.ultimo_tamano = escritos
+            self.ultimo_motivo = motivo
+        print(f"Backup {nombre} ({motivo}): {duracion:.2f} s, {escritos / 1024:.1f} KB escritos")
+
+    def detener(self, timeout: float = 30.0) -> None:
+        """Detiene el hilo (espera a que termine una copia en curso)."""
+        with self._cond:
+            self._parar = True
+            self._cond.notify()
+        if self._hilo is not threading.current_thread():
+            self._hilo.join(timeout)
+
+    # -------------------------- Métricas -------------------------------------
+    def estado(self) -> Dict:
+        """Última copia, recibos pendientes y coste de la última copia."""
+        with self._cond:
+            return {
+                'ultimo_backup': datetime.fromtimestamp(self._ultimo).isoformat(),
+                'recibos_pendientes': self._recibos_pendientes,
+                'backups': self.backups,
+                'errores': self.errores,
+                'ultimo_motivo': self.ultimo_motivo,
+                'ultima_duracion_s': round(self.ultima_duracion, 3),
+                'ultimo_tamano_bytes': self.ultimo_tamano
+            }
+
+
+__all__ = [
+    'BackupScheduler'
+]
@@ -0,0 +1,267 @@
+"""
+Contenedor cifrado fragmentado para la imagen SQLite.
+
+En lugar de cifrar la base de datos entera como un único token Fernet,
+la imagen SQLite se divide en fragmentos de tamaño fijo alineados con el
+tamaño de página de SQLite. Cada fragmento se cifra y autentica por
+separado y se guarda en su propio archivo; un manifiesto cifrado (pequeño)
+enumera los fragmentos en orden.
+
+Estructura en disco (para `data/tpv.db`):
+
+    data/tpv.db              # MAGIC + manifiesto cifrado
+    data/tpv.db.chunks/      # un archivo por fragmento cifrado
+        <sha256[:32]>.chk
+
+Los fragmentos se nombran por el SHA-256 (truncado) de su contenido cifrado y el
+manifiesto guarda esos hashes, de modo que no pueden intercambiarse ni
+sustituirse sin que la lectura lo detecte. La escritura es copy-on-write:
+primero se escriben los fragmentos nuevos, después se sustituye el
+manifiesto de forma atómica y por último se borran los fragmentos que ya
+no se usan. Al confirmar cambios solo se vuelven a cifrar y escribir los
+fragmentos cuyas páginas cambiaron.
+"""
+from __future__ import annotations
+
+import json
+import hashlib
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+# Prefijo en claro que identifica el formato fragmentado. Un token Fernet
+# siempre empieza por "gAAAAA", así que no hay ambigüedad con el formato
+# de token único.
+MAGIC = b"TPVCHUNK1\n"
+
+VERSION_MANIFIESTO = 1
+
+# Caracteres hexadecimales del SHA-256 usados como nombre (128 bits), para
+# mantener pequeño el manifiesto
+LONGITUD_NOMBRE = 32
+
+
+class ChunkedContainer:
+    """Lee y escribe una imagen SQLite como fragmentos cifrados por separado.
+
+    Nota:
+        El contenedor conserva en memoria la última imagen leída o escrita
+        para detectar qué fragmentos cambian en la siguiente escritura.
+    """
+
+    def __init__(self, ruta: Path, cifrar: Callable[[bytes], bytes],
+                 descifrar: Callable[[bytes], bytes],
+                 tamano_fragmento: int = 64 * 1024):
+        self.ruta = Path(ruta)
+        self.dir_fragmentos = self.ruta.with_name(self.ruta.name + ".chunks")
+        self._cifrar = cifrar
+        self._descifrar = descifrar
+        self.tamano_fragmento_base = tamano_fragmento
+
+        # Estado de la última imagen sincronizada con disco
+        self._anterior: Optional[bytes] = None
+        self._tamano_fragmento: Optional[int] = None
+        self._nombres: List[str] = []
+
+        # Tras el primer barrido completo solo se borran los fragmentos
+        # que deja de referenciar cada escritura
+        self._barrido_completo = False
+
+        # Estadísticas de la última escritura
+        self.ultimos_fragmentos_escritos = 0
+        self.ultimos_bytes_escritos = 0
+
+    # -------------------------- Detección de formato ------------------------
+    @staticmethod
+    def es_contenedor(ruta: Path) -> bool:
+        """Indica si el archivo de `ruta` es un manifiesto fragmentado."""
+        ruta = Path(ruta)
+        if not ruta.exists():
+            return False
+        with open(ruta, 'rb') as archivo:
+            return archivo.read(len(MAGIC)) == MAGIC
+
+    @staticmethod
+    def tamano_pagina(imagen: bytes) -> int:
+        """Devuelve el tamaño de página de una imagen SQLite (4096 por defecto)."""
+        if len(imagen) < 100:
+            return 4096
+        valor = int.from_bytes(imagen[16:18], 'big')
+        return 65536 if valor == 1 else (valor or 4096)
+
+    def _calcular_tamano_fragmento(self, imagen: bytes) -> int:
+        """Tamaño de fragmento múltiplo del tamaño de página de la imagen."""
+        pagina = self.tamano_pagina(imagen)
+        paginas = max(1, -(-self.tamano_fragmento_base // pagina))
+        return paginas * pagina
+
+    # -------------------------- Lectura --------------------------------------
+    def _leer_manifiesto(self) -> Dict:
+        datos = self.ruta.read_bytes()
+        if not datos.startswith(MAGIC):
+            raise ValueError(f"{self.ruta} no es un contenedor fragmentado")
+        manifiesto = json.loads(self._descifrar(datos[len(MAGIC):]).decode('utf-8'))
+        if manifiesto.get('version') != VERSION_MANIFIESTO:
+            raise ValueError(f"Versión de manifiesto no soportada: {manifiesto.get('version')}")
+        return manifiesto
+
+    def leer_imagen(self) -> bytes:
+        """Descifra y reensambla la imagen SQLite completa.
+
+        Raises:
+            ValueError: Si falta un fragmento o no coincide con el manifiesto
+        """
+        manifiesto = self._leer_manifiesto()
+        partes = []
+
+        for nombre in manifiesto['fragmentos']:
+            ruta_fragmento = self.dir_fragmentos / f"{nombre}.chk"
+            try:
+                cifrado = ruta_fragmento.read_bytes()
+            except FileNotFoundError:
+                raise ValueError(f"Falta el fragmento {nombre}")
+            if hashlib.sha256(cifrado).hexdigest()[:LONGITUD_NOMBRE] != nombre:
+                raise ValueError(f"Fragmento {nombre} alterado o corrupto")
+            partes.append(self._descifrar(cifrado))
+
+        imagen = b"".join(partes)[:manifiesto['longitud']]
+
+        self._anterior = imagen
+        self._tamano_fragmento = manifiesto['tamano_fragmento']
+        self._nombres = list(manifiesto['fragmentos'])
+        return imagen
+
+    # -------------------------- Escritura ------------------------------------
+    def escribir_imagen(self, imagen: bytes) -> int:
+        """Persiste la imagen reescribiendo solo los fragmentos modificados.
+
+        Args:
+            imagen: Imagen SQLite en claro
+
+        Returns:
+            int: Número de fragmentos cifrados y escritos
+        """
+        if self._anterior is None and self.es_contenedor(self.ruta):
+            # Sincronizar con lo que hay en disco para poder comparar
+            try:
+                self.leer_imagen()
+            except Exception:
+                self._anterior = None
+                self._nombres = []
+
+        tamano = self._calcular_tamano_fragmento(imagen)
+        reutilizable = (
+            self._anterior is not None and tamano == self._tamano_fragmento
+        )
+
+        self.dir_fragmentos.mkdir(parents=True, exist_ok=True)
+        imagen = bytes(imagen)
+        anterior = self._anterior if reutilizable else None
+
+        nombres = []
+        escritos = 0
+        bytes_escritos = 0
+
+        for indice, inicio in enumerate(range(0, max(len(imagen), 1), tamano)):
+            # Comparar cortes de bytes (memcmp) es mucho más rápido que
+            # comparar memoryviews elemento a elemento
+            fragmento = imagen[inicio:inicio + tamano]
+
+            if (reutilizable and indice < len(self._nombres)
+                    and anterior[inicio:inicio + tamano] == fragmento):
+                nombres.append(self._nombres[indice])
+                continue
+
+            cifrado = self._cifrar(fragmento)
+            nombre = hashlib.sha256(cifrado).hexdigest()[:LONGITUD_NOMBRE]
+            (self.dir_fragmentos / f"{nombre}.chk").write_bytes(cifrado)
+            nombres.append(nombre)
+            escritos += 1
+            bytes_escritos += len(cifrado)
+
+        manifiesto = {
+            'version': VERSION_MANIFIESTO,
+            'tamano_fragmento': tamano,
+            'tamano_pagina': self.tamano_pagina(imagen),
+            'longitud': len(imagen),
+            'fragmentos': nombres
+        }
+        contenido = MAGIC + self._cifrar(json.dumps(manifiesto).encode('utf-8'))
+
+        # Sustitución atómica del manifiesto
+        tmp_write = self.ruta.with_suffix(self.ruta.suffix + ".write")
+        tmp_write.write_bytes(contenido)
+        tmp_write.replace(self.ruta)
+
+        self._recolectar(set(self._nombres) - set(nombres), set(nombres))
+
+        self._anterior = imagen
+        self._tamano_fragmento = tamano
+        self._nombres = nombres
+        self.ultimos_fragmentos_escritos = escritos
+        self.ultimos_bytes_escritos = bytes_escritos + len(contenido)
+        return escritos
+
+    def _recolectar(self, obsoletos: set, vivos: set) -> None:
+        """Elimina los fragmentos que ya no referencia el manifiesto.
+
+        La primera vez recorre el directorio completo para limpiar también
+        fragmentos huérfanos de escrituras interrumpidas.
+        """
+        if not self._barrido_completo:
+            obsoletos = {
+                p.stem for p in self.dir_fragmentos.glob("*.chk")
+                if p.stem not in vivos
+            }
+            self._barrido_completo = True
+
+        for nombre in obsoletos:
+            try:
+                (self.dir_fragmentos / f"{nombre}.chk").unlink()
+            except OSError:
+                pass
+
+    # -------------------------- Utilidades -----------------------------------
+    def tamano_total(self) -> int:
+        """Bytes ocupados en disco por el manifiesto y los fragmentos."""
+        total = self.ruta.stat().st_size if self.ruta.exists() else 0
+        if self.dir_fragmentos.exists():
+            total += sum(p.stat().st_size for p in self.dir_fragmentos.glob("*.chk"))
+        return total
+
+    def copiar(self, destino: Path) -> None:
+        """Copia el contenedor (manifiesto y fragmentos) a `destino`."""
+        destino = Path(destino)
+        shutil.copy2(self.ruta, destino)
+        destino_fragmentos = destino.with_name(destino.name + ".chunks")
+        if self.dir_fragmentos.exists():
+            shutil.copytree(self.dir_fragmentos, destino_fragmentos, dirs_exist_ok=True)
+
+    def descartar_fragmentos(self) -> None:
+        """Borra el directorio de fragmentos y olvida la última imagen sincronizada.
+
+        Sin olvidarla, una escritura posterior reutilizaría nombres de
+        fragmentos que ya no existen en disco.
+        """
+        if self.dir_fragmentos.exists():
+            shutil.rmtree(self.dir_fragmentos, ignore_errors=True)
+        self._anterior = None
+        self._tamano_fragmento = None
+        self._nombres = []
+
+    @staticmethod
+    def eliminar(ruta: Path) -> None:
+        """Elimina un contenedor (o un archivo de token único) de `ruta`."""
+        ruta = Path(ruta)
+        dir_fragmentos = ruta.with_name(ruta.name + ".chunks")
+        if dir_fragmentos.exists():
+            shutil.rmtree(dir_fragmentos, ignore_errors=True)
+        if ruta.exists():
+            ruta.unlink()
+
+
+__all__ = [
+    'ChunkedContainer',
+    'MAGIC'
+]
@@ -0,0 +1,225 @@
+"""
+Diario de commits cifrado (append-only) para la base de datos encriptada.
+
+Cada transacción confirmada en modo sesión se añade al diario como un
+registro pequeño, cifrado y autenticado, con las filas que cambió. Así
+confirmar un ticket cuesta el tamaño del ticket y no el de la base de
+datos completa. Al abrir, el diario se reaplica sobre la última imagen
+completa; la compactación lo vuelca en la imagen principal y lo vacía.
+
+Estructura en disco (para `data/tpv.db`):
+
+    data/tpv.db.journal
+        MAGIC
+        registro*:  longitud (4 bytes, big endian) | registro cifrado
+
+Cada registro lleva un número de secuencia consecutivo, de modo que no
+pueden eliminarse ni reordenarse registros intermedios sin que la lectura
+lo detecte. Un último registro incompleto (escritura interrumpida) se
+descarta al leer.
+"""
+from __future__ import annotations
+
+import os
+import json
+import base64
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+# Prefijo en claro que identifica el archivo de diario
+MAGIC = b"TPVJRNL1\n"
+
+_LONGITUD = 4
+
+
+class CommitJournal:
+    """Diario de registros cifrados que se añaden al final de un archivo."""
+
+    def __init__(self, ruta_db: Path, cifrar: Callable[[bytes], bytes],
+                 descifrar: Callable[[bytes], bytes], fsync: bool = True):
+        """
+        Args:
+            ruta_db: Ruta de la base de datos (el diario va a su lado)
+            cifrar: Función de cifrado de un registro
+            descifrar: Función de descifrado de un registro
+            fsync: Forzar cada registro a disco antes de devolver
+        """
+        ruta_db = Path(ruta_db)
+        self.ruta = ruta_db.with_name(ruta_db.name + ".journal")
+        self._cifrar = cifrar
+        self._descifrar = descifrar
+        self.fsync = fsync
+
+        # Lock propio: añadir registros no debe esperar a que termine de
+        # escribirse la imagen completa durante una compactación
+        self._lock = threading.Lock()
+        self._secuencia = 0
+        self._primer_registro: Optional[float] = None
+
+        # Estadísticas del último registro añadido
+        self.ultimos_bytes_escritos = 0
+
+    # -------------------------- Codificación ---------------------------------
+    @staticmethod
+    def _codificar(valor):
+        if isinstance(valor, (bytes, bytearray, memoryview)):
+            return {'$b64': base64.b64encode(bytes(valor)).decode('ascii')}
+        return valor
+
+    @staticmethod
+    def _decodificar(valor):
+        if isinstance(valor, dict) and '$b64' in valor:
+            return base64.b64decode(valor['$b64'])
+        return valor
+
+    # -------------------------- Estado ---------------------------------------
+    def tamano(self) -> int:
+        """Bytes del diario en disco (0 si no existe)."""
+        try:
+            return self.ruta.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def esta_vacio(self) -> bool:
+        return self.tamano() <= len(MAGIC)
+
+    def edad(self) -> float:
+        """Segundos desde el registro más antiguo sin compactar (0 si vacío)."""
+        if self._primer_registro is None or self.esta_vacio():
+            return 0.0
+        return time.monotonic() - self._primer_registro
+
+    # -------------------------- Escritura ------------------------------------
+    def anadir(self, cambios: List, secuencias: Dict[str, int]) -> int:
+        """Añade un registro con las filas cambiadas por una transacción.
+
+        Args:
+            cambios: Lista de [tabla, rowid, fila] (fila None = borrada)
+            secuencias: Contenido de sqlite_sequence tras la transacción
+
+        Returns:
+            int: Bytes añadidos al diario
+        """
+        return self.anadir_varios([(cambios, secuencias)])
+
+    def anadir_varios(self, transacciones: List[tuple]) -> int:
+        """Añade varios registros con una sola escritura y un solo fsync.
+
+        Args:
+            transacciones: Lista de (cambios, secuencias), en orden de commit
+
+        Returns:
+            int: Bytes añadidos al diario
+        """
+        with self._lock:
+            partes = []
+            for cambios, secuencias in transacciones:
+                self._secuencia += 1
+                registro = {
+                    'seq': self._secuencia,
+                    'cambios': [
+                        [tabla, rowid, None if fila is None else
+                         {col: self._codificar(v) for col, v in fila.items()}]
+                        for tabla, rowid, fila in cambios
+                    ],
+                    'secuencias': secuencias
+                }
+                cifrado = self._cifrar(json.dumps(registro).encode('utf-8'))
+                partes.append(len(cifrado).to_bytes(_LONGITUD, 'big') + cifrado)
+            datos = b"".join(partes)
+
+            nuevo = self.esta_vacio()
+            with open(self.ruta, 'ab') as archivo:
+                if archivo.tell() == 0:
+                    archivo.write(MAGIC)
+                archivo.write(datos)
+                archivo.flush()
+                if self.fsync:
+                    os.fsync(archivo.fileno())
+
+            if nuevo:
+                self._primer_registro = time.monotonic()
+            self.ultimos_bytes_escritos = len(datos)
+            return len(datos)
+
+    def descartar_hasta(self, posicion: int) -> None:
+        """Elimina los registros anteriores a `posicion` (ya volcados en la imagen).
+
+        Los registros añadidos después de `posicion` se conservan.
+        """
+        with self._lock:
+            tamano = self.tamano()
+            if tamano <= len(MAGIC) or posicion <= len(MAGIC):
+                return
+
+            if posicion >= tamano:
+                self.ruta.unlink()
+                self._primer_registro = None
+                return
+
+            with open(self.ruta, 'rb') as archivo:
+                archivo.seek(posicion)
+                resto = archivo.read()
+
+            tmp_write = self.ruta.with_suffix(self.ruta.suffix + ".write")
+            with open(tmp_write, 'wb') as archivo:
+                archivo.write(MAGIC + resto)
+                archivo.flush()
+                os.fsync(archivo.fileno())
+            tmp_write.replace(self.ruta)
+            self._primer_registro = time.monotonic()
+
+    def vaciar(self) -> None:
+        """Elimina el diario completo."""
+        with self._lock:
+            if self.ruta.exists():
+                self.ruta.unlink()
+            self._primer_registro = None
+
+    # -------------------------- Lectura --------------------------------------
+    def leer_registros(self) -> List[Dict]:
+        """Lee y descifra todos los registros completos del diario.
+
+        Raises:
+            ValueError: Si un registro está alterado o falta uno intermedio
+        """
+        with self._lock:
+            if self.esta_vacio():
+                return []
+            datos = self.ruta.read_bytes()
+
+        if not datos.startswith(MAGIC):
+            raise ValueError(f"{self.ruta} no es un diario de commits")
+
+        registros = []
+        posicion = len(MAGIC)
+        while posicion + _LONGITUD <= len(datos):
+            longitud = int.from_bytes(datos[posicion:posicion + _LONGITUD], 'big')
+            inicio = posicion + _LONGITUD
+            if inicio + longitud > len(datos):
+                break  # último registro incompleto: escritura interrumpida
+
+            registro = json.loads(self._descifrar(datos[inicio:inicio + longitud]).decode('utf-8'))
+            if registros and registro['seq'] != registros[-1]['seq'] + 1:
+                raise ValueError("Diario de commits con registros ausentes o reordenados")
+
+            registro['cambios'] = [
+                [tabla, rowid, None if fila is None else
+                 {col: self._decodificar(v) for col, v in fila.items()}]
+                for tabla, rowid, fila in registro['cambios']
+            ]
+            registros.append(registro)
+            posicion = inicio + longitud
+
+        if registros:
+            self._secuencia = registros[-1]['seq']
+        return registros
+
+
+__all__ = [
+    'CommitJournal',
+    'MAGIC'
+]
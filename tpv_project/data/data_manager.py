@@ -5,6 +5,7 @@ Este módulo maneja la carga y guardado de todos los datos de la aplicación.
 """
 
 import os
+from contextlib import nullcontext
 from typing import Dict, List, Tuple
 from datetime import datetime
 from pathlib import Path
@@ -19,9 +20,16 @@ from config.settings import DATA_FILE, DATA_DIR, TicketConfig
 class DataManager:
     """Gestiona la persistencia de todos los datos de la aplicación."""
     
-    def __init__(self):
-        """Inicializa el gestor de datos."""
+    def __init__(self, directorio: Path = None):
+        """
+        Inicializa el gestor de datos.
+        
+        Args:
+            directorio: Carpeta de data.tpv y anual.{año}.tpv (por defecto data/)
+        """
         self._encryption = get_encryption_manager()
+        self._directorio = Path(directorio) if directorio else DATA_DIR
+        self._archivo = self._directorio / DATA_FILE.name
         
         # Gestores de datos
         self.products = ProductManager()
@@ -34,6 +42,17 @@ class DataManager:
         self.password = ''
         self.printers = ['', '']  # [principal, comanda]
     
+    def batch(self):
+        """Compatibilidad con `DataManagerSQLite.batch()`.
+
+        Este gestor trabaja en memoria y solo escribe en
+        `guardar_datos_generales`, así que no hay nada que agrupar.
+        """
+        return nullcontext(self)
+    
+    def cerrar(self) -> None:
+        """Compatibilidad con `DataManagerSQLite.cerrar()` (nada pendiente)."""
+    
     def guardar_datos_generales(self) -> None:
         """
         Guarda los datos generales en data.tpv.
@@ -56,7 +75,7 @@ class DataManager:
             ]
             
             self._encryption.guardar_archivo_encriptado(
-                str(DATA_FILE),
+                str(self._archivo),
                 datos,
                 usar_json=True
             )
@@ -77,13 +96,13 @@ class DataManager:
             Exception: Si hay error al cargar
         """
         try:
-            if not os.path.exists(DATA_FILE):
+            if not os.path.exists(self._archivo):
                 # Crear archivo con datos por defecto
                 self.guardar_datos_generales()
                 return False
             
             datos = self._encryption.cargar_archivo_encriptado(
-                str(DATA_FILE),
+                str(self._archivo),
                 usar_json=True
             )
             
@@ -129,7 +148,7 @@ class DataManager:
         if anio is None:
             anio = datetime.now().year
         
-        archivo = DATA_DIR / f'anual.{anio}.tpv'
+        archivo = self._directorio / f'anual.{anio}.tpv'
         
         try:
             datos = recibos_manager.exportar_recibos_anuales()
@@ -159,7 +178,7 @@ class DataManager:
         if anio is None:
             anio = datetime.now().year
         
-        archivo = DATA_DIR / f'anual.{anio}.tpv'
+        archivo = self._directorio / f'anual.{anio}.tpv'
         
         manager = ReceiptManager()
         
@@ -243,6 +262,20 @@ class DataManager:
         """
         return any(r.nombre == nombre_cliente for r in self.receipts_pending)
     
+    def obtener_saldos_clientes(self) -> List[Tuple[str, int, float]]:
+        """
+        Obtiene los clientes con recibos pendientes y lo que deben.
+        
+        Returns:
+            List[Tuple[str, int, float]]: (cliente, tickets, total) por nombre
+        """
+        saldos: Dict[str, List] = {}
+        for recibo in self.receipts_pending:
+            saldo = saldos.setdefault(recibo.nombre, [0, 0.0])
+            saldo[0] += 1
+            saldo[1] += recibo.calcular_total()
+        return [(nombre, tickets, total) for nombre, (tickets, total) in sorted(saldos.items())]
+    
     def unir_recibos_pendientes(self, nombre_cliente: str) -> Receipt:
         """
         Une todos los recibos pendientes de un cliente en uno solo.
@@ -0,0 +1,406 @@
+"""
+Gestor de persistencia de datos (VERSIÓN ALMACÉN CLAVE-VALOR CIFRADO).
+
+Misma interfaz que `DataManager` y `DataManagerSQLite`, sobre un registro
+append-only de pares clave-valor cifrados uno a uno (ver data/log_store.py):
+cada cambio añade un registro y cada lectura por clave es una lectura y un
+descifrado, sin reescribir ni descifrar el resto de los datos.
+
+Claves:
+    producto:<nombre>         -> {'nombre', 'precio', 'familia'}
+    cliente:<nombre>          -> True
+    camarero:<nombre>         -> True
+    config:<clave>            -> valor (iva, password, impresoras)
+    pendiente:<id>            -> recibo pendiente (Receipt.to_dict())
+    recibo:<año>:<id>         -> recibo pagado (Receipt.to_dict())
+
+Productos, clientes, camareros y recibos pendientes se cargan en memoria
+al arrancar (como en `DataManager`) y cada cambio se escribe al momento.
+"""
+
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+from pathlib import Path
+
+from core.cipher import obtener_cifrador
+from data.data_manager import DataManager
+from data.log_store import LogStore
+from models.product import Product, ProductManager
+from models.receipt import Receipt, ReceiptManager
+from models.customer import CustomerManager, WaiterManager
+from config.settings import DATA_DIR, DatabaseConfig, TicketConfig
+
+
+class DataManagerKV:
+    """Gestiona la persistencia en un almacén clave-valor cifrado."""
+
+    def __init__(self, directorio: Optional[Path] = None):
+        """
+        Inicializa el gestor de datos.
+
+        Args:
+            directorio: Carpeta del almacén (por defecto data/tpv.kv)
+        """
+        cifrador = obtener_cifrador()
+        self.kv = LogStore(
+            directorio or DATA_DIR / 'tpv.kv',
+            cifrador.cifrar,
+            cifrador.descifrar,
+            fsync=DatabaseConfig.KV_FSYNC,
+            tamano_segmento=DatabaseConfig.KV_TAMANO_SEGMENTO,
+            segmentos_fusion=DatabaseConfig.KV_SEGMENTOS_FUSION
+        )
+
+        # Gestores en memoria que escriben cada cambio en el almacén
+        self.products = ProductManagerKV(self.kv)
+        self.customers = CustomerManagerKV(self.kv)
+        self.waiters = WaiterManagerKV(self.kv)
+
+        # Recibos pendientes y lo último escrito de cada uno (por `db_id`)
+        self.receipts_pending = []
+        self._pendientes_guardados: Dict[int, Dict] = {}
+
+        # Configuración
+        self.iva = self.kv.obtener('config:iva', TicketConfig.DEFAULT_IVA)
+        self.password = self.kv.obtener('config:password', '')
+        self.printers = self.kv.obtener('config:impresoras', ['', ''])
+
+        # Siguiente id de recibo (pendientes y pagados comparten numeración)
+        self._ultimo_id = max(
+            (int(clave.rsplit(':', 1)[1])
+             for prefijo in ('pendiente:', 'recibo:') for clave in self.kv.claves(prefijo)),
+            default=0
+        )
+
+    def _nuevo_id(self) -> int:
+        self._ultimo_id += 1
+        return self._ultimo_id
+
+    def batch(self):
+        """Agrupa varias escrituras en un solo fsync (ver `LogStore.lote()`)."""
+        return self.kv.lote()
+
+    def cerrar(self) -> None:
+        """Cierra el almacén (cada cambio ya está escrito)."""
+        self.kv.cerrar()
+
+    def cargar_datos_generales(self) -> bool:
+        """
+        Carga los recibos pendientes del almacén.
+
+        Returns:
+            bool: True si el almacén tenía datos, False si está vacío
+        """
+        try:
+            self.receipts_pending = []
+            self._pendientes_guardados = {}
+            for clave in sorted(self.kv.claves('pendiente:'), key=lambda c: int(c.split(':')[1])):
+                datos = self.kv.obtener(clave)
+                recibo = Receipt.from_dict(datos)
+                recibo.db_id = int(clave.split(':')[1])
+                self.receipts_pending.append(recibo)
+                self._pendientes_guardados[recibo.db_id] = datos
+
+            return len(self.kv) > 0
+
+        except Exception as e:
+            raise Exception(f"Error al cargar datos generales: {str(e)}")
+
+    def guardar_datos_generales(self) -> None:
+        """
+        Escribe la configuración y los recibos pendientes que han cambiado.
+
+        Productos, clientes y camareros ya se escriben al modificarse.
+        """
+        try:
+            with self.kv.lote():
+                for clave, valor in (('config:iva', self.iva),
+                                     ('config:password', self.password),
+                                     ('config:impresoras', self.printers)):
+                    if clave not in self.kv or self.kv.obtener(clave) != valor:
+                        self.kv.guardar(clave, valor)
+
+                for recibo in self.receipts_pending:
+                    if (getattr(recibo, 'db_id', None) is None
+                            or recibo.to_dict() != self._pendientes_guardados.get(recibo.db_id)):
+                        self._guardar_pendiente(recibo)
+
+        except Exception as e:
+            raise Exception(f"Error al guardar datos generales: {str(e)}")
+
+    def _guardar_pendiente(self, recibo: Receipt) -> None:
+        """Escribe un recibo pendiente (le asigna `db_id` si no lo tiene)."""
+        if getattr(recibo, 'db_id', None) is None:
+            recibo.db_id = self._nuevo_id()
+        datos = recibo.to_dict()
+        self.kv.guardar(f'pendiente:{recibo.db_id}', datos)
+        self._pendientes_guardados[recibo.db_id] = datos
+
+    def _eliminar_pendiente(self, recibo: Receipt) -> None:
+        if getattr(recibo, 'db_id', None) is not None:
+            self.kv.eliminar(f'pendiente:{recibo.db_id}')
+            self._pendientes_guardados.pop(recibo.db_id, None)
+            # Si se cobra, se guardará de nuevo como recibo pagado
+            recibo.db_id = None
+
+    def agregar_recibo_pendiente(self, recibo: Receipt) -> None:
+        """Agrega un recibo a la lista de pendientes y al almacén."""
+        self.receipts_pending.append(recibo)
+        self._guardar_pendiente(recibo)
+
+    def eliminar_recibo_pendiente(self, fecha: str) -> bool:
+        """Elimina un recibo pendiente por su fecha."""
+        for i, recibo in enumerate(self.receipts_pending):
+            if recibo.fecha == fecha:
+                self._eliminar_pendiente(recibo)
+                del self.receipts_pending[i]
+                return True
+        return False
+
+    def guardar_recibos_anuales(self, recibos_manager: ReceiptManager,
+                                anio: int = None) -> None:
+        """
+        Escribe los recibos pagados que aún no están en el almacén (sin
+        `db_id`), cada uno bajo el año de su fecha.
+        """
+        pagados = (TicketConfig.ESTADO_EFECTIVO, TicketConfig.ESTADO_TARJETA)
+        nuevos = [
+            r for r in recibos_manager.obtener_todos_recibos()
+            if r.estado in pagados and getattr(r, 'db_id', None) is None
+        ]
+        if not nuevos:
+            return
+
+        with self.kv.lote():
+            for recibo in nuevos:
+                anio_recibo = int(recibo.fecha.split(' - ')[0].split('/')[2])
+                recibo.db_id = self._nuevo_id()
+                self.kv.guardar(f'recibo:{anio_recibo}:{recibo.db_id:010d}', recibo.to_dict())
+
+    def cargar_recibos_anuales(self, anio: int = None) -> ReceiptManager:
+        """Carga los recibos pagados de un año, en orden de cobro."""
+        if anio is None:
+            anio = datetime.now().year
+
+        manager = ReceiptManager()
+
+        try:
+            # Los ids van rellenos con ceros: el orden de clave es el de cobro
+            for clave in sorted(self.kv.claves(f'recibo:{anio}:')):
+                recibo = Receipt.from_dict(self.kv.obtener(clave))
+                recibo.db_id = int(clave.rsplit(':', 1)[1])
+                manager.agregar_recibo(recibo)
+
+            return manager
+
+        except Exception as e:
+            print(f"Error al cargar recibos anuales: {e}")
+            return manager
+
+    def obtener_recibo_pendiente(self, fecha: str) -> Optional[Receipt]:
+        """Obtiene un recibo pendiente por su fecha."""
+        for recibo in self.receipts_pending:
+            if recibo.fecha == fecha:
+                return recibo
+        return None
+
+    def obtener_recibos_pendientes_cliente(self, nombre_cliente: str) -> List[Receipt]:
+        """Obtiene todos los recibos pendientes de un cliente."""
+        return [
+            r for r in self.receipts_pending
+            if r.nombre == nombre_cliente
+        ]
+
+    def cliente_tiene_pendientes(self, nombre_cliente: str) -> bool:
+        """Verifica si un cliente tiene recibos pendientes."""
+        return any(r.nombre == nombre_cliente for r in self.receipts_pending)
+
+    def obtener_saldos_clientes(self) -> List[Tuple[str, int, float]]:
+        """Clientes con recibos pendientes: (cliente, tickets, total) por nombre."""
+        return DataManager.obtener_saldos_clientes(self)
+
+    def unir_recibos_pendientes(self, nombre_cliente: str) -> Optional[Receipt]:
+        """Une todos los recibos pendientes de un cliente en uno solo."""
+        recibos_cliente = self.obtener_recibos_pendientes_cliente(nombre_cliente)
+
+        if not recibos_cliente:
+            return None
+
+        # Crear nuevo recibo con todas las líneas
+        recibo_unido = Receipt(
+            nombre=nombre_cliente,
+            fecha=recibos_cliente[0].fecha,
+            estado=TicketConfig.ESTADO_PENDIENTE,
+            camarero=recibos_cliente[0].camarero
+        )
+
+        # Unir todas las líneas
+        for recibo in recibos_cliente:
+            for linea in recibo.pedido:
+                recibo_unido.agregar_linea(linea)
+
+        with self.kv.lote():
+            for recibo in recibos_cliente:
+                self._eliminar_pendiente(recibo)
+
+            self.receipts_pending = [
+                r for r in self.receipts_pending
+                if r.nombre != nombre_cliente
+            ]
+
+            self.agregar_recibo_pendiente(recibo_unido)
+
+        return recibo_unido
+
+    def crear_datos_ejemplo(self) -> None:
+        """Crea los productos de ejemplo (un solo fsync)."""
+        with self.kv.lote():
+            DataManager.crear_datos_ejemplo(self)
+
+
+# ============================================================================
+# GESTORES ESPECIALIZADOS (en memoria, con escritura en el almacén)
+# ============================================================================
+
+class ProductManagerKV(ProductManager):
+    """Gestor de productos que escribe cada cambio en el almacén."""
+
+    def __init__(self, kv: LogStore):
+        super().__init__()
+        self.kv = kv
+        for _, datos in kv.elementos('producto:'):
+            try:
+                self._productos.append(Product.from_dict(datos))
+            except Exception as e:
+                print(f"Error al cargar producto: {e}")
+
+    def _guardar(self, producto: Product) -> None:
+        self.kv.guardar(f'producto:{producto.nombre}', producto.to_dict())
+
+    def agregar_producto(self, producto: Product) -> None:
+        """Agrega un nuevo producto."""
+        super().agregar_producto(producto)
+        self._guardar(producto)
+
+    def actualizar_producto(self, nombre: str, precio: Optional[float] = None,
+                          familia: Optional[str] = None) -> None:
+        """Actualiza un producto existente."""
+        super().actualizar_producto(nombre, precio, familia)
+        self._guardar(self.obtener_producto(nombre))
+
+    def eliminar_producto(self, nombre: str) -> bool:
+        """Elimina un producto."""
+        if not super().eliminar_producto(nombre):
+            return False
+        self.kv.eliminar(f'producto:{nombre}')
+        return True
+
+    def cargar_productos(self, productos_data: List[Dict]) -> None:
+        """Sustituye los productos por los de `productos_data`."""
+        with self.kv.lote():
+            self.limpiar()
+            super().cargar_productos(productos_data)
+            for producto in self._productos:
+                self._guardar(producto)
+
+    def limpiar(self) -> None:
+        """Elimina todos los productos."""
+        with self.kv.lote():
+            for producto in self._productos:
+                self.kv.eliminar(f'producto:{producto.nombre}')
+            super().limpiar()
+
+
+class CustomerManagerKV(CustomerManager):
+    """Gestor de clientes que escribe cada cambio en el almacén."""
+
+    def __init__(self, kv: LogStore):
+        super().__init__()
+        self.kv = kv
+        self._clientes = [clave.split(':', 1)[1] for clave in kv.claves('cliente:')]
+
+    def agregar_cliente(self, nombre: str) -> None:
+        """Agrega un nuevo cliente."""
+        super().agregar_cliente(nombre)
+        self.kv.guardar(f'cliente:{nombre}', True)
+
+    def eliminar_cliente(self, nombre: str) -> bool:
+        """Elimina un cliente."""
+        if not super().eliminar_cliente(nombre):
+            return False
+        self.kv.eliminar(f'cliente:{nombre}')
+        return True
+
+    def cargar_clientes(self, clientes: List[str]) -> None:
+        """Sustituye los clientes por los de `clientes`."""
+        with self.kv.lote():
+            self.limpiar()
+            for cliente in clientes:
+                self.agregar_cliente(cliente)
+
+    def limpiar(self) -> None:
+        """Elimina todos los clientes."""
+        with self.kv.lote():
+            for cliente in self._clientes:
+                self.kv.eliminar(f'cliente:{cliente}')
+            super().limpiar()
+
+
+class WaiterManagerKV(WaiterManager):
+    """Gestor de camareros que escribe cada cambio en el almacén."""
+
+    def __init__(self, kv: LogStore):
+        super().__init__()
+        self.kv = kv
+        self._camareros = [clave.split(':', 1)[1] for clave in kv.claves('camarero:')]
+
+    def agregar_camarero(self, nombre: str) -> None:
+        """Agrega un nuevo camarero."""
+        super().agregar_camarero(nombre)
+        self.kv.guardar(f'camarero:{nombre}', True)
+
+    def eliminar_camarero(self, nombre: str) -> bool:
+        """Elimina un camarero."""
+        if not super().eliminar_camarero(nombre):
+            return False
+        self.kv.eliminar(f'camarero:{nombre}')
+        return True
+
+    def cargar_camareros(self, camareros: List[str]) -> None:
+        """Sustituye los camareros por los de `camareros`."""
+        with self.kv.lote():
+            self.limpiar()
+            for camarero in camareros:
+                self.agregar_camarero(camarero)
+
+    def limpiar(self) -> None:
+        """Elimina todos los camareros."""
+        with self.kv.lote():
+            for camarero in self._camareros:
+                self.kv.eliminar(f'camarero:{camarero}')
+            super().limpiar()
+
+
+# ============================================================================
+# INSTANCIA GLOBAL
+# ============================================================================
+
+_data_manager_kv = None
+
+
+def get_data_manager_kv() -> DataManagerKV:
+    """Obtiene la instancia global del gestor de datos clave-valor."""
+    global _data_manager_kv
+    if _data_manager_kv is None:
+        _data_manager_kv = DataManagerKV()
+    return _data_manager_kv
+
+
+# ============================================================================
+# EXPORTACIÓN
+# ============================================================================
+
+__all__ = [
+    'DataManagerKV',
+    'get_data_manager_kv'
+]
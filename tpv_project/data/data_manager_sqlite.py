@@ -6,36 +6,71 @@ pero usa SQLite encriptada internamente.
 """
 
 import os
-from typing import Dict, List, Tuple, Optional
+import bisect
+import copy
+import json
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Set, Tuple, Optional
 from datetime import datetime
 from pathlib import Path
 
 from data.database_encrypted import get_database_manager
+from data.db_service import conectar_servicio
 from models.product import Product, ProductManager
 from models.receipt import Receipt, ReceiptManager, LineaRecibo
 from models.customer import CustomerManager, WaiterManager
-from config.settings import TicketConfig
+from config.settings import DatabaseConfig, TicketConfig
 
 
 class DataManagerSQLite:
     """Gestiona la persistencia usando SQLite ENCRIPTADA."""
     
-    def __init__(self):
-        """Inicializa el gestor de datos."""
-        self.db = get_database_manager()
+    def __init__(self, db=None):
+        """
+        Inicializa el gestor de datos.
+        
+        Args:
+            db: Base de datos a usar (por defecto la global o el servicio)
+        """
+        # Con varias cajas en la máquina, todas pasan por el servicio
+        if db is None:
+            db = conectar_servicio() if DatabaseConfig.SERVICIO else get_database_manager()
+        self.db = db
+        
+        # Datos de referencia en memoria, cargados en una sola lectura
+        referencia = self.db.obtener_datos_referencia()
         
         # Gestores (mantienen compatibilidad con el código existente)
-        self.products = ProductManagerSQLite(self.db)
-        self.customers = CustomerManagerSQLite(self.db)
-        self.waiters = WaiterManagerSQLite(self.db)
+        self.products = ProductManagerSQLite(self.db, referencia['productos'])
+        self.customers = CustomerManagerSQLite(self.db, referencia['clientes'])
+        self.waiters = WaiterManagerSQLite(self.db, referencia['camareros'])
+        self.configuracion = ConfiguracionSQLite(self.db, referencia['configuracion'])
         
         # Recibos pendientes (cargados en memoria para compatibilidad)
         self.receipts_pending = []
         
+        # Contenido guardado de cada pendiente (db_id -> foto, ver
+        # `_foto_pendiente`), para escribir solo lo que cambie
+        self._pendientes_guardados: Dict[int, Tuple[Dict, List[Tuple]]] = {}
+        
+        # Pendientes quitados de la lista para editarlos en pantalla (ver
+        # `retirar_recibo_pendiente`); siguen en la base de datos
+        self._pendientes_retirados: List[Receipt] = []
+        
+        # Saldo pendiente por cliente: copia en memoria de `saldos_clientes`
+        self._saldos: Dict[str, Tuple[int, float]] = {
+            s['cliente_nombre']: (s['tickets'], s['total']) for s in referencia['saldos']
+        }
+        self._clientes_con_saldo = _NombresEnMemoria(list(self._saldos))
+        
         # Configuración
-        self.iva = self.db.obtener_configuracion('iva', TicketConfig.DEFAULT_IVA)
-        self.password = self.db.obtener_configuracion('password', '')
-        self.printers = self.db.obtener_configuracion('impresoras', ['', ''])
+        self.iva = self.configuracion.obtener('iva', TicketConfig.DEFAULT_IVA)
+        self.password = self.configuracion.obtener('password', '')
+        self.printers = self.configuracion.obtener('impresoras', ['', ''])
+        
+        # Backups en segundo plano (sustituye al backup en el guardado)
+        if DatabaseConfig.BACKUP_AUTOMATICO:
+            self.db.iniciar_backups_programados()
     
     def cargar_datos_generales(self) -> bool:
         """
@@ -45,34 +80,16 @@ class DataManagerSQLite:
             bool: True si se cargaron datos
         """
         try:
-            # Cargar recibos pendientes
-            recibos_db = self.db.obtener_recibos(estado='pendiente')
+            # Cargar recibos pendientes (en streaming, sin lista intermedia)
             self.receipts_pending = []
-            
-            for recibo_db in recibos_db:
-                # Convertir de formato DB a Receipt
-                pedido = []
-                for linea in recibo_db['lineas']:
-                    pedido.append(LineaRecibo(
-                        cantidad=linea['cantidad'],
-                        nombre=linea['producto_nombre'],
-                        precio=linea['precio_unitario'],
-                        familia=linea['familia']
-                    ))
-                
-                recibo = Receipt(
-                    pedido=pedido,
-                    nombre=recibo_db.get('cliente_nombre', 'Cliente'),
-                    fecha=recibo_db['fecha'],
-                    estado=recibo_db['estado'],
-                    impreso=recibo_db['impreso'],
-                    camarero=recibo_db.get('camarero_nombre', '')
-                )
-                
-                # Guardar ID de base de datos
-                recibo.db_id = recibo_db['id']
-                
+            self._pendientes_guardados = {}
+            self._pendientes_retirados = []
+            for recibo_db in self.db.iter_recibos(estado=TicketConfig.ESTADO_PENDIENTE):
+                recibo = self._recibo_desde_db(recibo_db, 'Cliente')
                 self.receipts_pending.append(recibo)
+                self._pendientes_guardados[recibo.db_id] = self._foto_pendiente(
+                    recibo, recibo_db['iva_porcentaje']
+                )
             
             return True
             
@@ -80,74 +97,269 @@ class DataManagerSQLite:
             print(f"Error al cargar datos: {e}")
             return False
     
+    @staticmethod
+    def _recibo_desde_db(recibo_db: Dict, nombre_defecto: str) -> Receipt:
+        """Convierte un recibo de `iter_recibos` (con sus líneas) en Receipt."""
+        pedido = [
+            LineaRecibo(
+                cantidad=linea['cantidad'],
+                nombre=linea['producto_nombre'],
+                precio=linea['precio_unitario'],
+                familia=linea['familia']
+            )
+            for linea in recibo_db['lineas']
+        ]
+        
+        recibo = Receipt(
+            pedido=pedido,
+            nombre=recibo_db.get('cliente_nombre', nombre_defecto),
+            fecha=recibo_db['fecha'],
+            estado=recibo_db['estado'],
+            impreso=recibo_db['impreso'],
+            camarero=recibo_db.get('camarero_nombre', '')
+        )
+        
+        # Guardar ID de base de datos
+        recibo.db_id = recibo_db['id']
+        return recibo
+    
+    @contextmanager
+    def batch(self):
+        """Agrupa varias operaciones en una sola transacción y un solo cifrado.
+
+        Ver `DatabaseManagerEncrypted.batch()`. Los cambios de productos se
+        avisan una sola vez al terminar (ver `ProductManagerSQLite.agrupar_cambios`)
+        y, si el lote se deshace, las cachés vuelven a lo que hay en la base
+        de datos.
+        """
+        with self.products.agrupar_cambios(), self.customers.agrupar_cambios(), \
+                self.waiters.agrupar_cambios(), self.configuracion.agrupar_cambios(), \
+                self.db.batch():
+            yield
+    
+    def cerrar(self) -> None:
+        """Vuelca los commits pendientes, compacta el diario y cierra la sesión."""
+        self.db.cerrar()
+    
     def guardar_datos_generales(self) -> None:
         """Guarda los datos generales en la base de datos encriptada."""
         try:
-            # Guardar configuración
-            self.db.guardar_configuracion('iva', self.iva)
-            self.db.guardar_configuracion('password', self.password)
-            self.db.guardar_configuracion('impresoras', self.printers)
+            # Guardar configuración (solo lo que haya cambiado)
+            with self.configuracion.agrupar_cambios(), self.db.batch():
+                self.configuracion.guardar('iva', self.iva)
+                self.configuracion.guardar('password', self.password)
+                self.configuracion.guardar('impresoras', self.printers)
+                
+                # Recibos pendientes editados en memoria (solo sus cambios)
+                for recibo in self.receipts_pending:
+                    self._guardar_pendiente(recibo)
             
-            # Crear backup cada 6 horas
-            hora_actual = datetime.now().hour
-            if hora_actual % 6 == 0:
-                self.db.crear_backup()
+            # Persistir la sesión en memoria en el archivo cifrado
+            self.db.checkpoint()
             
         except Exception as e:
             raise Exception(f"Error al guardar datos generales: {str(e)}")
     
     def agregar_recibo_pendiente(self, recibo: Receipt) -> None:
         """Agrega un recibo a la lista de pendientes Y a la BD encriptada."""
-        # Agregar a memoria
-        self.receipts_pending.append(recibo)
+        # Agregar a memoria (un pendiente cargado y vuelto a guardar ya está)
+        self._pendientes_retirados = [r for r in self._pendientes_retirados if r is not recibo]
+        if not any(r is recibo for r in self.receipts_pending):
+            self.receipts_pending.append(recibo)
         
-        # Guardar en base de datos encriptada
-        recibo_data = {
+        # Guardar en base de datos encriptada (solo los cambios si ya estaba)
+        self._guardar_pendiente(recibo)
+    
+    def _datos_recibo(self, recibo: Receipt, iva: Optional[float] = None) -> Dict:
+        """Cabecera de un recibo para `guardar_recibo`/`actualizar_recibo`."""
+        return {
             'fecha': recibo.fecha,
             'cliente_nombre': recibo.nombre,
             'camarero_nombre': recibo.camarero,
             'estado': recibo.estado,
             'subtotal': recibo.calcular_subtotal(),
-            'iva_porcentaje': self.iva,
+            'iva_porcentaje': self.iva if iva is None else iva,
             'total': recibo.calcular_total(),
             'impreso': recibo.impreso
         }
-        
-        lineas = []
-        for linea in recibo.pedido:
-            lineas.append({
-                'producto_nombre': linea.nombre,
-                'cantidad': linea.cantidad,
-                'precio_unitario': linea.precio,
-                'familia': linea.familia,
-                'subtotal': linea.calcular_total()
-            })
-        
-        recibo_id = self.db.guardar_recibo(recibo_data, lineas)
+    
+    @staticmethod
+    def _datos_linea(linea: LineaRecibo) -> Dict:
+        """Línea de un recibo para `guardar_recibo`/`actualizar_recibo`."""
+        return {
+            'producto_nombre': linea.nombre,
+            'cantidad': linea.cantidad,
+            'precio_unitario': linea.precio,
+            'familia': linea.familia,
+            'subtotal': linea.calcular_total()
+        }
+    
+    def _guardar_recibo_db(self, recibo: Receipt) -> None:
+        """Inserta un recibo en la base de datos y guarda su `db_id`."""
+        lineas = [self._datos_linea(linea) for linea in recibo.pedido]
+        recibo_id = self.db.guardar_recibo(self._datos_recibo(recibo), lineas)
         recibo.db_id = recibo_id
     
+    def _foto_pendiente(self, recibo: Receipt,
+                        iva: Optional[float] = None) -> Tuple[Dict, List[Tuple]]:
+        """Contenido comparable de un pendiente: cabecera y líneas en orden."""
+        return (self._datos_recibo(recibo, iva),
+                [tuple(linea.to_list()) for linea in recibo.pedido])
+    
+    def _guardar_pendiente(self, recibo: Receipt) -> None:
+        """
+        Escribe un recibo pendiente: entero si aún no está en la base de
+        datos y, si ya está, solo las líneas y la cabecera que han cambiado.
+        """
+        foto = self._foto_pendiente(recibo)
+        guardada = self._pendientes_guardados.get(getattr(recibo, 'db_id', None))
+        
+        if guardada == foto:
+            return
+        
+        if guardada is None:
+            self._guardar_recibo_db(recibo)
+        else:
+            insertar, actualizar, eliminar = self._diferencias_lineas(guardada[1], recibo.pedido)
+            if not self.db.actualizar_recibo(recibo.db_id, foto[0], insertar, actualizar,
+                                             eliminar, usuario='sistema'):
+                # Ya no estaba en la base de datos (p. ej. cobrado en otra caja):
+                # se inserta de nuevo con otro db_id
+                self._pendientes_guardados.pop(recibo.db_id, None)
+                self._guardar_recibo_db(recibo)
+            self._ajustar_saldo(guardada[0], -1)
+        
+        self._ajustar_saldo(foto[0], 1)
+        self._pendientes_guardados[recibo.db_id] = foto
+    
+    def _ajustar_saldo(self, cabecera: Dict, signo: int) -> None:
+        """Suma o resta un recibo en la copia de `saldos_clientes` (ver `_sumar_saldo`)."""
+        if cabecera['estado'] != TicketConfig.ESTADO_PENDIENTE:
+            return
+        
+        cliente = cabecera['cliente_nombre'] or ''
+        importe = round(signo * cabecera['total'], 2)
+        if cliente in self._saldos:
+            tickets, total = self._saldos[cliente]
+            tickets, total = tickets + signo, round(total + importe, 2)
+        else:
+            tickets, total = signo, importe
+        
+        if tickets > 0:
+            self._saldos[cliente] = (tickets, total)
+            self._clientes_con_saldo.agregar(cliente)
+        else:
+            self._saldos.pop(cliente, None)
+            self._clientes_con_saldo.quitar(cliente)
+    
+    def obtener_saldos_clientes(self) -> List[Tuple[str, int, float]]:
+        """
+        Obtiene los clientes con recibos pendientes y lo que deben, sin
+        recorrer los recibos (tabla `saldos_clientes`, copiada en memoria).
+        
+        Returns:
+            List[Tuple[str, int, float]]: (cliente, tickets, total) por nombre
+        """
+        return [(cliente, *self._saldos[cliente]) for cliente in self._clientes_con_saldo.lista()]
+    
+    @classmethod
+    def _diferencias_lineas(cls, guardadas: List[Tuple],
+                            pedido: List[LineaRecibo]) -> Tuple[List[Dict], List[Dict], List[str]]:
+        """
+        Líneas a insertar, a actualizar y productos a eliminar para pasar
+        de `guardadas` (tuplas `to_list`) a `pedido`.
+        
+        Las líneas se comparan por producto. Si un producto tiene una sola
+        línea antes y después, se actualiza; si tiene varias, se borran y se
+        vuelven a insertar.
+        """
+        antes: Dict[str, List[Tuple]] = {}
+        for linea in guardadas:
+            antes.setdefault(linea[1], []).append(linea)
+        ahora: Dict[str, List[LineaRecibo]] = {}
+        for linea in pedido:
+            ahora.setdefault(linea.nombre, []).append(linea)
+        
+        insertar, actualizar = [], []
+        eliminar = [nombre for nombre in antes if nombre not in ahora]
+        for nombre, lineas in ahora.items():
+            previas = antes.get(nombre, [])
+            if [tuple(linea.to_list()) for linea in lineas] == previas:
+                continue
+            if len(lineas) == 1 and len(previas) == 1:
+                actualizar.append(cls._datos_linea(lineas[0]))
+            else:
+                if previas:
+                    eliminar.append(nombre)
+                insertar.extend(cls._datos_linea(linea) for linea in lineas)
+        
+        return insertar, actualizar, eliminar
+    
+    def _olvidar_pendiente(self, db_id: int) -> None:
+        """Descarta la foto de un pendiente borrado y lo resta de su saldo."""
+        guardada = self._pendientes_guardados.pop(db_id, None)
+        if guardada is not None:
+            self._ajustar_saldo(guardada[0], -1)
+    
     def eliminar_recibo_pendiente(self, fecha: str) -> bool:
-        """Elimina un recibo pendiente por su fecha."""
+        """Elimina un recibo pendiente por su fecha (también uno retirado)."""
+        for lista in (self.receipts_pending, self._pendientes_retirados):
+            for i, recibo in enumerate(lista):
+                if recibo.fecha == fecha:
+                    # Eliminar de base de datos
+                    if getattr(recibo, 'db_id', None) is not None:
+                        self.db.eliminar_recibo(recibo.db_id, usuario='sistema')
+                        self._olvidar_pendiente(recibo.db_id)
+                        # Si se cobra, se guardará de nuevo como recibo pagado
+                        recibo.db_id = None
+                    
+                    # Eliminar de memoria
+                    del lista[i]
+                    return True
+        return False
+    
+    def retirar_recibo_pendiente(self, fecha: str) -> Optional[Receipt]:
+        """
+        Quita un recibo pendiente de la lista (al cargarlo en pantalla) sin
+        borrarlo de la base de datos.
+        
+        Conserva su fila, su `db_id` y lo guardado de él: al volver a
+        guardarlo con `agregar_recibo_pendiente` solo se escriben sus cambios
+        y al cobrarlo `eliminar_recibo_pendiente` borra la fila. Si no pasa
+        ninguna de las dos cosas sigue pendiente en la base de datos.
+        
+        Returns:
+            Optional[Receipt]: El recibo retirado, None si no existía
+        """
         for i, recibo in enumerate(self.receipts_pending):
             if recibo.fecha == fecha:
-                # Eliminar de base de datos
-                if hasattr(recibo, 'db_id'):
-                    self
-                if hasattr(recibo, 'db_id'):
-                    self.db.eliminar_recibo(recibo.db_id, usuario='sistema')
-                
-                # Eliminar de memoria
                 del self.receipts_pending[i]
-                return True
-        return False
+                self._pendientes_retirados.append(recibo)
+                return recibo
+        return None
+    
     def guardar_recibos_anuales(self, recibos_manager: ReceiptManager,
                                 anio: int = None) -> None:
         """
-        Guarda los recibos anuales en la base de datos encriptada.
-        Los recibos ya se guardan en tiempo real, este método es para compatibilidad.
+        Guarda en la base de datos encriptada los recibos pagados que aún
+        no están en ella (sin `db_id`), junto con sus ventas diarias.
         """
-        # No hacer nada, los recibos ya están guardados en tiempo real
-        pass
+        pagados = (TicketConfig.ESTADO_EFECTIVO, TicketConfig.ESTADO_TARJETA)
+        nuevos = [
+            r for r in recibos_manager.obtener_todos_recibos()
+            if r.estado in pagados and getattr(r, 'db_id', None) is None
+        ]
+        if not nuevos:
+            return
+        
+        with self.db.batch():
+            for recibo in nuevos:
+                self._guardar_recibo_db(recibo)
+    
+    def obtener_ventas_diarias(self, fecha_inicio, fecha_fin,
+                               metodos: List[str] = None) -> List[Dict]:
+        """Ventas agregadas por día (ver `DatabaseManagerEncrypted.obtener_ventas_diarias`)."""
+        return self.db.obtener_ventas_diarias(fecha_inicio, fecha_fin, metodos)
     
     def cargar_recibos_anuales(self, anio: int = None) -> ReceiptManager:
         """Carga los recibos anuales desde la base de datos encriptada."""
@@ -157,43 +369,22 @@ class DataManagerSQLite:
         manager = ReceiptManager()
         
         try:
-            # Obtener recibos del año (pagados)
-            fecha_inicio = f'01/01/{anio}'
-            fecha_fin = f'31/12/{anio}'
-            
-            recibos_db = self.db.obtener_recibos(
-                fecha_inicio=fecha_inicio,
-                fecha_fin=fecha_fin
+            # Recibos pagados del año, en orden cronológico y por páginas,
+            # de una instantánea (no retiene la base de datos entre páginas)
+            recibos_pagados = self.db.iter_recibos(
+                estados=[TicketConfig.ESTADO_EFECTIVO, TicketConfig.ESTADO_TARJETA],
+                fecha_inicio=f'01/01/{anio}',
+                fecha_fin=f'31/12/{anio}',
+                descendente=False,
+                instantanea=True
             )
             
-            # Filtrar solo pagados
-            recibos_pagados = [r for r in recibos_db if r['estado'] in ['efectivo', 'tarjeta']]
-            
             # Agrupar por mes y convertir a Receipt
             for recibo_db in recibos_pagados:
                 # Extraer mes de la fecha
-                fecha_str = recibo_db['fecha']
-                mes = int(fecha_str.split('/')[1])
-                
-                # Convertir a Receipt
-                pedido = []
-                for linea in recibo_db['lineas']:
-                    pedido.append(LineaRecibo(
-                        cantidad=linea['cantidad'],
-                        nombre=linea['producto_nombre'],
-                        precio=linea['precio_unitario'],
-                        familia=linea['familia']
-                    ))
-                
-                recibo = Receipt(
-                    pedido=pedido,
-                    nombre=recibo_db.get('cliente_nombre', f"Pagado {recibo_db['estado']}"),
-                    fecha=recibo_db['fecha'],
-                    estado=recibo_db['estado'],
-                    impreso=recibo_db['impreso'],
-                    camarero=recibo_db.get('camarero_nombre', '')
-                )
+                mes = int(recibo_db['fecha'].split('/')[1])
                 
+                recibo = self._recibo_desde_db(recibo_db, f"Pagado {recibo_db['estado']}")
                 manager.agregar_recibo(recibo, mes)
             
             return manager
@@ -240,19 +431,28 @@ class DataManagerSQLite:
             for linea in recibo.pedido:
                 recibo_unido.agregar_linea(linea)
         
-        # Eliminar recibos antiguos de BD
-        for recibo in recibos_cliente:
-            if hasattr(recibo, 'db_id'):
-                self.db.eliminar_recibo(recibo.db_id, usuario='sistema')
-        
-        # Eliminar de memoria
-        self.receipts_pending = [
-            r for r in self.receipts_pending 
-            if r.nombre != nombre_cliente
-        ]
+        # El recibo unido reutiliza la fila del primero ya guardado: solo
+        # cambian sus cantidades y líneas nuevas, y se borran los demás
+        principal = next((r for r in recibos_cliente
+                          if getattr(r, 'db_id', None) in self._pendientes_guardados), None)
         
-        # Agregar recibo unido
-        self.agregar_recibo_pendiente(recibo_unido)
+        with self.db.batch():
+            # Eliminar recibos antiguos de BD
+            for recibo in recibos_cliente:
+                if recibo is not principal and getattr(recibo, 'db_id', None) is not None:
+                    self.db.eliminar_recibo(recibo.db_id, usuario='sistema')
+                    self._olvidar_pendiente(recibo.db_id)
+            
+            # Eliminar de memoria
+            self.receipts_pending = [
+                r for r in self.receipts_pending 
+                if r.nombre != nombre_cliente
+            ]
+            
+            # Agregar recibo unido
+            if principal is not None:
+                recibo_unido.db_id = principal.db_id
+            self.agregar_recibo_pendiente(recibo_unido)
         
         return recibo_unido
     
@@ -288,27 +488,28 @@ class DataManagerSQLite:
             ("Navaja", 10.0)
         ]
         
-        # Agregar productos
-        for nombre, precio in bebidas_ejemplo:
-            producto = Product(nombre, precio, "Bebida")
-            try:
-                self.products.agregar_producto(producto)
-            except:
-                pass
-        
-        for nombre, precio in comidas_ejemplo:
-            producto = Product(nombre, precio, "Comida")
-            try:
-                self.products.agregar_producto(producto)
-            except:
-                pass
-        
-        for nombre, precio in otros_ejemplo:
-            producto = Product(nombre, precio, "Otros")
-            try:
-                self.products.agregar_producto(producto)
-            except:
-                pass
+        # Agregar productos (una sola transacción)
+        with self.batch():
+            for nombre, precio in bebidas_ejemplo:
+                producto = Product(nombre, precio, "Bebida")
+                try:
+                    self.products.agregar_producto(producto)
+                except:
+                    pass
+            
+            for nombre, precio in comidas_ejemplo:
+                producto = Product(nombre, precio, "Comida")
+                try:
+                    self.products.agregar_producto(producto)
+                except:
+                    pass
+            
+            for nombre, precio in otros_ejemplo:
+                producto = Product(nombre, precio, "Otros")
+                try:
+                    self.products.agregar_producto(producto)
+                except:
+                    pass
 
 
 # ============================================================================
@@ -316,10 +517,144 @@ class DataManagerSQLite:
 # ============================================================================
 
 class ProductManagerSQLite:
-    """Gestor de productos usando SQLite encriptada."""
+    """
+    Gestor de productos usando SQLite encriptada.
+    
+    Mantiene en memoria el catálogo de productos activos, indexado por
+    nombre y por familia, con la posición de cada uno en su familia
+    (columna `posicion`, ver `intercambiar_productos`). Se carga una sola vez de la base de datos y las
+    escrituras van a la base de datos y a la caché, así que las consultas
+    (cada pulsación de un producto en el TPV) no tocan el disco.
     
-    def __init__(self, db):
+    Los suscriptores (`suscribir`) reciben el conjunto de familias cuyo
+    catálogo ha cambiado, para redibujar solo esos paneles.
+    """
+    
+    def __init__(self, db, productos: Optional[List[Dict]] = None):
         self.db = db
+        
+        # Caché: nombre -> Product, familia -> {nombre -> Product}
+        # y nombre -> posición en su familia
+        self._productos: Dict[str, Product] = {}
+        self._por_familia: Dict[str, Dict[str, Product]] = {}
+        self._posiciones: Dict[str, int] = {}
+        
+        # Avisos de cambios
+        self._suscriptores: List[Callable[[Set[str]], None]] = []
+        self._nivel_agrupacion = 0
+        self._foto_agrupacion: Dict[str, Tuple[float, str, int]] = {}
+        
+        self.recargar(productos)
+    
+    # ------ Caché ------
+    
+    def recargar(self, productos: Optional[List[Dict]] = None) -> None:
+        """
+        Vuelve a cargar el catálogo desde la base de datos.
+        
+        Args:
+            productos: Filas ya leídas (`obtener_datos_referencia`); si no
+                se indican se leen de la base de datos
+        """
+        if productos is None:
+            productos = self.db.obtener_productos()
+        self._productos = {}
+        self._por_familia = {}
+        self._posiciones = {}
+        for p in productos:
+            self._cachear(Product(p['nombre'], p['precio'], p['familia']), p['posicion'])
+    
+    def _cachear(self, producto: Product, posicion: int) -> None:
+        """Inserta o sustituye un producto en la caché."""
+        self._descachear(producto.nombre)
+        self._productos[producto.nombre] = producto
+        self._por_familia.setdefault(producto.familia, {})[producto.nombre] = producto
+        self._posiciones[producto.nombre] = posicion
+    
+    def _descachear(self, nombre: str) -> Optional[Product]:
+        """Quita un producto de la caché y lo devuelve (si estaba)."""
+        producto = self._productos.pop(nombre, None)
+        if producto is not None:
+            del self._posiciones[nombre]
+            familia = self._por_familia.get(producto.familia, {})
+            familia.pop(nombre, None)
+            if not familia:
+                self._por_familia.pop(producto.familia, None)
+        return producto
+    
+    def _siguiente_posicion(self, familia: str) -> int:
+        """Posición tras el último producto de la familia (como en la base de datos)."""
+        return max((self._posiciones[nombre] for nombre in self._por_familia.get(familia, {})),
+                   default=-1) + 1
+    
+    def _ordenados(self, productos) -> List[Product]:
+        """Productos en el orden de `obtener_productos` (familia, posición, nombre)."""
+        return sorted(productos, key=lambda p: (p.familia, self._posiciones[p.nombre], p.nombre))
+    
+    # ------ Avisos de cambios ------
+    
+    def suscribir(self, callback: Callable[[Set[str]], None]) -> None:
+        """
+        Registra una función a la que avisar cuando cambie el catálogo.
+        
+        Args:
+            callback: Recibe el conjunto de familias afectadas
+        """
+        if callback not in self._suscriptores:
+            self._suscriptores.append(callback)
+    
+    def cancelar_suscripcion(self, callback: Callable[[Set[str]], None]) -> None:
+        """Deja de avisar a una función registrada con `suscribir`."""
+        if callback in self._suscriptores:
+            self._suscriptores.remove(callback)
+    
+    def _foto(self) -> Dict[str, Tuple[float, str, int]]:
+        """Estado comparable del catálogo (nombre -> (precio, familia, posición))."""
+        return {p.nombre: (p.precio, p.familia, self._posiciones[p.nombre])
+                for p in self._productos.values()}
+    
+    def _avisar(self, familias: Set[str]) -> None:
+        """Avisa a los suscriptores (salvo dentro de `agrupar_cambios`)."""
+        if self._nivel_agrupacion or not familias:
+            return
+        for callback in list(self._suscriptores):
+            try:
+                callback(set(familias))
+            except Exception as e:
+                print(f"Error al avisar del cambio de productos: {e}")
+    
+    @contextmanager
+    def agrupar_cambios(self):
+        """
+        Agrupa los avisos de varias escrituras en uno solo al terminar.
+        
+        Solo se avisa de las familias cuyo catálogo ha cambiado de verdad
+        (p. ej. `limpiar` + volver a agregar lo mismo no avisa). Si el bloque
+        falla se recarga la caché, porque la transacción se habrá deshecho.
+        """
+        if self._nivel_agrupacion == 0:
+            self._foto_agrupacion = self._foto()
+        self._nivel_agrupacion += 1
+        try:
+            yield
+        except BaseException:
+            if self._nivel_agrupacion == 1:
+                self.recargar()
+            raise
+        finally:
+            self._nivel_agrupacion -= 1
+            if self._nivel_agrupacion == 0:
+                antes, self._foto_agrupacion = self._foto_agrupacion, {}
+                despues = self._foto()
+                familias = {
+                    estado[1]
+                    for foto, otra in ((antes, despues), (despues, antes))
+                    for nombre, estado in foto.items()
+                    if otra.get(nombre) != estado
+                }
+                self._avisar(familias)
+    
+    # ------ Escrituras (base de datos y caché) ------
     
     def agregar_producto(self, producto: Product) -> None:
         """Agrega o actualiza un producto."""
@@ -328,59 +663,96 @@ class ProductManagerSQLite:
             producto.precio,
             producto.familia
         )
+        # Misma regla que `guardar_producto`: nuevo, reactivado o con otra
+        # familia pasa al final; si no, conserva su posición
+        anterior = self._productos.get(producto.nombre)
+        if anterior is None or anterior.familia != producto.familia:
+            posicion = self._siguiente_posicion(producto.familia)
+        else:
+            posicion = self._posiciones[producto.nombre]
+        self._cachear(Product(producto.nombre, producto.precio, producto.familia), posicion)
+        
+        familias = {producto.familia}
+        if anterior is not None:
+            familias.add(anterior.familia)
+        self._avisar(familias)
     
     def actualizar_producto(self, nombre: str, precio: Optional[float] = None,
                           familia: Optional[str] = None) -> None:
         """Actualiza un producto."""
-        productos = self.db.obtener_productos()
-        for p in productos:
-            if p['nombre'] == nombre:
-                nuevo_precio = precio if precio is not None else p['precio']
-                nueva_familia = familia if familia is not None else p['familia']
-                self.db.guardar_producto(nombre, nuevo_precio, nueva_familia)
-                return
+        p = self._productos.get(nombre)
+        if p is None:
+            raise ValueError(f"Producto '{nombre}' no encontrado")
         
-        raise ValueError(f"Producto '{nombre}' no encontrado")
+        nuevo_precio = precio if precio is not None else p.precio
+        nueva_familia = familia if familia is not None else p.familia
+        self.agregar_producto(Product(nombre, nuevo_precio, nueva_familia))
     
     def eliminar_producto(self, nombre: str) -> bool:
         """Elimina un producto (soft delete)."""
-        return self.db.eliminar_producto(nombre)
+        exito = self.db.eliminar_producto(nombre)
+        producto = self._descachear(nombre)
+        if producto is not None:
+            self._avisar({producto.familia})
+        return exito
+    
+    def intercambiar_productos(self, nombre1: str, nombre2: str) -> bool:
+        """
+        Intercambia la posición de dos productos de la misma familia.
+        
+        Returns:
+            bool: False si alguno no existe o son de familias distintas
+        """
+        if not self.db.intercambiar_productos(nombre1, nombre2):
+            return False
+        
+        self._posiciones[nombre1], self._posiciones[nombre2] = \
+            self._posiciones[nombre2], self._posiciones[nombre1]
+        self._avisar({self._productos[nombre1].familia})
+        return True
+    
+    def mover_producto(self, nombre: str, posicion: int) -> bool:
+        """
+        Lleva un producto al lugar `posicion` (0 = primero) de su familia
+        tal como se muestra; el que lo ocupaba pasa al que deja libre (ver
+        `DatabaseManagerEncrypted.mover_producto`).
+        
+        Returns:
+            bool: False si el producto no existe o la posición está fuera
+                de su familia
+        """
+        if not self.db.mover_producto(nombre, posicion):
+            return False
+        
+        familia = self._productos[nombre].familia
+        destino = self.obtener_productos_por_familia(familia)[posicion].nombre
+        if destino != nombre:
+            self._posiciones[nombre], self._posiciones[destino] = \
+                self._posiciones[destino], self._posiciones[nombre]
+            self._avisar({familia})
+        return True
+    
+    # ------ Consultas (solo caché) ------
     
     def obtener_producto(self, nombre: str) -> Optional[Product]:
-        """Obtiene un producto por su nombre."""
-        productos = self.db.obtener_productos()
-        for p in productos:
-            if p['nombre'] == nombre:
-                return Product(
-                    nombre=p['nombre'],
-                    precio=p['precio'],
-                    familia=p['familia']
-                )
-        return None
+        """Obtiene un producto por su nombre (el de la caché: no modificar)."""
+        return self._productos.get(nombre)
     
     def existe_producto(self, nombre: str) -> bool:
         """Verifica si existe un producto."""
-        return self.obtener_producto(nombre) is not None
+        return nombre in self._productos
     
     def obtener_productos_por_familia(self, familia: str) -> List[Product]:
         """Obtiene productos de una familia."""
-        productos_db = self.db.obtener_productos(familia=familia)
-        return [
-            Product(p['nombre'], p['precio'], p['familia'])
-            for p in productos_db
-        ]
+        return self._ordenados(self._por_familia.get(familia, {}).values())
     
     def obtener_todos(self) -> List[Product]:
         """Obtiene todos los productos activos."""
-        productos_db = self.db.obtener_productos()
-        return [
-            Product(p['nombre'], p['precio'], p['familia'])
-            for p in productos_db
-        ]
+        return self._ordenados(self._productos.values())
     
     def obtener_numero_productos(self) -> int:
         """Obtiene el número total de productos."""
-        return len(self.db.obtener_productos())
+        return len(self._productos)
     
     def exportar_productos(self) -> List[Dict]:
         """Exporta productos (para compatibilidad)."""
@@ -388,49 +760,188 @@ class ProductManagerSQLite:
     
     def cargar_productos(self, productos_data: List[Dict]) -> None:
         """Carga productos (para compatibilidad)."""
-        for data in productos_data:
-            try:
-                self.db.guardar_producto(
-                    data['nombre'],
-                    data['precio'],
-                    data['familia']
-                )
-            except Exception as e:
-                print(f"Error al cargar producto: {e}")
+        with self.agrupar_cambios(), self.db.batch():
+            for data in productos_data:
+                try:
+                    self.agregar_producto(Product(
+                        data['nombre'],
+                        data['precio'],
+                        data['familia']
+                    ))
+                except Exception as e:
+                    print(f"Error al cargar producto: {e}")
     
     def limpiar(self) -> None:
         """Limpia todos los productos (marca como inactivos)."""
-        productos = self.db.obtener_productos()
-        for p in productos:
-            self.db.eliminar_producto(p['nombre'])
+        with self.agrupar_cambios(), self.db.batch():
+            for nombre in list(self._productos):
+                self.eliminar_producto(nombre)
+
+
+class _NombresEnMemoria:
+    """Nombres activos (clientes o camareros) como conjunto y lista ordenada."""
+    
+    def __init__(self, nombres: List[str],
+                 cargar: Optional[Callable[[], List[str]]] = None):
+        """
+        Args:
+            nombres: Nombres iniciales
+            cargar: Lee los nombres de la base de datos (para `recargar`)
+        """
+        self._cargar = cargar
+        self._nivel_agrupacion = 0
+        self._poner(nombres)
+    
+    def _poner(self, nombres: List[str]) -> None:
+        self._conjunto: Set[str] = set(nombres)
+        self._lista: List[str] = sorted(self._conjunto)
+    
+    def recargar(self) -> None:
+        """Vuelve a leer los nombres de la base de datos."""
+        self._poner(self._cargar())
+    
+    @contextmanager
+    def agrupar_cambios(self):
+        """
+        Bloque de escrituras en un lote: si falla se recargan los nombres,
+        porque la transacción se habrá deshecho.
+        """
+        self._nivel_agrupacion += 1
+        try:
+            yield
+        except BaseException:
+            if self._nivel_agrupacion == 1:
+                self.recargar()
+            raise
+        finally:
+            self._nivel_agrupacion -= 1
+    
+    def __contains__(self, nombre: str) -> bool:
+        return nombre in self._conjunto
+    
+    def __len__(self) -> int:
+        return len(self._conjunto)
+    
+    def lista(self) -> List[str]:
+        """Copia de la lista ordenada (mismo orden que `ORDER BY nombre`)."""
+        return list(self._lista)
+    
+    def agregar(self, nombre: str) -> None:
+        if nombre not in self._conjunto:
+            self._conjunto.add(nombre)
+            bisect.insort(self._lista, nombre)
+    
+    def quitar(self, nombre: str) -> None:
+        if nombre in self._conjunto:
+            self._conjunto.remove(nombre)
+            del self._lista[bisect.bisect_left(self._lista, nombre)]
+
+
+class ConfiguracionSQLite:
+    """
+    Configuración en memoria con escritura a la base de datos.
+    
+    Guarda el texto de cada clave tal como está en la tabla `configuracion`
+    y lo convierte al tipo del valor por defecto al leerlo: una contraseña
+    '1234' sigue siendo str y un IVA guardado como 21 sale como 21.0. Solo
+    se escribe en la base de datos lo que cambia.
+    """
+    
+    def __init__(self, db, valores: Optional[Dict[str, str]] = None):
+        self.db = db
+        self._valores: Dict[str, str] = dict(
+            valores if valores is not None
+            else db.obtener_datos_referencia()['configuracion']
+        )
+        self._nivel_agrupacion = 0
+        self._foto_agrupacion: Dict[str, str] = {}
+    
+    @contextmanager
+    def agrupar_cambios(self):
+        """
+        Bloque de escrituras en un lote: si falla se vuelve a los valores de
+        antes del bloque, porque la transacción se habrá deshecho.
+        """
+        if self._nivel_agrupacion == 0:
+            self._foto_agrupacion = dict(self._valores)
+        self._nivel_agrupacion += 1
+        try:
+            yield
+        except BaseException:
+            if self._nivel_agrupacion == 1:
+                self._valores = self._foto_agrupacion
+            raise
+        finally:
+            self._nivel_agrupacion -= 1
+            if self._nivel_agrupacion == 0:
+                self._foto_agrupacion = {}
+    
+    @staticmethod
+    def _codificar(valor: Any) -> str:
+        """Texto con el que `guardar_configuracion` guarda un valor."""
+        return valor if isinstance(valor, str) else json.dumps(valor)
+    
+    def obtener(self, clave: str, default: Any = None) -> Any:
+        """Obtiene un valor de configuración con el tipo de `default`."""
+        texto = self._valores.get(clave)
+        if texto is None:
+            return copy.deepcopy(default)
+        if isinstance(default, str):
+            return texto
+        
+        try:
+            valor = json.loads(texto)
+        except ValueError:
+            return texto
+        if isinstance(default, float) and type(valor) is int:
+            return float(valor)
+        return valor
+    
+    def guardar(self, clave: str, valor: Any) -> None:
+        """Guarda un valor de configuración (nada si no ha cambiado)."""
+        texto = self._codificar(valor)
+        if self._valores.get(clave) == texto:
+            return
+        self.db.guardar_configuracion(clave, valor)
+        self._valores[clave] = texto
 
 
 class CustomerManagerSQLite:
-    """Gestor de clientes usando SQLite encriptada."""
+    """Gestor de clientes usando SQLite encriptada (nombres en memoria)."""
     
-    def __init__(self, db):
+    def __init__(self, db, clientes: Optional[List[str]] = None):
         self.db = db
+        self._clientes = _NombresEnMemoria(
+            clientes if clientes is not None else db.obtener_clientes(),
+            db.obtener_clientes
+        )
+    
+    def agrupar_cambios(self):
+        """Ver `_NombresEnMemoria.agrupar_cambios`."""
+        return self._clientes.agrupar_cambios()
     
     def agregar_cliente(self, nombre: str) -> None:
         """Agrega un nuevo cliente."""
         self.db.guardar_cliente(nombre)
+        self._clientes.agregar(nombre)
     
     def eliminar_cliente(self, nombre: str) -> bool:
         """Elimina un cliente (soft delete)."""
-        return self.db.eliminar_cliente(nombre)
+        exito = self.db.eliminar_cliente(nombre)
+        self._clientes.quitar(nombre)
+        return exito
     
     def existe_cliente(self, nombre: str) -> bool:
         """Verifica si existe un cliente."""
-        clientes = self.db.obtener_clientes()
-        return nombre in clientes
+        return nombre in self._clientes
     
     def obtener_todos(self) -> List[str]:
         """Obtiene todos los clientes activos."""
-        return self.db.obtener_clientes()
+        return self._clientes.lista()
     
     def obtener_numero_clientes(self) -> int:
         """Obtiene el número total de clientes."""
-        return len(self.obtener_todos())
+        return len(self._clientes)
     
     def exportar_clientes(self) -> List[str]:
         """Exporta clientes (para compatibilidad)."""
@@ -438,46 +949,58 @@ class CustomerManagerSQLite:
     
     def cargar_clientes(self, clientes: List[str]) -> None:
         """Carga clientes (para compatibilidad)."""
-        for cliente in clientes:
-            try:
-                if not self.existe_cliente(cliente):
-                    self.agregar_cliente(cliente)
-            except:
-                pass
+        with self.agrupar_cambios(), self.db.batch():
+            for cliente in clientes:
+                try:
+                    if not self.existe_cliente(cliente):
+                        self.agregar_cliente(cliente)
+                except:
+                    pass
     
     def limpiar(self) -> None:
         """Limpia todos los clientes."""
-        clientes = self.obtener_todos()
-        for cliente in clientes:
-            self.eliminar_cliente(cliente)
+        with self.agrupar_cambios(), self.db.batch():
+            clientes = self.obtener_todos()
+            for cliente in clientes:
+                self.eliminar_cliente(cliente)
 
 
 class WaiterManagerSQLite:
-    """Gestor de camareros usando SQLite encriptada."""
+    """Gestor de camareros usando SQLite encriptada (nombres en memoria)."""
     
-    def __init__(self, db):
+    def __init__(self, db, camareros: Optional[List[str]] = None):
         self.db = db
+        self._camareros = _NombresEnMemoria(
+            camareros if camareros is not None else db.obtener_camareros(),
+            db.obtener_camareros
+        )
+    
+    def agrupar_cambios(self):
+        """Ver `_NombresEnMemoria.agrupar_cambios`."""
+        return self._camareros.agrupar_cambios()
     
     def agregar_camarero(self, nombre: str) -> None:
         """Agrega un nuevo camarero."""
         self.db.guardar_camarero(nombre)
+        self._camareros.agregar(nombre)
     
     def eliminar_camarero(self, nombre: str) -> bool:
         """Elimina un camarero (soft delete)."""
-        return self.db.eliminar_camarero(nombre)
+        exito = self.db.eliminar_camarero(nombre)
+        self._camareros.quitar(nombre)
+        return exito
     
     def existe_camarero(self, nombre: str) -> bool:
         """Verifica si existe un camarero."""
-        camareros = self.db.obtener_camareros()
-        return nombre in camareros
+        return nombre in self._camareros
     
     def obtener_todos(self) -> List[str]:
         """Obtiene todos los camareros activos."""
-        return self.db.obtener_camareros()
+        return self._camareros.lista()
     
     def obtener_numero_camareros(self) -> int:
         """Obtiene el número total de camareros."""
-        return len(self.obtener_todos())
+        return len(self._camareros)
     
     def exportar_camareros(self) -> List[str]:
         """Exporta camareros (para compatibilidad)."""
@@ -485,18 +1008,20 @@ class WaiterManagerSQLite:
     
     def cargar_camareros(self, camareros: List[str]) -> None:
         """Carga camareros (para compatibilidad)."""
-        for camarero in camareros:
-            try:
-                if not self.existe_camarero(camarero):
-                    self.agregar_camarero(camarero)
-            except:
-                pass
+        with self.agrupar_cambios(), self.db.batch():
+            for camarero in camareros:
+                try:
+                    if not self.existe_camarero(camarero):
+                        self.agregar_camarero(camarero)
+                except:
+                    pass
     
     def limpiar(self) -> None:
         """Limpia todos los camareros."""
-        camareros = self.obtener_todos()
-        for camarero in camareros:
-            self.eliminar_camarero(camarero)
+        with self.agrupar_cambios(), self.db.batch():
+            camareros = self.obtener_todos()
+            for camarero in camareros:
+                self.eliminar_camarero(camarero)
 
 
 # ============================================================================
@@ -2,35 +2,74 @@
 Sistema de base de datos SQLite ENCRIPTADA para TPV.
 
 Este archivo implementa la opción A (recomendada): la base de datos
-entera se almacena cifrada en disco usando Fernet (cryptography).
+entera se almacena cifrada en disco (AES-GCM por segmentos o Fernet, ver
+core/cipher.py).
 
 Funcionamiento resumido:
 - En disco: archivo cifrado (tpv.db) — nunca en claro.
-- Al abrir: se descifra a un archivo temporal, SQLite trabaja sobre él.
-- Al cerrar: se cifra el temporal y se sobreescribe el archivo en disco.
+- Modo sesión (por defecto): se descifra una sola vez al arrancar en una
+  SQLite en memoria (sqlite3 deserialize) y se mantiene una única conexión
+  durante toda la vida del proceso. Cada commit se añade cifrado al diario
+  (`tpv.db.journal`, ver data/commit_journal.py) y la imagen completa solo
+  se reescribe al compactar el diario (`checkpoint()`, `compactar()`,
+  inactividad y `cerrar()`).
+- Modo por operación: cada `get_connection()` descifra a un archivo
+  temporal, SQLite trabaja sobre él y al salir se cifra y sobreescribe
+  el archivo en disco.
 
 Requisitos: `pip install cryptography`
 """
 from __future__ import annotations
 
 import sqlite3
-from datetime import datetime
-from typing import List, Optional, Dict, Any
-from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Dict, Any
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from itertools import chain, islice
+import heapq
 import json
-import shutil
-from pathlib import Path
+import hmac
 import hashlib
-import base64
+import re
+from pathlib import Path
+import atexit
+import threading
+import time
 
-from cryptography.fernet import Fernet, InvalidToken
+from cryptography.fernet import InvalidToken
 
 # Importa la configuración de encriptación de tu proyecto
-from config.settings import EncryptionConfig
+from config.settings import EncryptionConfig, DatabaseConfig, TicketConfig
+from core.cipher import Cipher, obtener_cifrador
+from data.chunked_container import ChunkedContainer
+from data.audit_store import AuditStore
+from data.backup_repository import BackupRepository
+from data.backup_scheduler import BackupScheduler
+from data.commit_journal import CommitJournal
+from data.persistence_worker import PersistenceWorker, instalar_manejadores_senales
+from data.year_archive import YearArchive
+from utils.formatters import fecha_a_ts
+
+
+def _fecha_ts_recibo(fecha, fecha_creacion: str) -> int:
+    """`fecha_a_ts` de un recibo; si la fecha no tiene un formato reconocido
+    se usa la de creación (ISO), para que `fecha_ts` nunca sea NULL y la
+    paginación por (fecha_ts, id) no se salte recibos."""
+    try:
+        return fecha_a_ts(fecha)
+    except (TypeError, ValueError):
+        print(f"⚠ Fecha de recibo no reconocida: {fecha!r}")
+        return fecha_a_ts(datetime.fromisoformat(fecha_creacion))
+
+
+def _anio_ts(fecha_ts: int) -> int:
+    """Año de un `fecha_ts` (hora local de pared, ver `fecha_a_ts`)."""
+    return (date(1970, 1, 1) + timedelta(days=fecha_ts // 86400)).year
 
 
 class DatabaseManagerEncrypted:
-    """Gestiona la base de datos SQLite cifrada en disco usando Fernet.
+    """Gestiona la base de datos SQLite cifrada en disco (ver core/cipher.py).
 
     Nota:
         - No usa SQLCipher ni extensiones C; es compatible con Python 3.13+ en Windows.
@@ -38,9 +77,15 @@ class DatabaseManagerEncrypted:
             * Una clave Fernet válida (bytes o str, 44 caracteres base64 urlsafe)
             * O cualquier secreto (passphrase) — en ese caso se derivará un key determinístico
               mediante SHA-256 y se mapeará a una clave Fernet.
+        - En modo sesión la conexión en memoria se comparte entre hilos y
+          está protegida por un RLock. Con el diario activo cada commit es
+          durable al confirmarse; sin él, los datos confirmados desde el
+          último checkpoint solo existen en memoria hasta que se llama a
+          `checkpoint()` o `cerrar()` (registrado también con atexit).
     """
 
-    def __init__(self, db_path: str = "data/tpv.db"):
+    def __init__(self, db_path: str = "data/tpv.db", modo_sesion: Optional[bool] = None,
+                 diario: Optional[bool] = None):
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -49,48 +94,796 @@ class DatabaseManagerEncrypted:
         if isinstance(raw_key, str):
             raw_key = raw_key.encode("utf-8")
         self._raw_key = raw_key
+        # Claves derivadas una sola vez (contexto cacheado por clave)
+        self._cifrador: Cipher = obtener_cifrador(raw_key)
+
+        # Contenedor fragmentado (formato en disco por fragmentos cifrados)
+        self._contenedor = ChunkedContainer(
+            self.db_path,
+            self._encrypt_bytes,
+            self._decrypt_bytes,
+            DatabaseConfig.TAMANO_FRAGMENTO
+        )
+
+        # Estado del modo sesión
+        self.modo_sesion = DatabaseConfig.MODO_SESION if modo_sesion is None else modo_sesion
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._lock_disco = threading.Lock()
+        self._profundidad = 0
+        self._ultimo_checkpoint: Optional[datetime] = None
+        # Huella (total_changes, schema_version) de lo último persistido;
+        # None si la sesión nunca se ha escrito en disco
+        self._huella_persistida: Optional[tuple] = None
+
+        # Copias de solo lectura en reserva (ver `instantanea`), con la
+        # versión (conexión, huella) de la que se tomaron
+        self._instantaneas: List[tuple] = []
+        self._lock_instantaneas = threading.Lock()
+        self.instantaneas_creadas = 0
+        self.instantaneas_reutilizadas = 0
+
+        # Compactaciones de páginas libres (ver `compactar_paginas`)
+        self.compactaciones_paginas = 0
+        self._ultima_compactacion_paginas: Optional[datetime] = None
+
+        # Diario de commits (solo en modo sesión)
+        self._diario = CommitJournal(
+            self.db_path,
+            self._encrypt_bytes,
+            self._decrypt_bytes,
+            DatabaseConfig.DIARIO_FSYNC
+        )
+        self.usar_diario = self.modo_sesion and (
+            DatabaseConfig.DIARIO if diario is None else diario
+        )
+        self._esquema_capturado: Optional[int] = None
+        self._ultimo_commit = time.monotonic()
+
+        # Auditoría en segmentos mensuales cifrados, fuera de la imagen.
+        # Los registros de la transacción en curso se acumulan aquí y se
+        # escriben en un solo bloque al confirmarla
+        self._auditoria = AuditStore(
+            self.db_path.with_name(self.db_path.name + ".auditoria"),
+            self._encrypt_comprimido,
+            self._decrypt_bytes,
+            DatabaseConfig.AUDITORIA_FSYNC,
+            DatabaseConfig.AUDITORIA_COMPRESION
+        )
+        self._auditoria_pendiente: List[Dict] = []
+
+        # Repositorio de backups deduplicado (ver `crear_backup`)
+        self._copias = BackupRepository(
+            self.db_path.parent / 'backup' / 'repositorio',
+            self._encrypt_comprimido,
+            self._decrypt_bytes,
+            hmac.new(self._cifrador.contexto.clave_aead, b"tpv-backup-id-v1",
+                     hashlib.sha256).digest()
+        )
+        self._lock_copias = threading.Lock()
+
+        # Recibos de los años cerrados (ver `archivar_anios_cerrados`)
+        self._archivo = YearArchive(
+            self.db_path.with_name(self.db_path.name + ".archivo"),
+            self._cifrador,
+            DatabaseConfig.ARCHIVO_ANIOS_EN_MEMORIA
+        )
+        self._anio_activo: Optional[int] = None
+        # Programador de backups (ver `iniciar_backups_programados`)
+        self._programador_backups: Optional[BackupScheduler] = None
+
+        # Hilo de persistencia que escribe los registros del diario
+        self._persistencia: Optional[PersistenceWorker] = None
+
+        # Lote en curso (ver `batch()`)
+        self._conexion_lote: Optional[sqlite3.Connection] = None
+        self._nivel_lote = 0
+
+        # Un diario pendiente (cierre inesperado) se vuelca antes de abrir
+        self._recuperar_diario()
+
+        if self.usar_diario:
+            # Si una escritura falla, los registros vuelven a la cola y se
+            # reintentan; la compactación también los incluye en la imagen
+            self._persistencia = PersistenceWorker(
+                self._diario.anadir_varios,
+                DatabaseConfig.PERSISTENCIA,
+                commits=DatabaseConfig.PERSISTENCIA_COMMITS,
+                segundos=DatabaseConfig.PERSISTENCIA_SEGUNDOS,
+                retraso_max=DatabaseConfig.PERSISTENCIA_RETRASO_MAX,
+                tarea_periodica=self._comprobar_compactacion,
+                intervalo_tarea=DatabaseConfig.DIARIO_INTERVALO
+            )
+            instalar_manejadores_senales()
+
+        if self.modo_sesion:
+            self._abrir_sesion()
+            atexit.register(self.cerrar)
 
         # Inicializar DB (si no existe, se creará al abrir por primera vez)
         self._inicializar_db()
 
+        # Sellar los segmentos de auditoría de meses ya cerrados
+        self._auditoria.rotar()
+
+        # Año activo; terminar un archivado anual interrumpido
+        self._anio_activo = self.obtener_configuracion('anio_activo')
+        archivando = self.obtener_configuracion('archivando')
+        if archivando:
+            self.archivar_anios_cerrados(archivando)
+
+        # En modo sesión, asegurar que el archivo cifrado exista desde el inicio
+        if self.modo_sesion and not self.db_path.exists():
+            self.compactar()
+
     # -------------------------- Helpers de cifrado --------------------------
-    def _derive_fernet_key(self) -> bytes:
-        """Deriva una clave Fernet a partir de _raw_key.
+    def _encrypt_bytes(self, data: bytes) -> bytes:
+        return self._cifrador.cifrar(data)
+
+    def _encrypt_comprimido(self, data: bytes) -> bytes:
+        # Bloques de auditoría y fragmentos de backup: ya van comprimidos
+        return self._cifrador.cifrar(data, comprimir=False)
+
+    def _decrypt_bytes(self, data: bytes) -> bytes:
+        # Detecta el formato: binario (AES-GCM/ChaCha20) o token Fernet
+        return self._cifrador.descifrar(data)
+
+    def es_fragmentada(self) -> bool:
+        """Indica si la base de datos usa (o usará) el formato fragmentado.
+
+        Un archivo existente conserva su formato; uno nuevo usa el de
+        `DatabaseConfig.FORMATO_FRAGMENTADO`.
+        """
+        if self.db_path.exists() and self.db_path.stat().st_size > 0:
+            return ChunkedContainer.es_contenedor(self.db_path)
+        return DatabaseConfig.FORMATO_FRAGMENTADO
+
+    def _leer_imagen(self) -> Optional[bytes]:
+        """Lee y descifra la imagen SQLite del disco (None si no existe)."""
+        if not (self.db_path.exists() and self.db_path.stat().st_size > 0):
+            return None
+
+        try:
+            if ChunkedContainer.es_contenedor(self.db_path):
+                with self._lock_disco:
+                    return self._contenedor.leer_imagen()
+            return self._cifrador.descifrar_archivo(self.db_path)
+        except (InvalidToken, ValueError):
+            raise Exception("Clave de encriptación incorrecta o archivo corrupto")
+
+    def _escribir_imagen(self, plain: bytes, fragmentada: Optional[bool] = None) -> None:
+        """Cifra una imagen SQLite y la escribe en disco de forma atómica.
+
+        Args:
+            plain: Imagen SQLite en claro
+            fragmentada: Formato de destino (None = el actual, ver `es_fragmentada`)
+        """
+        if fragmentada is None:
+            fragmentada = self.es_fragmentada()
+
+        with self._lock_disco:
+            if fragmentada:
+                # Solo se cifran y escriben los fragmentos modificados
+                self._contenedor.escribir_imagen(plain)
+                return
+
+            # Asegurar escritura atómica: cifrar en flujo a tmp y renombrar
+            tmp_write = self.db_path.with_suffix(self.db_path.suffix + ".write")
+            self._cifrador.cifrar_a_archivo(plain, tmp_write)
+            tmp_write.replace(self.db_path)
+
+    def convertir_formato(self, fragmentada: bool = True) -> None:
+        """Convierte el archivo en disco entre token único y fragmentado.
+
+        Args:
+            fragmentada: True para pasar a fragmentos, False para token único
+        """
+        with self._lock:
+            if self.modo_sesion and self._conn is not None:
+                plain = self._conn.serialize()
+            else:
+                plain = self._leer_imagen()
+            if plain is None:
+                return
+
+            posicion = self._diario.tamano()
+            self._escribir_imagen(plain, fragmentada)
+            self._diario.descartar_hasta(posicion)
+            if not fragmentada:
+                self._contenedor.descartar_fragmentos()
+
+    # -------------------------- Seguimiento de cambios ----------------------
+    @staticmethod
+    def _huella(conn: sqlite3.Connection) -> tuple:
+        """Devuelve la huella de cambios de una conexión.
+
+        `total_changes` cuenta las filas modificadas por INSERT/UPDATE/DELETE;
+        `schema_version` cubre los cambios de esquema (CREATE/ALTER), que
+        no se reflejan en `total_changes`.
+        """
+        schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        return (conn.total_changes, schema_version)
+
+    def hay_cambios_pendientes(self) -> bool:
+        """Indica si la sesión tiene cambios sin persistir en disco."""
+        with self._lock:
+            if self._conn is None:
+                return False
+            return self._huella(self._conn) != self._huella_persistida
+
+    # -------------------------- Modo sesión ---------------------------------
+    @staticmethod
+    def _normalizar_cabecera(plain: bytes) -> bytes:
+        """Desactiva el modo WAL en la cabecera de una imagen SQLite.
+
+        Las imágenes creadas por el modo por operación llevan los bytes 18/19
+        de la cabecera a 2 (WAL), que una base de datos en memoria no admite.
+        """
+        if len(plain) >= 100 and (plain[18] == 2 or plain[19] == 2):
+            imagen = bytearray(plain)
+            imagen[18] = 1
+            imagen[19] = 1
+            return bytes(imagen)
+        return plain
+
+    def _abrir_sesion(self) -> None:
+        """Descifra la imagen del disco en una SQLite en memoria."""
+        with self._lock:
+            if self._conn is not None:
+                return
+
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            plain = self._leer_imagen()
+            if plain:
+                conn.deserialize(self._normalizar_cabecera(plain))
+            conn.row_factory = sqlite3.Row
+            self._conn = conn
+            self._huella_persistida = self._huella(conn) if plain else None
+            if self.usar_diario:
+                self._instalar_captura(conn)
+
+    def checkpoint(self, forzar: bool = False) -> bool:
+        """Cifra la base de datos en memoria y la persiste en disco.
+
+        Solo tiene efecto en modo sesión. Si no hay cambios desde el último
+        checkpoint (y no se fuerza) no se escribe nada. Si hay una
+        transacción en curso en este hilo, el checkpoint se omite (se hará
+        en el siguiente).
+
+        Con el diario activo los commits ya son durables, así que solo se
+        compacta si el diario supera `DIARIO_MAX_BYTES` o `DIARIO_MAX_EDAD`.
+
+        Args:
+            forzar: Escribir la imagen aunque no haya cambios
+
+        Returns:
+            bool: True si se escribió la imagen en disco
+        """
+        if not self.modo_sesion:
+            return False
+
+        if (self.usar_diario and not forzar
+                and self._huella_persistida is not None
+                and not self._diario_excedido()):
+            return False
+
+        return self._volcar_imagen(forzar)
+
+    def compactar(self) -> bool:
+        """Vuelca el diario en la imagen principal si hay cambios sin volcar.
+
+        Returns:
+            bool: True si se escribió la imagen en disco
+        """
+        if not self.modo_sesion:
+            return False
+        return self._volcar_imagen()
+
+    def _volcar_imagen(self, forzar: bool = False) -> bool:
+        """Escribe la imagen completa y descarta los registros del diario que incluye."""
+        with self._lock:
+            if self._conn is None or self._profundidad > 0:
+                return False
+            huella = self._huella(self._conn)
+            if not forzar and huella == self._huella_persistida:
+                return False
+            plain = self._conn.serialize()
+            # Los registros añadidos después de este punto no están en `plain`
+            posicion = self._diario.tamano()
+            encolados = self._persistencia.ultima_secuencia if self._persistencia else 0
+
+        self._escribir_imagen(plain)
+        self._diario.descartar_hasta(posicion)
+        if self._persistencia:
+            # Los registros aún en cola ya están incluidos en la imagen
+            self._persistencia.descartar_hasta(encolados)
+        with self._lock:
+            self._huella_persistida = huella
+        self._ultimo_checkpoint = datetime.now()
+        return True
+
+    # -------------------------- Páginas libres ------------------------------
+    @staticmethod
+    def _medir_paginas(conn: sqlite3.Connection) -> Dict:
+        """Páginas totales y libres de la imagen y la relación entre ambas."""
+        total = conn.execute("PRAGMA main.page_count").fetchone()[0]
+        libres = conn.execute("PRAGMA main.freelist_count").fetchone()[0]
+        return {
+            'total': total,
+            'libres': libres,
+            'tamano_pagina': conn.execute("PRAGMA main.page_size").fetchone()[0],
+            'relacion_hinchado': round(libres / total, 4) if total else 0.0
+        }
+
+    @staticmethod
+    def _hay_que_compactar(paginas: Dict, forzar: bool = False) -> bool:
+        if forzar:
+            return paginas['libres'] > 0
+        return (paginas['libres'] >= DatabaseConfig.VACUUM_MIN_PAGINAS
+                and paginas['relacion_hinchado'] >= DatabaseConfig.VACUUM_RELACION)
+
+    def _ejecutar_vacuum(self, conn: sqlite3.Connection) -> bool:
+        """Reconstruye la base de datos de `conn` sin páginas libres."""
+        try:
+            conn.execute("VACUUM")
+        except sqlite3.OperationalError as e:
+            # Lecturas en curso sobre la conexión: se reintenta más tarde
+            print(f"⚠ VACUUM aplazado: {e}")
+            return False
+        self.compactaciones_paginas += 1
+        self._ultima_compactacion_paginas = datetime.now()
+        return True
+
+    def compactar_paginas(self, forzar: bool = False) -> bool:
+        """Libera con VACUUM las páginas vacías de la imagen descifrada.
+
+        Solo actúa si las páginas libres superan `VACUUM_RELACION` del
+        total y `VACUUM_MIN_PAGINAS`, salvo que se fuerce. En modo sesión
+        se omite si hay una transacción o un lote en curso; la imagen
+        compactada se escribe completa y sustituye al diario, porque
+        VACUUM puede renumerar los rowid a los que se refieren sus
+        registros.
+
+        Args:
+            forzar: Compactar con cualquier número de páginas libres
+
+        Returns:
+            bool: True si se compactó la imagen
+        """
+        if not self.modo_sesion:
+            with self._conexion_temporal() as conn:
+                if not self._hay_que_compactar(self._medir_paginas(conn), forzar):
+                    return False
+                return self._ejecutar_vacuum(conn)
+
+        with self._lock:
+            conn = self._conn
+            if (conn is None or self._profundidad > 0 or self._nivel_lote > 0
+                    or conn.in_transaction):
+                return False
+            if not self._hay_que_compactar(self._medir_paginas(conn), forzar):
+                return False
+
+            if self._persistencia is not None:
+                # Que ningún registro anterior al VACUUM quede fuera del diario
+                self._persistencia.volcar()
+            if not self._ejecutar_vacuum(conn):
+                return False
+            self._volcar_imagen()
+            if self.usar_diario:
+                self._instalar_captura(conn)
+            return True
+
+    def volcar(self) -> int:
+        """Escribe ya en el diario los commits pendientes del hilo de persistencia.
+
+        Returns:
+            int: Número de commits escritos
+        """
+        if self._persistencia is None:
+            return 0
+        return self._persistencia.volcar()
+
+    def estado_persistencia(self) -> Dict:
+        """Cola y retraso del hilo de persistencia (para ajustar la política).
+
+        Returns:
+            Dict: politica, pendientes (profundidad de la cola), retraso_s
+                (antigüedad del commit pendiente más antiguo), máximos
+                observados, número de volcados y fecha del último
+        """
+        if self._persistencia is None:
+            return {'politica': None, 'pendientes': 0, 'retraso_s': 0.0}
+        return self._persistencia.estado()
+
+    def cerrar(self) -> None:
+        """Persiste la sesión y cierra la conexión en memoria."""
+        if self._programador_backups is not None:
+            self._programador_backups.detener()
+            self._programador_backups = None
+        self._archivo.vaciar()
+        if self._persistencia is not None:
+            self._persistencia.detener()
+        with self._lock_instantaneas:
+            for _, copia in self._instantaneas:
+                copia.close()
+            self._instantaneas.clear()
+        with self._lock:
+            if self._conn is None:
+                return
+            self.compactar_paginas()
+            self.compactar()
+            self._conn.close()
+            self._conn = None
+
+    # -------------------------- Diario de commits ---------------------------
+    def _instalar_captura(self, conn: sqlite3.Connection) -> None:
+        """Crea triggers TEMP que anotan las filas que cambia cada transacción.
+
+        Los objetos TEMP no forman parte de la imagen serializada. Se
+        reinstalan tras cada cambio de esquema.
+        """
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS _diario_cambios "
+            "(tabla TEXT NOT NULL, fila INTEGER NOT NULL)"
+        )
+        tablas = [r[0] for r in conn.execute(
+            "SELECT name FROM main.sqlite_master "
+            "WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        for tabla in tablas:
+            for evento, filas in (('INSERT', ['NEW']), ('UPDATE', ['OLD', 'NEW']),
+                                  ('DELETE', ['OLD'])):
+                cuerpo = " ".join(
+                    f"INSERT INTO _diario_cambios VALUES ('{tabla}', {fila}.rowid);"
+                    for fila in filas
+                )
+                conn.execute(
+                    f'CREATE TEMP TRIGGER IF NOT EXISTS "_diario_{tabla}_{evento.lower()}" '
+                    f'AFTER {evento} ON main."{tabla}" BEGIN {cuerpo} END'
+                )
+        self._esquema_capturado = conn.execute("PRAGMA schema_version").fetchone()[0]
+
+    @staticmethod
+    def _capturar_cambios(conn: sqlite3.Connection) -> Optional[tuple]:
+        """Devuelve (cambios, secuencias) de la transacción en curso, o None."""
+        filas = conn.execute(
+            "SELECT DISTINCT tabla, fila FROM temp._diario_cambios"
+        ).fetchall()
+        if not filas:
+            return None
+
+        cambios = []
+        for tabla, rowid in filas:
+            fila = conn.execute(
+                f'SELECT * FROM main."{tabla}" WHERE rowid = ?', (rowid,)
+            ).fetchone()
+            cambios.append([tabla, rowid, dict(fila) if fila is not None else None])
+
+        secuencias = {}
+        if conn.execute("SELECT 1 FROM main.sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+            secuencias = {r[0]: r[1] for r in conn.execute("SELECT name, seq FROM main.sqlite_sequence")}
+
+        conn.execute("DELETE FROM temp._diario_cambios")
+        return cambios, secuencias
+
+    @staticmethod
+    def _aplicar_registro(conn: sqlite3.Connection, registro: Dict) -> None:
+        """Reaplica un registro del diario (idempotente: imagen de fila por rowid)."""
+        cambios = registro['cambios']
+        for tabla, rowid, fila in cambios:
+            if fila is None:
+                conn.execute(f'DELETE FROM "{tabla}" WHERE rowid = ?', (rowid,))
+
+        for tabla, rowid, fila in cambios:
+            if fila is None:
+                continue
+            columnas = ", ".join(f'"{c}"' for c in fila)
+            marcas = ", ".join("?" for _ in range(len(fila) + 1))
+            conn.execute(
+                f'INSERT OR REPLACE INTO "{tabla}" (rowid, {columnas}) VALUES ({marcas})',
+                [rowid, *fila.values()]
+            )
+
+        for nombre, seq in registro['secuencias'].items():
+            cursor = conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (seq, nombre))
+            if cursor.rowcount == 0:
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (nombre, seq))
+
+    def _recuperar_diario(self) -> None:
+        """Reaplica un diario pendiente sobre la imagen y lo vuelca en disco.
+
+        Solo hay diario pendiente si el proceso anterior terminó sin
+        compactar (cierre inesperado). Tras volcarlo, el diario se vacía.
+        """
+        try:
+            registros = self._diario.leer_registros()
+        except (InvalidToken, ValueError):
+            raise Exception("Clave de encriptación incorrecta o diario de commits corrupto")
+        if not registros:
+            self._diario.vaciar()
+            return
+
+        conn = sqlite3.connect(":memory:")
+        try:
+            plain = self._leer_imagen()
+            if plain:
+                conn.deserialize(self._normalizar_cabecera(plain))
+            for registro in registros:
+                self._aplicar_registro(conn, registro)
+            conn.commit()
+            self._escribir_imagen(conn.serialize())
+        finally:
+            conn.close()
+
+        self._diario.vaciar()
+        print(f"✓ Diario de commits recuperado ({len(registros)} transacciones)")
 
-        Si _raw_key ya parece una clave Fernet válida (44 bytes base64 urlsafe),
-        se usa tal cual. Si no, se deriva SHA256(raw_key) y se convierte a base64 urlsafe.
+    def _diario_excedido(self) -> bool:
+        return (self._diario.tamano() > DatabaseConfig.DIARIO_MAX_BYTES
+                or self._diario.edad() > DatabaseConfig.DIARIO_MAX_EDAD)
+
+    def _comprobar_compactacion(self) -> None:
+        """Tarea periódica: compacta el diario si es grande, antiguo o hay inactividad.
+
+        Con inactividad también libera las páginas vacías si la imagen
+        está hinchada (ver `compactar_paginas`).
         """
-        if self._raw_key is None:
-            raise ValueError("No hay clave de encriptación configurada")
+        inactivo = time.monotonic() - self._ultimo_commit >= DatabaseConfig.DIARIO_INACTIVIDAD
+        if inactivo and self.compactar_paginas():
+            return
+        if self._diario.esta_vacio():
+            return
+        if inactivo or self._diario_excedido():
+            self.compactar()
 
-        # Si parece ya una clave Fernet válida -> usarla
-        if len(self._raw_key) == 44:
+    # -------------------------- Context manager ------------------------------
+    def get_connection(self):
+        """Context manager que devuelve una conexión sqlite3.
+
+        En modo sesión devuelve la conexión en memoria compartida; si no,
+        una conexión sobre un archivo temporal descifrado. Dentro de un
+        `batch()` devuelve la conexión del lote.
+        """
+        if self._conexion_lote is not None:
+            return self._conexion_en_lote(self.get_connection)
+        if self.modo_sesion:
+            return self._conexion_sesion()
+        return self._conexion_temporal()
+
+    @contextmanager
+    def batch(self):
+        """Agrupa varias operaciones en una transacción y un solo ciclo de cifrado.
+
+        Todas las llamadas (`guardar_producto`, `eliminar_cliente`, ...) hechas
+        dentro del bloque comparten la conexión del lote; al salir se confirma
+        una sola vez y se cifra/persiste una sola vez (un registro de diario
+        en modo sesión, una reescritura del archivo en modo por operación).
+        Si el bloque lanza una excepción se deshace el lote completo.
+
+        Es reentrante: un `batch()` anidado se integra en el exterior.
+        Cada operación dentro del lote usa un SAVEPOINT, así que una
+        operación que falla (y cuyo error se captura) no deja cambios a medias.
+
+        Uso:
+            with db.batch():
+                for nombre, precio, familia in productos:
+                    db.guardar_producto(nombre, precio, familia)
+        """
+        with self._lock:
+            if self._conexion_lote is not None:
+                yield self
+                return
+
+            with self.get_connection() as conn:
+                # Sin transacción abierta, el primer SAVEPOINT abriría una
+                # propia y su RELEASE confirmaría la operación por su cuenta
+                if not conn.in_transaction:
+                    conn.execute("BEGIN")
+                self._conexion_lote = conn
+                try:
+                    yield self
+                finally:
+                    self._conexion_lote = None
+
+    @contextmanager
+    def _conexion_en_lote(self, alternativa):
+        """Conexión del lote en curso, aislando cada operación en un SAVEPOINT.
+
+        Args:
+            alternativa: Context manager a usar si el lote terminó mientras
+                se esperaba el lock (llamada desde otro hilo)
+        """
+        with self._lock:
+            conn = self._conexion_lote
+            if conn is None:
+                with alternativa() as conn:
+                    yield conn
+                return
+
+            self._nivel_lote += 1
+            punto = f"lote_{self._nivel_lote}"
+            auditoria = len(self._auditoria_pendiente)
+            conn.execute(f"SAVEPOINT {punto}")
             try:
-                # validar base64
-                base64.urlsafe_b64decode(self._raw_key)
-                return self._raw_key
+                yield conn
+                conn.execute(f"RELEASE {punto}")
             except Exception:
-                pass
+                conn.execute(f"ROLLBACK TO {punto}")
+                conn.execute(f"RELEASE {punto}")
+                del self._auditoria_pendiente[auditoria:]
+                raise
+            finally:
+                self._nivel_lote -= 1
 
-        # Derivar: SHA256(secret) -> base64 urlsafe
-        h = hashlib.sha256(self._raw_key).digest()
-        return base64.urlsafe_b64encode(h)
+    @contextmanager
+    def _conexion_sesion(self):
+        """Context manager sobre la conexión en memoria del modo sesión.
 
-    def _get_fernet(self) -> Fernet:
-        key = self._derive_fernet_key()
-        return Fernet(key)
+        Es reentrante: solo el nivel más externo confirma o deshace la
+        transacción. Con el diario activo, al confirmar se añade al diario
+        un registro con las filas cambiadas; si la transacción cambió el
+        esquema se vuelca la imagen completa (el diario solo guarda filas).
+        """
+        with self._lock:
+            if self._conn is None:
+                self._abrir_sesion()
+            conn = self._conn
+
+            cambios = None
+            cambio_esquema = False
+            self._profundidad += 1
+            try:
+                yield conn
+                if self._profundidad == 1:
+                    if self.usar_diario:
+                        cambios = self._capturar_cambios(conn)
+                    conn.commit()
+                    if self.usar_diario:
+                        esquema = conn.execute("PRAGMA schema_version").fetchone()[0]
+                        cambio_esquema = esquema != self._esquema_capturado
+            except Exception:
+                if self._profundidad == 1:
+                    # También descarta las anotaciones de la tabla TEMP
+                    conn.rollback()
+                    self._auditoria_pendiente.clear()
+                raise
+            finally:
+                self._profundidad -= 1
 
-    def _encrypt_bytes(self, data: bytes) -> bytes:
-        f = self._get_fernet()
-        return f.encrypt(data)
+            if self._profundidad == 0:
+                self._confirmar_auditoria()
 
-    def _decrypt_bytes(self, data: bytes) -> bytes:
-        f = self._get_fernet()
-        return f.decrypt(data)
+            if self._profundidad == 0 and self.usar_diario:
+                self._ultimo_commit = time.monotonic()
+                if cambio_esquema:
+                    self._volcar_imagen()
+                    self._instalar_captura(conn)
+                elif cambios:
+                    # Vuelve enseguida: el hilo de persistencia lo escribe
+                    self._persistencia.encolar(cambios)
 
-    # -------------------------- Context manager ------------------------------
     @contextmanager
-    def get_connection(self):
+    def read_connection(self):
+        """Context manager que devuelve una conexión de solo lectura.
+
+        Nunca escribe en disco ni vuelve a cifrar: cualquier intento de
+        escritura falla con `sqlite3.OperationalError` (PRAGMA query_only).
+
+        - En modo sesión usa la conexión en memoria compartida. Si se anida
+          dentro de un `get_connection()` abierto, reutiliza esa transacción.
+        - En modo por operación descifra la imagen directamente en memoria,
+          sin archivo temporal en claro.
+        - Dentro de un `batch()` usa la conexión del lote (ve sus cambios
+          aún sin confirmar).
+        """
+        if self._conexion_lote is not None:
+            with self._conexion_en_lote(self.read_connection) as conn:
+                yield conn
+            return
+
+        if self.modo_sesion:
+            with self._lock:
+                if self._conn is None:
+                    self._abrir_sesion()
+                conn = self._conn
+
+                if self._profundidad > 0:
+                    yield conn
+                    return
+
+                self._profundidad += 1
+                conn.execute("PRAGMA query_only = ON")
+                try:
+                    yield conn
+                finally:
+                    conn.execute("PRAGMA query_only = OFF")
+                    self._profundidad -= 1
+            return
+
+        conn = sqlite3.connect(":memory:")
+        try:
+            plain = self._leer_imagen()
+            if plain:
+                conn.deserialize(self._normalizar_cabecera(plain))
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA query_only = ON")
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def instantanea(self):
+        """Conexión de solo lectura sobre una copia de lo ya confirmado.
+
+        Para informes, comprobaciones de integridad y otros hilos que leen
+        mucho: la copia se toma con el lock (copia de páginas en memoria con
+        la API de backup de SQLite, sin cifrar ni tocar el disco) y después
+        se lee sin él, así que los commits del hilo de Tk no esperan a la
+        lectura. Una copia se reutiliza mientras no haya commits nuevos
+        (hasta `DatabaseConfig.INSTANTANEAS_MAX` en reserva).
+
+        - Dentro de una transacción o lote del propio hilo usa
+          `read_connection` (ve sus cambios aún sin confirmar).
+        - En modo por operación equivale a `read_connection`, que ya
+          descifra una copia propia en memoria.
+        """
+        conn = None
+        if self.modo_sesion:
+            with self._lock:
+                if self._conn is None:
+                    self._abrir_sesion()
+                # Con el lock tomado, una transacción abierta es de este hilo
+                if self._profundidad == 0 and self._conexion_lote is None:
+                    version = (self._conn,) + self._huella(self._conn)
+                    conn = self._tomar_instantanea(version)
+
+        if conn is None:
+            with self.read_connection() as conn:
+                yield conn
+            return
+
+        try:
+            yield conn
+        finally:
+            self._devolver_instantanea(version, conn)
+
+    def _tomar_instantanea(self, version: tuple) -> sqlite3.Connection:
+        """Copia en reserva de `version` o una nueva (con `_lock` tomado)."""
+        with self._lock_instantaneas:
+            # Las copias de versiones anteriores ya no volverán a servir
+            vigentes = []
+            for anterior, copia in self._instantaneas:
+                if anterior == version:
+                    vigentes.append((anterior, copia))
+                else:
+                    copia.close()
+            self._instantaneas = vigentes
+            if vigentes:
+                self.instantaneas_reutilizadas += 1
+                return self._instantaneas.pop()[1]
+
+        copia = sqlite3.connect(":memory:", check_same_thread=False)
+        self._conn.backup(copia)
+        copia.row_factory = sqlite3.Row
+        copia.execute("PRAGMA query_only = ON")
+        self.instantaneas_creadas += 1
+        return copia
+
+    def _devolver_instantanea(self, version: tuple, copia: sqlite3.Connection) -> None:
+        if copia.in_transaction:
+            copia.rollback()
+        with self._lock_instantaneas:
+            if version[0] is self._conn:
+                self._instantaneas.append((version, copia))
+                copia = None
+            while len(self._instantaneas) > DatabaseConfig.INSTANTANEAS_MAX:
+                self._instantaneas.pop(0)[1].close()
+        if copia is not None:
+            copia.close()
+
+    @contextmanager
+    def _conexion_temporal(self):
         """Context manager que devuelve una conexión sqlite3 sobre un archivo temporal
 
         Flujo:
@@ -104,13 +897,8 @@ class DatabaseManagerEncrypted:
 
         try:
             # Si existe archivo cifrado en disco, lo desciframos
-            if self.db_path.exists() and self.db_path.stat().st_size > 0:
-                encrypted = self.db_path.read_bytes()
-                try:
-                    decrypted = self._decrypt_bytes(encrypted)
-                except InvalidToken:
-                    raise Exception("Clave de encriptación incorrecta o archivo corrupto")
-
+            decrypted = self._leer_imagen()
+            if decrypted is not None:
                 temp_path.write_bytes(decrypted)
             else:
                 # Crear una base sqlite vacía en el temporal
@@ -122,23 +910,27 @@ class DatabaseManagerEncrypted:
             # Abrir conexión sobre el temporal
             conn = sqlite3.connect(str(temp_path))
             conn.row_factory = sqlite3.Row
+            huella_inicial = self._huella(conn)
 
             try:
                 yield conn
                 conn.commit()
+                sucio = decrypted is None or self._huella(conn) != huella_inicial
+                if sucio and self._hay_que_compactar(self._medir_paginas(conn)):
+                    # La imagen se va a cifrar entera de todos modos
+                    self._ejecutar_vacuum(conn)
             except Exception:
                 conn.rollback()
+                self._auditoria_pendiente.clear()
                 raise
             finally:
                 conn.close()
 
-            # Leer el contenido del temporal y cifrarlo en disco
-            plain = temp_path.read_bytes()
-            encrypted = self._encrypt_bytes(plain)
-            # Asegurar escritura atómica: escribir a tmp y renombrar
-            tmp_write = self.db_path.with_suffix(self.db_path.suffix + ".write")
-            tmp_write.write_bytes(encrypted)
-            tmp_write.replace(self.db_path)
+            # Leer el contenido del temporal y cifrarlo en disco, solo si
+            # la conexión modificó algo (las lecturas no reescriben el archivo)
+            if sucio:
+                self._escribir_imagen(temp_path.read_bytes())
+            self._confirmar_auditoria()
 
         finally:
             try:
@@ -160,6 +952,7 @@ class DatabaseManagerEncrypted:
             # Comprobamos si las tablas ya existen
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='productos'")
             if cursor.fetchone():
+                self._migrar_esquema(cursor)
                 return  # ya inicializada
 
             fecha_actual = datetime.now().isoformat()
@@ -173,6 +966,7 @@ class DatabaseManagerEncrypted:
                     nombre TEXT UNIQUE NOT NULL,
                     precio REAL NOT NULL,
                     familia TEXT NOT NULL,
+                    posicion INTEGER NOT NULL DEFAULT 0,
                     activo BOOLEAN DEFAULT 1,
                     fecha_creacion TEXT NOT NULL,
                     fecha_modificacion TEXT NOT NULL,
@@ -230,6 +1024,7 @@ class DatabaseManagerEncrypted:
                 CREATE TABLE IF NOT EXISTS recibos (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     fecha TEXT NOT NULL,
+                    fecha_ts INTEGER,
                     cliente_nombre TEXT,
                     camarero_nombre TEXT,
                     estado TEXT NOT NULL,
@@ -269,31 +1064,166 @@ class DatabaseManagerEncrypted:
                 )
             """)
 
-            # ================================================================
-            # TABLA DE AUDITORÍA
-            # ================================================================
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS auditoria (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    tabla TEXT NOT NULL,
-                    accion TEXT NOT NULL,
-                    registro_id INTEGER,
-                    datos_anteriores TEXT,
-                    datos_nuevos TEXT,
-                    usuario TEXT,
-                    fecha TEXT NOT NULL
-                )
-            """)
+            # La auditoría no vive en la base de datos: ver data/audit_store.py
 
             # INDICES
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_recibos_fecha ON recibos(fecha)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_recibos_estado ON recibos(estado)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_recibos_cliente ON recibos(cliente_nombre)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_recibos_camarero ON recibos(camarero_nombre)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_productos_nombre ON productos(nombre)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_productos_familia ON productos(familia)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_lineas_recibo_id ON lineas_recibo(recibo_id)")
 
+            self._migrar_esquema(cursor)
+
+    # -------------------------- Migraciones ---------------------------------
+    # Versión del esquema, guardada en PRAGMA user_version
+    VERSION_ESQUEMA = 6
+
+    def _migrar_esquema(self, cursor) -> None:
+        """Aplica las migraciones pendientes según `PRAGMA user_version`.
+
+        Se ejecuta en la misma transacción que la inicialización; cada
+        migración debe ser idempotente.
+        """
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= self.VERSION_ESQUEMA:
+            return
+
+        if version < 1:
+            self._migracion_1_fecha_ts(cursor)
+        if version < 2:
+            self._migracion_2_ventas_diarias(cursor)
+        if version < 3:
+            self._migracion_3_auditoria_externa(cursor)
+        if version < 4:
+            self._migracion_4_archivos_anuales(cursor)
+        if version < 5:
+            self._migracion_5_posicion_productos(cursor)
+        if version < 6:
+            self._migracion_6_saldos_clientes(cursor)
+
+        cursor.execute(f"PRAGMA user_version = {self.VERSION_ESQUEMA}")
+
+    def _migracion_6_saldos_clientes(self, cursor) -> None:
+        """Tickets y total pendientes por cliente (ver `_sumar_saldo`)."""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS saldos_clientes (
+                cliente_nombre TEXT PRIMARY KEY,
+                tickets INTEGER NOT NULL DEFAULT 0,
+                total REAL NOT NULL DEFAULT 0
+            )
+        """)
+        self._reconstruir_saldos(cursor)
+
+    @staticmethod
+    def _migracion_5_posicion_productos(cursor) -> None:
+        """Columna `posicion`: orden de los productos dentro de su familia.
+
+        Los productos activos se numeran 0, 1, 2... por familia en el orden
+        en que se mostraban hasta ahora (por nombre).
+        """
+        columnas = [r[1] for r in cursor.execute("PRAGMA table_info(productos)")]
+        if 'posicion' not in columnas:
+            cursor.execute("ALTER TABLE productos ADD COLUMN posicion INTEGER NOT NULL DEFAULT 0")
+
+        siguiente: Dict[str, int] = {}
+        valores = []
+        for producto_id, familia in cursor.execute(
+                "SELECT id, familia FROM productos WHERE activo = 1 ORDER BY familia, nombre"
+        ).fetchall():
+            valores.append((siguiente.get(familia, 0), producto_id))
+            siguiente[familia] = siguiente.get(familia, 0) + 1
+        cursor.executemany("UPDATE productos SET posicion = ? WHERE id = ?", valores)
+
+        # idx_productos_familia queda cubierto por el compuesto (prefijo)
+        cursor.execute("DROP INDEX IF EXISTS idx_productos_familia")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_productos_familia_posicion ON productos(familia, posicion)"
+        )
+
+    @staticmethod
+    def _migracion_4_archivos_anuales(cursor) -> None:
+        """Resumen de los años archivados (ver `archivar_anios_cerrados`)."""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS archivos_anuales (
+                anio INTEGER PRIMARY KEY,
+                recibos INTEGER NOT NULL,
+                total REAL NOT NULL,
+                fecha_archivo TEXT NOT NULL
+            )
+        """)
+
+    def _migracion_3_auditoria_externa(self, cursor) -> None:
+        """Traslada la tabla `auditoria` a los segmentos mensuales y la elimina."""
+        existe = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'auditoria'"
+        ).fetchone()
+        if not existe:
+            return
+
+        def _json(valor):
+            return json.loads(valor) if valor else None
+
+        filas = cursor.execute("""
+            SELECT tabla, accion, registro_id, datos_anteriores, datos_nuevos, usuario, fecha
+            FROM auditoria ORDER BY id
+        """).fetchall()
+        self._auditoria.anadir([{
+            'fecha': fila[6],
+            'tabla': fila[0],
+            'accion': fila[1],
+            'registro_id': fila[2],
+            'datos_anteriores': _json(fila[3]),
+            'datos_nuevos': _json(fila[4]),
+            'usuario': fila[5]
+        } for fila in filas])
+        self._auditoria.rotar()
+
+        cursor.execute("DROP TABLE auditoria")
+
+    def _migracion_2_ventas_diarias(self, cursor) -> None:
+        """Tabla de ventas agregadas por día, estado y camarero (ver `_sumar_venta`)."""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ventas_diarias (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dia INTEGER NOT NULL,
+                estado TEXT NOT NULL,
+                camarero_nombre TEXT NOT NULL DEFAULT '',
+                tickets INTEGER NOT NULL DEFAULT 0,
+                total REAL NOT NULL DEFAULT 0,
+                lineas INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (dia, estado, camarero_nombre)
+            )
+        """)
+        self._reconstruir_ventas(cursor)
+
+    @staticmethod
+    def _migracion_1_fecha_ts(cursor) -> None:
+        """Columna `fecha_ts` ordenable e índices compuestos de recibos.
+
+        `fecha` guarda 'DD/MM/YYYY - HH:MM:SS', que no se ordena ni filtra
+        por rangos correctamente como texto. `fecha_ts` (ver `fecha_a_ts`)
+        sí, y los índices (x, fecha_ts) permiten recorrer por rango.
+        """
+        columnas = [r[1] for r in cursor.execute("PRAGMA table_info(recibos)")]
+        if 'fecha_ts' not in columnas:
+            cursor.execute("ALTER TABLE recibos ADD COLUMN fecha_ts INTEGER")
+
+        pendientes = cursor.execute(
+            "SELECT id, fecha, fecha_creacion FROM recibos WHERE fecha_ts IS NULL"
+        ).fetchall()
+        valores = [(_fecha_ts_recibo(fecha, creacion), recibo_id)
+                   for recibo_id, fecha, creacion in pendientes]
+        cursor.executemany("UPDATE recibos SET fecha_ts = ? WHERE id = ?", valores)
+
+        # Los índices simples quedan cubiertos por los compuestos (prefijo)
+        for indice in ('idx_recibos_fecha', 'idx_recibos_estado',
+                       'idx_recibos_cliente', 'idx_recibos_camarero'):
+            cursor.execute(f"DROP INDEX IF EXISTS {indice}")
+
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_recibos_ts ON recibos(fecha_ts)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_recibos_estado_ts ON recibos(estado, fecha_ts)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_recibos_cliente_ts ON recibos(cliente_nombre, fecha_ts)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_recibos_camarero_ts ON recibos(camarero_nombre, fecha_ts)")
+
     # ========================================================================
     # PRODUCTOS (se conservan exactamente los mismos métodos que antes)
     # ========================================================================
@@ -304,18 +1234,25 @@ class DatabaseManagerEncrypted:
             cursor = conn.cursor()
             fecha_actual = datetime.now().isoformat()
 
-            cursor.execute("SELECT id, precio FROM productos WHERE nombre = ?", (nombre,))
+            cursor.execute("SELECT id, precio, familia, posicion, activo FROM productos WHERE nombre = ?",
+                           (nombre,))
             row = cursor.fetchone()
 
             if row:
                 producto_id = row['id']
                 precio_anterior = row['precio']
 
+                # Al cambiar de familia o reactivarse pasa al final de la familia
+                posicion = row['posicion']
+                if row['familia'] != familia or not row['activo']:
+                    posicion = self._siguiente_posicion(cursor, familia)
+
                 cursor.execute("""
                     UPDATE productos 
-                    SET precio = ?, familia = ?, fecha_modificacion = ?, usuario_modificacion = ?
+                    SET precio = ?, familia = ?, posicion = ?, activo = 1,
+                        fecha_modificacion = ?, usuario_modificacion = ?
                     WHERE id = ?
-                """, (precio, familia, fecha_actual, usuario, producto_id))
+                """, (precio, familia, posicion, fecha_actual, usuario, producto_id))
 
                 if precio != precio_anterior:
                     cursor.execute("""
@@ -332,9 +1269,11 @@ class DatabaseManagerEncrypted:
                 )
             else:
                 cursor.execute("""
-                    INSERT INTO productos (nombre, precio, familia, fecha_creacion, fecha_modificacion)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (nombre, precio, familia, fecha_actual, fecha_actual))
+                    INSERT INTO productos (nombre, precio, familia, posicion,
+                                           fecha_creacion, fecha_modificacion)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (nombre, precio, familia, self._siguiente_posicion(cursor, familia),
+                      fecha_actual, fecha_actual))
 
                 producto_id = cursor.lastrowid
 
@@ -348,7 +1287,7 @@ class DatabaseManagerEncrypted:
             return producto_id
 
     def obtener_productos(self, familia: str = None, activos: bool = True) -> List[Dict]:
-        with self.get_connection() as conn:
+        with self.read_connection() as conn:
             cursor = conn.cursor()
 
             query = "SELECT * FROM productos WHERE 1=1"
@@ -361,11 +1300,112 @@ class DatabaseManagerEncrypted:
                 query += " AND familia = ?"
                 params.append(familia)
 
-            query += " ORDER BY nombre"
+            query += " ORDER BY familia, posicion, nombre"
 
             cursor.execute(query, params)
             return [dict(row) for row in cursor.fetchall()]
 
+    @staticmethod
+    def _siguiente_posicion(cursor, familia: str) -> int:
+        """Posición tras el último producto activo de la familia."""
+        cursor.execute(
+            "SELECT COALESCE(MAX(posicion) + 1, 0) FROM productos WHERE familia = ? AND activo = 1",
+            (familia,)
+        )
+        return cursor.fetchone()[0]
+
+    def intercambiar_productos(self, nombre1: str, nombre2: str,
+                               usuario: str = None) -> bool:
+        """
+        Intercambia la posición de dos productos activos de la misma familia.
+
+        Returns:
+            bool: False si alguno no existe o son de familias distintas
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            fecha_actual = datetime.now().isoformat()
+
+            cursor.execute(
+                "SELECT id, nombre, familia, posicion FROM productos "
+                "WHERE nombre IN (?, ?) AND activo = 1",
+                (nombre1, nombre2)
+            )
+            filas = {row['nombre']: row for row in cursor.fetchall()}
+            if (nombre1 == nombre2 or len(filas) != 2
+                    or filas[nombre1]['familia'] != filas[nombre2]['familia']):
+                return False
+
+            for origen, destino in ((nombre1, nombre2), (nombre2, nombre1)):
+                cursor.execute("""
+                    UPDATE productos SET posicion = ?, fecha_modificacion = ?, usuario_modificacion = ?
+                    WHERE id = ?
+                """, (filas[destino]['posicion'], fecha_actual, usuario, filas[origen]['id']))
+
+                self._registrar_auditoria(
+                    cursor, 'productos', 'UPDATE', filas[origen]['id'],
+                    {'posicion': filas[origen]['posicion']},
+                    {'posicion': filas[destino]['posicion']},
+                    usuario
+                )
+
+            return True
+
+    def mover_producto(self, nombre: str, posicion: int, usuario: str = None) -> bool:
+        """
+        Lleva un producto activo al lugar `posicion` (0 = primero) de su
+        familia tal como se muestra.
+
+        `posicion` es un índice en el orden de la familia, no el valor
+        guardado: al eliminar productos quedan huecos en la columna. El
+        producto que ocupaba ese lugar pasa al que deja libre, así que solo
+        cambian dos filas (las dos quedan en la auditoría).
+
+        Returns:
+            bool: False si el producto no existe o `posicion` no está en
+                [0, número de productos activos de la familia)
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            fecha_actual = datetime.now().isoformat()
+
+            cursor.execute(
+                "SELECT id, familia, posicion FROM productos WHERE nombre = ? AND activo = 1",
+                (nombre,)
+            )
+            row = cursor.fetchone()
+            if not row:
+                return False
+            cursor.execute(
+                "SELECT id, posicion FROM productos WHERE familia = ? AND activo = 1 "
+                "ORDER BY posicion, nombre",
+                (row['familia'],)
+            )
+            orden = cursor.fetchall()
+            if not 0 <= posicion < len(orden):
+                return False
+            destino = orden[posicion]
+            if destino['id'] == row['id']:
+                return True
+
+            cambios = ((destino['id'], destino['posicion'], row['posicion']),
+                       (row['id'], row['posicion'], destino['posicion']))
+
+            for producto_id, anterior, nueva in cambios:
+                cursor.execute("""
+                    UPDATE productos SET posicion = ?, fecha_modificacion = ?, usuario_modificacion = ?
+                    WHERE id = ?
+                """, (nueva, fecha_actual, usuario, producto_id))
+
+                self._registrar_auditoria(
+                    cursor, 'productos', 'UPDATE', producto_id,
+                    {'posicion': anterior},
+                    {'posicion': nueva},
+                    usuario
+                )
+
+            return True
+
     def eliminar_producto(self, nombre: str, usuario: str = None) -> bool:
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -399,18 +1439,28 @@ class DatabaseManagerEncrypted:
 
     def guardar_recibo(self, recibo_data: Dict, lineas: List[Dict],
                       usuario: str = None) -> int:
+        fecha_actual = datetime.now().isoformat()
+        fecha_ts = _fecha_ts_recibo(recibo_data['fecha'], fecha_actual)
+
+        # El primer ticket de un año nuevo archiva los años cerrados (fuera
+        # de un lote o transacción abierta: se hará en el siguiente ticket)
+        anio = _anio_ts(fecha_ts)
+        if ((self._anio_activo is None or anio > self._anio_activo)
+                and self._conexion_lote is None and self._profundidad == 0):
+            self.archivar_anios_cerrados(anio)
+
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            fecha_actual = datetime.now().isoformat()
 
             cursor.execute("""
                 INSERT INTO recibos 
-                (fecha, cliente_nombre, camarero_nombre, estado, 
+                (fecha, fecha_ts, cliente_nombre, camarero_nombre, estado, 
                  subtotal, iva_porcentaje, total, impreso, 
                  fecha_creacion, fecha_modificacion)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 recibo_data['fecha'],
+                fecha_ts,
                 recibo_data.get('cliente_nombre'),
                 recibo_data.get('camarero_nombre'),
                 recibo_data['estado'],
@@ -438,6 +1488,8 @@ class DatabaseManagerEncrypted:
                     linea['subtotal']
                 ))
 
+            self._sumar_venta(cursor, recibo_id, 1)
+
             self._registrar_auditoria(
                 cursor, 'recibos', 'INSERT', recibo_id,
                 None,
@@ -445,49 +1497,355 @@ class DatabaseManagerEncrypted:
                 usuario
             )
 
-            return recibo_id
+        if self._programador_backups is not None:
+            self._programador_backups.notificar_recibo()
+        return recibo_id
+
+    def guardar_recibos_bulk(self, recibos: Iterable, usuario: str = None,
+                             tamano_bloque: int = None) -> Dict:
+        """Importa muchos recibos (histórico, otra caja) de una sola vez.
+
+        `recibos` puede ser un generador: se consume por bloques de
+        `tamano_bloque` recibos, cada bloque con un `executemany` para los
+        recibos y otro para sus líneas. Los índices de recibos y líneas se
+        quitan durante la carga y se reconstruyen al final, `ventas_diarias`
+        se actualiza con una sola consulta agregada y la auditoría recibe un
+        único registro resumen.
+
+        Toda la importación es una transacción con un único ciclo de
+        cifrado: si falla a medias no queda nada importado y se puede repetir.
+        No se puede llamar dentro de un `batch()`.
+
+        Args:
+            recibos: Pares (recibo_data, lineas) como los de `guardar_recibo`,
+                o recibos con clave 'lineas' como los de `iter_recibos`
+            usuario: Usuario del registro de auditoría
+            tamano_bloque: Recibos por bloque (None = `DatabaseConfig.TAMANO_BLOQUE_IMPORTACION`)
+
+        Returns:
+            Dict: recibos, lineas, primer_id y ultimo_id (ids consecutivos en
+            el orden de entrada), segundos y filas_por_segundo
+        """
+        if self._conexion_lote is not None:
+            raise ValueError("guardar_recibos_bulk no se puede usar dentro de un lote")
+        tamano_bloque = tamano_bloque or DatabaseConfig.TAMANO_BLOQUE_IMPORTACION
+        fecha_actual = datetime.now().isoformat()
+        inicio = time.perf_counter()
+        total_recibos = total_lineas = 0
+        anios = set()
 
-    def obtener_recibos(self, estado: str = None, cliente: str = None,
-                       fecha_inicio: str = None, fecha_fin: str = None,
-                       limit: int = None, offset: int = 0) -> List[Dict]:
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-
-            query = "SELECT * FROM recibos WHERE 1=1"
-            params = []
-
-            if estado:
-                query += " AND estado = ?"
-                params.append(estado)
-
-            if cliente:
-                query += " AND cliente_nombre = ?"
-                params.append(cliente)
-
-            if fecha_inicio:
-                query += " AND fecha >= ?"
-                params.append(fecha_inicio)
+            # DDL sin transacción abierta se confirmaría por su cuenta
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+
+            # Las filas importadas no pasan por el diario: el esquema cambia
+            # (índices), así que al confirmar se vuelca la imagen completa
+            for (trigger,) in conn.execute(
+                    "SELECT name FROM temp.sqlite_master "
+                    "WHERE type = 'trigger' AND name GLOB '_diario_*'").fetchall():
+                conn.execute(f'DROP TRIGGER temp."{trigger}"')
+
+            indices = conn.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+                "AND tbl_name IN ('recibos', 'lineas_recibo') AND sql IS NOT NULL"
+            ).fetchall()
+            for nombre, _ in indices:
+                conn.execute(f'DROP INDEX "{nombre}"')
+
+            # Ids explícitos y consecutivos (AUTOINCREMENT nunca reutiliza
+            # los de recibos ya archivados)
+            secuencia = conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'recibos'").fetchone()
+            maximo = conn.execute("SELECT MAX(id) FROM recibos").fetchone()[0]
+            primer_id = max(secuencia[0] if secuencia else 0, maximo or 0) + 1
+            siguiente = primer_id
+
+            pendientes = iter(recibos)
+            while True:
+                bloque = list(islice(pendientes, tamano_bloque))
+                if not bloque:
+                    break
+
+                filas_recibos = []
+                filas_lineas = []
+                for recibo in bloque:
+                    if isinstance(recibo, dict):
+                        recibo_data, lineas = recibo, recibo.get('lineas', [])
+                    else:
+                        recibo_data, lineas = recibo
+                    fecha_ts = _fecha_ts_recibo(recibo_data['fecha'], fecha_actual)
+                    anios.add(_anio_ts(fecha_ts))
+                    filas_recibos.append((
+                        siguiente,
+                        recibo_data['fecha'],
+                        fecha_ts,
+                        recibo_data.get('cliente_nombre'),
+                        recibo_data.get('camarero_nombre'),
+                        recibo_data['estado'],
+                        recibo_data['subtotal'],
+                        recibo_data['iva_porcentaje'],
+                        recibo_data['total'],
+                        recibo_data.get('impreso', False),
+                        fecha_actual,
+                        fecha_actual
+                    ))
+                    filas_lineas.extend((
+                        siguiente,
+                        linea['producto_nombre'],
+                        linea['cantidad'],
+                        linea['precio_unitario'],
+                        linea['familia'],
+                        linea['subtotal']
+                    ) for linea in lineas)
+                    siguiente += 1
+
+                conn.executemany("""
+                    INSERT INTO recibos
+                    (id, fecha, fecha_ts, cliente_nombre, camarero_nombre, estado,
+                     subtotal, iva_porcentaje, total, impreso,
+                     fecha_creacion, fecha_modificacion)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, filas_recibos)
+                conn.executemany("""
+                    INSERT INTO lineas_recibo
+                    (recibo_id, producto_nombre, cantidad, precio_unitario, familia, subtotal)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, filas_lineas)
+                total_recibos += len(filas_recibos)
+                total_lineas += len(filas_lineas)
+
+            for _, sql in indices:
+                conn.execute(sql)
+
+            if total_recibos:
+                ultimo_id = siguiente - 1
+                conn.execute(f"""
+                    INSERT INTO ventas_diarias (dia, estado, camarero_nombre, tickets, total, lineas)
+                    SELECT dia, estado, camarero_nombre, COUNT(*), ROUND(SUM(total), 2), SUM(lineas)
+                    FROM ({self._SQL_VENTA_RECIBO} WHERE r.id BETWEEN ? AND ?) AS v
+                    WHERE 1
+                    GROUP BY dia, estado, camarero_nombre
+                    ON CONFLICT (dia, estado, camarero_nombre) DO UPDATE SET
+                        tickets = tickets + excluded.tickets,
+                        total = ROUND(total + excluded.total, 2),
+                        lineas = lineas + excluded.lineas
+                """, (primer_id, ultimo_id))
+                self._reconstruir_saldos(conn.cursor())
 
-            if fecha_fin:
-                query += " AND fecha <= ?"
-                params.append(fecha_fin)
+                self._registrar_auditoria(
+                    conn.cursor(), 'recibos', 'IMPORT', primer_id, None,
+                    {'recibos': total_recibos, 'lineas': total_lineas,
+                     'primer_id': primer_id, 'ultimo_id': ultimo_id},
+                    usuario
+                )
 
-            query += " ORDER BY fecha DESC"
+        if total_recibos and self.modo_sesion:
+            self.checkpoint()
+
+        segundos = time.perf_counter() - inicio
+        resultado = {
+            'recibos': total_recibos,
+            'lineas': total_lineas,
+            'primer_id': primer_id if total_recibos else None,
+            'ultimo_id': siguiente - 1 if total_recibos else None,
+            'segundos': round(segundos, 3),
+            'filas_por_segundo': round((total_recibos + total_lineas) / segundos) if segundos else 0
+        }
+        if not total_recibos:
+            return resultado
+
+        # Los recibos de años cerrados van a sus archivos anuales
+        objetivo = max(max(anios), self._anio_activo or 0)
+        if self._anio_activo is None or min(anios) < objetivo or objetivo > self._anio_activo:
+            self.archivar_anios_cerrados(objetivo)
+
+        if self._programador_backups is not None:
+            self._programador_backups.notificar_recibo(total_recibos)
+
+        print(f"✓ Importados {total_recibos} recibos y {total_lineas} líneas en "
+              f"{segundos:.2f} s ({resultado['filas_por_segundo']} filas/s)")
+        return resultado
+
+    @staticmethod
+    def _consulta_recibos(estado: str = None, cliente: str = None,
+                          fecha_inicio: str = None, fecha_fin: str = None,
+                          limit: int = None, estados: List[str] = None,
+                          camarero: str = None, despues_de: tuple = None,
+                          descendente: bool = True) -> tuple:
+        """Construye (sql, params) de una página de recibos con sus líneas.
+
+        Las fechas se comparan sobre `fecha_ts`; `fecha_fin` sin hora
+        incluye el día completo. `despues_de` es el (fecha_ts, id) del
+        último recibo de la página anterior (paginación por clave).
+
+        Cada fila es un recibo seguido de las columnas `linea_*` de una de
+        sus líneas (o NULL si no tiene), ordenadas por recibo.
+        """
+        query = "SELECT * FROM recibos WHERE 1=1"
+        params = []
+
+        if estado:
+            query += " AND estado = ?"
+            params.append(estado)
+
+        if estados:
+            # '+estado': sin índice por estado, se recorre idx_recibos_ts ya
+            # ordenado y LIMIT corta pronto (con IN habría que ordenar todo)
+            query += f" AND +estado IN ({', '.join('?' for _ in estados)})"
+            params.extend(estados)
+
+        if cliente:
+            query += " AND cliente_nombre = ?"
+            params.append(cliente)
+
+        if camarero:
+            query += " AND camarero_nombre = ?"
+            params.append(camarero)
+
+        if fecha_inicio:
+            query += " AND fecha_ts >= ?"
+            params.append(fecha_a_ts(fecha_inicio))
+
+        if fecha_fin:
+            query += " AND fecha_ts <= ?"
+            params.append(fecha_a_ts(fecha_fin, fin_de_dia=True))
+
+        orden = "DESC" if descendente else "ASC"
+        if despues_de:
+            # La primera condición acota el rango del índice; la segunda
+            # desempata entre recibos del mismo segundo
+            comparacion = '<' if descendente else '>'
+            query += f" AND fecha_ts {comparacion}= ? AND (fecha_ts, id) {comparacion} (?, ?)"
+            params.extend([despues_de[0], *despues_de])
+
+        query += f" ORDER BY fecha_ts {orden}, id {orden}"
+
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        query = f"""
+            WITH pagina AS ({query})
+            SELECT pagina.*,
+                   l.id AS linea_id, l.producto_nombre AS linea_producto_nombre,
+                   l.cantidad AS linea_cantidad, l.precio_unitario AS linea_precio_unitario,
+                   l.familia AS linea_familia, l.subtotal AS linea_subtotal
+            FROM pagina
+            LEFT JOIN lineas_recibo l ON l.recibo_id = pagina.id
+            ORDER BY pagina.fecha_ts {orden}, pagina.id {orden}, l.id
+        """
+        return query, params
+
+    @staticmethod
+    def _agrupar_lineas(filas) -> List[Dict]:
+        """Convierte las filas recibo+línea de `_consulta_recibos` en recibos con 'lineas'."""
+        recibos = []
+        for fila in filas:
+            fila = dict(fila)
+            linea = {campo[len('linea_'):]: fila.pop(campo)
+                     for campo in list(fila) if campo.startswith('linea_')}
+
+            if not recibos or recibos[-1]['id'] != fila['id']:
+                fila['lineas'] = []
+                recibos.append(fila)
+            if linea['id'] is not None:
+                linea['recibo_id'] = fila['id']
+                recibos[-1]['lineas'].append(linea)
+        return recibos
+
+    def iter_recibos(self, estado: str = None, cliente: str = None,
+                     fecha_inicio: str = None, fecha_fin: str = None,
+                     estados: List[str] = None, camarero: str = None,
+                     descendente: bool = True,
+                     tamano_pagina: int = None,
+                     instantanea: bool = False) -> Iterator[Dict]:
+        """Recorre los recibos con sus líneas, página a página.
+
+        Cada página es una sola consulta (recibos + líneas) y la siguiente
+        continúa desde el último (fecha_ts, id) visto, sin OFFSET. La
+        conexión solo se retiene mientras se lee cada página, no mientras
+        el llamador procesa los recibos. Con `instantanea` todas las páginas
+        se leen de una misma copia (ver `instantanea()`): el recorrido ve un
+        estado coherente y no compite con los commits por el lock.
+
+        Args:
+            estado / estados: Un estado o una lista de estados
+            cliente / camarero: Filtrar por nombre
+            fecha_inicio / fecha_fin: 'DD/MM/YYYY[ - HH:MM:SS]', date o datetime (inclusivas)
+            descendente: Del más reciente al más antiguo (por defecto)
+            tamano_pagina: Recibos por consulta (None = `DatabaseConfig.TAMANO_PAGINA_RECIBOS`)
+            instantanea: Leer todas las páginas de una misma copia
+        """
+        tamano_pagina = tamano_pagina or DatabaseConfig.TAMANO_PAGINA_RECIBOS
+        filtros = (estado, cliente, fecha_inicio, fecha_fin, estados, camarero,
+                   descendente, tamano_pagina)
+
+        with (self.instantanea() if instantanea else nullcontext()) as copia:
+            conexion = partial(nullcontext, copia) if instantanea else self.read_connection
+            yield from self._recorrer_recibos(conexion, filtros)
+
+    def _recorrer_recibos(self, conexion, filtros: tuple) -> Iterator[Dict]:
+        """Recibos de la base de datos activa intercalados con los archivados."""
+        estado, _, fecha_inicio, fecha_fin, estados, _, descendente, _ = filtros
+        activos = self._paginas_recibos(conexion, *filtros)
+
+        # Los pendientes nunca se archivan
+        solo_pendientes = (estado == TicketConfig.ESTADO_PENDIENTE or (
+            estados and all(e == TicketConfig.ESTADO_PENDIENTE for e in estados)))
+        anios = [] if solo_pendientes else self._anios_archivados(fecha_inicio, fecha_fin)
+        if not anios:
+            yield from activos
+            return
+
+        # Cada archivo solo contiene su año: se recorren uno tras otro (solo
+        # uno cargado a la vez) y se intercalan con la base de datos activa,
+        # que puede tener recibos de años cerrados aún pendientes de archivar
+        if descendente:
+            anios.reverse()
+        archivados = chain.from_iterable(
+            self._paginas_recibos(partial(self._archivo.conexion, anio), *filtros)
+            for anio in anios
+        )
+        yield from heapq.merge(activos, archivados, reverse=descendente,
+                               key=lambda recibo: (recibo['fecha_ts'], recibo['id']))
+
+    def _paginas_recibos(self, conexion, estado, cliente, fecha_inicio, fecha_fin,
+                         estados, camarero, descendente, tamano_pagina) -> Iterator[Dict]:
+        """Recorre por páginas los recibos de una sola base de datos.
+
+        Args:
+            conexion: Context manager que da la conexión de cada página
+        """
+        despues_de = None
+        while True:
+            query, params = self._consulta_recibos(
+                estado, cliente, fecha_inicio, fecha_fin, tamano_pagina,
+                estados, camarero, despues_de, descendente
+            )
+            with conexion() as conn:
+                pagina = self._agrupar_lineas(conn.execute(query, params).fetchall())
 
-            if limit:
-                query += " LIMIT ? OFFSET ?"
-                params.extend([limit, offset])
+            yield from pagina
 
-            cursor.execute(query, params)
-            recibos = [dict(row) for row in cursor.fetchall()]
+            if len(pagina) < tamano_pagina:
+                return
+            despues_de = (pagina[-1]['fecha_ts'], pagina[-1]['id'])
 
-            for recibo in recibos:
-                cursor.execute("""
-                    SELECT * FROM lineas_recibo WHERE recibo_id = ?
-                """, (recibo['id'],))
-                recibo['lineas'] = [dict(row) for row in cursor.fetchall()]
+    def obtener_recibos(self, estado: str = None, cliente: str = None,
+                       fecha_inicio: str = None, fecha_fin: str = None,
+                       limit: int = None, offset: int = 0,
+                       estados: List[str] = None, camarero: str = None) -> List[Dict]:
+        """Recibos con sus líneas, del más reciente al más antiguo.
 
-            return recibos
+        Lista completa de `iter_recibos`; para recorrer muchos recibos es
+        preferible usar el iterador directamente.
+        """
+        recibos = self.iter_recibos(
+            estado, cliente, fecha_inicio, fecha_fin, estados, camarero,
+            tamano_pagina=(offset + limit) if limit else None
+        )
+        return list(islice(recibos, offset, offset + limit if limit else None))
 
     def actualizar_estado_recibo(self, recibo_id: int, nuevo_estado: str,
                                  usuario: str = None) -> bool:
@@ -501,11 +1859,13 @@ class DatabaseManagerEncrypted:
             if row:
                 estado_anterior = row['estado']
 
+                self._sumar_venta(cursor, recibo_id, -1)
                 cursor.execute("""
                     UPDATE recibos 
                     SET estado = ?, fecha_modificacion = ?
                     WHERE id = ?
                 """, (nuevo_estado, fecha_actual, recibo_id))
+                self._sumar_venta(cursor, recibo_id, 1)
 
                 self._registrar_auditoria(
                     cursor, 'recibos', 'UPDATE', recibo_id,
@@ -518,6 +1878,102 @@ class DatabaseManagerEncrypted:
 
             return False
 
+    def actualizar_recibo(self, recibo_id: int, recibo_data: Dict,
+                          insertar: List[Dict] = (), actualizar: List[Dict] = (),
+                          eliminar: List[str] = (), usuario: str = None) -> bool:
+        """
+        Aplica a un recibo guardado solo lo que ha cambiado, en una transacción.
+
+        Args:
+            recibo_id: Recibo a modificar
+            recibo_data: Cabecera completa (como en `guardar_recibo`)
+            insertar: Líneas nuevas (como en `guardar_recibo`)
+            actualizar: Líneas cuyo producto ya estaba en el recibo
+                (se localizan por `producto_nombre`)
+            eliminar: Nombres de producto cuyas líneas se borran (antes de
+                actualizar e insertar)
+
+        Returns:
+            bool: False si el recibo no existe
+        """
+        fecha_actual = datetime.now().isoformat()
+        fecha_ts = _fecha_ts_recibo(recibo_data['fecha'], fecha_actual)
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT * FROM recibos WHERE id = ?", (recibo_id,))
+            row = cursor.fetchone()
+            if not row:
+                return False
+
+            recibo_anterior = dict(row)
+            self._sumar_venta(cursor, recibo_id, -1)
+
+            cursor.execute("""
+                UPDATE recibos
+                SET fecha = ?, fecha_ts = ?, cliente_nombre = ?, camarero_nombre = ?,
+                    estado = ?, subtotal = ?, iva_porcentaje = ?, total = ?, impreso = ?,
+                    fecha_modificacion = ?
+                WHERE id = ?
+            """, (
+                recibo_data['fecha'],
+                fecha_ts,
+                recibo_data.get('cliente_nombre'),
+                recibo_data.get('camarero_nombre'),
+                recibo_data['estado'],
+                recibo_data['subtotal'],
+                recibo_data['iva_porcentaje'],
+                recibo_data['total'],
+                recibo_data.get('impreso', False),
+                fecha_actual,
+                recibo_id
+            ))
+
+            cursor.executemany(
+                "DELETE FROM lineas_recibo WHERE recibo_id = ? AND producto_nombre = ?",
+                [(recibo_id, nombre) for nombre in eliminar]
+            )
+            cursor.executemany("""
+                UPDATE lineas_recibo
+                SET cantidad = ?, precio_unitario = ?, familia = ?, subtotal = ?
+                WHERE recibo_id = ? AND producto_nombre = ?
+            """, [(
+                linea['cantidad'],
+                linea['precio_unitario'],
+                linea['familia'],
+                linea['subtotal'],
+                recibo_id,
+                linea['producto_nombre']
+            ) for linea in actualizar])
+            cursor.executemany("""
+                INSERT INTO lineas_recibo
+                (recibo_id, producto_nombre, cantidad, precio_unitario, familia, subtotal)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(
+                recibo_id,
+                linea['producto_nombre'],
+                linea['cantidad'],
+                linea['precio_unitario'],
+                linea['familia'],
+                linea['subtotal']
+            ) for linea in insertar])
+
+            self._sumar_venta(cursor, recibo_id, 1)
+
+            self._registrar_auditoria(
+                cursor, 'recibos', 'UPDATE', recibo_id,
+                recibo_anterior,
+                dict(recibo_data, lineas={
+                    'insertadas': len(insertar),
+                    'actualizadas': len(actualizar),
+                    'eliminadas': len(eliminar)
+                }),
+                usuario
+            )
+
+            return True
+
     def eliminar_recibo(self, recibo_id: int, usuario: str = None) -> bool:
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -527,6 +1983,7 @@ class DatabaseManagerEncrypted:
 
             if row:
                 recibo_data = dict(row)
+                self._sumar_venta(cursor, recibo_id, -1)
                 cursor.execute("DELETE FROM recibos WHERE id = ?", (recibo_id,))
 
                 self._registrar_auditoria(
@@ -540,6 +1997,317 @@ class DatabaseManagerEncrypted:
 
             return False
 
+    # ========================================================================
+    # VENTAS DIARIAS (agregados)
+    # ========================================================================
+
+    # Día de un recibo: su fecha_ts es hora local de pared (ver `fecha_a_ts`)
+    _SQL_VENTA_RECIBO = """
+        SELECT r.fecha_ts / 86400 AS dia, r.estado,
+               COALESCE(r.camarero_nombre, '') AS camarero_nombre,
+               r.total, (SELECT COUNT(*) FROM lineas_recibo l WHERE l.recibo_id = r.id) AS lineas,
+               COALESCE(r.cliente_nombre, '') AS cliente_nombre
+        FROM recibos r
+    """
+
+    @classmethod
+    def _sumar_venta(cls, cursor, recibo_id: int, signo: int) -> None:
+        """Suma (signo=1) o resta (signo=-1) un recibo en `ventas_diarias`
+        y, si está pendiente, en `saldos_clientes`.
+
+        Se llama dentro de la misma transacción que modifica el recibo,
+        con el recibo y sus líneas ya insertados (al sumar) o todavía
+        presentes (al restar).
+        """
+        venta = cursor.execute(cls._SQL_VENTA_RECIBO + " WHERE r.id = ?", (recibo_id,)).fetchone()
+        if venta is None:
+            return
+        dia, estado, camarero, total, lineas, cliente = venta
+
+        if estado == TicketConfig.ESTADO_PENDIENTE:
+            cls._sumar_saldo(cursor, cliente, signo, total)
+
+        cursor.execute("""
+            INSERT INTO ventas_diarias (dia, estado, camarero_nombre, tickets, total, lineas)
+            VALUES (?, ?, ?, ?, ROUND(?, 2), ?)
+            ON CONFLICT (dia, estado, camarero_nombre) DO UPDATE SET
+                tickets = tickets + excluded.tickets,
+                total = ROUND(total + excluded.total, 2),
+                lineas = lineas + excluded.lineas
+        """, (dia, estado, camarero, signo, signo * total, signo * lineas))
+        if signo < 0:
+            cursor.execute(
+                "DELETE FROM ventas_diarias WHERE dia = ? AND estado = ? "
+                "AND camarero_nombre = ? AND tickets <= 0",
+                (dia, estado, camarero)
+            )
+
+    @staticmethod
+    def _sumar_saldo(cursor, cliente: str, signo: int, total: float) -> None:
+        """Suma o resta un recibo pendiente en el saldo de su cliente."""
+        cursor.execute("""
+            INSERT INTO saldos_clientes (cliente_nombre, tickets, total)
+            VALUES (?, ?, ROUND(?, 2))
+            ON CONFLICT (cliente_nombre) DO UPDATE SET
+                tickets = tickets + excluded.tickets,
+                total = ROUND(total + excluded.total, 2)
+        """, (cliente, signo, signo * total))
+        if signo < 0:
+            cursor.execute(
+                "DELETE FROM saldos_clientes WHERE cliente_nombre = ? AND tickets <= 0",
+                (cliente,)
+            )
+
+    @staticmethod
+    def _reconstruir_saldos(cursor) -> int:
+        cursor.execute("DELETE FROM saldos_clientes")
+        cursor.execute("""
+            INSERT INTO saldos_clientes (cliente_nombre, tickets, total)
+            SELECT COALESCE(cliente_nombre, ''), COUNT(*), ROUND(SUM(total), 2)
+            FROM recibos WHERE estado = ?
+            GROUP BY COALESCE(cliente_nombre, '')
+        """, (TicketConfig.ESTADO_PENDIENTE,))
+        return cursor.execute("SELECT COUNT(*) FROM saldos_clientes").fetchone()[0]
+
+    def obtener_saldos_clientes(self) -> List[Dict]:
+        """
+        Clientes con tickets pendientes, por nombre.
+
+        Returns:
+            List[Dict]: {'cliente_nombre', 'tickets', 'total'} por cliente
+        """
+        with self.read_connection() as conn:
+            return [dict(row) for row in conn.execute(
+                "SELECT * FROM saldos_clientes ORDER BY cliente_nombre"
+            )]
+
+    @classmethod
+    def _reconstruir_ventas(cls, cursor) -> int:
+        cursor.execute("DELETE FROM ventas_diarias")
+        cursor.execute(f"""
+            INSERT INTO ventas_diarias (dia, estado, camarero_nombre, tickets, total, lineas)
+            SELECT dia, estado, camarero_nombre, COUNT(*), ROUND(SUM(total), 2), SUM(lineas)
+            FROM ({cls._SQL_VENTA_RECIBO}) AS v
+            GROUP BY dia, estado, camarero_nombre
+        """)
+        return cursor.execute("SELECT COUNT(*) FROM ventas_diarias").fetchone()[0]
+
+    def reconstruir_ventas_diarias(self) -> int:
+        """Recalcula `ventas_diarias` desde los recibos (una sola transacción).
+
+        Returns:
+            int: Filas de agregados resultantes
+        """
+        with self.get_connection() as conn:
+            return self._reconstruir_ventas(conn.cursor())
+
+    def obtener_ventas_diarias(self, fecha_inicio, fecha_fin,
+                               estados: List[str] = None,
+                               camarero: str = None) -> List[Dict]:
+        """Ventas agregadas por día entre dos fechas (inclusivas).
+
+        Lee solo los agregados: para un mes devuelve como mucho 31 filas,
+        sea cual sea el número de tickets.
+
+        Args:
+            fecha_inicio / fecha_fin: 'DD/MM/YYYY', date o datetime
+            estados: Estados a sumar (None = todos)
+            camarero: Solo los tickets de este camarero
+
+        Returns:
+            List[Dict]: {'fecha': date, 'tickets', 'total', 'lineas'} por día con ventas
+        """
+        query = """
+            SELECT dia, SUM(tickets) AS tickets, ROUND(SUM(total), 2) AS total,
+                   SUM(lineas) AS lineas
+            FROM ventas_diarias
+            WHERE dia BETWEEN ? AND ?
+        """
+        params = [fecha_a_ts(fecha_inicio) // 86400, fecha_a_ts(fecha_fin) // 86400]
+
+        if estados:
+            query += f" AND estado IN ({', '.join('?' for _ in estados)})"
+            params.extend(estados)
+
+        if camarero is not None:
+            query += " AND camarero_nombre = ?"
+            params.append(camarero)
+
+        query += " GROUP BY dia ORDER BY dia"
+
+        conexiones = [self.read_connection] + [
+            partial(self._archivo.conexion, anio)
+            for anio in self._anios_archivados(fecha_inicio, fecha_fin)
+        ]
+        dias: Dict[int, list] = {}
+        for conexion in conexiones:
+            with conexion() as conn:
+                for fila in conn.execute(query, params):
+                    acumulado = dias.setdefault(fila['dia'], [0, 0.0, 0])
+                    acumulado[0] += fila['tickets']
+                    acumulado[1] += fila['total']
+                    acumulado[2] += fila['lineas']
+
+        return [{
+            'fecha': date(1970, 1, 1) + timedelta(days=dia),
+            'tickets': tickets,
+            'total': round(total, 2),
+            'lineas': lineas
+        } for dia, (tickets, total, lineas) in sorted(dias.items())]
+
+    # ========================================================================
+    # ARCHIVO ANUAL
+    # ========================================================================
+
+    def _anios_archivados(self, fecha_inicio=None, fecha_fin=None) -> List[int]:
+        """Años archivados que se solapan con [fecha_inicio, fecha_fin]."""
+        desde = _anio_ts(fecha_a_ts(fecha_inicio)) if fecha_inicio else None
+        hasta = _anio_ts(fecha_a_ts(fecha_fin)) if fecha_fin else None
+        return [anio for anio in self._archivo.anios()
+                if (desde is None or anio >= desde) and (hasta is None or anio <= hasta)]
+
+    # Recibos que se archivan: los de años cerrados salvo los pendientes
+    _SQL_RECIBOS_ARCHIVABLES = "fecha_ts >= ? AND fecha_ts < ? AND estado != ?"
+
+    def archivar_anios_cerrados(self, anio_activo: int = None) -> Dict[int, int]:
+        """Pasa los recibos de los años anteriores a `anio_activo` a sus archivos anuales.
+
+        Se llama sola con el primer ticket de un año nuevo. Los recibos
+        pendientes se quedan en la base de datos activa hasta que se cobren
+        (se archivan en el siguiente cambio de año). Si el archivo del año
+        ya existe, los recibos se añaden a él.
+
+        Si se interrumpe, se completa al volver a abrir la base de datos
+        (los recibos nunca quedan a la vez en el archivo y en la activa).
+
+        Args:
+            anio_activo: Año que queda activo (None = el actual)
+
+        Returns:
+            Dict[int, int]: Recibos archivados por año
+        """
+        if anio_activo is None:
+            anio_activo = date.today().year
+        limite = fecha_a_ts(date(anio_activo, 1, 1))
+        pendiente = TicketConfig.ESTADO_PENDIENTE
+
+        with self._lock:
+            with self.read_connection() as conn:
+                primero = conn.execute(
+                    "SELECT MIN(fecha_ts) FROM recibos WHERE fecha_ts < ? AND estado != ?",
+                    (limite, pendiente)
+                ).fetchone()[0]
+
+            anios = []
+            if primero is not None:
+                with self.read_connection() as conn:
+                    for anio in range(_anio_ts(primero), anio_activo):
+                        if conn.execute(
+                            f"SELECT 1 FROM recibos WHERE {self._SQL_RECIBOS_ARCHIVABLES} LIMIT 1",
+                            (*self._limites_anio(anio), pendiente)
+                        ).fetchone():
+                            anios.append(anio)
+
+            if anios:
+                # Marca persistida antes de escribir ningún archivo
+                self.guardar_configuracion('archivando', anio_activo)
+                self.volcar()
+
+            archivados = {anio: self._escribir_archivo_anual(anio) for anio in anios}
+
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                fecha_actual = datetime.now().isoformat()
+                for anio, (recibos, total) in archivados.items():
+                    condicion = self._SQL_RECIBOS_ARCHIVABLES
+                    params = (*self._limites_anio(anio), pendiente)
+                    cursor.execute(f"""
+                        DELETE FROM lineas_recibo WHERE recibo_id IN
+                        (SELECT id FROM recibos WHERE {condicion})
+                    """, params)
+                    cursor.execute(f"DELETE FROM recibos WHERE {condicion}", params)
+                    cursor.execute("""
+                        INSERT OR REPLACE INTO archivos_anuales (anio, recibos, total, fecha_archivo)
+                        VALUES (?, ?, ?, ?)
+                    """, (anio, recibos, total, fecha_actual))
+                    self._registrar_auditoria(
+                        cursor, 'recibos', 'ARCHIVE', anio, None,
+                        {'anio': anio, 'recibos': recibos, 'total': total}, 'sistema'
+                    )
+                if archivados:
+                    self._reconstruir_ventas(cursor)
+
+                anio_guardado = max(anio_activo, self._anio_activo or anio_activo)
+                cursor.execute("""
+                    INSERT OR REPLACE INTO configuracion (clave, valor, fecha_modificacion)
+                    VALUES ('anio_activo', ?, ?)
+                """, (json.dumps(anio_guardado), fecha_actual))
+                cursor.execute("DELETE FROM configuracion WHERE clave = 'archivando'")
+
+            self._anio_activo = anio_guardado
+            if archivados:
+                self.volcar()
+
+        return {anio: recibos for anio, (recibos, _) in archivados.items()}
+
+    @staticmethod
+    def _limites_anio(anio: int) -> tuple:
+        """[inicio, fin) de un año en `fecha_ts`."""
+        return fecha_a_ts(date(anio, 1, 1)), fecha_a_ts(date(anio + 1, 1, 1))
+
+    def _escribir_archivo_anual(self, anio: int) -> tuple:
+        """Añade al archivo de `anio` sus recibos archivables de la base activa.
+
+        Returns:
+            tuple: (recibos, total) del archivo resultante
+        """
+        params = (*self._limites_anio(anio), TicketConfig.ESTADO_PENDIENTE)
+        with self.read_connection() as conn:
+            recibos = conn.execute(
+                f"SELECT * FROM recibos WHERE {self._SQL_RECIBOS_ARCHIVABLES}", params
+            ).fetchall()
+            lineas = conn.execute(f"""
+                SELECT l.* FROM lineas_recibo l
+                WHERE l.recibo_id IN (SELECT id FROM recibos WHERE {self._SQL_RECIBOS_ARCHIVABLES})
+            """, params).fetchall()
+            esquema = [fila[0] for fila in conn.execute("""
+                SELECT sql FROM sqlite_master
+                WHERE tbl_name IN ('recibos', 'lineas_recibo', 'ventas_diarias')
+                  AND sql IS NOT NULL
+                ORDER BY type DESC
+            """)]
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        archivo = sqlite3.connect(":memory:")
+        try:
+            imagen = self._archivo.leer(anio)
+            if imagen:
+                # Un archivo existente se amplía (INSERT OR REPLACE: repetir es inocuo)
+                archivo.deserialize(imagen)
+            else:
+                for sql in esquema:
+                    archivo.execute(sql)
+                archivo.execute(f"PRAGMA user_version = {version}")
+
+            for tabla, filas in (('recibos', recibos), ('lineas_recibo', lineas)):
+                if filas:
+                    columnas = filas[0].keys()
+                    archivo.executemany(
+                        f"INSERT OR REPLACE INTO {tabla} ({', '.join(columnas)}) "
+                        f"VALUES ({', '.join('?' for _ in columnas)})",
+                        [tuple(fila) for fila in filas]
+                    )
+            self._reconstruir_ventas(archivo.cursor())
+            cantidad, total = archivo.execute(
+                "SELECT COUNT(*), ROUND(COALESCE(SUM(total), 0), 2) FROM recibos"
+            ).fetchone()
+            archivo.commit()
+            self._archivo.escribir(anio, archivo.serialize())
+        finally:
+            archivo.close()
+
+        return cantidad, total
+
     # ========================================================================
     # CLIENTES
     # ========================================================================
@@ -557,11 +2325,14 @@ class DatabaseManagerEncrypted:
             if cursor.rowcount > 0:
                 return cursor.lastrowid
             else:
+                # Reactivar si estaba eliminado (soft delete)
+                cursor.execute("UPDATE clientes SET activo = 1 WHERE nombre = ? AND activo = 0",
+                               (nombre,))
                 cursor.execute("SELECT id FROM clientes WHERE nombre = ?", (nombre,))
                 return cursor.fetchone()['id']
 
     def obtener_clientes(self, activos: bool = True) -> List[str]:
-        with self.get_connection() as conn:
+        with self.read_connection() as conn:
             cursor = conn.cursor()
 
             query = "SELECT nombre FROM clientes WHERE 1=1"
@@ -595,11 +2366,14 @@ class DatabaseManagerEncrypted:
             if cursor.rowcount > 0:
                 return cursor.lastrowid
             else:
+                # Reactivar si estaba eliminado (soft delete)
+                cursor.execute("UPDATE camareros SET activo = 1 WHERE nombre = ? AND activo = 0",
+                               (nombre,))
                 cursor.execute("SELECT id FROM camareros WHERE nombre = ?", (nombre,))
                 return cursor.fetchone()['id']
 
     def obtener_camareros(self, activos: bool = True) -> List[str]:
-        with self.get_connection() as conn:
+        with self.read_connection() as conn:
             cursor = conn.cursor()
 
             query = "SELECT nombre FROM camareros WHERE 1=1"
@@ -634,7 +2408,7 @@ class DatabaseManagerEncrypted:
             """, (clave, valor, fecha_actual))
 
     def obtener_configuracion(self, clave: str, default: Any = None) -> Any:
-        with self.get_connection() as conn:
+        with self.read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT valor FROM configuracion WHERE clave = ?", (clave,))
             row = cursor.fetchone()
@@ -648,6 +2422,48 @@ class DatabaseManagerEncrypted:
 
             return default
 
+    # ========================================================================
+    # DATOS DE REFERENCIA
+    # ========================================================================
+
+    def obtener_datos_referencia(self) -> Dict[str, Any]:
+        """
+        Productos, clientes y camareros activos, toda la configuración y
+        los saldos pendientes por cliente, en una sola lectura (para las
+        cachés en memoria del TPV).
+
+        Returns:
+            Dict: 'productos' (como `obtener_productos`), 'clientes' y
+            'camareros' (como `obtener_clientes`/`obtener_camareros`),
+            'configuracion' (clave -> texto guardado, sin decodificar) y
+            'saldos' (como `obtener_saldos_clientes`)
+        """
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT * FROM productos WHERE activo = 1 ORDER BY familia, posicion, nombre")
+            productos = [dict(row) for row in cursor.fetchall()]
+
+            cursor.execute("SELECT nombre FROM clientes WHERE activo = 1 ORDER BY nombre")
+            clientes = [row['nombre'] for row in cursor.fetchall()]
+
+            cursor.execute("SELECT nombre FROM camareros WHERE activo = 1 ORDER BY nombre")
+            camareros = [row['nombre'] for row in cursor.fetchall()]
+
+            cursor.execute("SELECT clave, valor FROM configuracion")
+            configuracion = {row['clave']: row['valor'] for row in cursor.fetchall()}
+
+            cursor.execute("SELECT * FROM saldos_clientes ORDER BY cliente_nombre")
+            saldos = [dict(row) for row in cursor.fetchall()]
+
+            return {
+                'productos': productos,
+                'clientes': clientes,
+                'camareros': camareros,
+                'configuracion': configuracion,
+                'saldos': saldos
+            }
+
     # ========================================================================
     # UTILIDADES
     # ========================================================================
@@ -655,43 +2471,160 @@ class DatabaseManagerEncrypted:
     def _registrar_auditoria(self, cursor, tabla: str, accion: str,
                             registro_id: int, datos_anteriores: Dict,
                             datos_nuevos: Dict, usuario: str):
-        fecha_actual = datetime.now().isoformat()
+        """Anota un registro de auditoría en la transacción en curso.
 
-        cursor.execute("""
-            INSERT INTO auditoria 
-            (tabla, accion, registro_id, datos_anteriores, datos_nuevos, usuario, fecha)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            tabla,
-            accion,
-            registro_id,
-            json.dumps(datos_anteriores) if datos_anteriores else None,
-            json.dumps(datos_nuevos) if datos_nuevos else None,
-            usuario,
-            fecha_actual
-        ))
+        No toca la base de datos: el registro se escribe en el almacén de
+        auditoría junto con el resto de la transacción al confirmarla, y
+        se descarta si se deshace.
+        """
+        self._auditoria_pendiente.append({
+            'fecha': datetime.now().isoformat(),
+            'tabla': tabla,
+            'accion': accion,
+            'registro_id': registro_id,
+            'datos_anteriores': datos_anteriores or None,
+            'datos_nuevos': datos_nuevos or None,
+            'usuario': usuario
+        })
+
+    def _confirmar_auditoria(self) -> None:
+        """Escribe en un solo bloque la auditoría de la transacción confirmada."""
+        if self._auditoria_pendiente:
+            registros = self._auditoria_pendiente
+            self._auditoria_pendiente = []
+            self._auditoria.anadir(registros)
+
+    def obtener_auditoria(self, tabla: str = None, accion: str = None,
+                          registro_id: int = None, usuario: str = None,
+                          desde: datetime = None, hasta: datetime = None,
+                          limit: int = None) -> List[Dict]:
+        """Busca en la auditoría de todos los meses, del registro más reciente al más antiguo.
+
+        Ver `AuditStore.buscar`.
+        """
+        return self._auditoria.buscar(tabla, accion, registro_id, usuario,
+                                      desde, hasta, limit)
 
+    # -------------------------- Backups -------------------------------------
     def crear_backup(self) -> Path:
-        backup_dir = self.db_path.parent / 'backup'
-        backup_dir.mkdir(exist_ok=True)
-
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_path = backup_dir / f'tpv_{timestamp}.db'
-
-        # Copiar archivo cifrado tal cual
-        if self.db_path.exists():
-            shutil.copy2(self.db_path, backup_path)
+        """Guarda una copia de la base de datos y la auditoría en el repositorio.
 
-        # Mantener solo últimos 30 backups
-        backups = sorted(backup_dir.glob('tpv_*.db'))
-        if len(backups) > 30:
-            for old_backup in backups[:-30]:
-                old_backup.unlink()
+        Solo se escriben los fragmentos que no estaban ya en el repositorio
+        (ver `BackupRepository`); después se podan las copias que exceden
+        `DatabaseConfig.BACKUP_CONSERVAR`.
 
-        return backup_path
+        Returns:
+            Path: Manifiesto de la copia creada
+        """
+        # En modo sesión, volcar primero el diario y los cambios en memoria
+        self.compactar()
+
+        # Instantánea consistente: la imagen y la auditoría confirmada hasta
+        # ese commit (la auditoría se escribe con el lock tomado)
+        with self._lock:
+            if self.modo_sesion and self._conn is not None:
+                plain = self._conn.serialize()
+            else:
+                plain = self._leer_imagen()
+            if plain is None:
+                raise ValueError("No hay base de datos que copiar")
+
+            archivos = {self.db_path.name: plain}
+            for _, ruta in self._auditoria.segmentos():
+                archivos[f"auditoria/{ruta.name}"] = ruta.read_bytes()
+            # Los archivos anuales ya están cifrados y no cambian: se
+            # deduplican por completo entre copias
+            for anio in self._archivo.anios():
+                ruta = self._archivo.ruta(anio)
+                archivos[f"archivo/{ruta.name}"] = ruta.read_bytes()
+
+        # Fragmentar, cifrar y escribir fuera del lock: no bloquea los cobros
+        with self._lock_copias:
+            copia = self._copias.crear(archivos)
+            self._copias.podar(DatabaseConfig.BACKUP_CONSERVAR)
+        return copia
+
+    def iniciar_backups_programados(self) -> None:
+        """Arranca el hilo que hace los backups según `DatabaseConfig.BACKUP_*`."""
+        if self._programador_backups is not None:
+            return
+        copias = self._copias.copias()
+        self._programador_backups = BackupScheduler(
+            self._backup_programado,
+            intervalo=DatabaseConfig.BACKUP_INTERVALO,
+            recibos=DatabaseConfig.BACKUP_RECIBOS,
+            intervalo_minimo=DatabaseConfig.BACKUP_INTERVALO_MINIMO,
+            # Sin copias previas, la primera se hace al arrancar
+            ultimo_backup=copias[-1].stat().st_mtime if copias else 0.0
+        )
+
+    def _backup_programado(self) -> tuple:
+        copia = self.crear_backup()
+        return copia.stem, self._copias.ultimos_bytes_escritos
+
+    def listar_backups(self) -> List[Dict]:
+        """Copias del repositorio, de la más reciente a la más antigua."""
+        copias = []
+        for ruta in reversed(self._copias.copias()):
+            manifiesto = self._copias.leer_manifiesto(ruta)
+            copias.append({
+                'nombre': ruta.stem,
+                'fecha': manifiesto['fecha'],
+                'tamano_bytes': sum(e['longitud'] for e in manifiesto['archivos'].values())
+            })
+        return copias
+
+    def restaurar_backup(self, copia: str, destino: str) -> Path:
+        """Restaura una copia como una base de datos cifrada nueva en `destino`.
+
+        No sobrescribe la base de datos en uso: para recuperarla se cierra
+        la aplicación y se sustituye `tpv.db` por el archivo restaurado.
+        La auditoría y los años archivados de la copia se restauran en
+        `<destino>.auditoria/` y `<destino>.archivo/`.
+
+        Args:
+            copia: Nombre (o ruta del manifiesto) de la copia
+            destino: Ruta del archivo a crear
+
+        Returns:
+            Path: Ruta de la base de datos restaurada
+        """
+        destino = Path(destino)
+        if destino.resolve() == self.db_path.resolve():
+            raise ValueError("No se puede restaurar sobre la base de datos en uso")
+
+        archivos = self._copias.restaurar(copia)
+        imagen = archivos.pop(self.db_path.name, None)
+        if imagen is None:
+            raise ValueError(f"La copia {copia} no contiene {self.db_path.name}")
+
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        self._cifrador.cifrar_a_archivo(imagen, destino)
+
+        for nombre, datos in archivos.items():
+            carpeta, _, archivo = nombre.partition('/')
+            if carpeta in ('auditoria', 'archivo'):
+                directorio = destino.with_name(f"{destino.name}.{carpeta}")
+                directorio.mkdir(exist_ok=True)
+                (directorio / archivo).write_bytes(datos)
+        return destino
+
+    def verificar_backups(self, copia: str = None) -> List[str]:
+        """Comprueba una copia (o todas). Devuelve la lista de errores."""
+        return self._copias.verificar(copia)
+
+    def podar_backups(self, conservar: int = None) -> tuple:
+        """Elimina las copias más antiguas y sus fragmentos sin uso.
+
+        Returns:
+            tuple: (copias eliminadas, fragmentos eliminados)
+        """
+        if conservar is None:
+            conservar = DatabaseConfig.BACKUP_CONSERVAR
+        return self._copias.podar(conservar)
 
     def obtener_estadisticas(self) -> Dict:
-        with self.get_connection() as conn:
+        with self.read_connection() as conn:
             cursor = conn.cursor()
 
             stats = {}
@@ -715,21 +2648,84 @@ class DatabaseManagerEncrypted:
             cursor.execute("SELECT COUNT(*) as total FROM camareros WHERE activo = 1")
             stats['camareros'] = cursor.fetchone()['total']
 
-            stats['tamano_db_bytes'] = self.db_path.stat().st_size if self.db_path.exists() else 0
+            stats['tamano_db_bytes'] = self._contenedor.tamano_total()
+            stats['formato_fragmentado'] = ChunkedContainer.es_contenedor(self.db_path)
+            stats['tamano_diario_bytes'] = self._diario.tamano()
+            stats['tamano_auditoria_bytes'] = self._auditoria.tamano()
+            stats['tamano_backups_bytes'] = self._copias.tamano()
+            stats['tamano_archivo_bytes'] = self._archivo.tamano()
+            stats['archivo_anual'] = self._archivo.estado()
+            stats['anios_archivados'] = {row['anio']: {
+                'recibos': row['recibos'],
+                'total': row['total']
+            } for row in cursor.execute("SELECT * FROM archivos_anuales ORDER BY anio")}
+            if self._programador_backups is not None:
+                stats['backups_programados'] = self._programador_backups.estado()
+            stats['instantaneas'] = {
+                'creadas': self.instantaneas_creadas,
+                'reutilizadas': self.instantaneas_reutilizadas,
+                'en_reserva': len(self._instantaneas)
+            }
+            stats['paginas'] = self._medir_paginas(conn)
+            stats['paginas']['compactaciones'] = self.compactaciones_paginas
+            stats['paginas']['ultima_compactacion'] = (
+                self._ultima_compactacion_paginas.isoformat()
+                if self._ultima_compactacion_paginas else None
+            )
+            stats['persistencia'] = self.estado_persistencia()
 
             return stats
 
     def verificar_integridad(self) -> bool:
+        """Comprueba la imagen con PRAGMA integrity_check (sobre una instantánea)."""
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM sqlite_master")
-                cursor.fetchone()
-                return True
+            with self.instantanea() as conn:
+                resultado = [fila[0] for fila in conn.execute("PRAGMA integrity_check")]
+            if resultado != ['ok']:
+                print(f"Error de integridad: {'; '.join(resultado[:5])}")
+                return False
+            return True
         except Exception as e:
             print(f"Error de integridad: {e}")
             return False
 
+    # Consultas de recibos frecuentes (argumentos de `obtener_recibos`)
+    CONSULTAS_CALIENTES = {
+        'pendientes': {'estado': 'pendiente'},
+        'pendientes_cliente': {'estado': 'pendiente', 'cliente': 'cliente'},
+        'pagados_anio': {'estados': ['efectivo', 'tarjeta'],
+                         'fecha_inicio': '01/01/2025', 'fecha_fin': '31/12/2025'},
+        'rango_fechas': {'fecha_inicio': '01/06/2025', 'fecha_fin': '30/06/2025'},
+        'camarero_rango': {'camarero': 'camarero',
+                           'fecha_inicio': '01/06/2025', 'fecha_fin': '30/06/2025'},
+        'ultimos': {'limit': 50},
+        'pendientes_pagina': {'estado': 'pendiente', 'limit': 500,
+                              'despues_de': (1735732800, 1000)},
+        'pagina_siguiente': {'estados': ['efectivo', 'tarjeta'],
+                             'fecha_inicio': '01/01/2025', 'fecha_fin': '31/12/2025',
+                             'limit': 500, 'despues_de': (1735732800, 1000),
+                             'descendente': False}
+    }
+
+    def planes_consultas(self) -> Dict[str, str]:
+        """Devuelve el EXPLAIN QUERY PLAN de cada consulta de `CONSULTAS_CALIENTES`."""
+        planes = {}
+        with self.read_connection() as conn:
+            for nombre, argumentos in self.CONSULTAS_CALIENTES.items():
+                query, params = self._consulta_recibos(**argumentos)
+                filas = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+                planes[nombre] = " | ".join(fila[-1] for fila in filas)
+        return planes
+
+    def verificar_planes_consultas(self) -> bool:
+        """Comprueba que ninguna consulta caliente recorre la tabla de recibos entera."""
+        correcto = True
+        for nombre, plan in self.planes_consultas().items():
+            if re.search(r"SCAN recibos(?! USING)", plan):
+                print(f"⚠ Consulta '{nombre}' sin índice: {plan}")
+                correcto = False
+        return correcto
+
 
 # ============================================================================
 # INSTANCIA GLOBAL
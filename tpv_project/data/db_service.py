@@ -0,0 +1,626 @@
+"""
+Servicio local de base de datos para varios TPV en la misma máquina.
+
+Un solo proceso (`python servicio_db.py`) abre `tpv.db` en modo sesión y
+es su único escritor; los TPV (caja de barra, terraza, ...) le envían las
+llamadas por un socket local y nunca tocan los archivos de la base de
+datos. Las escrituras quedan serializadas por el lock de la sesión: un
+`batch()` de un cliente retiene la sesión hasta que termina, así que el
+lote de un TPV nunca se mezcla con el de otro.
+
+Transporte: socket de dominio Unix `<db>.sock` (permisos 0600). En
+plataformas sin AF_UNIX se usa TCP en 127.0.0.1:`DatabaseConfig.SERVICIO_PUERTO`.
+
+Protocolo (tramas de longitud fija + contenido):
+
+    trama    = longitud (4 bytes, big-endian) + marshal(valor)
+    saludo   = servidor -> nonce (16 bytes, sin trama)
+               cliente  -> HMAC-SHA256(clave, nonce) (32 bytes, sin trama)
+               servidor -> (OK, VERSION_PROTOCOLO)
+    llamada  = (metodo, args, kwargs)
+    respuesta = (OK, resultado) | (ERROR, tipo, mensaje) | (PAGINA, recibos)...
+
+La clave del saludo se deriva de la clave de cifrado del TPV: solo un
+proceso que podría descifrar la base de datos puede hablar con el servicio.
+El saludo es de longitud fija: el servidor no deserializa nada de un
+cliente hasta que se ha autenticado.
+`iter_recibos` se responde en varias tramas PAGINA seguidas de un OK final.
+
+marshal no admite fechas: `date` y `datetime` viajan como
+(_MARCA_FECHA, tipo, isoformat) y se reconstruyen al recibir.
+
+El cliente (`DatabaseClient`) ofrece los mismos métodos que
+`DatabaseManagerEncrypted` y mantiene una conexión persistente por hilo.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import hmac
+import time
+import struct
+import marshal
+import socket
+import sqlite3
+import builtins
+import hashlib
+import threading
+import subprocess
+from contextlib import contextmanager
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from config.settings import DatabaseConfig, EncryptionConfig
+from core.cipher import obtener_cifrador
+
+
+VERSION_PROTOCOLO = 2
+
+# Estados de una respuesta
+OK = 0
+ERROR = 1
+PAGINA = 2
+
+_LONGITUD = struct.Struct(">I")
+TAMANO_MAXIMO_TRAMA = 256 * 1024 * 1024
+
+# Saludo
+_TAMANO_NONCE = 16
+_TAMANO_FIRMA = hashlib.sha256().digest_size
+_ESPERA_SALUDO = 10.0     # segundos para completar el saludo
+
+# Fechas codificadas: (_MARCA_FECHA, tipo, isoformat)
+_MARCA_FECHA = b"\x00tpv-fecha"
+_TIPOS_FECHA = {'date': date, 'datetime': datetime}
+_ESCALARES = (str, int, float, bool, bytes, type(None))
+
+# Métodos de DatabaseManagerEncrypted que se pueden llamar por el servicio
+METODOS = frozenset({
+    'guardar_producto', 'obtener_productos', 'eliminar_producto',
+    'intercambiar_productos', 'mover_producto',
+    'guardar_recibo', 'guardar_recibos_bulk', 'obtener_recibos', 'actualizar_recibo',
+    'eliminar_recibo',
+    'obtener_ventas_diarias', 'obtener_saldos_clientes', 'archivar_anios_cerrados',
+    'guardar_cliente', 'obtener_clientes', 'eliminar_cliente',
+    'guardar_camarero', 'obtener_camareros', 'eliminar_camarero',
+    'guardar_configuracion', 'obtener_configuracion', 'obtener_datos_referencia',
+    'obtener_auditoria',
+    'checkpoint', 'compactar', 'volcar', 'estado_persistencia',
+    'crear_backup', 'listar_backups', 'verificar_backups', 'podar_backups',
+    'iniciar_backups_programados', 'obtener_estadisticas',
+    'verificar_integridad', 'es_fragmentada'
+})
+
+# Métodos que devuelven una ruta (viaja como str)
+_DEVUELVEN_RUTA = frozenset({'crear_backup'})
+
+
+class ErrorServicio(ConnectionError):
+    """El servicio no está disponible o la conexión con él se perdió."""
+
+
+# ============================================================================
+# TRAMAS
+# ============================================================================
+
+def _codificar(valor: Any) -> Any:
+    """Sustituye date/datetime (a cualquier profundidad) por su forma marcada."""
+    if isinstance(valor, _ESCALARES):
+        return valor
+    if isinstance(valor, date):
+        tipo = 'datetime' if isinstance(valor, datetime) else 'date'
+        return (_MARCA_FECHA, tipo, valor.isoformat())
+    if isinstance(valor, dict):
+        return {_codificar(k): _codificar(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [_codificar(v) for v in valor]
+    if isinstance(valor, tuple):
+        return tuple(_codificar(v) for v in valor)
+    return valor
+
+
+def _decodificar(valor: Any) -> Any:
+    """Inversa de `_codificar`."""
+    if isinstance(valor, _ESCALARES):
+        return valor
+    if isinstance(valor, dict):
+        return {_decodificar(k): _decodificar(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [_decodificar(v) for v in valor]
+    if isinstance(valor, tuple):
+        if len(valor) == 3 and valor[0] == _MARCA_FECHA:
+            return _TIPOS_FECHA[valor[1]].fromisoformat(valor[2])
+        return tuple(_decodificar(v) for v in valor)
+    return valor
+
+
+def _enviar(sock: socket.socket, valor: Any) -> None:
+    """Envía una trama.
+
+    Raises:
+        ValueError: Si `valor` no se puede serializar (no se envía nada)
+    """
+    datos = marshal.dumps(_codificar(valor), 4)
+    sock.sendall(_LONGITUD.pack(len(datos)) + datos)
+
+
+def _recibir_exacto(sock: socket.socket, n: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < n:
+        parte = sock.recv(n - len(buffer))
+        if not parte:
+            raise EOFError("Conexión cerrada")
+        buffer += parte
+    return bytes(buffer)
+
+
+def _recibir(sock: socket.socket) -> Any:
+    longitud, = _LONGITUD.unpack(_recibir_exacto(sock, _LONGITUD.size))
+    if longitud > TAMANO_MAXIMO_TRAMA:
+        raise EOFError(f"Trama demasiado grande ({longitud} bytes)")
+    return _decodificar(marshal.loads(_recibir_exacto(sock, longitud)))
+
+
+# ============================================================================
+# DIRECCIÓN Y CLAVE
+# ============================================================================
+
+def direccion_servicio(db_path: str = "data/tpv.db") -> Tuple[int, Any]:
+    """(familia, dirección) del servicio para la base de datos dada."""
+    if hasattr(socket, 'AF_UNIX'):
+        return socket.AF_UNIX, str(Path(db_path).with_name(Path(db_path).name + ".sock"))
+    return socket.AF_INET, ('127.0.0.1', DatabaseConfig.SERVICIO_PUERTO)
+
+
+def _clave_servicio() -> bytes:
+    contexto = obtener_cifrador(EncryptionConfig.ENCRYPTION_KEY).contexto
+    return hmac.new(contexto.clave_aead, b"tpv-servicio-v1", hashlib.sha256).digest()
+
+
+def _firma(clave: bytes, nonce: bytes) -> bytes:
+    return hmac.new(clave, nonce, hashlib.sha256).digest()
+
+
+# ============================================================================
+# SERVIDOR
+# ============================================================================
+
+class DatabaseService:
+    """Atiende a los TPV por el socket local sobre una única base de datos."""
+
+    def __init__(self, db, direccion: Optional[Tuple[int, Any]] = None,
+                 max_clientes: int = None, cierre_sin_clientes: float = 0):
+        """
+        Args:
+            db: DatabaseManagerEncrypted (en modo sesión) del que es dueño el servicio
+            direccion: (familia, dirección); None = `direccion_servicio(db.db_path)`
+            max_clientes: Conexiones simultáneas (None = `DatabaseConfig.SERVICIO_MAX_CLIENTES`)
+            cierre_sin_clientes: Segundos sin clientes tras los que el servicio
+                termina (0 = nunca)
+        """
+        self.db = db
+        self.familia, self.direccion = direccion or direccion_servicio(str(db.db_path))
+        self.max_clientes = max_clientes or DatabaseConfig.SERVICIO_MAX_CLIENTES
+        self.cierre_sin_clientes = cierre_sin_clientes
+        self._clave = _clave_servicio()
+
+        self._socket: Optional[socket.socket] = None
+        self._lock = threading.Lock()
+        self._clientes: Dict[int, socket.socket] = {}
+        self._parar = threading.Event()
+        self._sin_clientes_desde = time.monotonic()
+        self._hilo: Optional[threading.Thread] = None
+
+        # Métricas
+        self.conexiones = 0
+        self.rechazadas = 0
+        self.llamadas = 0
+
+    # -------------------------- Arranque -------------------------------------
+    def _escuchar(self) -> None:
+        if self.familia == getattr(socket, 'AF_UNIX', None):
+            ruta = Path(self.direccion)
+            if ruta.exists():
+                # Un socket que no acepta conexiones es de un servicio caído
+                try:
+                    with socket.socket(self.familia, socket.SOCK_STREAM) as prueba:
+                        prueba.connect(self.direccion)
+                    raise ErrorServicio(f"Ya hay un servicio escuchando en {ruta}")
+                except (ConnectionRefusedError, FileNotFoundError):
+                    ruta.unlink(missing_ok=True)
+
+        sock = socket.socket(self.familia, socket.SOCK_STREAM)
+        if self.familia != getattr(socket, 'AF_UNIX', None):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        anterior = os.umask(0o177)
+        try:
+            sock.bind(self.direccion)
+        finally:
+            os.umask(anterior)
+        sock.listen(self.max_clientes)
+        sock.settimeout(1.0)
+        self._socket = sock
+
+    def iniciar(self) -> None:
+        """Empieza a escuchar y atiende las conexiones en un hilo propio."""
+        self._escuchar()
+        self._hilo = threading.Thread(target=self._aceptar, name="tpv-servicio", daemon=True)
+        self._hilo.start()
+
+    def servir(self) -> None:
+        """Empieza a escuchar y atiende las conexiones hasta `detener()`."""
+        self._escuchar()
+        print(f"✓ Servicio de base de datos escuchando en {self.direccion}")
+        self._aceptar()
+
+    def _aceptar(self) -> None:
+        try:
+            while not self._parar.is_set():
+                try:
+                    conn, _ = self._socket.accept()
+                except socket.timeout:
+                    if self._inactivo():
+                        print("Servicio sin clientes: terminando")
+                        break
+                    continue
+                except OSError:
+                    break
+                conn.settimeout(_ESPERA_SALUDO)
+
+                with self._lock:
+                    if len(self._clientes) >= self.max_clientes:
+                        self.rechazadas += 1
+                        conn.close()
+                        continue
+                    self._clientes[conn.fileno()] = conn
+                    self.conexiones += 1
+                threading.Thread(
+                    target=self._atender, args=(conn,), name="tpv-servicio-cliente", daemon=True
+                ).start()
+        finally:
+            self._cerrar_socket()
+
+    def _inactivo(self) -> bool:
+        if not self.cierre_sin_clientes:
+            return False
+        with self._lock:
+            if self._clientes:
+                return False
+            return time.monotonic() - self._sin_clientes_desde >= self.cierre_sin_clientes
+
+    # -------------------------- Clientes -------------------------------------
+    def _atender(self, conn: socket.socket) -> None:
+        """Bucle de una conexión: saludo y llamadas hasta que se cierra."""
+        clave = conn.fileno()
+        lotes = []
+        try:
+            # Saludo de longitud fija: nada del cliente se deserializa antes
+            nonce = os.urandom(_TAMANO_NONCE)
+            conn.sendall(nonce)
+            firma = _recibir_exacto(conn, _TAMANO_FIRMA)
+            if not hmac.compare_digest(firma, _firma(self._clave, nonce)):
+                return
+            _enviar(conn, (OK, VERSION_PROTOCOLO))
+
+            espera = None
+            conn.settimeout(espera)
+            while True:
+                # Un lote abierto retiene la sesión: si el cliente no sigue
+                # en SERVICIO_ESPERA_LOTE segundos se deshace y se cierra
+                limite = DatabaseConfig.SERVICIO_ESPERA_LOTE if lotes else None
+                if limite != espera:
+                    espera = limite
+                    conn.settimeout(espera)
+                try:
+                    metodo, args, kwargs = _recibir(conn)
+                except socket.timeout:
+                    print(f"Lote de un cliente inactivo más de {espera} s: deshecho")
+                    return
+                with self._lock:
+                    self.llamadas += 1
+                self._responder(conn, metodo, args, kwargs, lotes)
+        except (EOFError, OSError, ValueError, TypeError):
+            pass
+        finally:
+            # Un cliente que se va con un lote abierto lo deshace
+            while lotes:
+                try:
+                    lotes.pop().__exit__(ErrorServicio, ErrorServicio("Cliente desconectado"), None)
+                except Exception as e:
+                    print(f"Error deshaciendo el lote de un cliente desconectado: {e}")
+            conn.close()
+            with self._lock:
+                self._clientes.pop(clave, None)
+                if not self._clientes:
+                    self._sin_clientes_desde = time.monotonic()
+
+    def _responder(self, conn: socket.socket, metodo: str, args, kwargs, lotes: list) -> None:
+        try:
+            if metodo == 'lote_inicio':
+                lote = self.db.batch()
+                lote.__enter__()
+                lotes.append(lote)
+                resultado = len(lotes)
+            elif metodo == 'lote_fin':
+                exito, = args
+                lote = lotes.pop()
+                if exito:
+                    lote.__exit__(None, None, None)
+                else:
+                    lote.__exit__(ErrorServicio, ErrorServicio("Lote cancelado"), None)
+                resultado = len(lotes)
+            elif metodo == 'iter_recibos':
+                pagina = []
+                tamano = kwargs.get('tamano_pagina') or DatabaseConfig.TAMANO_PAGINA_RECIBOS
+                for recibo in self.db.iter_recibos(*args, **kwargs):
+                    pagina.append(recibo)
+                    if len(pagina) >= tamano:
+                        _enviar(conn, (PAGINA, pagina))
+                        pagina = []
+                if pagina:
+                    _enviar(conn, (PAGINA, pagina))
+                resultado = None
+            elif metodo in METODOS:
+                resultado = getattr(self.db, metodo)(*args, **kwargs)
+                if isinstance(resultado, Path):
+                    resultado = str(resultado)
+            else:
+                raise AttributeError(f"Método no disponible en el servicio: {metodo}")
+        except (OSError, EOFError):
+            raise
+        except Exception as e:
+            _enviar(conn, (ERROR, type(e).__name__, str(e)))
+            return
+        try:
+            _enviar(conn, (OK, resultado))
+        except ValueError as e:
+            # marshal no admite el resultado; la conexión sigue siendo válida
+            _enviar(conn, (ERROR, 'TypeError', f"Resultado de {metodo} no serializable: {e}"))
+
+    # -------------------------- Parada ---------------------------------------
+    def detener(self, timeout: float = 5.0) -> None:
+        """Deja de aceptar conexiones y cierra las abiertas."""
+        self._parar.set()
+        with self._lock:
+            for conn in self._clientes.values():
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if self._hilo is not None and self._hilo is not threading.current_thread():
+            self._hilo.join(timeout)
+
+    def _cerrar_socket(self) -> None:
+        if self._socket is None:
+            return
+        self._socket.close()
+        self._socket = None
+        if self.familia == getattr(socket, 'AF_UNIX', None):
+            Path(self.direccion).unlink(missing_ok=True)
+
+    def estado(self) -> Dict:
+        """Clientes conectados y llamadas atendidas."""
+        with self._lock:
+            return {
+                'clientes': len(self._clientes),
+                'conexiones': self.conexiones,
+                'rechazadas': self.rechazadas,
+                'llamadas': self.llamadas
+            }
+
+
+# ============================================================================
+# CLIENTE
+# ============================================================================
+
+class DatabaseClient:
+    """Misma interfaz que DatabaseManagerEncrypted, a través del servicio.
+
+    Cada hilo usa su propia conexión persistente (se abre en la primera
+    llamada y se reutiliza). `batch()` abre un lote en el servicio que
+    retiene la base de datos hasta que termina el bloque.
+    """
+
+    def __init__(self, db_path: str = "data/tpv.db",
+                 direccion: Optional[Tuple[int, Any]] = None):
+        self.db_path = Path(db_path)
+        self.familia, self.direccion = direccion or direccion_servicio(db_path)
+        self._clave = _clave_servicio()
+        self._local = threading.local()
+        self._conexiones_lock = threading.Lock()
+        self._conexiones = []
+
+    # -------------------------- Conexiones -----------------------------------
+    def conectar(self) -> socket.socket:
+        """Conexión del hilo actual (la abre y saluda si hace falta).
+
+        Raises:
+            ErrorServicio: Si el servicio no responde o rechaza el saludo
+        """
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            return sock
+
+        sock = socket.socket(self.familia, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.direccion)
+            nonce = _recibir_exacto(sock, _TAMANO_NONCE)
+            sock.sendall(_firma(self._clave, nonce))
+            estado, version = _recibir(sock)
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            sock.close()
+            raise ErrorServicio(f"No se pudo conectar con el servicio ({e})")
+        if estado != OK or version != VERSION_PROTOCOLO:
+            sock.close()
+            raise ErrorServicio(f"Versión de protocolo no soportada: {version}")
+
+        self._local.sock = sock
+        self._local.lotes = 0
+        with self._conexiones_lock:
+            self._conexiones.append(sock)
+        return sock
+
+    def _descartar(self) -> None:
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            return
+        self._local.sock = None
+        with self._conexiones_lock:
+            if sock in self._conexiones:
+                self._conexiones.remove(sock)
+        sock.close()
+
+    def _enviar_llamada(self, metodo: str, args, kwargs) -> socket.socket:
+        """Envía una llamada; una conexión caída se reabre una vez fuera de lotes."""
+        sock = self.conectar()
+        try:
+            _enviar(sock, (metodo, tuple(args), kwargs))
+            return sock
+        except OSError:
+            reintentar = not self._local.lotes
+            self._descartar()
+            if not reintentar:
+                raise ErrorServicio("Conexión con el servicio perdida dentro de un lote")
+
+        sock = self.conectar()
+        try:
+            _enviar(sock, (metodo, tuple(args), kwargs))
+        except OSError as e:
+            self._descartar()
+            raise ErrorServicio(f"Conexión con el servicio perdida ({e})")
+        return sock
+
+    def _respuesta(self, sock: socket.socket):
+        try:
+            return _recibir(sock)
+        except (OSError, EOFError) as e:
+            self._descartar()
+            raise ErrorServicio(f"Conexión con el servicio perdida ({e})")
+
+    @staticmethod
+    def _lanzar(tipo: str, mensaje: str):
+        excepcion = getattr(builtins, tipo, None) or getattr(sqlite3, tipo, None)
+        if isinstance(excepcion, type) and issubclass(excepcion, Exception):
+            raise excepcion(mensaje)
+        raise RuntimeError(f"{tipo}: {mensaje}")
+
+    def llamar(self, metodo: str, *args, **kwargs) -> Any:
+        """Ejecuta `metodo` en el servicio y devuelve su resultado."""
+        sock = self._enviar_llamada(metodo, args, kwargs)
+        respuesta = self._respuesta(sock)
+        if respuesta[0] == ERROR:
+            self._lanzar(respuesta[1], respuesta[2])
+        return respuesta[1]
+
+    def __getattr__(self, nombre: str):
+        if nombre not in METODOS:
+            raise AttributeError(f"{nombre} no está disponible a través del servicio")
+
+        def metodo(*args, **kwargs):
+            resultado = self.llamar(nombre, *args, **kwargs)
+            return Path(resultado) if nombre in _DEVUELVEN_RUTA else resultado
+
+        metodo.__name__ = nombre
+        return metodo
+
+    # -------------------------- Lotes y recorridos ---------------------------
+    @contextmanager
+    def batch(self):
+        """Como `DatabaseManagerEncrypted.batch`, en el servicio."""
+        self.llamar('lote_inicio')
+        self._local.lotes += 1
+        try:
+            yield self
+        except BaseException:
+            self._local.lotes -= 1
+            # Si la conexión se perdió, el servicio ya deshizo el lote
+            if getattr(self._local, 'sock', None) is not None:
+                self.llamar('lote_fin', False)
+            raise
+        self._local.lotes -= 1
+        self.llamar('lote_fin', True)
+
+    def iter_recibos(self, *args, **kwargs) -> Iterator[Dict]:
+        """Como `DatabaseManagerEncrypted.iter_recibos`, recibido por páginas.
+
+        La conexión del hilo queda ocupada hasta terminar el recorrido; si
+        se abandona antes, se descartan las páginas restantes.
+        """
+        sock = self._enviar_llamada('iter_recibos', args, kwargs)
+        terminado = False
+        try:
+            while True:
+                respuesta = self._respuesta(sock)
+                if respuesta[0] == PAGINA:
+                    yield from respuesta[1]
+                    continue
+                terminado = True
+                if respuesta[0] == ERROR:
+                    self._lanzar(respuesta[1], respuesta[2])
+                return
+        finally:
+            if not terminado and getattr(self._local, 'sock', None) is sock:
+                while self._respuesta(sock)[0] == PAGINA:
+                    pass
+
+    def cerrar(self) -> None:
+        """Cierra las conexiones de este cliente (el servicio sigue en marcha)."""
+        with self._conexiones_lock:
+            conexiones, self._conexiones = self._conexiones, []
+        for sock in conexiones:
+            sock.close()
+        self._local = threading.local()
+
+
+# ============================================================================
+# ARRANQUE AUTOMÁTICO
+# ============================================================================
+
+def conectar_servicio(db_path: str = "data/tpv.db", arrancar: bool = True) -> DatabaseClient:
+    """Cliente del servicio; si no está en marcha y `arrancar`, lo lanza.
+
+    El servicio lanzado así (`servicio_db.py --automatico`) termina cuando
+    se queda sin clientes `DatabaseConfig.SERVICIO_CIERRE` segundos.
+
+    Raises:
+        ErrorServicio: Si el servicio no responde tras `SERVICIO_ESPERA_ARRANQUE` segundos
+    """
+    cliente = DatabaseClient(db_path)
+    try:
+        cliente.conectar()
+        return cliente
+    except ErrorServicio:
+        if not arrancar:
+            raise
+
+    script = Path(__file__).resolve().parent.parent / "servicio_db.py"
+    opciones = {}
+    if os.name == 'nt':
+        opciones['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        opciones['start_new_session'] = True
+    subprocess.Popen(
+        [sys.executable, str(script), '--automatico', str(db_path)],
+        stdin=subprocess.DEVNULL, cwd=os.getcwd(), **opciones
+    )
+
+    limite = time.monotonic() + DatabaseConfig.SERVICIO_ESPERA_ARRANQUE
+    while True:
+        try:
+            cliente.conectar()
+            return cliente
+        except ErrorServicio:
+            if time.monotonic() >= limite:
+                raise
+            time.sleep(0.1)
+
+
+__all__ = [
+    'DatabaseClient',
+    'DatabaseService',
+    'ErrorServicio',
+    'METODOS',
+    'conectar_servicio',
+    'direccion_servicio'
+]
@@ -0,0 +1,459 @@
+"""
+Almacén clave-valor cifrado con estructura de registro (append-only).
+
+Cada escritura añade al final del segmento activo un registro cifrado por
+separado con la clave y el valor (o una marca de borrado). Un índice hash
+en memoria (clave -> archivo, posición, longitud) permite leer cualquier
+clave con una lectura y un descifrado, y escribir cuesta lo que el
+registro, no lo que el almacén completo.
+
+Estructura en disco (para `data/tpv.kv`):
+
+    data/tpv.kv/
+        fusion_000004.log      # valores vivos de los segmentos <= 4
+        fusion_000004.hint     # índice de ese archivo (cifrado)
+        segmento_000005.log    # segmento cerrado
+        segmento_000005.hint
+        segmento_000006.log    # segmento activo (sin hint)
+
+Cada `.log` es una sucesión de registros: longitud (4 bytes, big endian) |
+registro cifrado. Al abrir, el índice se reconstruye con los `.hint` de
+los archivos cerrados (un descifrado por archivo) y recorriendo solo el
+segmento activo; un último registro incompleto (escritura interrumpida)
+se descarta.
+
+Cuando hay `segmentos_fusion` archivos cerrados, un hilo en segundo plano
+copia sus registros vivos (sin descifrarlos) a `fusion_N`, que sustituye a
+todos los archivos <= N. Si la fusión se interrumpe, al abrir se termina
+(el `fusion_N` completo manda sobre los archivos que cubre).
+"""
+from __future__ import annotations
+
+import os
+import re
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+_LONGITUD = 4
+
+_ARCHIVO = re.compile(r"(segmento|fusion)_(\d{6})\.log$")
+
+_AUSENTE = object()
+
+
+class LogStore:
+    """Registro de pares clave-valor cifrados con índice hash en memoria."""
+
+    def __init__(self, directorio: Path, cifrar: Callable[[bytes], bytes],
+                 descifrar: Callable[[bytes], bytes], fsync: bool = True,
+                 tamano_segmento: int = 4 * 1024 * 1024, segmentos_fusion: int = 4):
+        """
+        Args:
+            directorio: Carpeta del almacén (se crea si no existe)
+            cifrar: Función de cifrado de un registro
+            descifrar: Función de descifrado de un registro
+            fsync: Forzar cada escritura a disco (en un `lote()`, una vez al final)
+            tamano_segmento: Bytes a partir de los que se abre un segmento nuevo
+            segmentos_fusion: Archivos cerrados que disparan una fusión (0 = nunca)
+        """
+        self.directorio = Path(directorio)
+        self._cifrar = cifrar
+        self._descifrar = descifrar
+        self.fsync = fsync
+        self.tamano_segmento = tamano_segmento
+        self.segmentos_fusion = segmentos_fusion
+
+        self._lock = threading.RLock()
+        # Solo una fusión a la vez (la escritura no la espera)
+        self._lock_fusion = threading.Lock()
+
+        # clave -> (archivo, posición del registro cifrado, longitud)
+        self._indice: Dict[str, Tuple[str, int, int]] = {}
+        # Archivos en orden (el último es el segmento activo) y bytes de
+        # registros obsoletos (sobrescritos o borrados) de cada uno
+        self._archivos: List[str] = []
+        self._muertos: Dict[str, int] = {}
+        self._lectores: Dict[str, BinaryIO] = {}
+
+        self._activo: Optional[BinaryIO] = None
+        self._tamano_activo = 0
+        self._hint_activo: List[list] = []
+        self._nivel_lote = 0
+        self._fsync_pendiente = False
+
+        # Fusión en segundo plano (el hilo se crea con la primera)
+        self._hilo_fusion: Optional[threading.Thread] = None
+        self._cond_fusion = threading.Condition()
+        self._parar = False
+
+        # Métricas
+        self.escrituras = 0
+        self.lecturas = 0
+        self.fusiones = 0
+        self.ultima_fusion: Optional[datetime] = None
+
+        self._abrir()
+
+    # -------------------------- Archivos -------------------------------------
+    def _ruta(self, nombre: str) -> Path:
+        return self.directorio / nombre
+
+    @staticmethod
+    def _hint(nombre: str) -> str:
+        return nombre[:-len(".log")] + ".hint"
+
+    @staticmethod
+    def _numero(nombre: str) -> int:
+        return int(_ARCHIVO.match(nombre)[2])
+
+    def _abrir(self) -> None:
+        """Completa una fusión interrumpida y reconstruye el índice."""
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        for ruta in self.directorio.glob("*.tmp"):
+            ruta.unlink()
+
+        segmentos, fusiones = [], []
+        for ruta in self.directorio.iterdir():
+            coincidencia = _ARCHIVO.match(ruta.name)
+            if coincidencia:
+                (fusiones if coincidencia[1] == 'fusion' else segmentos).append(ruta.name)
+
+        # Un fusion_N completo sustituye a todos los archivos <= N
+        ultima = max(fusiones, key=self._numero, default=None)
+        if ultima is not None:
+            cubiertos = [n for n in segmentos + fusiones
+                         if n != ultima and self._numero(n) <= self._numero(ultima)]
+            for nombre in cubiertos:
+                self._borrar_archivo(nombre)
+            segmentos = [n for n in segmentos if n not in cubiertos]
+
+        self._archivos = ([ultima] if ultima else []) + sorted(segmentos, key=self._numero)
+        if not self._archivos or not self._archivos[-1].startswith("segmento_"):
+            siguiente = self._numero(self._archivos[-1]) + 1 if self._archivos else 1
+            self._archivos.append(f"segmento_{siguiente:06d}.log")
+            self._ruta(self._archivos[-1]).touch()
+
+        for nombre in self._archivos:
+            self._muertos[nombre] = 0
+        for nombre in self._archivos[:-1]:
+            self._cargar_cerrado(nombre)
+
+        activo = self._archivos[-1]
+        self._hint_activo = self._recorrer(activo, truncar=True)
+        self._aplicar(activo, self._hint_activo)
+        self._activo = open(self._ruta(activo), 'ab')
+        self._tamano_activo = self._activo.tell()
+
+    def _borrar_archivo(self, nombre: str) -> None:
+        lector = self._lectores.pop(nombre, None)
+        if lector is not None:
+            lector.close()
+        for ruta in (self._ruta(nombre), self._ruta(self._hint(nombre))):
+            if ruta.exists():
+                ruta.unlink()
+
+    def _cargar_cerrado(self, nombre: str) -> None:
+        """Aplica al índice un archivo cerrado, desde su hint si lo tiene."""
+        ruta_hint = self._ruta(self._hint(nombre))
+        if ruta_hint.exists():
+            entradas = json.loads(self._descifrar(ruta_hint.read_bytes()).decode('utf-8'))
+        else:
+            # Cierre inesperado justo al rotar: se recorre y se crea el hint
+            entradas = self._recorrer(nombre)
+            self._escribir_hint(nombre, entradas)
+        self._aplicar(nombre, entradas)
+
+    def _recorrer(self, nombre: str, truncar: bool = False) -> List[list]:
+        """Descifra los registros de un archivo y devuelve sus entradas de hint.
+
+        Args:
+            nombre: Archivo a recorrer
+            truncar: Eliminar del archivo un último registro incompleto
+
+        Raises:
+            ValueError: Si un registro completo no se puede descifrar
+        """
+        datos = self._ruta(nombre).read_bytes()
+        entradas = []
+        posicion = 0
+        while posicion + _LONGITUD <= len(datos):
+            longitud = int.from_bytes(datos[posicion:posicion + _LONGITUD], 'big')
+            inicio = posicion + _LONGITUD
+            if inicio + longitud > len(datos):
+                break  # último registro incompleto: escritura interrumpida
+
+            registro = json.loads(self._descifrar(datos[inicio:inicio + longitud]).decode('utf-8'))
+            entradas.append([registro[0], inicio, longitud] if len(registro) == 2 else [registro[0]])
+            posicion = inicio + longitud
+
+        if truncar and posicion < len(datos):
+            with open(self._ruta(nombre), 'r+b') as archivo:
+                archivo.truncate(posicion)
+        return entradas
+
+    def _aplicar(self, nombre: str, entradas: List[list]) -> None:
+        """Aplica al índice las entradas de hint de un archivo, en orden."""
+        for entrada in entradas:
+            if len(entrada) == 1:
+                self._descartar(self._indice.pop(entrada[0], None))
+            else:
+                clave, posicion, longitud = entrada
+                self._descartar(self._indice.get(clave))
+                self._indice[clave] = (nombre, posicion, longitud)
+
+    def _descartar(self, ubicacion: Optional[Tuple[str, int, int]]) -> None:
+        """Cuenta como obsoleto el registro de `ubicacion`."""
+        if ubicacion is not None:
+            self._muertos[ubicacion[0]] += _LONGITUD + ubicacion[2]
+
+    def _escribir_hint(self, nombre: str, entradas: List[list]) -> None:
+        ruta = self._ruta(self._hint(nombre))
+        tmp_write = ruta.with_suffix(ruta.suffix + ".tmp")
+        with open(tmp_write, 'wb') as archivo:
+            archivo.write(self._cifrar(json.dumps(entradas).encode('utf-8')))
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        tmp_write.replace(ruta)
+
+    def _rotar(self) -> None:
+        """Cierra el segmento activo (con su hint) y abre uno nuevo."""
+        self._sincronizar()
+        self._activo.close()
+        cerrado = self._archivos[-1]
+        self._escribir_hint(cerrado, self._hint_activo)
+
+        nuevo = f"segmento_{self._numero(cerrado) + 1:06d}.log"
+        self._archivos.append(nuevo)
+        self._muertos[nuevo] = 0
+        self._activo = open(self._ruta(nuevo), 'ab')
+        self._tamano_activo = 0
+        self._hint_activo = []
+
+        if self.segmentos_fusion and len(self._archivos) - 1 >= self.segmentos_fusion:
+            self._avisar_fusion()
+
+    def _sincronizar(self) -> None:
+        self._activo.flush()
+        if self.fsync:
+            os.fsync(self._activo.fileno())
+        self._fsync_pendiente = False
+
+    # -------------------------- Escritura ------------------------------------
+    def _anadir(self, clave: str, registro: list) -> None:
+        cifrado = self._cifrar(json.dumps(registro, ensure_ascii=False).encode('utf-8'))
+        with self._lock:
+            if self._activo is None:
+                raise ValueError("El almacén está cerrado")
+            if self._tamano_activo and self._tamano_activo + _LONGITUD + len(cifrado) > self.tamano_segmento:
+                self._rotar()
+
+            nombre = self._archivos[-1]
+            self._activo.write(len(cifrado).to_bytes(_LONGITUD, 'big') + cifrado)
+            inicio = self._tamano_activo + _LONGITUD
+            self._tamano_activo = inicio + len(cifrado)
+            if self._nivel_lote:
+                self._fsync_pendiente = True
+            else:
+                self._sincronizar()
+
+            if len(registro) == 2:
+                self._hint_activo.append([clave, inicio, len(cifrado)])
+                self._aplicar(nombre, [self._hint_activo[-1]])
+            else:
+                self._hint_activo.append([clave])
+                self._aplicar(nombre, [[clave]])
+            self.escrituras += 1
+
+    def guardar(self, clave: str, valor: Any) -> None:
+        """Añade el valor (serializable en JSON) de una clave."""
+        self._anadir(clave, [clave, valor])
+
+    def eliminar(self, clave: str) -> bool:
+        """Añade una marca de borrado para la clave.
+
+        Returns:
+            bool: True si la clave existía
+        """
+        with self._lock:
+            if clave not in self._indice:
+                return False
+            self._anadir(clave, [clave])
+            return True
+
+    @contextmanager
+    def lote(self):
+        """Agrupa varias escrituras en un solo fsync al final del bloque.
+
+        Es reentrante. No es una transacción: lo escrito antes de una
+        excepción se conserva.
+        """
+        with self._lock:
+            self._nivel_lote += 1
+            try:
+                yield self
+            finally:
+                self._nivel_lote -= 1
+                if self._nivel_lote == 0 and self._fsync_pendiente and self._activo is not None:
+                    self._sincronizar()
+
+    # -------------------------- Lectura --------------------------------------
+    def __contains__(self, clave: str) -> bool:
+        return clave in self._indice
+
+    def __len__(self) -> int:
+        return len(self._indice)
+
+    def obtener(self, clave: str, defecto: Any = None) -> Any:
+        """Valor de una clave (`defecto` si no existe)."""
+        with self._lock:
+            ubicacion = self._indice.get(clave)
+            if ubicacion is None:
+                return defecto
+            nombre, posicion, longitud = ubicacion
+            if nombre == self._archivos[-1]:
+                self._activo.flush()
+            lector = self._lectores.get(nombre)
+            if lector is None:
+                lector = self._lectores[nombre] = open(self._ruta(nombre), 'rb')
+            lector.seek(posicion)
+            cifrado = lector.read(longitud)
+            self.lecturas += 1
+        return json.loads(self._descifrar(cifrado).decode('utf-8'))[1]
+
+    def claves(self, prefijo: str = "") -> List[str]:
+        """Claves existentes que empiezan por `prefijo` (en orden de alta)."""
+        with self._lock:
+            return [clave for clave in self._indice if clave.startswith(prefijo)]
+
+    def elementos(self, prefijo: str = "") -> Iterator[Tuple[str, Any]]:
+        """Recorre (clave, valor) de las claves que empiezan por `prefijo`."""
+        for clave in self.claves(prefijo):
+            valor = self.obtener(clave, _AUSENTE)
+            if valor is not _AUSENTE:
+                yield clave, valor
+
+    # -------------------------- Fusión ---------------------------------------
+    def _avisar_fusion(self) -> None:
+        with self._cond_fusion:
+            if self._hilo_fusion is None:
+                self._hilo_fusion = threading.Thread(
+                    target=self._bucle_fusion,
+                    name="tpv-kv-fusion",
+                    daemon=True
+                )
+                self._hilo_fusion.start()
+            self._cond_fusion.notify()
+
+    def _bucle_fusion(self) -> None:
+        while True:
+            with self._cond_fusion:
+                if not self._parar:
+                    self._cond_fusion.wait()
+                if self._parar:
+                    return
+            try:
+                self.fusionar()
+            except Exception as e:
+                print(f"Error fusionando segmentos del almacén: {e}")
+
+    def fusionar(self) -> bool:
+        """Copia los registros vivos de los archivos cerrados a uno solo.
+
+        Los registros se copian cifrados tal cual (sin descifrar) y las
+        marcas de borrado se descartan, porque se fusionan todos los
+        archivos anteriores al segmento activo. Las escrituras siguen
+        durante la copia; solo esperan al cambio final del índice.
+
+        Returns:
+            bool: True si se fusionó algo
+        """
+        with self._lock_fusion:
+            with self._lock:
+                cerrados = self._archivos[:-1]
+                if len(cerrados) < 2:
+                    return False
+                incluidos = set(cerrados)
+                vivos = [(clave, ubicacion) for clave, ubicacion in self._indice.items()
+                         if ubicacion[0] in incluidos]
+
+            nombre = f"fusion_{self._numero(cerrados[-1]):06d}.log"
+            ruta = self._ruta(nombre)
+            tmp_write = ruta.with_suffix(ruta.suffix + ".tmp")
+            entradas = []
+            origenes: Dict[str, BinaryIO] = {}
+            try:
+                with open(tmp_write, 'wb') as destino:
+                    for clave, (origen, posicion, longitud) in vivos:
+                        if origen not in origenes:
+                            origenes[origen] = open(self._ruta(origen), 'rb')
+                        origenes[origen].seek(posicion - _LONGITUD)
+                        destino.write(origenes[origen].read(_LONGITUD + longitud))
+                        entradas.append([clave, destino.tell() - longitud, longitud])
+                    destino.flush()
+                    os.fsync(destino.fileno())
+            finally:
+                for archivo in origenes.values():
+                    archivo.close()
+            self._escribir_hint(nombre, entradas)
+
+            with self._lock:
+                # El rename del .log confirma la fusión (ver `_abrir`)
+                tmp_write.replace(ruta)
+                muertos = 0
+                for (clave, ubicacion), (_, posicion, longitud) in zip(vivos, entradas):
+                    if self._indice.get(clave) == ubicacion:
+                        self._indice[clave] = (nombre, posicion, longitud)
+                    else:
+                        muertos += _LONGITUD + longitud  # cambiada durante la copia
+                for cerrado in cerrados:
+                    self._borrar_archivo(cerrado)
+                    del self._muertos[cerrado]
+                self._archivos = [nombre] + self._archivos[len(cerrados):]
+                self._muertos[nombre] = muertos
+
+            self.fusiones += 1
+            self.ultima_fusion = datetime.now()
+            return True
+
+    # -------------------------- Cierre y métricas ----------------------------
+    def cerrar(self) -> None:
+        """Detiene la fusión en segundo plano y cierra los archivos."""
+        with self._cond_fusion:
+            self._parar = True
+            self._cond_fusion.notify()
+        if self._hilo_fusion is not None and self._hilo_fusion is not threading.current_thread():
+            self._hilo_fusion.join(30)
+        with self._lock:
+            if self._activo is None:
+                return
+            self._sincronizar()
+            self._activo.close()
+            self._activo = None
+            for lector in self._lectores.values():
+                lector.close()
+            self._lectores.clear()
+
+    def estado(self) -> Dict:
+        """Claves, archivos, bytes obsoletos y fusiones del almacén."""
+        with self._lock:
+            tamanos = {nombre: self._ruta(nombre).stat().st_size for nombre in self._archivos}
+            return {
+                'claves': len(self._indice),
+                'archivos': list(self._archivos),
+                'bytes': sum(tamanos.values()),
+                'bytes_obsoletos': sum(self._muertos.values()),
+                'escrituras': self.escrituras,
+                'lecturas': self.lecturas,
+                'fusiones': self.fusiones,
+                'ultima_fusion': self.ultima_fusion.isoformat() if self.ultima_fusion else None
+            }
+
+
+__all__ = [
+    'LogStore'
+]
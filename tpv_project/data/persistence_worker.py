@@ -0,0 +1,274 @@
+"""
+Hilo de persistencia en segundo plano para la base de datos encriptada.
+
+Los commits se confirman en la base de datos en memoria y vuelven al
+instante; sus registros se encolan y un hilo dedicado los escribe en
+disco (cifrados) según una política de durabilidad configurable:
+
+    'sincrona'    - en el propio commit, en el hilo que confirma
+    'commit'      - tras cada commit, en el hilo de persistencia
+    'commits'     - cada N commits
+    'intervalo'   - cada N segundos
+    'inactividad' - tras N segundos sin commits
+
+Con cualquier política ningún registro espera más de `retraso_max`
+segundos. La cola se vuelca también al detener el hilo, al salir del
+proceso (atexit, a través de `DatabaseManagerEncrypted.cerrar`) y al
+recibir SIGTERM/SIGINT (ver `instalar_manejadores_senales`).
+"""
+from __future__ import annotations
+
+import sys
+import signal
+import threading
+import time
+import weakref
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+
+POLITICAS = ('sincrona', 'commit', 'commits', 'intervalo', 'inactividad')
+
+
+class PersistenceWorker:
+    """Cola de registros pendientes y el hilo que los vuelca a disco."""
+
+    def __init__(self, escribir: Callable[[List[Any]], None], politica: str = 'commit',
+                 commits: int = 20, segundos: float = 2.0, retraso_max: float = 5.0,
+                 tarea_periodica: Optional[Callable[[], None]] = None,
+                 intervalo_tarea: float = 15.0):
+        """
+        Args:
+            escribir: Función que persiste una lista de registros, en orden
+            politica: Una de `POLITICAS`
+            commits: N de la política 'commits'
+            segundos: N de las políticas 'intervalo' e 'inactividad'
+            retraso_max: Segundos máximos que un registro puede esperar
+            tarea_periodica: Función llamada desde el hilo cada `intervalo_tarea` s
+            intervalo_tarea: Periodo de `tarea_periodica`
+        """
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de persistencia desconocida: {politica}")
+
+        self._escribir = escribir
+        self.politica = politica
+        self.commits = commits
+        self.segundos = segundos
+        self.retraso_max = retraso_max
+        self._tarea_periodica = tarea_periodica
+        self._intervalo_tarea = intervalo_tarea
+
+        # Cola de (secuencia, instante, registro)
+        self._cola: deque = deque()
+        self._cond = threading.Condition()
+        # Un solo volcado a la vez: los registros deben escribirse en orden
+        self._lock_volcado = threading.RLock()
+        self._volcando = False
+        self._secuencia = 0
+        self._ultimo_encolado = time.monotonic()
+        self._parar = False
+
+        # Métricas
+        self.volcados = 0
+        self.max_pendientes = 0
+        self.max_retraso = 0.0
+        self.ultimo_volcado: Optional[datetime] = None
+
+        self._hilo = threading.Thread(
+            target=self._bucle,
+            name="tpv-persistencia",
+            daemon=True
+        )
+        self._hilo.start()
+        _trabajadores.add(self)
+
+    # -------------------------- Cola -----------------------------------------
+    @property
+    def ultima_secuencia(self) -> int:
+        """Secuencia del último registro encolado."""
+        with self._cond:
+            return self._secuencia
+
+    def encolar(self, registro: Any) -> None:
+        """Encola un registro (en 'sincrona' lo escribe antes de volver)."""
+        with self._cond:
+            self._secuencia += 1
+            ahora = time.monotonic()
+            self._cola.append((self._secuencia, ahora, registro))
+            self._ultimo_encolado = ahora
+            self.max_pendientes = max(self.max_pendientes, len(self._cola))
+            self._cond.notify()
+
+        if self.politica == 'sincrona':
+            self.volcar()
+
+    def descartar_hasta(self, secuencia: int) -> None:
+        """Quita de la cola los registros ya incluidos por otra vía (compactación)."""
+        with self._cond:
+            while self._cola and self._cola[0][0] <= secuencia:
+                self._cola.popleft()
+
+    def volcar(self) -> int:
+        """Escribe ahora todos los registros pendientes.
+
+        Returns:
+            int: Número de registros escritos
+        """
+        with self._lock_volcado:
+            # Reentrada desde un manejador de señal en mitad de un volcado:
+            # el volcado en curso ya escribirá su lote en orden
+            if self._volcando:
+                return 0
+
+            with self._cond:
+                if not self._cola:
+                    return 0
+                lote = list(self._cola)
+                self._cola.clear()
+
+            self._volcando = True
+            try:
+                self._escribir([registro for _, _, registro in lote])
+            except Exception:
+                # Devolver el lote a la cabeza de la cola para reintentar
+                with self._cond:
+                    self._cola.extendleft(reversed(lote))
+                raise
+            finally:
+                self._volcando = False
+
+            self.volcados += 1
+            self.max_retraso = max(self.max_retraso, time.monotonic() - lote[0][1])
+            self.ultimo_volcado = datetime.now()
+            return len(lote)
+
+    # -------------------------- Política -------------------------------------
+    def _toca_volcar(self, ahora: float) -> bool:
+        if not self._cola:
+            return False
+        if ahora - self._cola[0][1] >= self.retraso_max:
+            return True
+        if self.politica in ('sincrona', 'commit'):
+            return True
+        if self.politica == 'commits':
+            return len(self._cola) >= self.commits
+        if self.politica == 'intervalo':
+            return ahora - self._cola[0][1] >= self.segundos
+        return ahora - self._ultimo_encolado >= self.segundos
+
+    def _espera(self, ahora: float) -> float:
+        """Segundos hasta la próxima comprobación de la política."""
+        if not self._cola:
+            return self._intervalo_tarea
+        limite = self._cola[0][1] + self.retraso_max
+        if self.politica == 'intervalo':
+            limite = min(limite, self._cola[0][1] + self.segundos)
+        elif self.politica == 'inactividad':
+            limite = min(limite, self._ultimo_encolado + self.segundos)
+        return min(max(limite - ahora, 0.01), self._intervalo_tarea)
+
+    def _bucle(self) -> None:
+        proxima_tarea = time.monotonic() + self._intervalo_tarea
+        while True:
+            with self._cond:
+                ahora = time.monotonic()
+                if not self._parar and not self._toca_volcar(ahora):
+                    self._cond.wait(min(self._espera(ahora), max(proxima_tarea - ahora, 0.01)))
+                parar = self._parar
+                toca = parar or self._toca_volcar(time.monotonic())
+
+            try:
+                if toca:
+                    self.volcar()
+                if parar:
+                    return
+                if self._tarea_periodica and time.monotonic() >= proxima_tarea:
+                    proxima_tarea = time.monotonic() + self._intervalo_tarea
+                    self._tarea_periodica()
+            except Exception as e:
+                print(f"Error en el hilo de persistencia: {e}")
+                if parar:
+                    return
+                time.sleep(1.0)  # no reintentar en bucle cerrado
+
+    def detener(self, timeout: float = 10.0) -> None:
+        """Vuelca lo pendiente y detiene el hilo."""
+        with self._cond:
+            self._parar = True
+            self._cond.notify()
+        if self._hilo is not threading.current_thread():
+            self._hilo.join(timeout)
+        self.volcar()
+        _trabajadores.discard(self)
+
+    # -------------------------- Métricas -------------------------------------
+    def estado(self) -> Dict:
+        """Profundidad de la cola y retraso de volcado, para ajustar la política."""
+        with self._cond:
+            pendientes = len(self._cola)
+            retraso = time.monotonic() - self._cola[0][1] if self._cola else 0.0
+        return {
+            'politica': self.politica,
+            'pendientes': pendientes,
+            'retraso_s': round(retraso, 3),
+            'max_pendientes': self.max_pendientes,
+            'max_retraso_s': round(self.max_retraso, 3),
+            'volcados': self.volcados,
+            'ultimo_volcado': self.ultimo_volcado.isoformat() if self.ultimo_volcado else None
+        }
+
+
+# ============================================================================
+# SEÑALES
+# ============================================================================
+
+_trabajadores: "weakref.WeakSet[PersistenceWorker]" = weakref.WeakSet()
+_senales_instaladas = False
+
+
+def volcar_todos() -> None:
+    """Vuelca las colas de todos los hilos de persistencia activos."""
+    for trabajador in list(_trabajadores):
+        try:
+            trabajador.volcar()
+        except Exception as e:
+            print(f"Error volcando registros pendientes: {e}")
+
+
+def instalar_manejadores_senales() -> None:
+    """Vuelca las colas pendientes al recibir SIGTERM/SIGINT/SIGHUP/SIGBREAK.
+
+    Tras volcar se delega en el manejador anterior; si era el de por
+    defecto se sale con `sys.exit` para que se ejecuten los `atexit`
+    (cierre de la sesión y compactación). Solo puede instalarse desde el
+    hilo principal; en otro hilo no hace nada.
+    """
+    global _senales_instaladas
+    if _senales_instaladas or threading.current_thread() is not threading.main_thread():
+        return
+
+    for nombre in ('SIGTERM', 'SIGINT', 'SIGHUP', 'SIGBREAK'):
+        senal = getattr(signal, nombre, None)
+        if senal is None:
+            continue
+        anterior = signal.getsignal(senal)
+
+        def manejador(signum, frame, anterior=anterior):
+            volcar_todos()
+            if callable(anterior):
+                anterior(signum, frame)
+            elif anterior != signal.SIG_IGN:
+                sys.exit(128 + signum)
+
+        signal.signal(senal, manejador)
+
+    _senales_instaladas = True
+
+
+__all__ = [
+    'POLITICAS',
+    'PersistenceWorker',
+    'instalar_manejadores_senales',
+    'volcar_todos'
+]
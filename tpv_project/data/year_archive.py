@@ -0,0 +1,143 @@
+"""
+Archivos anuales cifrados con los recibos de los años cerrados.
+
+La base de datos activa (`tpv.db`) solo guarda el año en curso, el
+catálogo y la configuración; los recibos de los años cerrados se pasan a
+un archivo cifrado de solo lectura por año, así que confirmar un ticket
+no vuelve a cifrar el histórico.
+
+Estructura en disco (para `data/tpv.db`):
+
+    data/tpv.db.archivo/
+        anio_2023.db      # imagen SQLite cifrada: recibos, lineas_recibo,
+        anio_2024.db      # ventas_diarias (solo recibos de ese año)
+
+Un archivo solo se descifra cuando una consulta toca su año; se carga en
+una conexión SQLite en memoria de solo lectura que se conserva en una
+caché LRU de `capacidad` años.
+"""
+from __future__ import annotations
+
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from core.cipher import Cipher
+
+
+_NOMBRE = re.compile(r"anio_(\d{4})\.db$")
+
+
+class YearArchive:
+    """Archivos anuales cifrados y la caché LRU de los años cargados."""
+
+    def __init__(self, directorio: Path, cifrador: Cipher, capacidad: int = 2):
+        """
+        Args:
+            directorio: Carpeta de los archivos anuales (se crea al escribir)
+            cifrador: Cifrador de la base de datos
+            capacidad: Años que se mantienen descifrados en memoria
+        """
+        self.directorio = Path(directorio)
+        self._cifrador = cifrador
+        self.capacidad = capacidad
+
+        self._lock = threading.RLock()
+        self._cache: "OrderedDict[int, sqlite3.Connection]" = OrderedDict()
+
+        # Métricas
+        self.aciertos = 0
+        self.fallos = 0
+
+    # -------------------------- Archivos -------------------------------------
+    def ruta(self, anio: int) -> Path:
+        return self.directorio / f"anio_{anio:04d}.db"
+
+    def anios(self) -> List[int]:
+        """Años archivados, de más antiguo a más reciente."""
+        if not self.directorio.exists():
+            return []
+        return sorted(
+            int(coincidencia[1]) for coincidencia in
+            (_NOMBRE.match(ruta.name) for ruta in self.directorio.iterdir())
+            if coincidencia
+        )
+
+    def leer(self, anio: int) -> Optional[bytes]:
+        """Imagen SQLite en claro de un año archivado (None si no existe)."""
+        ruta = self.ruta(anio)
+        if not ruta.exists():
+            return None
+        return self._cifrador.descifrar_archivo(ruta)
+
+    def escribir(self, anio: int, imagen: bytes) -> None:
+        """Cifra y sustituye de forma atómica el archivo de un año."""
+        with self._lock:
+            self.directorio.mkdir(parents=True, exist_ok=True)
+            ruta = self.ruta(anio)
+            tmp_write = ruta.with_suffix(ruta.suffix + ".write")
+            self._cifrador.cifrar_a_archivo(imagen, tmp_write)
+            tmp_write.replace(ruta)
+            self._expulsar(anio)
+
+    def tamano(self) -> int:
+        """Bytes ocupados por todos los archivos anuales."""
+        return sum(self.ruta(anio).stat().st_size for anio in self.anios())
+
+    # -------------------------- Caché ----------------------------------------
+    @contextmanager
+    def conexion(self, anio: int):
+        """Conexión de solo lectura al archivo de un año (cargada si hace falta).
+
+        Raises:
+            KeyError: Si el año no está archivado
+        """
+        with self._lock:
+            conn = self._cache.get(anio)
+            if conn is not None:
+                self._cache.move_to_end(anio)
+                self.aciertos += 1
+            else:
+                imagen = self.leer(anio)
+                if imagen is None:
+                    raise KeyError(f"El año {anio} no está archivado")
+                self.fallos += 1
+                conn = sqlite3.connect(":memory:", check_same_thread=False)
+                conn.deserialize(imagen)
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA query_only = ON")
+                self._cache[anio] = conn
+                while len(self._cache) > self.capacidad:
+                    self._expulsar(next(iter(self._cache)))
+
+            yield conn
+
+    def _expulsar(self, anio: int) -> None:
+        conn = self._cache.pop(anio, None)
+        if conn is not None:
+            conn.close()
+
+    def vaciar(self) -> None:
+        """Cierra todas las conexiones en caché."""
+        with self._lock:
+            for anio in list(self._cache):
+                self._expulsar(anio)
+
+    def estado(self) -> Dict:
+        """Años archivados, años en memoria y aciertos de la caché."""
+        with self._lock:
+            return {
+                'anios': self.anios(),
+                'en_memoria': list(self._cache),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos
+            }
+
+
+__all__ = [
+    'YearArchive'
+]
@@ -2,6 +2,10 @@
 Punto de entrada principal de la aplicación TPV.
 
 Este script inicializa todos los componentes y lanza la aplicación.
+
+Uso:
+    python main.py                      # backend de DatabaseConfig.BACKEND
+    python main.py --backend=kv         # sqlite | kv | archivo
 """
 
 import sys
@@ -12,9 +16,11 @@ from pathlib import Path
 ROOT_DIR = Path(__file__).parent
 sys.path.insert(0, str(ROOT_DIR))
 
-from config.settings import validate_config
+from config.settings import DatabaseConfig, validate_config
 from core.image_manager import get_image_manager
-from data.data_manager_sqlite import get_data_manager_sqlite as get_data_manager
+from data.data_manager import get_data_manager as get_data_manager_archivo
+from data.data_manager_sqlite import get_data_manager_sqlite
+from data.data_manager_kv import get_data_manager_kv
 from models.receipt import ReceiptManager
 from controllers.receipt_controller import ReceiptController
 from controllers.printer_controller import get_printer_controller
@@ -22,6 +28,19 @@ from controllers.calendar_controller import CalendarController
 from views.main_view import MainWindow
 
 
+# Gestores de datos disponibles (ver `DatabaseConfig.BACKEND`)
+BACKENDS = {
+    'sqlite': get_data_manager_sqlite,
+    'kv': get_data_manager_kv,
+    'archivo': get_data_manager_archivo
+}
+
+
+def get_data_manager():
+    """Devuelve el gestor de datos del backend configurado."""
+    return BACKENDS[DatabaseConfig.BACKEND]()
+
+
 def inicializar_locale() -> None:
     """Inicializa la configuración regional."""
     try:
@@ -121,6 +140,15 @@ def main():
     print("=" * 60)
     print()
     
+    # Backend de datos indicado en la línea de comandos (--backend=kv)
+    for argumento in sys.argv[1:]:
+        if argumento.startswith('--backend='):
+            DatabaseConfig.BACKEND = argumento.split('=', 1)[1]
+    if DatabaseConfig.BACKEND not in BACKENDS:
+        print(f"✗ ERROR: Backend desconocido '{DatabaseConfig.BACKEND}' "
+              f"(opciones: {', '.join(BACKENDS)})")
+        return 1
+    
     # Validar configuración
     print("Validando configuración...")
     if not validate_config():
@@ -94,67 +94,36 @@ def main():
     print("-" * 70)
     
     try:
-        # Migrar productos
-        print("Migrando productos...", end=" ")
-        productos = data_manager_old.products.obtener_todos()
-        for producto in productos:
-            db.guardar_producto(
-                producto.nombre,
-                producto.precio,
-                producto.familia
-            )
-        print(f"✓ {len(productos)} productos migrados")
-        
-        # Migrar clientes
-        print("Migrando clientes...", end=" ")
-        clientes = data_manager_old.customers.obtener_todos()
-        for cliente in clientes:
-            db.guardar_cliente(cliente)
-        print(f"✓ {len(clientes)} clientes migrados")
-        
-        # Migrar camareros
-        print("Migrando camareros...", end=" ")
-        camareros = data_manager_old.waiters.obtener_todos()
-        for camarero in camareros:
-            db.guardar_camarero(camarero)
-        print(f"✓ {len(camareros)} camareros migrados")
-        
-        # Migrar recibos pendientes
-        print("Migrando recibos pendientes...", end=" ")
-        for recibo in data_manager_old.receipts_pending:
-            recibo_data = {
-                'fecha': recibo.fecha,
-                'cliente_nombre': recibo.nombre,
-                'camarero_nombre': recibo.camarero,
-                'estado': recibo.estado,
-                'subtotal': recibo.calcular_subtotal(),
-                'iva_porcentaje': data_manager_old.iva,
-                'total': recibo.calcular_total(),
-                'impreso': recibo.impreso
-            }
+        # Toda la migración en una sola transacción y un solo cifrado
+        with db.batch():
+            # Migrar productos
+            print("Migrando productos...", end=" ")
+            productos = data_manager_old.products.obtener_todos()
+            for producto in productos:
+                db.guardar_producto(
+                    producto.nombre,
+                    producto.precio,
+                    producto.familia
+                )
+            print(f"✓ {len(productos)} productos migrados")
             
-            lineas = []
-            for linea in recibo.pedido:
-                lineas.append({
-                    'producto_nombre': linea.nombre,
-                    'cantidad': linea.cantidad,
-                    'precio_unitario': linea.precio,
-                    'familia': linea.familia,
-                    'subtotal': linea.calcular_total()
-                })
+            # Migrar clientes
+            print("Migrando clientes...", end=" ")
+            clientes = data_manager_old.customers.obtener_todos()
+            for cliente in clientes:
+                db.guardar_cliente(cliente)
+            print(f"✓ {len(clientes)} clientes migrados")
             
-            db.guardar_recibo(recibo_data, lineas)
-        
-        print(f"✓ {len(data_manager_old.receipts_pending)} recibos pendientes migrados")
-        
-        # Migrar recibos anuales (pagados)
-        print("Migrando recibos pagados del año actual...", end=" ")
-        anio_actual = datetime.now().year
-        receipt_manager = data_manager_old.cargar_recibos_anuales(anio_actual)
-        
-        total_recibos_pagados = 0
-        for mes_recibos in receipt_manager._recibos_anuales:
-            for recibo in mes_recibos:
+            # Migrar camareros
+            print("Migrando camareros...", end=" ")
+            camareros = data_manager_old.waiters.obtener_todos()
+            for camarero in camareros:
+                db.guardar_camarero(camarero)
+            print(f"✓ {len(camareros)} camareros migrados")
+            
+            # Migrar recibos pendientes
+            print("Migrando recibos pendientes...", end=" ")
+            for recibo in data_manager_old.receipts_pending:
                 recibo_data = {
                     'fecha': recibo.fecha,
                     'cliente_nombre': recibo.nombre,
@@ -177,16 +146,48 @@ def main():
                     })
                 
                 db.guardar_recibo(recibo_data, lineas)
-                total_recibos_pagados += 1
+            
+            print(f"✓ {len(data_manager_old.receipts_pending)} recibos pendientes migrados")
+            
+            # Migrar configuración
+            print("Migrando configuración...", end=" ")
+            db.guardar_configuracion('iva', data_manager_old.iva)
+            db.guardar_configuracion('password', data_manager_old.password)
+            db.guardar_configuracion('impresoras', data_manager_old.printers)
+            print("✓ Configuración migrada")
         
-        print(f"✓ {total_recibos_pagados} recibos pagados migrados")
+        # Migrar recibos anuales (pagados): importación masiva, en su
+        # propia transacción y sin pasar recibo a recibo por el lote
+        print("Migrando recibos pagados del año actual...")
+        anio_actual = datetime.now().year
+        receipt_manager = data_manager_old.cargar_recibos_anuales(anio_actual)
+        
+        def recibos_pagados():
+            for mes_recibos in receipt_manager._recibos_anuales:
+                for recibo in mes_recibos:
+                    recibo_data = {
+                        'fecha': recibo.fecha,
+                        'cliente_nombre': recibo.nombre,
+                        'camarero_nombre': recibo.camarero,
+                        'estado': recibo.estado,
+                        'subtotal': recibo.calcular_subtotal(),
+                        'iva_porcentaje': data_manager_old.iva,
+                        'total': recibo.calcular_total(),
+                        'impreso': recibo.impreso
+                    }
+                    
+                    lineas = [{
+                        'producto_nombre': linea.nombre,
+                        'cantidad': linea.cantidad,
+                        'precio_unitario': linea.precio,
+                        'familia': linea.familia,
+                        'subtotal': linea.calcular_total()
+                    } for linea in recibo.pedido]
+                    
+                    yield recibo_data, lineas
         
-        # Migrar configuración
-        print("Migrando configuración...", end=" ")
-        db.guardar_configuracion('iva', data_manager_old.iva)
-        db.guardar_configuracion('password', data_manager_old.password)
-        db.guardar_configuracion('impresoras', data_manager_old.printers)
-        print("✓ Configuración migrada")
+        importados = db.guardar_recibos_bulk(recibos_pagados(), usuario='migracion')
+        print(f"✓ {importados['recibos']} recibos pagados migrados")
         
         print()
         
@@ -0,0 +1,54 @@
+"""
+Script para reconstruir las ventas diarias agregadas desde los recibos.
+
+La tabla `ventas_diarias` se mantiene al día en cada escritura de un
+recibo (guardar, cambiar de estado, eliminar). Este script la recalcula
+por completo a partir de la tabla `recibos`, por ejemplo tras importar
+datos o corregir recibos a mano.
+
+Uso:
+    python reconstruir_ventas_diarias.py
+"""
+
+import sys
+from pathlib import Path
+
+# Agregar directorio raíz al path
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from data.database_encrypted import DatabaseManagerEncrypted
+
+
+def main():
+    """Función principal de reconstrucción."""
+    print()
+    print("=" * 70)
+    print("  RECONSTRUCCIÓN DE VENTAS DIARIAS")
+    print("=" * 70)
+    print()
+
+    db_path = Path('data/tpv.db')
+    if not db_path.exists():
+        print(f"✗ No existe la base de datos {db_path}")
+        return 1
+
+    try:
+        db = DatabaseManagerEncrypted(str(db_path))
+
+        filas = db.reconstruir_ventas_diarias()
+        db.cerrar()
+
+        print(f"✓ Ventas diarias reconstruidas: {filas} filas")
+        print()
+        return 0
+
+    except Exception as e:
+        print(f"✗ Error durante la reconstrucción: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Servicio de base de datos para varios TPV en la misma máquina.
+
+Abre data/tpv.db como único escritor y atiende a los TPV por un socket
+local (ver data/db_service.py). Los TPV lo usan con
+`DatabaseConfig.SERVICIO = True` y lo arrancan solos si no está en marcha.
+
+Uso:
+    python servicio_db.py                           # hasta Ctrl+C / SIGTERM
+    python servicio_db.py --automatico [ruta_db]    # termina sin clientes
+"""
+
+import sys
+from pathlib import Path
+
+# Agregar directorio raíz al path
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from config.settings import DatabaseConfig
+from data.database_encrypted import DatabaseManagerEncrypted
+from data.db_service import DatabaseService, ErrorServicio
+
+
+def main():
+    """Función principal del servicio."""
+    argumentos = sys.argv[1:]
+    automatico = '--automatico' in argumentos
+    rutas = [a for a in argumentos if not a.startswith('--')]
+    db_path = rutas[0] if rutas else 'data/tpv.db'
+
+    print()
+    print("=" * 70)
+    print("  SERVICIO DE BASE DE DATOS DEL TPV")
+    print("=" * 70)
+    print()
+
+    db = DatabaseManagerEncrypted(db_path, modo_sesion=True)
+    servicio = DatabaseService(
+        db,
+        cierre_sin_clientes=DatabaseConfig.SERVICIO_CIERRE if automatico else 0
+    )
+
+    try:
+        servicio.servir()
+    except ErrorServicio as e:
+        print(f"✗ {e}")
+        return 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servicio.detener()
+        db.cerrar()
+        estado = servicio.estado()
+        print(f"✓ Servicio detenido: {estado['conexiones']} conexiones, "
+              f"{estado['llamadas']} llamadas")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -350,34 +350,25 @@ def test_7_auditoria():
         print("  ✓ Precio modificado: 6.5€")
         
         # Verificar auditoría
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT * FROM auditoria 
-                WHERE tabla = 'productos' 
-                ORDER BY fecha DESC 
-                LIMIT 5
-            """)
+        registros = db.obtener_auditoria(tabla='productos', limit=5)
+        
+        if len(registros) >= 2:
+            print_success(f"Se encontraron {len(registros)} registros de auditoría")
             
-            registros = cursor.fetchall()
+            for registro in registros[:2]:
+                print(f"\n  Registro de auditoría:")
+                print(f"    Acción: {registro['accion']}")
+                print(f"    Fecha: {registro['fecha']}")
+                print(f"    Usuario: {registro['usuario']}")
+                if registro['datos_anteriores']:
+                    print(f"    Datos anteriores: {registro['datos_anteriores']}")
+                if registro['datos_nuevos']:
+                    print(f"    Datos nuevos: {registro['datos_nuevos']}")
             
-            if len(registros) >= 2:
-                print_success(f"Se encontraron {len(registros)} registros de auditoría")
-                
-                for registro in registros[:2]:
-                    print(f"\n  Registro de auditoría:")
-                    print(f"    Acción: {registro['accion']}")
-                    print(f"    Fecha: {registro['fecha']}")
-                    print(f"    Usuario: {registro['usuario']}")
-                    if registro['datos_anteriores']:
-                        print(f"    Datos anteriores: {registro['datos_anteriores']}")
-                    if registro['datos_nuevos']:
-                        print(f"    Datos nuevos: {registro['datos_nuevos']}")
-                
-                return True
-            else:
-                print_warning("Se encontraron menos registros de auditoría de los esperados")
-                return True  # No es crítico
+            return True
+        else:
+            print_warning("Se encontraron menos registros de auditoría de los esperados")
+            return True  # No es crítico
         
     except Exception as e:
         print_error(f"Error en test de auditoría: {e}")
@@ -398,8 +389,10 @@ def test_8_rendimiento():
         print("Test de escritura: Guardando 100 productos...")
         start_time = time.time()
         
-        for i in range(100):
-            db.guardar_producto(f"Test Producto {i}", 1.5 + i * 0.1, "Bebida")
+        # Una sola transacción y un solo cifrado para los 100 productos
+        with db.batch():
+            for i in range(100):
+                db.guardar_producto(f"Test Producto {i}", 1.5 + i * 0.1, "Bebida")
         
         write_time = time.time() - start_time
         print(f"  Tiempo: {write_time:.3f} segundos")
@@ -532,6 +525,2208 @@ def test_10_limpieza():
         return False
 
 
+def test_11_modo_sesion():
+    """Test 11: Sesión en memoria con persistencia en checkpoints."""
+    print_header("TEST 11: Modo Sesión (SQLite en memoria)")
+    
+    try:
+        import tempfile
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "sesion.db"
+            db = DatabaseManagerEncrypted(str(db_path), modo_sesion=True, diario=False)
+            
+            print("Guardando producto en la sesión...")
+            db.guardar_producto("Test Sesión", 2.5, "Bebida")
+            cifrado_antes = db_path.read_bytes()
+            
+            if db.obtener_productos()[0]['nombre'] != "Test Sesión":
+                print_error("El producto no es visible en la sesión")
+                return False
+            
+            print("Realizando checkpoint...")
+            if not db.checkpoint() or db_path.read_bytes() == cifrado_antes:
+                print_error("El checkpoint no reescribió el archivo cifrado")
+                return False
+            print_success("Checkpoint escrito en disco")
+            
+            db.cerrar()
+            
+            # Reabrir en modo por operación y comprobar los datos
+            db2 = DatabaseManagerEncrypted(str(db_path), modo_sesion=False)
+            productos = [p['nombre'] for p in db2.obtener_productos()]
+            if "Test Sesión" in productos:
+                print_success("Datos recuperados tras cerrar la sesión")
+                return True
+            
+            print_error("Los datos de la sesión no se persistieron")
+            return False
+        
+    except Exception as e:
+        print_error(f"Error en test de modo sesión: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_12_lectura_sin_reescritura():
+    """Test 12: Las lecturas no vuelven a cifrar ni reescribir el archivo."""
+    print_header("TEST 12: Lecturas sin Reescritura del Archivo Cifrado")
+    
+    try:
+        import tempfile
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "lectura.db"
+            db = DatabaseManagerEncrypted(str(db_path), modo_sesion=False)
+            db.guardar_producto("Test Lectura", 1.0, "Bebida")
+            cifrado = db_path.read_bytes()
+            
+            print("Ejecutando lecturas...")
+            db.obtener_productos()
+            db.obtener_clientes()
+            db.obtener_camareros()
+            db.obtener_configuracion('iva')
+            db.obtener_recibos()
+            db.obtener_estadisticas()
+            
+            # El cifrado usa un nonce aleatorio: si se hubiera reescrito, cambiaría
+            if db_path.read_bytes() != cifrado:
+                print_error("Una lectura reescribió el archivo cifrado")
+                return False
+            print_success("Ninguna lectura reescribió el archivo")
+            
+            try:
+                with db.read_connection() as conn:
+                    conn.execute("DELETE FROM productos")
+                print_error("read_connection() permitió una escritura")
+                return False
+            except sqlite3.OperationalError:
+                print_success("read_connection() rechaza escrituras")
+            
+            db.guardar_producto("Test Lectura", 2.0, "Bebida")
+            if db_path.read_bytes() == cifrado:
+                print_error("Una escritura no actualizó el archivo cifrado")
+                return False
+            print_success("Las escrituras siguen persistiéndose")
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de lectura: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_13_formato_fragmentado():
+    """Test 13: Contenedor fragmentado y conversión desde token único."""
+    print_header("TEST 13: Formato Fragmentado")
+    
+    try:
+        import tempfile
+        from data.database_encrypted import DatabaseManagerEncrypted
+        from data.chunked_container import ChunkedContainer
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "fragmentada.db"
+            db = DatabaseManagerEncrypted(str(db_path), modo_sesion=False)
+            
+            print("Convirtiendo a token único y de vuelta a fragmentado...")
+            db.convertir_formato(fragmentada=False)
+            if ChunkedContainer.es_contenedor(db_path):
+                print_error("La conversión a token único no se aplicó")
+                return False
+            db.guardar_producto("Test Fragmento", 1.0, "Bebida")
+            
+            db.convertir_formato(fragmentada=True)
+            if not ChunkedContainer.es_contenedor(db_path):
+                print_error("La conversión a fragmentado no se aplicó")
+                return False
+            print_success("Conversión en ambos sentidos correcta")
+            
+            db.guardar_producto("Test Fragmento 2", 2.0, "Bebida")
+            total = len(list(db._contenedor.dir_fragmentos.glob("*.chk")))
+            escritos = db._contenedor.ultimos_fragmentos_escritos
+            print(f"  Fragmentos reescritos: {escritos} de {total}")
+            
+            nombres = {p['nombre'] for p in db.obtener_productos()}
+            if not {"Test Fragmento", "Test Fragmento 2"} <= nombres:
+                print_error("Se perdieron datos tras la conversión")
+                return False
+            print_success("Datos íntegros en formato fragmentado")
+            
+            # Alterar un fragmento debe detectarse al leer
+            fragmento = next(db._contenedor.dir_fragmentos.glob("*.chk"))
+            fragmento.write_bytes(fragmento.read_bytes()[:-1] + b"A")
+            if db.verificar_integridad():
+                print_error("No se detectó un fragmento alterado")
+                return False
+            print_success("Fragmento alterado detectado")
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de formato fragmentado: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_14_cifrado_binario():
+    """Test 14: Formato binario AEAD y compatibilidad con Fernet."""
+    print_header("TEST 14: Cifrado Binario por Segmentos")
+    
+    try:
+        import os
+        from core.cipher import Cipher, ErrorDescifrado, obtener_cifrador
+        
+        cifrador = obtener_cifrador()
+        cifrador = Cipher(cifrador.contexto, 'aesgcm', tamano_segmento=1024)
+        datos = os.urandom(10 * 1024 + 7)
+        
+        print("Cifrando 10 KB en segmentos de 1 KB...")
+        cifrado = cifrador.cifrar(datos)
+        if not Cipher.es_binario(cifrado) or cifrador.descifrar(cifrado) != datos:
+            print_error("El formato binario no recupera los datos")
+            return False
+        print_success(f"Ida y vuelta correcta ({len(cifrado) - len(datos)} bytes de sobrecarga)")
+        
+        # Los tokens Fernet antiguos siguen siendo legibles
+        token = cifrador.contexto.fernet.encrypt(datos)
+        if cifrador.descifrar(token) != datos:
+            print_error("No se pudo leer un token Fernet antiguo")
+            return False
+        print_success("Tokens Fernet antiguos legibles")
+        
+        alteraciones = {
+            'segmento alterado': cifrado[:500] + bytes([cifrado[500] ^ 1]) + cifrado[501:],
+            'último segmento eliminado': cifrado[:-(7 + 16)],
+            'segmento truncado': cifrado[:-1],
+        }
+        for descripcion, alterado in alteraciones.items():
+            try:
+                cifrador.descifrar(alterado)
+                print_error(f"No se detectó: {descripcion}")
+                return False
+            except ErrorDescifrado:
+                print_success(f"Detectado: {descripcion}")
+        return True
+        
+    except Exception as e:
+        print_error(f"Error en test de cifrado binario: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_15_diario_commits():
+    """Test 15: Diario de commits y recuperación tras un cierre inesperado."""
+    print_header("TEST 15: Diario de Commits")
+    
+    try:
+        import tempfile
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "diario.db"
+            db = DatabaseManagerEncrypted(str(db_path), modo_sesion=True, diario=True)
+            imagen = db_path.read_bytes()
+            
+            print("Confirmando un ticket...")
+            recibo_id = db.guardar_recibo({
+                'fecha': '01/01/2025 - 12:00:00',
+                'cliente_nombre': 'Test Diario',
+                'camarero_nombre': 'Test',
+                'estado': 'efectivo',
+                'subtotal': 3.0,
+                'iva_porcentaje': 21.0,
+                'total': 3.0,
+                'impreso': False
+            }, [{
+                'producto_nombre': 'Caña',
+                'cantidad': 2,
+                'precio_unitario': 1.5,
+                'familia': 'Bebida',
+                'subtotal': 3.0
+            }])
+            db.volcar()  # no esperar al hilo de persistencia
+            
+            if db_path.read_bytes() != imagen or db._diario.esta_vacio():
+                print_error("El commit reescribió la imagen en lugar de usar el diario")
+                return False
+            print_success(f"Commit añadido al diario ({db._diario.tamano()} bytes)")
+            
+            db.guardar_producto("Test Diario", 1.0, "Bebida")
+            db.eliminar_producto("Test Diario")
+            db.volcar()
+            
+            # Simular cierre inesperado: otra instancia abre sin compactar
+            # (se añade un registro incompleto, como una escritura interrumpida)
+            with open(db._diario.ruta, 'ab') as archivo:
+                archivo.write(b"\x00\x00\x10\x00incompleto")
+            db2 = DatabaseManagerEncrypted(str(db_path), modo_sesion=False)
+            
+            recibos = db2.obtener_recibos()
+            productos = db2.obtener_productos(activos=False)
+            if not any(r['id'] == recibo_id for r in recibos):
+                print_error("El ticket del diario no se recuperó")
+                return False
+            if [p['activo'] for p in productos if p['nombre'] == "Test Diario"] != [0]:
+                print_error("El estado final del producto no se recuperó")
+                return False
+            if db._diario.ruta.exists():
+                print_error("El diario no se vació tras la recuperación")
+                return False
+            print_success("Diario reaplicado y volcado en la imagen")
+            db.cerrar()
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de diario de commits: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_16_lotes():
+    """Test 16: batch() agrupa operaciones en una sola escritura cifrada."""
+    print_header("TEST 16: Operaciones por Lotes")
+    
+    try:
+        import tempfile
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManagerEncrypted(str(Path(tmp) / "lotes.db"), modo_sesion=False)
+            
+            escrituras = []
+            escribir_imagen = db._escribir_imagen
+            db._escribir_imagen = lambda *a, **k: (escrituras.append(1), escribir_imagen(*a, **k))
+            
+            print("Guardando 100 productos en un lote...")
+            with db.batch():
+                for i in range(100):
+                    db.guardar_producto(f"Lote {i}", 1.0, "Bebida")
+                with db.batch():  # anidado: se integra en el exterior
+                    db.guardar_cliente("Cliente Lote")
+                if len(db.obtener_productos()) != 100:
+                    print_error("Las lecturas del lote no ven sus propios cambios")
+                    return False
+            
+            if len(escrituras) != 1:
+                print_error(f"Se reescribió el archivo {len(escrituras)} veces")
+                return False
+            print_success("101 operaciones, 1 reescritura del archivo cifrado")
+            
+            try:
+                with db.batch():
+                    db.guardar_producto("Lote Descartado", 1.0, "Bebida")
+                    raise RuntimeError("fallo simulado")
+            except RuntimeError:
+                pass
+            
+            nombres = {p['nombre'] for p in db.obtener_productos()}
+            if "Lote Descartado" in nombres or len(nombres) != 100:
+                print_error("Un lote fallido dejó cambios")
+                return False
+            
+            sesion = DatabaseManagerEncrypted(str(Path(tmp) / "sesion.db"), modo_sesion=True)
+            try:
+                with sesion.batch():
+                    sesion.guardar_producto("Lote Descartado", 1.0, "Bebida")
+                    sesion.guardar_cliente("Cliente Descartado")
+                    raise RuntimeError("fallo simulado")
+            except RuntimeError:
+                pass
+            descartados = len(sesion.obtener_productos()) + len(sesion.obtener_clientes())
+            sesion.cerrar()
+            if descartados:
+                print_error("Un lote fallido dejó cambios en modo sesión")
+                return False
+            print_success("Un lote fallido se deshace completo")
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de lotes: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_17_hilo_persistencia():
+    """Test 17: Políticas del hilo de persistencia y métricas de cola."""
+    print_header("TEST 17: Hilo de Persistencia")
+    
+    try:
+        import time
+        from data.persistence_worker import PersistenceWorker
+        
+        escritos = []
+        trabajador = PersistenceWorker(escritos.extend, 'commits', commits=3,
+                                       retraso_max=60.0)
+        
+        print("Política 'commits' con N=3...")
+        trabajador.encolar(1)
+        trabajador.encolar(2)
+        time.sleep(0.2)
+        estado = trabajador.estado()
+        if escritos or estado['pendientes'] != 2:
+            print_error(f"Se volcó antes de tiempo: {estado}")
+            return False
+        print_success(f"2 commits en cola, retraso {estado['retraso_s']} s")
+        
+        trabajador.encolar(3)
+        limite = time.monotonic() + 2
+        while len(escritos) < 3 and time.monotonic() < limite:
+            time.sleep(0.01)
+        if escritos != [1, 2, 3]:
+            print_error(f"Volcado incorrecto: {escritos}")
+            return False
+        print_success("Volcado en orden al llegar al tercer commit")
+        
+        trabajador.encolar(4)
+        trabajador.detener()
+        if escritos != [1, 2, 3, 4] or trabajador.estado()['pendientes'] != 0:
+            print_error("detener() no volcó lo pendiente")
+            return False
+        print_success("detener() vuelca la cola completa")
+        return True
+        
+    except Exception as e:
+        print_error(f"Error en test del hilo de persistencia: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_18_fechas_indices():
+    """Test 18: Migración de fecha_ts, rangos de fechas y planes de consulta."""
+    print_header("TEST 18: Fechas Ordenables e Índices")
+    
+    try:
+        import tempfile
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        lineas = [{
+            'producto_nombre': 'Caña',
+            'cantidad': 1,
+            'precio_unitario': 1.5,
+            'familia': 'Bebida',
+            'subtotal': 1.5
+        }]
+        fechas = ['28/02/2025 - 23:59:59', '01/03/2025 - 00:00:00',
+                  '15/03/2025 - 12:00:00', '31/03/2025 - 22:00:00',
+                  '01/04/2025 - 09:00:00', '10/03/2024 - 12:00:00']
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "fechas.db"
+            db = DatabaseManagerEncrypted(str(db_path), modo_sesion=True, diario=False)
+            for i, fecha in enumerate(fechas):
+                db.guardar_recibo({
+                    'fecha': fecha,
+                    'cliente_nombre': 'Test Fechas',
+                    'camarero_nombre': 'Test',
+                    'estado': 'pendiente' if i % 2 else 'efectivo',
+                    'subtotal': 1.5,
+                    'iva_porcentaje': 21.0,
+                    'total': 1.5,
+                    'impreso': False
+                }, lineas)
+            
+            # Dejar la base de datos como antes de la migración
+            with db.get_connection() as conn:
+                for indice in ('idx_recibos_ts', 'idx_recibos_estado_ts',
+                               'idx_recibos_cliente_ts', 'idx_recibos_camarero_ts'):
+                    conn.execute(f"DROP INDEX {indice}")
+                conn.execute("ALTER TABLE recibos DROP COLUMN fecha_ts")
+                conn.execute("CREATE INDEX idx_recibos_fecha ON recibos(fecha)")
+                conn.execute("PRAGMA user_version = 0")
+            db.cerrar()
+            
+            print("Reabriendo una base de datos sin fecha_ts...")
+            db = DatabaseManagerEncrypted(str(db_path), modo_sesion=True, diario=False)
+            with db.read_connection() as conn:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                sin_ts = conn.execute(
+                    "SELECT COUNT(*) FROM recibos WHERE fecha_ts IS NULL"
+                ).fetchone()[0]
+            if version != db.VERSION_ESQUEMA or sin_ts:
+                print_error(f"Migración incompleta (versión {version}, {sin_ts} sin fecha_ts)")
+                return False
+            print_success("Migración aplicada y fecha_ts rellenada")
+            
+            # Como texto, '28/02/2025' >= '01/03/2025' y el rango fallaría
+            marzo = db.obtener_recibos(fecha_inicio='01/03/2025', fecha_fin='31/03/2025')
+            esperadas = ['31/03/2025 - 22:00:00', '15/03/2025 - 12:00:00', '01/03/2025 - 00:00:00']
+            if [r['fecha'] for r in marzo] != esperadas:
+                print_error(f"Rango de marzo incorrecto: {[r['fecha'] for r in marzo]}")
+                return False
+            pagados = db.obtener_recibos(estados=['efectivo', 'tarjeta'],
+                                         fecha_inicio='01/01/2025', fecha_fin='31/12/2025')
+            if len(pagados) != 3 or any(r['estado'] != 'efectivo' for r in pagados):
+                print_error(f"Filtro de estados incorrecto: {len(pagados)} recibos")
+                return False
+            print_success("Rangos de fechas y estados correctos")
+            
+            for nombre, plan in db.planes_consultas().items():
+                print(f"  {nombre}: {plan}")
+            if not db.verificar_planes_consultas():
+                print_error("Alguna consulta recorre la tabla de recibos completa")
+                return False
+            print_success("Todas las consultas usan índices")
+            db.cerrar()
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de fechas e índices: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_19_iter_recibos():
+    """Test 19: iter_recibos con paginación por clave y líneas en la misma consulta."""
+    print_header("TEST 19: Recorrido Paginado de Recibos")
+    
+    try:
+        import tempfile
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManagerEncrypted(str(Path(tmp) / "iter.db"), modo_sesion=True, diario=False)
+            
+            # Varios recibos en el mismo segundo: el id desempata entre páginas
+            fechas = ['01/05/2025 - 10:00:00'] * 3 + ['02/05/2025 - 10:00:00'] * 2
+            with db.batch():
+                for i, fecha in enumerate(fechas):
+                    db.guardar_recibo({
+                        'fecha': fecha,
+                        'cliente_nombre': f'Cliente {i}',
+                        'camarero_nombre': 'Test',
+                        'estado': 'efectivo',
+                        'subtotal': 1.0,
+                        'iva_porcentaje': 21.0,
+                        'total': 1.0,
+                        'impreso': False
+                    }, [{
+                        'producto_nombre': f'Producto {i}.{n}',
+                        'cantidad': 1,
+                        'precio_unitario': 1.0,
+                        'familia': 'Bebida',
+                        'subtotal': 1.0
+                    } for n in range(i)])
+            
+            print("Recorriendo en páginas de 2 recibos...")
+            consultas = []
+            with db.read_connection() as conn:
+                conn.set_trace_callback(consultas.append)
+            recibos = list(db.iter_recibos(tamano_pagina=2, descendente=False))
+            with db.read_connection() as conn:
+                conn.set_trace_callback(None)
+            
+            if [r['cliente_nombre'] for r in recibos] != [f'Cliente {i}' for i in range(5)]:
+                print_error(f"Orden o recibos incorrectos: {[r['cliente_nombre'] for r in recibos]}")
+                return False
+            if [len(r['lineas']) for r in recibos] != list(range(5)):
+                print_error("Líneas agrupadas incorrectamente")
+                return False
+            if any(l['recibo_id'] != r['id'] for r in recibos for l in r['lineas']):
+                print_error("Línea asignada al recibo equivocado")
+                return False
+            consultas = [c for c in consultas if 'lineas_recibo' in c]
+            if len(consultas) != 3:
+                print_error(f"Se esperaban 3 consultas (una por página), hubo {len(consultas)}")
+                return False
+            print_success(f"{len(recibos)} recibos con sus líneas en {len(consultas)} consultas")
+            
+            pagina = db.obtener_recibos(limit=2, offset=1)
+            if [r['cliente_nombre'] for r in pagina] != ['Cliente 3', 'Cliente 2']:
+                print_error(f"limit/offset incorrectos: {[r['cliente_nombre'] for r in pagina]}")
+                return False
+            print_success("obtener_recibos conserva limit/offset")
+            db.cerrar()
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de recorrido de recibos: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_20_ventas_diarias():
+    """Test 20: ventas_diarias se mantiene en cada escritura y alimenta los reportes."""
+    print_header("TEST 20: Ventas Diarias Agregadas")
+    
+    try:
+        import tempfile
+        import datetime as dt
+        from types import SimpleNamespace
+        from data.database_encrypted import DatabaseManagerEncrypted
+        from models.receipt import ReceiptManager
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManagerEncrypted(str(Path(tmp) / "ventas.db"), modo_sesion=True, diario=False)
+            
+            def ticket(fecha, estado, camarero, total):
+                return db.guardar_recibo({
+                    'fecha': fecha,
+                    'cliente_nombre': None,
+                    'camarero_nombre': camarero,
+                    'estado': estado,
+                    'subtotal': total,
+                    'iva_porcentaje': 21.0,
+                    'total': total,
+                    'impreso': False
+                }, [{
+                    'producto_nombre': 'Caña',
+                    'cantidad': 1,
+                    'precio_unitario': total,
+                    'familia': 'Bebida',
+                    'subtotal': total
+                }])
+            
+            print("Guardando, cobrando y eliminando tickets...")
+            ticket('03/06/2025 - 12:00:00', 'efectivo', 'Ana', 10.1)
+            ticket('03/06/2025 - 23:59:59', 'tarjeta', 'Luis', 5.2)
+            ticket('04/06/2025 - 00:00:00', 'efectivo', None, 2.3)
+            pendiente = ticket('04/06/2025 - 10:00:00', 'pendiente', 'Ana', 7.0)
+            borrado = ticket('05/06/2025 - 10:00:00', 'efectivo', 'Ana', 99.0)
+            db.actualizar_estado_recibo(pendiente, 'tarjeta')
+            db.eliminar_recibo(borrado)
+            
+            with db.read_connection() as conn:
+                incremental = conn.execute(
+                    "SELECT dia, estado, camarero_nombre, tickets, total, lineas "
+                    "FROM ventas_diarias ORDER BY dia, estado, camarero_nombre"
+                ).fetchall()
+            db.reconstruir_ventas_diarias()
+            with db.read_connection() as conn:
+                reconstruido = conn.execute(
+                    "SELECT dia, estado, camarero_nombre, tickets, total, lineas "
+                    "FROM ventas_diarias ORDER BY dia, estado, camarero_nombre"
+                ).fetchall()
+            if [tuple(f) for f in incremental] != [tuple(f) for f in reconstruido]:
+                print_error("Los agregados incrementales no coinciden con la reconstrucción")
+                return False
+            print_success(f"Agregados incrementales = reconstrucción ({len(incremental)} filas)")
+            
+            ventas = db.obtener_ventas_diarias('01/06/2025', '30/06/2025', ['efectivo', 'tarjeta'])
+            if [(v['fecha'].day, v['total'], v['tickets']) for v in ventas] != [(3, 15.3, 2), (4, 9.3, 2)]:
+                print_error(f"Ventas por día incorrectas: {ventas}")
+                return False
+            print_success("Ventas del mes: una fila por día con ventas")
+            
+            try:
+                from controllers.calendar_controller import CalendarController
+            except ImportError as e:
+                # controllers importa el controlador de impresoras (win32print)
+                print_warning(f"Reportes del calendario no comprobados: {e}")
+                db.cerrar()
+                return True
+            
+            calendario = CalendarController(ReceiptManager())
+            calendario.data_manager = SimpleNamespace(obtener_ventas_diarias=db.obtener_ventas_diarias)
+            junio = dt.date(2025, 6, 1)
+            if (calendario.calcular_total_mes(junio) != 24.6
+                    or calendario.calcular_total_dia(dt.date(2025, 6, 4), 'tarjeta') != 7.0):
+                print_error("Totales del calendario incorrectos")
+                return False
+            reporte = calendario.generar_reporte_dia_a_dia(junio, 21.0)
+            if '03/06/2025:' not in reporte or 'Total: 24.60€' not in reporte:
+                print_error("Reporte día a día incorrecto")
+                return False
+            print_success("Reportes del calendario calculados desde los agregados")
+            db.cerrar()
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de ventas diarias: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_21_auditoria_segmentada():
+    """Test 21: auditoría en segmentos mensuales cifrados, fuera de la imagen."""
+    print_header("TEST 21: Almacén de Auditoría Segmentado")
+    
+    try:
+        import tempfile
+        import datetime as dt
+        from data.audit_store import AuditStore, MAGIC
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManagerEncrypted(str(Path(tmp) / "audit.db"), modo_sesion=True, diario=False)
+            
+            print("Confirmando y deshaciendo transacciones auditadas...")
+            with db.batch():
+                for i in range(5):
+                    db.guardar_producto(f"Auditado {i}", 1.0 + i, "Bebida", usuario="test_user")
+            try:
+                with db.batch():
+                    db.guardar_producto("Deshecho", 9.0, "Bebida", usuario="test_user")
+                    raise RuntimeError("fallo provocado")
+            except RuntimeError:
+                pass
+            
+            segmentos = db._auditoria.segmentos()
+            if len(segmentos) != 1 or db._auditoria._contar_bloques(segmentos[0][1]) != 1:
+                print_error("El lote debería escribirse como un único bloque")
+                return False
+            if b"Auditado" in segmentos[0][1].read_bytes():
+                print_error("El segmento no está cifrado")
+                return False
+            print_success("Un bloque cifrado por transacción confirmada")
+            
+            registros = db.obtener_auditoria(tabla='productos')
+            if len(registros) != 5 or any(r['datos_nuevos']['nombre'] == "Deshecho" for r in registros):
+                print_error(f"Auditoría incorrecta: {len(registros)} registros")
+                return False
+            with db.read_connection() as conn:
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'auditoria'").fetchone():
+                    print_error("La tabla auditoria sigue en la base de datos")
+                    return False
+            print_success("La transacción deshecha no deja auditoría ni tabla en la imagen")
+            db.cerrar()
+            
+            print("\nRotando segmentos de meses anteriores...")
+            almacen = AuditStore(Path(tmp) / "meses", db._encrypt_bytes, db._decrypt_bytes)
+            
+            def registro(fecha, accion):
+                return {'fecha': fecha, 'tabla': 'recibos', 'accion': accion,
+                        'registro_id': 1, 'datos_anteriores': None,
+                        'datos_nuevos': None, 'usuario': None}
+            
+            almacen.anadir([registro('2025-05-30T10:00:00', 'INSERT')])
+            almacen.anadir([registro('2025-05-31T10:00:00', 'UPDATE')])
+            almacen.anadir([registro('2025-06-01T10:00:00', 'DELETE')])
+            mayo, junio = [ruta for _, ruta in almacen.segmentos()]
+            if almacen._contar_bloques(mayo) != 1 or almacen._contar_bloques(junio) != 1:
+                print_error("El segmento de mayo no se selló al empezar junio")
+                return False
+            
+            # Un bloque a medio escribir al final se ignora
+            with open(junio, 'ab') as archivo:
+                archivo.write((1000).to_bytes(4, 'big') + b"incompleto")
+            encontrados = almacen.buscar(desde=dt.datetime(2025, 5, 31), hasta=dt.datetime(2025, 6, 30))
+            if [r['accion'] for r in encontrados] != ['DELETE', 'UPDATE'] or not mayo.read_bytes().startswith(MAGIC):
+                print_error(f"Búsqueda entre segmentos incorrecta: {encontrados}")
+                return False
+            print_success("Mes anterior sellado y búsqueda entre segmentos correcta")
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de auditoría segmentada: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_22_backups_deduplicados():
+    """Test 22: repositorio de backups con fragmentos deduplicados."""
+    print_header("TEST 22: Backups Deduplicados")
+    
+    try:
+        import tempfile
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManagerEncrypted(str(Path(tmp) / "tpv.db"), modo_sesion=True, diario=False)
+            
+            recibo = {
+                'fecha': '01/06/2025 - 12:00:00',
+                'cliente_nombre': None,
+                'camarero_nombre': 'Ana',
+                'estado': 'efectivo',
+                'subtotal': 3.0,
+                'iva_porcentaje': 21.0,
+                'total': 3.0,
+                'impreso': False
+            }
+            lineas = [{
+                'producto_nombre': 'Caña',
+                'cantidad': 2,
+                'precio_unitario': 1.5,
+                'familia': 'Bebida',
+                'subtotal': 3.0
+            }]
+            
+            print("Creando 2000 tickets y una primera copia...")
+            with db.batch():
+                for _ in range(2000):
+                    db.guardar_recibo(recibo, lineas)
+            primera = db.crear_backup()
+            tamano_imagen = db.listar_backups()[0]['tamano_bytes']
+            
+            print("Añadiendo los tickets de un día y una segunda copia...")
+            with db.batch():
+                for _ in range(20):
+                    db.guardar_recibo(dict(recibo, fecha='02/06/2025 - 12:00:00'), lineas)
+            segunda = db.crear_backup()
+            escrito = db._copias.ultimos_bytes_escritos
+            print(f"  Imagen: {tamano_imagen / 1024:.0f} KB, escrito en la segunda copia: {escrito / 1024:.1f} KB")
+            if escrito * 4 > tamano_imagen:
+                print_error("La segunda copia no se deduplicó")
+                return False
+            print_success("La segunda copia solo escribe los fragmentos nuevos")
+            
+            if db.verificar_backups():
+                print_error("Errores al verificar copias íntegras")
+                return False
+            
+            destino = db.restaurar_backup(primera.stem, str(Path(tmp) / "restaurada.db"))
+            restaurada = DatabaseManagerEncrypted(str(destino), modo_sesion=False)
+            recibos = restaurada.obtener_estadisticas()['recibos']['efectivo']['cantidad']
+            auditoria = len(restaurada.obtener_auditoria(tabla='recibos'))
+            if recibos != 2000 or auditoria != 2000:
+                print_error(f"Copia restaurada incorrecta: {recibos} recibos, {auditoria} auditorías")
+                return False
+            print_success("Restauración de la primera copia correcta (con auditoría)")
+            
+            # Un fragmento alterado se detecta al verificar
+            fragmento = next(db._copias.dir_fragmentos.glob("*/*.chk"))
+            datos = fragmento.read_bytes()
+            fragmento.write_bytes(datos[:-1] + bytes([datos[-1] ^ 1]))
+            if not db.verificar_backups():
+                print_error("No se detectó un fragmento alterado")
+                return False
+            fragmento.write_bytes(datos)
+            print_success("Fragmento alterado detectado")
+            
+            copias, _ = db.podar_backups(1)
+            if copias != 1 or [c['nombre'] for c in db.listar_backups()] != [segunda.stem] \
+                    or db.verificar_backups():
+                print_error("La poda eliminó datos de la copia conservada")
+                return False
+            print_success("Poda correcta: la copia conservada sigue siendo restaurable")
+            db.cerrar()
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de backups: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_23_backups_programados():
+    """Test 23: programador de backups por intervalo y por recibos."""
+    print_header("TEST 23: Backups Programados")
+    
+    try:
+        import time
+        import tempfile
+        from config.settings import DatabaseConfig
+        from data.backup_scheduler import BackupScheduler
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        def esperar(condicion, segundos=3.0):
+            limite = time.monotonic() + segundos
+            while not condicion() and time.monotonic() < limite:
+                time.sleep(0.01)
+            return condicion()
+        
+        print("Disparo por recibos con intervalo mínimo de 0.5 s...")
+        copias = []
+        programador = BackupScheduler(lambda: (copias.append(1) or 'copia', 1024),
+                                      intervalo=0, recibos=3, intervalo_minimo=0.5,
+                                      ultimo_backup=time.time())
+        programador.notificar_recibo(2)
+        time.sleep(0.1)
+        if copias:
+            print_error("Copia antes de llegar a los recibos configurados")
+            return False
+        programador.notificar_recibo()
+        inicio = time.monotonic()
+        if not esperar(lambda: copias) or time.monotonic() - inicio < 0.3:
+            print_error("La copia por recibos no respetó el intervalo mínimo")
+            return False
+        programador.notificar_recibo(10)
+        time.sleep(0.2)
+        if len(copias) != 1:
+            print_error("Más de una copia dentro del intervalo mínimo")
+            return False
+        if not esperar(lambda: len(copias) == 2):
+            print_error("No se hizo la copia pendiente al cumplirse el intervalo")
+            return False
+        estado = programador.estado()
+        programador.detener()
+        if estado['ultimo_tamano_bytes'] != 1024 or estado['ultimo_motivo'] != 'recibos':
+            print_error(f"Métricas incorrectas: {estado}")
+            return False
+        print_success("Una copia por intervalo mínimo, con duración y tamaño registrados")
+        
+        print("\nCopias de una sesión real sin bloquear los cobros...")
+        originales = (DatabaseConfig.BACKUP_INTERVALO, DatabaseConfig.BACKUP_RECIBOS,
+                      DatabaseConfig.BACKUP_INTERVALO_MINIMO)
+        DatabaseConfig.BACKUP_INTERVALO, DatabaseConfig.BACKUP_RECIBOS = 0, 5
+        DatabaseConfig.BACKUP_INTERVALO_MINIMO = 0
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                db = DatabaseManagerEncrypted(str(Path(tmp) / "tpv.db"), modo_sesion=True, diario=False)
+                db.iniciar_backups_programados()
+                for i in range(5):
+                    db.guardar_recibo({
+                        'fecha': '01/06/2025 - 12:00:00',
+                        'cliente_nombre': None,
+                        'camarero_nombre': 'Ana',
+                        'estado': 'efectivo',
+                        'subtotal': 1.0,
+                        'iva_porcentaje': 21.0,
+                        'total': 1.0,
+                        'impreso': False
+                    }, [])
+                if not esperar(lambda: db.listar_backups(), 5.0):
+                    print_error("El programador no creó la copia de la sesión")
+                    return False
+                estado = db.obtener_estadisticas()['backups_programados']
+                db.cerrar()
+                print(f"  Copia en {estado['ultima_duracion_s']} s, "
+                      f"{estado['ultimo_tamano_bytes'] / 1024:.1f} KB escritos")
+                print_success("Copia tomada en segundo plano tras 5 recibos")
+        finally:
+            (DatabaseConfig.BACKUP_INTERVALO, DatabaseConfig.BACKUP_RECIBOS,
+             DatabaseConfig.BACKUP_INTERVALO_MINIMO) = originales
+        return True
+        
+    except Exception as e:
+        print_error(f"Error en test de backups programados: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_24_archivo_anual():
+    """Test 24: años cerrados en archivos cifrados cargados bajo demanda."""
+    print_header("TEST 24: Archivo Anual")
+    
+    try:
+        import tempfile
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / "tpv.db")
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True, diario=False)
+            
+            def ticket(fecha, estado, total):
+                return db.guardar_recibo({
+                    'fecha': fecha,
+                    'cliente_nombre': None,
+                    'camarero_nombre': 'Ana',
+                    'estado': estado,
+                    'subtotal': total,
+                    'iva_porcentaje': 21.0,
+                    'total': total,
+                    'impreso': False
+                }, [{
+                    'producto_nombre': 'Caña',
+                    'cantidad': 1,
+                    'precio_unitario': total,
+                    'familia': 'Bebida',
+                    'subtotal': total
+                }])
+            
+            print("Tickets de 2023, 2024 y 2025 (cambio de año automático)...")
+            ticket('10/03/2023 - 12:00:00', 'efectivo', 1.0)
+            ticket('31/12/2023 - 23:59:59', 'tarjeta', 2.0)
+            ticket('01/01/2024 - 00:00:00', 'efectivo', 3.0)
+            fiado = ticket('15/06/2024 - 20:00:00', 'pendiente', 4.0)
+            ticket('02/01/2025 - 09:00:00', 'efectivo', 5.0)
+            
+            if db._archivo.anios() != [2023, 2024]:
+                print_error(f"Años archivados incorrectos: {db._archivo.anios()}")
+                return False
+            if b"SQLite format" in db._archivo.ruta(2023).read_bytes():
+                print_error("El archivo anual no está cifrado")
+                return False
+            with db.read_connection() as conn:
+                activos = conn.execute("SELECT COUNT(*) FROM recibos").fetchone()[0]
+            if activos != 2:
+                print_error(f"La base activa debería tener el fiado de 2024 y el ticket de 2025: {activos}")
+                return False
+            print_success("2023 y 2024 archivados; el ticket pendiente sigue en la base activa")
+            
+            db.actualizar_estado_recibo(fiado, 'tarjeta')
+            db.cerrar()
+            
+            print("\nReabriendo y consultando solo lo necesario...")
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True, diario=False)
+            db.obtener_ventas_diarias('01/01/2025', '31/01/2025')
+            if db._archivo.estado()['en_memoria']:
+                print_error("Una consulta de 2025 descifró años archivados")
+                return False
+            
+            todos = list(db.iter_recibos(tamano_pagina=2))
+            totales = [r['total'] for r in todos]
+            if totales != [5.0, 4.0, 3.0, 2.0, 1.0] or any(len(r['lineas']) != 1 for r in todos):
+                print_error(f"Recorrido entre años incorrecto: {totales}")
+                return False
+            ventas = db.obtener_ventas_diarias('01/01/2024', '31/12/2024', ['efectivo', 'tarjeta'])
+            if [(v['fecha'].month, v['total']) for v in ventas] != [(1, 3.0), (6, 4.0)]:
+                print_error(f"Ventas de 2024 incorrectas: {ventas}")
+                return False
+            print_success("Recibos y ventas combinados entre base activa y archivos")
+            
+            db._archivo.vaciar()
+            db._archivo.capacidad = 1
+            db.obtener_recibos(fecha_inicio='01/01/2023', fecha_fin='31/12/2023')
+            db.obtener_recibos(fecha_inicio='01/01/2024', fecha_fin='31/12/2024')
+            if db._archivo.estado()['en_memoria'] != [2024]:
+                print_error(f"Caché LRU incorrecta: {db._archivo.estado()}")
+                return False
+            print_success("Años cargados bajo demanda con expulsión LRU")
+            
+            db.guardar_recibo({
+                'fecha': '03/01/2026 - 10:00:00', 'cliente_nombre': None,
+                'camarero_nombre': 'Ana', 'estado': 'efectivo', 'subtotal': 6.0,
+                'iva_porcentaje': 21.0, 'total': 6.0, 'impreso': False
+            }, [])
+            anios = db.obtener_estadisticas()['anios_archivados']
+            if anios.get(2024, {}).get('recibos') != 2 or anios.get(2025, {}).get('recibos') != 1:
+                print_error(f"El fiado cobrado no se añadió al archivo de 2024: {anios}")
+                return False
+            print_success("El fiado cobrado se añade a su año en el siguiente cambio")
+            db.cerrar()
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de archivo anual: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_25_compresion():
+    """Test 25: compresión antes de cifrar, con flag en la cabecera."""
+    print_header("TEST 25: Compresión antes de Cifrar")
+    
+    try:
+        import os
+        import tempfile
+        from config.settings import EncryptionConfig
+        from core.cipher import Cipher, ErrorDescifrado, FLAG_LZMA, FLAG_ZLIB, obtener_cifrador
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        contexto = obtener_cifrador().contexto
+        sin_compresion = Cipher(contexto, 'aesgcm', tamano_segmento=1024)
+        datos = b"".join(
+            f"{i};01/01/2025 - 12:00:00;Cliente {i % 50};Caña;2;1.5;Bebida\n".encode()
+            for i in range(2000)
+        ) + os.urandom(3000)
+        antiguo = sin_compresion.cifrar(datos)
+        
+        for compresion, flag in (('zlib', FLAG_ZLIB), ('lzma', FLAG_LZMA)):
+            cifrador = Cipher(contexto, 'aesgcm', tamano_segmento=1024,
+                              compresion=compresion, nivel_compresion=1)
+            cifrado = cifrador.cifrar(datos)
+            recuperado, flags = cifrador.descifrar_con_flags(cifrado)
+            if recuperado != datos or not flags & flag:
+                print_error(f"{compresion}: no recupera los datos o falta el flag")
+                return False
+            if len(cifrado) >= len(antiguo) // 2:
+                print_error(f"{compresion}: {len(cifrado)} bytes frente a {len(antiguo)} sin comprimir")
+                return False
+            print_success(f"{compresion}: {len(antiguo)} -> {len(cifrado)} bytes")
+            
+            # Los datos sin comprimir (flags 0) siguen siendo legibles
+            if cifrador.descifrar(antiguo) != datos:
+                print_error(f"{compresion}: no lee datos cifrados sin compresión")
+                return False
+            
+            alterado = cifrado[:-1]
+            try:
+                cifrador.descifrar(alterado)
+                print_error(f"{compresion}: no se detectó un segmento truncado")
+                return False
+            except ErrorDescifrado:
+                pass
+        print_success("Datos antiguos sin comprimir legibles y alteraciones detectadas")
+        
+        if len(sin_compresion.cifrar(datos, comprimir=False)) != len(antiguo):
+            print_error("comprimir=False no debería cambiar el formato")
+            return False
+        
+        # La base de datos se lee igual con y sin compresión configurada
+        from datetime import datetime
+        recibo = {
+            'fecha': datetime.now().strftime('%d/%m/%Y - %H:%M:%S'),
+            'cliente_nombre': 'Ana', 'camarero_nombre': 'Luis', 'estado': 'efectivo',
+            'subtotal': 3.0, 'iva_porcentaje': 21.0, 'total': 3.0, 'impreso': False
+        }
+        compresion_original = EncryptionConfig.COMPRESION
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                db_path = str(Path(tmp) / "tpv.db")
+                EncryptionConfig.COMPRESION = None
+                db = DatabaseManagerEncrypted(db_path, modo_sesion=True, diario=False)
+                db.guardar_recibo(recibo, [])
+                tamano_sin = db.obtener_estadisticas()['tamano_db_bytes']
+                db.cerrar()
+                
+                EncryptionConfig.COMPRESION = 'zlib'
+                db = DatabaseManagerEncrypted(db_path, modo_sesion=True, diario=False)
+                if len(db.obtener_recibos()) != 1:
+                    print_error("No se leyó la base de datos sin comprimir")
+                    return False
+                db.guardar_recibo(recibo, [])
+                db.compactar()
+                tamano_con = db.obtener_estadisticas()['tamano_db_bytes']
+                db.cerrar()
+                
+                EncryptionConfig.COMPRESION = None
+                db = DatabaseManagerEncrypted(db_path, modo_sesion=True, diario=False)
+                recibos = len(db.obtener_recibos())
+                db.cerrar()
+                if recibos != 2 or tamano_con >= tamano_sin:
+                    print_error(f"Recibos: {recibos}, tamaño {tamano_sin} -> {tamano_con}")
+                    return False
+                print_success(f"Imagen de la base de datos: {tamano_sin} -> {tamano_con} bytes")
+        finally:
+            EncryptionConfig.COMPRESION = compresion_original
+        return True
+        
+    except Exception as e:
+        print_error(f"Error en test de compresión: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_26_servicio():
+    """Test 26: varios clientes contra el servicio local de base de datos."""
+    print_header("TEST 26: Servicio de Base de Datos")
+    
+    try:
+        import tempfile
+        import threading
+        import time
+        from datetime import date, datetime
+        from config.settings import DatabaseConfig
+        from data.database_encrypted import DatabaseManagerEncrypted
+        from data.db_service import DatabaseClient, DatabaseService, ErrorServicio
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / "tpv.db")
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True, diario=False)
+            servicio = DatabaseService(db)
+            servicio.iniciar()
+            
+            def recibo(cliente):
+                return {
+                    'fecha': datetime.now().strftime('%d/%m/%Y - %H:%M:%S'),
+                    'cliente_nombre': cliente, 'camarero_nombre': 'Luis',
+                    'estado': 'efectivo', 'subtotal': 3.0, 'iva_porcentaje': 21.0,
+                    'total': 3.0, 'impreso': False
+                }
+            lineas = [{'producto_nombre': 'Caña', 'cantidad': 2, 'precio_unitario': 1.5,
+                       'familia': 'Bebida', 'subtotal': 3.0}]
+            
+            # Dos cajas escribiendo a la vez, cada una con sus lotes
+            errores = []
+            def caja(nombre):
+                cliente = DatabaseClient(db_path)
+                try:
+                    for _ in range(10):
+                        with cliente.batch():
+                            cliente.guardar_recibo(recibo(nombre), lineas)
+                            cliente.guardar_recibo(recibo(nombre), lineas)
+                    try:
+                        with cliente.batch():
+                            cliente.guardar_recibo(recibo(nombre), lineas)
+                            raise ValueError("lote cancelado")
+                    except ValueError:
+                        pass
+                except Exception as e:
+                    errores.append(e)
+                finally:
+                    cliente.cerrar()
+            
+            hilos = [threading.Thread(target=caja, args=(n,)) for n in ('Barra', 'Terraza')]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join(60)
+            
+            if errores or len(db.obtener_recibos()) != 40:
+                print_error(f"Escrituras concurrentes: {len(db.obtener_recibos())} recibos, {errores}")
+                return False
+            print_success("40 recibos de dos cajas; los lotes cancelados se deshicieron")
+            
+            cliente = DatabaseClient(db_path)
+            recorridos = list(cliente.iter_recibos(cliente='Barra', tamano_pagina=3))
+            if len(recorridos) != 20 or recorridos[0]['lineas'][0]['producto_nombre'] != 'Caña':
+                print_error(f"iter_recibos por el servicio devolvió {len(recorridos)} recibos")
+                return False
+            for _ in cliente.iter_recibos(tamano_pagina=3):
+                break
+            if cliente.obtener_configuracion('no_existe', 7) != 7:
+                print_error("La conexión no quedó utilizable tras abandonar un recorrido")
+                return False
+            print_success("iter_recibos por páginas, también abandonado a medias")
+            
+            try:
+                cliente.llamar('get_connection')
+                print_error("Se aceptó un método no permitido")
+                return False
+            except AttributeError:
+                print_success("Métodos fuera de la lista rechazados con su excepción")
+            
+            # Un cliente que se va con un lote abierto no bloquea a los demás
+            abandonado = DatabaseClient(db_path)
+            abandonado.llamar('lote_inicio')
+            abandonado.guardar_recibo(recibo('Barra'), lineas)
+            abandonado.cerrar()
+            cliente.guardar_recibo(recibo('Terraza'), lineas)
+            if len(db.obtener_recibos()) != 41:
+                print_error("El lote de un cliente desconectado no se deshizo")
+                return False
+            print_success("Lote de un cliente desconectado deshecho")
+            
+            # Fechas en los argumentos y en el resultado (calendario)
+            hoy = date.today()
+            ventas = cliente.obtener_ventas_diarias(hoy, hoy, ['efectivo'])
+            if ventas != db.obtener_ventas_diarias(hoy, hoy, ['efectivo']) or \
+                    type(ventas[0]['fecha']) is not date or ventas[0]['tickets'] != 41:
+                print_error(f"obtener_ventas_diarias por el servicio: {ventas}")
+                return False
+            print_success(f"Ventas diarias por el servicio: {ventas[0]['fecha']} "
+                          f"{ventas[0]['tickets']} tickets")
+            
+            # Un resultado que no se puede enviar es un error, no una desconexión
+            db.obtener_estadisticas = lambda: object()
+            try:
+                cliente.obtener_estadisticas()
+                print_error("Se envió un resultado no serializable")
+                return False
+            except TypeError:
+                pass
+            finally:
+                del db.obtener_estadisticas
+            if cliente.obtener_configuracion('no_existe', 7) != 7:
+                print_error("La conexión no sobrevivió a un resultado no serializable")
+                return False
+            print_success("Resultado no serializable devuelto como error")
+            
+            # Un lote inactivo se deshace y libera la base de datos
+            espera_lote = DatabaseConfig.SERVICIO_ESPERA_LOTE
+            DatabaseConfig.SERVICIO_ESPERA_LOTE = 0.5
+            try:
+                parado = DatabaseClient(db_path)
+                otra = threading.Thread(
+                    target=lambda: cliente.guardar_recibo(recibo('Terraza'), lineas)
+                )
+                try:
+                    with parado.batch():
+                        parado.guardar_recibo(recibo('Barra'), lineas)
+                        inicio = time.monotonic()
+                        otra.start()
+                        otra.join(10)
+                        esperado = time.monotonic() - inicio
+                        parado.guardar_recibo(recibo('Barra'), lineas)
+                    print_error("El lote inactivo siguió abierto")
+                    return False
+                except ErrorServicio:
+                    pass
+                finally:
+                    parado.cerrar()
+            finally:
+                DatabaseConfig.SERVICIO_ESPERA_LOTE = espera_lote
+            if otra.is_alive() or len(db.obtener_recibos()) != 42:
+                print_error(f"Lote inactivo: {len(db.obtener_recibos())} recibos")
+                return False
+            print_success(f"Lote inactivo deshecho; la otra caja esperó {esperado:.1f} s")
+            
+            intruso = DatabaseClient(db_path)
+            intruso._clave = b"x" * 32
+            try:
+                intruso.conectar()
+                print_error("Se aceptó un cliente sin la clave")
+                return False
+            except ErrorServicio:
+                print_success("Cliente sin la clave rechazado en el saludo")
+            
+            cliente.cerrar()
+            servicio.detener()
+            db.cerrar()
+            if Path(db_path + ".sock").exists():
+                print_error("El socket no se eliminó al detener el servicio")
+                return False
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test del servicio: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_27_instantaneas():
+    """Test 27: lectores sobre instantáneas mientras se siguen confirmando tickets."""
+    print_header("TEST 27: Instantáneas de Lectura")
+    
+    try:
+        import sqlite3
+        import tempfile
+        import threading
+        import time
+        from datetime import datetime
+        from config.settings import DatabaseConfig
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManagerEncrypted(str(Path(tmp) / "tpv.db"), modo_sesion=True, diario=False)
+            
+            def recibo():
+                return {
+                    'fecha': datetime.now().strftime('%d/%m/%Y - %H:%M:%S'),
+                    'cliente_nombre': 'Ana', 'camarero_nombre': 'Luis', 'estado': 'efectivo',
+                    'subtotal': 3.0, 'iva_porcentaje': 21.0, 'total': 3.0, 'impreso': False
+                }
+            for _ in range(5):
+                db.guardar_recibo(recibo(), [])
+            
+            # Un informe retiene su instantánea mientras el hilo principal cobra
+            leyendo = threading.Event()
+            seguir = threading.Event()
+            vistos = []
+            def informe():
+                with db.instantanea() as conn:
+                    vistos.append(conn.execute("SELECT COUNT(*) FROM recibos").fetchone()[0])
+                    leyendo.set()
+                    seguir.wait(10)
+                    vistos.append(conn.execute("SELECT COUNT(*) FROM recibos").fetchone()[0])
+            
+            hilo = threading.Thread(target=informe)
+            hilo.start()
+            leyendo.wait(10)
+            escrito = db.db_path.stat().st_mtime_ns
+            inicio = time.perf_counter()
+            for _ in range(5):
+                db.guardar_recibo(recibo(), [])
+            bloqueado = time.perf_counter() - inicio
+            seguir.set()
+            hilo.join(10)
+            
+            if vistos != [5, 5] or bloqueado > 5:
+                print_error(f"La instantánea vio {vistos} ({bloqueado:.2f} s en los commits)")
+                return False
+            print_success(f"Commits durante la lectura sin esperar ({bloqueado * 1000:.1f} ms); "
+                          "la lectura ve un estado fijo")
+            
+            with db.instantanea() as conn:
+                total = conn.execute("SELECT COUNT(*) FROM recibos").fetchone()[0]
+                try:
+                    conn.execute("DELETE FROM recibos")
+                    print_error("Se pudo escribir en una instantánea")
+                    return False
+                except sqlite3.OperationalError:
+                    pass
+            if total != 10:
+                print_error(f"Una instantánea nueva ve {total} recibos en lugar de 10")
+                return False
+            
+            with db.instantanea():
+                pass
+            estado = db.obtener_estadisticas()['instantaneas']
+            if estado['reutilizadas'] < 1 or estado['en_reserva'] > DatabaseConfig.INSTANTANEAS_MAX:
+                print_error(f"Reserva de instantáneas: {estado}")
+                return False
+            print_success(f"Solo lectura y reutilizada sin commits nuevos: {estado}")
+            
+            with db.batch():
+                db.guardar_recibo(recibo(), [])
+                with db.instantanea() as conn:
+                    propios = conn.execute("SELECT COUNT(*) FROM recibos").fetchone()[0]
+            if propios != 11:
+                print_error("Dentro de un lote la lectura no ve los cambios del lote")
+                return False
+            
+            recorridos = sum(1 for _ in db.iter_recibos(instantanea=True, tamano_pagina=4))
+            if recorridos != 11 or not db.verificar_integridad():
+                print_error(f"iter_recibos(instantanea=True) devolvió {recorridos} recibos")
+                return False
+            if db.db_path.stat().st_mtime_ns != escrito:
+                print_error("Las lecturas reescribieron el archivo cifrado")
+                return False
+            print_success("Lotes, recorridos e integridad sobre instantáneas sin reescribir el archivo")
+            db.cerrar()
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de instantáneas: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_28_importacion_masiva():
+    """Test 28: guardar_recibos_bulk con generadores, agregados y auditoría."""
+    print_header("TEST 28: Importación Masiva de Recibos")
+    
+    try:
+        import tempfile
+        from datetime import date
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        anio = date.today().year
+        lineas = [{'producto_nombre': 'Caña', 'cantidad': 2, 'precio_unitario': 1.5,
+                   'familia': 'Bebida', 'subtotal': 3.0},
+                  {'producto_nombre': 'Café', 'cantidad': 1, 'precio_unitario': 1.2,
+                   'familia': 'Bebida', 'subtotal': 1.2}]
+        
+        def historico(cantidad, fallar_en=None):
+            for i in range(cantidad):
+                if i == fallar_en:
+                    raise RuntimeError("archivo de origen corrupto")
+                yield ({
+                    'fecha': f'{1 + i % 28:02d}/{1 + i % 12:02d}/{anio - i % 2} - 12:00:00',
+                    'cliente_nombre': f'Cliente {i % 7}', 'camarero_nombre': 'Luis',
+                    'estado': 'efectivo' if i % 3 else 'tarjeta',
+                    'subtotal': 4.2, 'iva_porcentaje': 21.0, 'total': 4.2, 'impreso': True
+                }, lineas)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / "tpv.db")
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True)
+            db.guardar_recibo(*next(historico(1)))
+            
+            print("Importando 3000 recibos en bloques de 500...")
+            resultado = db.guardar_recibos_bulk(historico(3000), usuario='importador',
+                                                tamano_bloque=500)
+            if (resultado['recibos'] != 3000 or resultado['lineas'] != 6000
+                    or resultado['ultimo_id'] - resultado['primer_id'] != 2999):
+                print_error(f"Resultado inesperado: {resultado}")
+                return False
+            print_success(f"{resultado['filas_por_segundo']} filas/s, ids "
+                          f"{resultado['primer_id']}-{resultado['ultimo_id']}")
+            
+            # Los recibos de otra caja llegan como los devuelve iter_recibos
+            otra_caja = list(db.iter_recibos(fecha_inicio=f'01/01/{anio}', tamano_pagina=100))[:10]
+            db.guardar_recibos_bulk(otra_caja)
+            
+            importaciones = db.obtener_auditoria(tabla='recibos', accion='IMPORT')
+            if len(importaciones) != 2 or importaciones[-1]['usuario'] != 'importador':
+                print_error(f"Auditoría de la importación: {importaciones}")
+                return False
+            
+            activos = len(db.obtener_recibos(fecha_inicio=f'01/01/{anio}'))
+            archivados = db.obtener_estadisticas()['anios_archivados'].get(anio - 1, {}).get('recibos')
+            if activos != 1 + 1500 + 10 or archivados != 1500:
+                print_error(f"Activos {activos}, archivados {archivados}")
+                return False
+            print_success("Un registro de auditoría por importación; el año cerrado va a su archivo")
+            
+            ventas = db.obtener_ventas_diarias(f'01/01/{anio}', f'31/12/{anio}')
+            tickets = sum(v['tickets'] for v in ventas) if isinstance(ventas, list) else None
+            db.reconstruir_ventas_diarias()
+            if ventas != db.obtener_ventas_diarias(f'01/01/{anio}', f'31/12/{anio}'):
+                print_error("ventas_diarias no coincide con la reconstrucción")
+                return False
+            if not db.verificar_planes_consultas():
+                print_error("No se reconstruyeron los índices")
+                return False
+            print_success(f"Ventas diarias al día ({tickets} tickets) e índices reconstruidos")
+            
+            try:
+                db.guardar_recibos_bulk(historico(1000, fallar_en=700), tamano_bloque=200)
+                print_error("La importación fallida no lanzó la excepción")
+                return False
+            except RuntimeError:
+                pass
+            db.guardar_recibo(*next(historico(1)))
+            db.cerrar()
+            
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True)
+            activos_final = len(db.obtener_recibos(fecha_inicio=f'01/01/{anio}'))
+            db.cerrar()
+            if activos_final != activos + 1:
+                print_error(f"Tras una importación fallida hay {activos_final} recibos "
+                            f"en lugar de {activos + 1}")
+                return False
+            print_success("Una importación fallida no deja nada y el diario sigue funcionando")
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de importación masiva: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_29_compactacion_paginas():
+    """Test 29: VACUUM de la imagen hinchada por borrados, en inactividad y por operación."""
+    print_header("TEST 29: Compactación de Páginas Libres")
+    
+    try:
+        import tempfile
+        from datetime import date
+        from config.settings import DatabaseConfig
+        from data.database_encrypted import DatabaseManagerEncrypted
+        
+        anio = date.today().year
+        lineas = [{'producto_nombre': 'Caña', 'cantidad': 2, 'precio_unitario': 1.5,
+                   'familia': 'Bebida', 'subtotal': 3.0}] * 3
+        
+        def pendientes(cantidad):
+            for i in range(cantidad):
+                yield ({
+                    'fecha': f'{1 + i % 28:02d}/01/{anio} - 12:00:00',
+                    'cliente_nombre': f'Mesa {i % 20}', 'camarero_nombre': 'Luis',
+                    'estado': 'pendiente', 'subtotal': 9.0, 'iva_porcentaje': 21.0,
+                    'total': 9.0, 'impreso': False
+                }, lineas)
+        
+        def vaciar(db):
+            # Como al unir tickets pendientes: se borran casi todos
+            with db.get_connection() as conn:
+                conn.execute("DELETE FROM lineas_recibo WHERE recibo_id > 100")
+                conn.execute("DELETE FROM recibos WHERE id > 100")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / "tpv.db")
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True)
+            db.guardar_recibos_bulk(pendientes(8000))
+            vaciar(db)
+            db.volcar()
+            
+            paginas = db.obtener_estadisticas()['paginas']
+            if paginas['relacion_hinchado'] < DatabaseConfig.VACUUM_RELACION:
+                print_error(f"Los borrados no dejaron páginas libres: {paginas}")
+                return False
+            print_success(f"{paginas['libres']}/{paginas['total']} páginas libres "
+                          f"({paginas['relacion_hinchado']:.0%})")
+            
+            # Sin inactividad no se compacta; tras DIARIO_INACTIVIDAD sí
+            db._comprobar_compactacion()
+            if db.obtener_estadisticas()['paginas']['compactaciones'] != 0:
+                print_error("Se compactó con commits recientes")
+                return False
+            db._ultimo_commit -= DatabaseConfig.DIARIO_INACTIVIDAD
+            db._comprobar_compactacion()
+            
+            stats = db.obtener_estadisticas()
+            paginas = stats['paginas']
+            if (paginas['compactaciones'] != 1 or paginas['libres'] != 0
+                    or paginas['ultima_compactacion'] is None
+                    or stats['tamano_diario_bytes'] != 0):
+                print_error(f"Compactación en inactividad: {paginas}, diario "
+                            f"{stats['tamano_diario_bytes']} bytes")
+                return False
+            print_success(f"Compactada en inactividad a {paginas['total']} páginas "
+                          f"({paginas['ultima_compactacion']})")
+            
+            # El diario posterior al VACUUM se reaplica sobre la imagen compactada
+            db.guardar_recibo(*next(pendientes(1)))
+            db.volcar()
+            db._persistencia.detener()
+            db._conn.close()
+            db._conn = None
+            
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True)
+            total = len(db.obtener_recibos(estado='pendiente'))
+            correcta = db.verificar_integridad()
+            db.cerrar()
+            if total != 101 or not correcta:
+                print_error(f"Tras recuperar el diario hay {total} recibos (íntegra: {correcta})")
+                return False
+            print_success("El diario escrito tras el VACUUM se recupera sin pérdidas")
+            
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManagerEncrypted(str(Path(tmp) / "tpv.db"), modo_sesion=False)
+            db.guardar_recibos_bulk(pendientes(8000))
+            tamano_lleno = db.obtener_estadisticas()['tamano_db_bytes']
+            vaciar(db)
+            stats = db.obtener_estadisticas()
+            paginas, tamano = stats['paginas'], stats['tamano_db_bytes']
+            if paginas['compactaciones'] != 1 or paginas['libres'] != 0 or tamano > tamano_lleno / 4:
+                print_error(f"Modo por operación: {paginas}, {tamano_lleno} -> {tamano} bytes")
+                return False
+            print_success(f"Por operación se compacta en la misma escritura: "
+                          f"{tamano_lleno / 1024:.0f} KB -> {tamano / 1024:.0f} KB")
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de compactación de páginas: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_30_almacen_kv():
+    """Test 30: almacén clave-valor en registro y DataManagerKV."""
+    print_header("TEST 30: Almacén Clave-Valor en Registro")
+    
+    try:
+        import tempfile
+        from core.cipher import obtener_cifrador
+        from data.log_store import LogStore
+        from data.data_manager_kv import DataManagerKV
+        from models.product import Product
+        from models.receipt import Receipt, ReceiptManager, LineaRecibo
+        
+        cifrador = obtener_cifrador()
+        with tempfile.TemporaryDirectory() as tmp:
+            directorio = Path(tmp) / "almacen"
+            kv = LogStore(directorio, cifrador.cifrar, cifrador.descifrar, fsync=False,
+                          tamano_segmento=16 * 1024, segmentos_fusion=0)
+            for i in range(3000):
+                kv.guardar(f"mesa:{i % 200}", {'version': i})
+            for i in range(0, 200, 2):
+                kv.eliminar(f"mesa:{i}")
+            estado = kv.estado()
+            kv.cerrar()
+            
+            if any(b"mesa" in ruta.read_bytes() for ruta in directorio.iterdir()):
+                print_error("Claves en claro en el almacén")
+                return False
+            print_success(f"{estado['escrituras']} escrituras en {len(estado['archivos'])} "
+                          f"segmentos cifrados")
+            
+            kv = LogStore(directorio, cifrador.cifrar, cifrador.descifrar,
+                          tamano_segmento=16 * 1024, segmentos_fusion=0)
+            if len(kv) != 100 or kv.obtener("mesa:7") != {'version': 2807} or "mesa:8" in kv:
+                print_error(f"Índice reconstruido incorrecto: {len(kv)} claves")
+                return False
+            
+            kv.fusionar()
+            tras_fusion = kv.estado()
+            kv.guardar("mesa:7", {'version': 'ultima'})
+            kv.cerrar()
+            if len(tras_fusion['archivos']) != 2 or tras_fusion['bytes'] >= estado['bytes'] / 5:
+                print_error(f"Fusión: {estado['bytes']} -> {tras_fusion}")
+                return False
+            print_success(f"Fusión: {estado['bytes'] // 1024} KB -> "
+                          f"{tras_fusion['bytes'] // 1024} KB en {tras_fusion['archivos']}")
+            
+            # Escritura interrumpida: el último registro incompleto se descarta
+            activo = directorio / tras_fusion['archivos'][-1]
+            with open(activo, 'ab') as archivo:
+                archivo.write((500).to_bytes(4, 'big') + b"incompleto")
+            kv = LogStore(directorio, cifrador.cifrar, cifrador.descifrar)
+            recuperado = kv.obtener("mesa:7"), len(kv)
+            kv.cerrar()
+            if recuperado != ({'version': 'ultima'}, 100):
+                print_error(f"Tras una escritura interrumpida: {recuperado}")
+                return False
+            print_success("Índice desde los hint y último registro incompleto descartado")
+            
+        with tempfile.TemporaryDirectory() as tmp:
+            dm = DataManagerKV(Path(tmp) / "tpv.kv")
+            if dm.cargar_datos_generales():
+                print_error("Un almacén nuevo dice tener datos")
+                return False
+            dm.crear_datos_ejemplo()
+            dm.products.actualizar_producto("Caña", precio=1.5)
+            dm.products.eliminar_producto("Navaja")
+            dm.customers.agregar_cliente("Ana")
+            dm.waiters.agregar_camarero("Luis")
+            dm.iva = 10.0
+            
+            pedido = [LineaRecibo(2, "Caña", 1.5, "Bebida")]
+            for fecha in ("01/03/2025 - 10:00:00", "01/03/2025 - 11:00:00"):
+                dm.agregar_recibo_pendiente(Receipt(pedido=list(pedido), nombre="Ana",
+                                                    fecha=fecha, estado="pendiente"))
+            dm.unir_recibos_pendientes("Ana")
+            dm.receipts_pending[0].agregar_linea(LineaRecibo(1, "Café solo", 1.2, "Bebida"))
+            dm.guardar_datos_generales()
+            
+            anuales = ReceiptManager()
+            cobrado = Receipt(pedido=list(pedido), fecha="02/03/2025 - 12:00:00", estado="efectivo")
+            anuales.agregar_recibo(cobrado)
+            dm.guardar_recibos_anuales(anuales)
+            dm.guardar_recibos_anuales(anuales)
+            dm.cerrar()
+            
+            dm = DataManagerKV(Path(tmp) / "tpv.kv")
+            cargado = dm.cargar_datos_generales()
+            pendiente = dm.receipts_pending[0] if len(dm.receipts_pending) == 1 else None
+            anuales = dm.cargar_recibos_anuales(2025).obtener_todos_recibos()
+            dm.cerrar()
+            if (not cargado or dm.products.obtener_producto("Caña").precio != 1.5
+                    or dm.products.existe_producto("Navaja") or dm.iva != 10.0
+                    or dm.customers.obtener_todos() != ["Ana"]
+                    or dm.waiters.obtener_todos() != ["Luis"]):
+                print_error("Catálogo, clientes o configuración no persistidos")
+                return False
+            if pendiente is None or len(pendiente.pedido) != 2 or len(anuales) != 1:
+                print_error(f"Pendientes {dm.receipts_pending}, anuales {anuales}")
+                return False
+            print_success("DataManagerKV: catálogo, pendientes unidos y editados y recibos "
+                          "del año persisten entre sesiones")
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de almacén clave-valor: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_31_catalogo_productos():
+    """Test 31: catálogo de productos en memoria con escritura a la base de datos y avisos."""
+    print_header("TEST 31: Catálogo de Productos en Memoria")
+    
+    try:
+        import tempfile
+        from models.product import Product
+        from data.database_encrypted import DatabaseManagerEncrypted
+        from data.data_manager_sqlite import ProductManagerSQLite
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / "tpv.db")
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True)
+            db.guardar_producto("Caña", 1.3, "Bebida")
+            db.guardar_producto("Bravas", 6.0, "Comida")
+            
+            productos = ProductManagerSQLite(db)
+            avisos = []
+            productos.suscribir(avisos.append)
+            
+            # Las consultas no vuelven a leer la base de datos
+            lecturas = []
+            obtener_productos = db.obtener_productos
+            db.obtener_productos = lambda *a, **k: lecturas.append(a) or obtener_productos(*a, **k)
+            for _ in range(1000):
+                productos.obtener_producto("Caña")
+            if (lecturas or productos.obtener_producto("Caña").precio != 1.3
+                    or not productos.existe_producto("Bravas")
+                    or productos.obtener_numero_productos() != 2):
+                print_error(f"Consultas del catálogo: {len(lecturas)} lecturas")
+                return False
+            print_success("1000 consultas de producto sin leer la base de datos")
+            
+            # Escrituras: base de datos + caché, avisando solo las familias tocadas
+            productos.agregar_producto(Product("Vermut", 2.5, "Bebida"))
+            productos.actualizar_producto("Bravas", familia="Otros")
+            productos.eliminar_producto("Caña")
+            if avisos != [{"Bebida"}, {"Comida", "Otros"}, {"Bebida"}]:
+                print_error(f"Avisos: {avisos}")
+                return False
+            if ([p.nombre for p in productos.obtener_productos_por_familia("Otros")] != ["Bravas"]
+                    or productos.obtener_productos_por_familia("Comida")):
+                print_error("Índice por familia desactualizado")
+                return False
+            print_success(f"Escrituras avisan por familia: {avisos}")
+            
+            # Limpiar y volver a agregar todo avisa una sola vez
+            del avisos[:]
+            todos = productos.obtener_todos()
+            with productos.agrupar_cambios(), db.batch():
+                productos.limpiar()
+                for producto in todos:
+                    productos.agregar_producto(producto)
+            if len(avisos) > 1 or productos.obtener_numero_productos() != 2:
+                print_error(f"Limpiar y reagregar: avisos {avisos}")
+                return False
+            
+            # Un lote que falla deshace también la caché
+            try:
+                with productos.agrupar_cambios(), db.batch():
+                    productos.agregar_producto(Product("Navaja", 10.0, "Otros"))
+                    raise RuntimeError("fallo")
+            except RuntimeError:
+                pass
+            if productos.existe_producto("Navaja"):
+                print_error("La caché conserva un producto de un lote deshecho")
+                return False
+            print_success("Los lotes avisan una vez y se deshacen con la transacción")
+            
+            # La base de datos coincide con la caché (incluso reactivados)
+            db.obtener_productos = obtener_productos
+            en_db = {p['nombre']: (p['precio'], p['familia']) for p in db.obtener_productos()}
+            en_cache = {p.nombre: (p.precio, p.familia) for p in productos.obtener_todos()}
+            db.cerrar()
+            if en_db != en_cache or en_db != {"Bravas": (6.0, "Otros"), "Vermut": (2.5, "Bebida")}:
+                print_error(f"Base de datos {en_db} y caché {en_cache} no coinciden")
+                return False
+            print_success(f"Base de datos y caché coinciden: {sorted(en_cache)}")
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de catálogo de productos: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_32_datos_referencia():
+    """Test 32: clientes, camareros y configuración en memoria, cargados en una lectura."""
+    print_header("TEST 32: Caché de Datos de Referencia")
+    
+    try:
+        import tempfile
+        from config.settings import DatabaseConfig
+        from data.database_encrypted import DatabaseManagerEncrypted
+        from data.data_manager_sqlite import DataManagerSQLite
+        
+        backup_automatico = DatabaseConfig.BACKUP_AUTOMATICO
+        DatabaseConfig.BACKUP_AUTOMATICO = False
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManagerEncrypted(str(Path(tmp) / "tpv.db"), modo_sesion=True)
+            try:
+                for nombre in ("Luis", "Ana"):
+                    db.guardar_cliente(nombre)
+                    db.guardar_camarero(nombre)
+                db.guardar_configuracion('iva', 10)
+                db.guardar_configuracion('password', '1234')
+                
+                # Contar las lecturas al arrancar y al consultar
+                lecturas = []
+                read_connection = db.read_connection
+                db.read_connection = lambda: lecturas.append(1) or read_connection()
+                
+                dm = DataManagerSQLite(db)
+                arranque = len(lecturas)
+                for _ in range(1000):
+                    dm.customers.existe_cliente("Ana")
+                    dm.waiters.existe_camarero("Pepe")
+                if (arranque != 1 or len(lecturas) != 1
+                        or dm.customers.obtener_todos() != ["Ana", "Luis"]
+                        or dm.waiters.obtener_numero_camareros() != 2):
+                    print_error(f"Arranque con {arranque} lecturas, {len(lecturas)} en total")
+                    return False
+                if dm.iva != 10.0 or not isinstance(dm.iva, float) or dm.password != '1234':
+                    print_error(f"Configuración sin tipar: {dm.iva!r}, {dm.password!r}")
+                    return False
+                print_success("Arranque en 1 lectura; 2000 comprobaciones de nombres sin E/S; "
+                              f"iva={dm.iva!r}, password={dm.password!r}")
+                
+                # Guardar sin cambios no escribe la configuración
+                dm.guardar_datos_generales()
+                escrituras = []
+                guardar_configuracion = db.guardar_configuracion
+                db.guardar_configuracion = lambda *a: escrituras.append(a) or guardar_configuracion(*a)
+                dm.guardar_datos_generales()
+                if escrituras:
+                    print_error(f"Se reescribió la configuración sin cambios: {escrituras}")
+                    return False
+                
+                # Escrituras a memoria y base de datos (con reactivación)
+                dm.customers.eliminar_cliente("Luis")
+                dm.customers.agregar_cliente("Bea")
+                dm.customers.agregar_cliente("Luis")
+                dm.waiters.eliminar_camarero("Ana")
+                dm.iva = 21.0
+                dm.guardar_datos_generales()
+                
+                clientes = dm.customers.obtener_todos()
+                camareros = dm.waiters.obtener_todos()
+                if (clientes != db.obtener_clientes() or clientes != ["Ana", "Bea", "Luis"]
+                        or camareros != db.obtener_camareros() or camareros != ["Luis"]
+                        or db.obtener_configuracion('iva') != 21.0 or len(escrituras) != 1):
+                    print_error(f"Memoria {clientes}/{camareros} y base de datos "
+                                f"{db.obtener_clientes()}/{db.obtener_camareros()} no coinciden")
+                    return False
+                print_success(f"Escrituras a memoria y base de datos: clientes {clientes}, "
+                              f"camareros {camareros}")
+                
+                # Un lote que se deshace deja las cachés como la base de datos
+                try:
+                    with dm.batch():
+                        dm.customers.agregar_cliente("Temporal")
+                        dm.customers.eliminar_cliente("Ana")
+                        dm.waiters.agregar_camarero("Temporal")
+                        dm.configuracion.guardar('iva', 4.0)
+                        raise RuntimeError("lote cancelado")
+                except RuntimeError:
+                    pass
+                if (dm.customers.obtener_todos() != clientes or db.obtener_clientes() != clientes
+                        or dm.waiters.obtener_todos() != db.obtener_camareros()
+                        or dm.waiters.existe_camarero("Temporal")
+                        or dm.configuracion.obtener('iva', 0.0) != 21.0):
+                    print_error(f"Cachés tras deshacer el lote: {dm.customers.obtener_todos()}/"
+                                f"{dm.waiters.obtener_todos()}")
+                    return False
+                print_success("Un lote deshecho no deja cambios en las cachés")
+                return True
+            finally:
+                db.cerrar()
+                DatabaseConfig.BACKUP_AUTOMATICO = backup_automatico
+        
+    except Exception as e:
+        print_error(f"Error en test de datos de referencia: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_33_orden_productos():
+    """Test 33: posición persistente de los productos e intercambio de dos filas."""
+    print_header("TEST 33: Orden de Productos")
+    
+    try:
+        import tempfile
+        from datetime import datetime
+        from models.product import Product
+        from data.database_encrypted import DatabaseManagerEncrypted
+        from data.data_manager_sqlite import ProductManagerSQLite
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / "tpv.db")
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True)
+            with db.batch():
+                for i in range(120):
+                    db.guardar_producto(f"Producto {i:03d}", 1.0 + i, ("Bebida", "Comida", "Otros")[i % 3])
+            
+            productos = ProductManagerSQLite(db)
+            avisos = []
+            productos.suscribir(avisos.append)
+            
+            def orden(familia):
+                return [p.nombre for p in productos.obtener_productos_por_familia(familia)]
+            
+            def orden_db(familia):
+                return [p['nombre'] for p in db.obtener_productos(familia=familia)]
+            
+            # Intercambiar: dos filas, en la caché y en la base de datos
+            antes = orden("Bebida")
+            inicio = datetime.now().isoformat()
+            if not productos.intercambiar_productos(antes[0], antes[5]):
+                print_error("No se pudo intercambiar")
+                return False
+            with db.read_connection() as conn:
+                filas = conn.execute(
+                    "SELECT COUNT(*) FROM productos WHERE fecha_modificacion >= ?", (inicio,)
+                ).fetchone()[0]
+            esperado = [antes[5]] + antes[1:5] + [antes[0]] + antes[6:]
+            if orden("Bebida") != esperado or orden_db("Bebida") != esperado or filas != 2:
+                print_error(f"Intercambio: {orden('Bebida')[:6]} ({filas} filas)")
+                return False
+            if avisos != [{"Bebida"}]:
+                print_error(f"Avisos: {avisos}")
+                return False
+            print_success(f"Intercambio {antes[0]} ↔ {antes[5]} en {filas} filas de 40")
+            
+            # Entre familias distintas no se intercambia
+            if productos.intercambiar_productos(antes[1], orden("Comida")[0]):
+                print_error("Se intercambiaron productos de familias distintas")
+                return False
+            
+            # Mover a una posición ocupada: cambia el producto y el que la ocupaba
+            comida = orden("Comida")
+            productos.mover_producto(comida[-1], 0)
+            esperado = [comida[-1]] + comida[1:-1] + [comida[0]]
+            if orden("Comida") != esperado or orden_db("Comida") != esperado:
+                print_error(f"Mover: {orden('Comida')[:3]}")
+                return False
+            with db.read_connection() as conn:
+                ids = {conn.execute("SELECT id FROM productos WHERE nombre = ?", (n,)).fetchone()[0]
+                       for n in (comida[0], comida[-1])}
+            auditados = {r['registro_id'] for r in db.obtener_auditoria(
+                tabla='productos', accion='UPDATE', limit=2)}
+            if auditados != ids:
+                print_error(f"Auditoría de mover: {auditados} en vez de {ids}")
+                return False
+            
+            # Posiciones fuera de la familia se rechazan sin tocar nada
+            if (productos.mover_producto(comida[1], -1)
+                    or productos.mover_producto(comida[1], len(comida))
+                    or orden("Comida") != esperado or orden_db("Comida") != esperado):
+                print_error("Se aceptó una posición fuera de la familia")
+                return False
+            
+            # Con huecos (producto eliminado) la posición es el lugar visible
+            bebida = orden("Bebida")
+            productos.eliminar_producto(bebida[1])
+            ultimo = len(bebida) - 2
+            if (not productos.mover_producto(bebida[0], ultimo)
+                    or orden("Bebida") != [bebida[-1]] + bebida[2:-1] + [bebida[0]]):
+                print_error(f"Mover al último lugar con un hueco: {orden('Bebida')[-3:]}")
+                return False
+            if (not productos.mover_producto(bebida[0], 0)
+                    or orden("Bebida") != [bebida[0]] + bebida[2:]):
+                print_error(f"Mover al primer lugar con un hueco: {orden('Bebida')[:3]}")
+                return False
+            if (productos.mover_producto(bebida[0], ultimo + 1)
+                    or orden_db("Bebida") != orden("Bebida")
+                    or {n: productos._posiciones[n] for n in orden("Bebida")}
+                    != {p['nombre']: p['posicion'] for p in db.obtener_productos(familia="Bebida")}):
+                print_error("Caché y base de datos no coinciden tras eliminar y mover")
+                return False
+            print_success("Mover audita las dos filas, respeta los huecos y rechaza "
+                          "posiciones fuera de rango")
+            
+            # Nuevos, reactivados y cambios de familia pasan al final
+            productos.agregar_producto(Product("Nuevo", 2.0, "Otros"))
+            productos.eliminar_producto(antes[5])
+            productos.agregar_producto(Product(antes[5], 2.0, "Bebida"))
+            productos.actualizar_producto(comida[1], familia="Otros")
+            if (orden("Otros")[-2:] != ["Nuevo", comida[1]] or orden("Bebida")[-1] != antes[5]
+                    or any(orden(f) != orden_db(f) for f in ("Bebida", "Comida", "Otros"))):
+                print_error("Orden de productos nuevos, reactivados o movidos de familia")
+                return False
+            print_success("Mover, agregar y reactivar mantienen igual caché y base de datos")
+            
+            # El orden persiste entre sesiones
+            esperado = {f: orden(f) for f in ("Bebida", "Comida", "Otros")}
+            db.cerrar()
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True)
+            recargado = {f: orden_db(f) for f in ("Bebida", "Comida", "Otros")}
+            db.cerrar()
+            if recargado != esperado:
+                print_error("El orden no persiste al reabrir")
+                return False
+            print_success("El orden persiste al reabrir la base de datos")
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de orden de productos: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_34_pendientes_por_diferencias():
+    """Test 34: los recibos pendientes se guardan escribiendo solo sus diferencias."""
+    print_header("TEST 34: Pendientes Guardados por Diferencias")
+    
+    try:
+        import tempfile
+        from datetime import datetime
+        from config.settings import DatabaseConfig, TicketConfig
+        from models.receipt import Receipt, LineaRecibo
+        from data.database_encrypted import DatabaseManagerEncrypted
+        from data.data_manager_sqlite import DataManagerSQLite
+        
+        backup_automatico = DatabaseConfig.BACKUP_AUTOMATICO
+        DatabaseConfig.BACKUP_AUTOMATICO = False
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManagerEncrypted(str(Path(tmp) / "tpv.db"), modo_sesion=True)
+            try:
+                dm = DataManagerSQLite(db)
+                anio = datetime.now().year
+                for i in range(5):
+                    recibo = Receipt(pedido=[LineaRecibo(1, "Caña", 1.5, "Bebida"),
+                                             LineaRecibo(i + 1, f"Tapa {i}", 3.0, "Comida")],
+                                     nombre="Ana", fecha=f"0{i + 1}/03/{anio} - 12:00:00",
+                                     estado=TicketConfig.ESTADO_PENDIENTE)
+                    dm.agregar_recibo_pendiente(recibo)
+                
+                def lineas_db(recibo_id):
+                    with db.read_connection() as conn:
+                        return {fila['producto_nombre']: (fila['id'], fila['cantidad'])
+                                for fila in conn.execute(
+                                    "SELECT * FROM lineas_recibo WHERE recibo_id = ?", (recibo_id,))}
+                
+                def cuadran_ventas():
+                    with db.read_connection() as conn:
+                        ventas = conn.execute(
+                            "SELECT SUM(total) FROM ventas_diarias WHERE estado = 'pendiente'"
+                        ).fetchone()[0]
+                        recibos = conn.execute(
+                            "SELECT SUM(total) FROM recibos WHERE estado = 'pendiente'"
+                        ).fetchone()[0]
+                    return abs(ventas - recibos) < 1e-9
+                
+                # Contar escrituras de recibos completos y de diferencias
+                llamadas = {'guardar_recibo': 0, 'actualizar_recibo': 0}
+                for metodo in llamadas:
+                    original = getattr(db, metodo)
+                    def contar(*a, _m=metodo, _o=original, **k):
+                        llamadas[_m] += 1
+                        return _o(*a, **k)
+                    setattr(db, metodo, contar)
+                
+                # Unir las cinco cuentas: se reutiliza la fila de la primera
+                primero = dm.receipts_pending[0].db_id
+                antes = lineas_db(primero)
+                unido = dm.unir_recibos_pendientes("Ana")
+                despues = lineas_db(primero)
+                if (unido.db_id != primero or llamadas != {'guardar_recibo': 0, 'actualizar_recibo': 1}
+                        or despues["Caña"] != (antes["Caña"][0], 5)
+                        or despues["Tapa 0"] != antes["Tapa 0"] or len(despues) != 6
+                        or len(db.obtener_recibos(estado=TicketConfig.ESTADO_PENDIENTE)) != 1):
+                    print_error(f"Unión: {llamadas}, líneas {despues}")
+                    return False
+                print_success(f"5 cuentas unidas sobre el recibo {primero}: {llamadas}, "
+                              "la línea de Caña conserva su id")
+                
+                # Editar el pendiente cargado y volver a guardarlo
+                unido.agregar_linea(LineaRecibo(2, "Vermut", 2.5, "Bebida"))
+                unido.quitar_linea("Tapa 1", 2)
+                unido.quitar_linea("Caña", 1)
+                unido.marcar_como_pendiente("Ana")
+                dm.agregar_recibo_pendiente(unido)
+                despues = lineas_db(primero)
+                if (len(dm.receipts_pending) != 1 or llamadas['guardar_recibo'] != 0
+                        or "Tapa 1" in despues or despues["Caña"] != (antes["Caña"][0], 4)
+                        or despues["Vermut"][1] != 2 or not cuadran_ventas()):
+                    print_error(f"Edición: {llamadas}, líneas {despues}")
+                    return False
+                
+                # Sin cambios no se escribe nada; con cambios en memoria sí
+                dm.guardar_datos_generales()
+                editado = llamadas['actualizar_recibo']
+                unido.agregar_linea(LineaRecibo(1, "Caña", 1.5, "Bebida"))
+                dm.guardar_datos_generales()
+                if llamadas['actualizar_recibo'] != editado + 1 or lineas_db(primero)["Caña"][1] != 5:
+                    print_error(f"guardar_datos_generales: {llamadas}")
+                    return False
+                print_success("Editar y volver a guardar actualiza solo las líneas cambiadas")
+                
+                # Al recargar se ve lo mismo que en memoria
+                recargado = DataManagerSQLite(db)
+                recargado.cargar_datos_generales()
+                pendiente = recargado.receipts_pending
+                if (len(pendiente) != 1 or pendiente[0].db_id != primero
+                        or sorted(l.to_list() for l in pendiente[0].pedido)
+                        != sorted(l.to_list() for l in unido.pedido)):
+                    print_error(f"Recargado: {pendiente}")
+                    return False
+                print_success(f"Recargado igual que en memoria: {len(unido.pedido)} líneas, "
+                              f"{unido.calcular_total():.2f}€")
+                
+                # Cargar en pantalla, añadir una línea y volver a guardarlo
+                llamadas.update(guardar_recibo=0, actualizar_recibo=0)
+                antes = lineas_db(primero)
+                cargado = recargado.retirar_recibo_pendiente(pendiente[0].fecha)
+                if recargado.receipts_pending or lineas_db(primero) != antes:
+                    print_error("Cargar un pendiente lo borró de la base de datos")
+                    return False
+                cargado.agregar_linea(LineaRecibo(1, "Café", 1.2, "Bebida"))
+                cargado.marcar_como_pendiente("Ana")
+                recargado.agregar_recibo_pendiente(cargado)
+                despues = lineas_db(primero)
+                if (cargado.db_id != primero or recargado.receipts_pending != [cargado]
+                        or llamadas != {'guardar_recibo': 0, 'actualizar_recibo': 1}
+                        or set(despues) - set(antes) != {"Café"}
+                        or any(despues[n] != antes[n] for n in antes)):
+                    print_error(f"Cargar y volver a guardar: {llamadas}, líneas {despues}")
+                    return False
+                print_success("Cargar, editar y volver a guardar: mismo recibo, solo la línea nueva")
+                
+                # Si la fila desapareció (cobrado en otra caja) se inserta de
+                # nuevo sin dejar atrás lo guardado del recibo anterior
+                db.eliminar_recibo(primero)
+                cargado.agregar_linea(LineaRecibo(1, "Café", 1.2, "Bebida"))
+                recargado.agregar_recibo_pendiente(cargado)
+                if (cargado.db_id == primero or primero in recargado._pendientes_guardados
+                        or set(recargado._pendientes_guardados) != {cargado.db_id}):
+                    print_error(f"Pendientes guardados: {list(recargado._pendientes_guardados)}")
+                    return False
+                
+                # Cobrar un pendiente cargado borra su fila
+                cobrado = recargado.retirar_recibo_pendiente(cargado.fecha)
+                recargado.eliminar_recibo_pendiente(cobrado.fecha)
+                if (db.obtener_recibos(estado=TicketConfig.ESTADO_PENDIENTE)
+                        or recargado._pendientes_guardados or cobrado.db_id is not None):
+                    print_error("Cobrar un pendiente cargado no borró su fila")
+                    return False
+                print_success("Reinsertar no deja fotos huérfanas; cobrar un cargado lo borra")
+                return True
+            finally:
+                db.cerrar()
+                DatabaseConfig.BACKUP_AUTOMATICO = backup_automatico
+        
+    except Exception as e:
+        print_error(f"Error en test de pendientes por diferencias: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_35_saldos_clientes():
+    """Test 35: saldo pendiente por cliente materializado en la base de datos y en memoria."""
+    print_header("TEST 35: Saldos de Clientes")
+    
+    try:
+        import tempfile
+        from datetime import datetime
+        from config.settings import DatabaseConfig, TicketConfig
+        from models.receipt import Receipt, ReceiptManager, LineaRecibo
+        from data.data_manager import DataManager
+        from data.database_encrypted import DatabaseManagerEncrypted
+        from data.data_manager_sqlite import DataManagerSQLite
+        
+        backup_automatico = DatabaseConfig.BACKUP_AUTOMATICO
+        DatabaseConfig.BACKUP_AUTOMATICO = False
+        
+        def pendiente(cliente, cantidad):
+            # Un día distinto por recibo: los pendientes se buscan por fecha
+            return Receipt(pedido=[LineaRecibo(cantidad, "Caña", 1.35, "Bebida")],
+                           nombre=cliente, estado=TicketConfig.ESTADO_PENDIENTE,
+                           fecha=f"{cantidad:02d}/03/{datetime.now().year} - 12:00:00")
+        
+        def en_db(db):
+            return [(s['cliente_nombre'], s['tickets'], s['total'])
+                    for s in db.obtener_saldos_clientes()]
+        
+        def cuadra(dm, db):
+            # Memoria, tabla y el cálculo recorriendo los recibos coinciden
+            calculado = [(c, t, round(total, 2))
+                         for c, t, total in DataManager.obtener_saldos_clientes(dm)]
+            return dm.obtener_saldos_clientes() == en_db(db) == calculado
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / "tpv.db")
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True)
+            try:
+                dm = DataManagerSQLite(db)
+                for cliente, cantidad in (("Ana", 2), ("Luis", 1), ("Ana", 3), ("Bea", 7)):
+                    dm.agregar_recibo_pendiente(pendiente(cliente, cantidad))
+                
+                # Los cobrados no cuentan
+                cobrados = ReceiptManager()
+                cobrado = pendiente("Ana", 4)
+                cobrado.marcar_como_pagado(TicketConfig.ESTADO_EFECTIVO)
+                cobrados.agregar_recibo(cobrado)
+                dm.guardar_recibos_anuales(cobrados)
+                
+                saldos = dm.obtener_saldos_clientes()
+                if saldos != [("Ana", 2, 6.75), ("Bea", 1, 9.45), ("Luis", 1, 1.35)] or not cuadra(dm, db):
+                    print_error(f"Saldos tras agregar: {saldos} / {en_db(db)}")
+                    return False
+                print_success(f"Saldos al agregar pendientes: {saldos}")
+                
+                # Unir, cobrar y editar
+                dm.unir_recibos_pendientes("Ana")
+                dm.eliminar_recibo_pendiente(dm.obtener_recibos_pendientes_cliente("Luis")[0].fecha)
+                bea = dm.obtener_recibos_pendientes_cliente("Bea")[0]
+                bea.agregar_linea(LineaRecibo(1, "Vermut", 2.5, "Bebida"))
+                dm.guardar_datos_generales()
+                
+                saldos = dm.obtener_saldos_clientes()
+                if saldos != [("Ana", 1, 6.75), ("Bea", 1, 11.95)] or not cuadra(dm, db):
+                    print_error(f"Saldos tras unir, cobrar y editar: {saldos} / {en_db(db)}")
+                    return False
+                print_success(f"Unir, cobrar y editar mantienen los saldos: {saldos}")
+                
+                # Al arrancar se leen de la tabla, sin recorrer los recibos
+                if DataManagerSQLite(db).obtener_saldos_clientes() != saldos:
+                    print_error("Los saldos no se cargan al arrancar")
+                    return False
+                
+                # Una base de datos anterior los reconstruye al migrar
+                # (el diario se vuelca antes: no registra cambios de esquema)
+                db.compactar()
+                with db.get_connection() as conn:
+                    conn.execute("DROP TABLE saldos_clientes")
+                    conn.execute("PRAGMA user_version = 5")
+            finally:
+                db.cerrar()
+                DatabaseConfig.BACKUP_AUTOMATICO = backup_automatico
+            
+            db = DatabaseManagerEncrypted(db_path, modo_sesion=True)
+            migrados = en_db(db)
+            db.cerrar()
+            if migrados != saldos:
+                print_error(f"Saldos reconstruidos al migrar: {migrados}")
+                return False
+            print_success("Los saldos se cargan al arrancar y se reconstruyen al migrar")
+            return True
+        
+    except Exception as e:
+        print_error(f"Error en test de saldos de clientes: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def main():
     """Ejecuta todos los tests."""
     
@@ -552,6 +2747,31 @@ def main():
         ("Rendimiento Básico", test_8_rendimiento),
         ("Sistema de Backup", test_9_backup),
         ("Limpieza de Datos de Prueba", test_10_limpieza),
+        ("Modo Sesión", test_11_modo_sesion),
+        ("Lecturas sin Reescritura", test_12_lectura_sin_reescritura),
+        ("Formato Fragmentado", test_13_formato_fragmentado),
+        ("Cifrado Binario", test_14_cifrado_binario),
+        ("Diario de Commits", test_15_diario_commits),
+        ("Operaciones por Lotes", test_16_lotes),
+        ("Hilo de Persistencia", test_17_hilo_persistencia),
+        ("Fechas Ordenables e Índices", test_18_fechas_indices),
+        ("Recorrido Paginado de Recibos", test_19_iter_recibos),
+        ("Ventas Diarias Agregadas", test_20_ventas_diarias),
+        ("Auditoría Segmentada", test_21_auditoria_segmentada),
+        ("Backups Deduplicados", test_22_backups_deduplicados),
+        ("Backups Programados", test_23_backups_programados),
+        ("Archivo Anual", test_24_archivo_anual),
+        ("Compresión antes de Cifrar", test_25_compresion),
+        ("Servicio de Base de Datos", test_26_servicio),
+        ("Instantáneas de Lectura", test_27_instantaneas),
+        ("Importación Masiva de Recibos", test_28_importacion_masiva),
+        ("Compactación de Páginas Libres", test_29_compactacion_paginas),
+        ("Almacén Clave-Valor en Registro", test_30_almacen_kv),
+        ("Catálogo de Productos en Memoria", test_31_catalogo_productos),
+        ("Caché de Datos de Referencia", test_32_datos_referencia),
+        ("Orden de Productos", test_33_orden_productos),
+        ("Pendientes Guardados por Diferencias", test_34_pendientes_por_diferencias),
+        ("Saldos de Clientes", test_35_saldos_clientes),
     ]
     
     resultados = []
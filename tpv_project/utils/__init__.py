@@ -12,6 +12,7 @@ from .formatters import (
     centrar_texto,
     obtener_listado_lineas,
     formatear_precio,
+    fecha_a_ts,
     calcular_base_imponible,
     calcular_iva
 )
@@ -35,6 +36,7 @@ __all__ = [
     'centrar_texto',
     'obtener_listado_lineas',
     'formatear_precio',
+    'fecha_a_ts',
     'calcular_base_imponible',
     'calcular_iva',
     'validar_precio',
@@ -4,7 +4,9 @@ Utilidades de formateo para la aplicación TPV.
 Este módulo contiene funciones para formatear texto, números y fechas.
 """
 
-from typing import List
+import calendar
+from datetime import date, datetime
+from typing import List, Union
 from config.settings import TicketConfig
 
 
@@ -189,6 +191,51 @@ def formatear_fecha_completa(fecha_str: str) -> str:
     return fecha_str
 
 
+def fecha_a_ts(fecha: Union[str, date, datetime], fin_de_dia: bool = False) -> int:
+    """
+    Convierte una fecha de recibo en una marca de tiempo ordenable.
+
+    El resultado son los segundos desde 01/01/1970 en hora local de pared
+    (sin zona horaria), de modo que `ts // 86400` es siempre el día del
+    recibo, también en los cambios de horario de verano.
+
+    Args:
+        fecha: 'DD/MM/YYYY - HH:MM:SS', 'DD/MM/YYYY', date o datetime
+        fin_de_dia: Si la fecha no lleva hora, devolver el último segundo
+            del día en lugar del primero (límites de rango inclusivos)
+
+    Returns:
+        int: Marca de tiempo
+
+    Raises:
+        ValueError: Si el texto no tiene ninguno de los dos formatos
+
+    Examples:
+        >>> fecha_a_ts('02/01/1970 - 00:00:01')
+        86401
+        >>> fecha_a_ts('01/01/1970', fin_de_dia=True)
+        86399
+    """
+    sin_hora = False
+    if isinstance(fecha, datetime):
+        momento = fecha
+    elif isinstance(fecha, date):
+        momento = datetime(fecha.year, fecha.month, fecha.day)
+        sin_hora = True
+    else:
+        fecha = fecha.strip()
+        try:
+            momento = datetime.strptime(fecha, TicketConfig.DATETIME_FORMAT)
+        except ValueError:
+            momento = datetime.strptime(fecha, TicketConfig.DATE_FORMAT)
+            sin_hora = True
+
+    ts = calendar.timegm(momento.timetuple())
+    if sin_hora and fin_de_dia:
+        ts += 86399
+    return ts
+
+
 def calcular_base_imponible(total: float, iva: float) -> float:
     """
     Calcula la base imponible dado un total con IVA incluido.
@@ -243,6 +290,7 @@ __all__ = [
     'obtener_listado_lineas',
     'formatear_precio',
     'formatear_fecha_completa',
+    'fecha_a_ts',
     'calcular_base_imponible',
     'calcular_iva',
     'limpiar_texto_entrada'
@@ -124,6 +124,11 @@ class MainWindow(Tk):
         self.printer_controller = printer_controller
         self.calendar_controller = calendar_controller
         self.data_manager = data_manager
+        
+        # Redibujar solo los paneles de las familias que cambien
+        suscribir = getattr(self.data_manager.products, 'suscribir', None)
+        if suscribir is not None:
+            suscribir(self._on_productos_cambiados)
     
     def crear_interfaz(self) -> None:
         """Crea toda la interfaz de usuario."""
@@ -575,14 +580,40 @@ class MainWindow(Tk):
     # CARGA DE DATOS
     # ========================================================================
     
-    def cargar_productos(self, productos: List[Product]) -> None:
-        """Carga los productos en los paneles."""
-        # Limpiar marcos existentes
+    @staticmethod
+    def _panel_de_familia(familia: str) -> str:
+        """Panel de productos en el que se muestra una familia."""
+        return familia if familia in ('Bebida', 'Comida') else 'Otros'
+    
+    def cargar_productos(self, productos: List[Product],
+                         familias: Optional[set] = None) -> None:
+        """
+        Carga los productos en los paneles.
+        
+        Args:
+            productos: Productos a mostrar
+            familias: Si se indica, solo se redibujan los paneles de esas
+                familias y se conservan los marcos del resto
+        """
+        paneles = None
+        if familias is not None:
+            paneles = {self._panel_de_familia(f) for f in familias}
+        
+        # Limpiar marcos existentes (de los paneles a redibujar)
+        conservados = []
         for marco in self.marcos_productos:
-            marco.destroy()
-        self.marcos_productos.clear()
+            if paneles is None or marco.panel_producto in paneles:
+                # Una selección de reordenar en un panel redibujado se pierde
+                if marco is self.producto_reordenar_1:
+                    self.producto_reordenar_1 = None
+                if marco is self.producto_reordenar_2:
+                    self.producto_reordenar_2 = None
+                marco.destroy()
+            else:
+                conservados.append(marco)
+        self.marcos_productos[:] = conservados
         
-        # Posiciones por familia
+        # Posiciones por panel
         posiciones = {
             'Bebida': {'x': 5, 'y': 5},
             'Comida': {'x': 5, 'y': 5},
@@ -590,12 +621,14 @@ class MainWindow(Tk):
         }
         
         for producto in productos:
-            familia = producto.familia
+            clave_panel = self._panel_de_familia(producto.familia)
+            if paneles is not None and clave_panel not in paneles:
+                continue
             
             # Determinar panel
-            if familia == 'Bebida':
+            if clave_panel == 'Bebida':
                 panel = self.panel_productos_bebidas
-            elif familia == 'Comida':
+            elif clave_panel == 'Comida':
                 panel = self.panel_productos_comidas
             else:
                 panel = self.panel_productos_otros
@@ -611,7 +644,7 @@ class MainWindow(Tk):
             )
             
             # Posicionar
-            pos = posiciones[familia]
+            pos = posiciones[clave_panel]
             marco.colocar(pos['x'], pos['y'])
             
             # Actualizar posición
@@ -622,15 +655,31 @@ class MainWindow(Tk):
             
             # Datos
             marco.nombre_producto = producto.nombre
+            marco.panel_producto = clave_panel
             
             # Eventos
             marco.bind("<Button-1>", self._on_producto_press)
             marco.bind("<ButtonRelease-1>", self._on_producto_release)
             
+            # En modo reordenar los marcos redibujados (p. ej. tras un
+            # intercambio) se ven igual que el resto
+            if self.modo_reordenar_activo:
+                marco.cambiar_fondo(ColorScheme.REORDER)
+                marco.invertir_colores()
+            
             self.marcos_productos.append(marco)
         
-        # Mostrar bebidas por defecto
-        self.panel_productos_bebidas.traer_al_frente()
+        # Mostrar bebidas por defecto (solo en la carga completa)
+        if paneles is None:
+            self.panel_productos_bebidas.traer_al_frente()
+    
+    def _on_productos_cambiados(self, familias: set) -> None:
+        """Redibuja los paneles de las familias cuyo catálogo ha cambiado."""
+        # Todavía no se ha creado la interfaz
+        if not hasattr(self, 'panel_productos_bebidas'):
+            return
+        productos = self.data_manager.products.obtener_todos()
+        self.cargar_productos(productos, familias)
     
     def cargar_camareros(self) -> None:
         """Carga los camareros en el panel de selección."""
@@ -977,30 +1026,14 @@ class MainWindow(Tk):
 
     def _cargar_clientes_con_tickets(self) -> None:
         """Carga la lista de clientes con sus tickets pendientes."""
-        # Obtener todos los recibos pendientes
-        recibos_pendientes = self.data_manager.receipts_pending
-        
-        # Agrupar por cliente y contar tickets
-        clientes_dict = {}
-        for recibo in recibos_pendientes:
-            nombre_cliente = recibo.nombre
-            if nombre_cliente not in clientes_dict:
-                clientes_dict[nombre_cliente] = {
-                    'count': 0,
-                    'total': 0.0
-                }
-            clientes_dict[nombre_cliente]['count'] += 1
-            clientes_dict[nombre_cliente]['total'] += recibo.calcular_total()
+        # Tickets y total por cliente, ya agrupados y ordenados por nombre
+        saldos = self.data_manager.obtener_saldos_clientes()
         
         # Crear lista formateada
         items = []
         colores = []
         
-        for nombre_cliente in sorted(clientes_dict.keys()):
-            info = clientes_dict[nombre_cliente]
-            tickets_count = info['count']
-            total = info['total']
-            
+        for nombre_cliente, tickets_count, total in saldos:
             # Formato: "Nombre Cliente - 3 tickets - 45.50€"
             item = f"{nombre_cliente} - {tickets_count} ticket{'s' if tickets_count > 1 else ''} - {total:.2f}€"
             items.append(item)
@@ -1521,11 +1554,12 @@ class MainWindow(Tk):
     def _volver_desde_teclado(self) -> None:
         """Vuelve desde el teclado virtual al panel principal."""
         # Actualizar productos si estábamos en modo producto
-
+        # (con avisos de cambios los paneles ya están al día)
         if self.keyboard_view.modo_actual == ModeConfig.MODO_PRODUCTO:
-            productos = self.data_manager.products.obtener_todos()
-            self.cargar_productos(productos)
-            print("DEBUG: Productos recargados al volver del teclado virtual")
+            if not hasattr(self.data_manager.products, 'suscribir'):
+                productos = self.data_manager.products.obtener_todos()
+                self.cargar_productos(productos)
+                print("DEBUG: Productos recargados al volver del teclado virtual")
         
         # Actualizar impagos si estábamos en modo pendiente
         elif self.keyboard_view.modo_actual == ModeConfig.MODO_PENDIENTE:
@@ -1810,25 +1844,20 @@ class MainWindow(Tk):
         if filtro == 'todos':
             # Todos los clientes (con y sin tickets)
             todos_clientes = self.data_manager.customers.obtener_todos()
-            recibos_pendientes = self.data_manager.receipts_pending
             
-            # Agrupar tickets por cliente
-            tickets_por_cliente = {}
-            for recibo in recibos_pendientes:
-                nombre = recibo.nombre
-                if nombre not in tickets_por_cliente:
-                    tickets_por_cliente[nombre] = []
-                tickets_por_cliente[nombre].append(recibo)
+            # Tickets y total por cliente, ya agrupados
+            saldos = {
+                cliente: (count, total)
+                for cliente, count, total in self.data_manager.obtener_saldos_clientes()
+            }
             
             # Crear lista
             items = []
             colores = []
             
             for cliente in sorted(todos_clientes):
-                if cliente in tickets_por_cliente:
-                    tickets = tickets_por_cliente[cliente]
-                    count = len(tickets)
-                    total = sum(r.calcular_total() for r in tickets)
+                if cliente in saldos:
+                    count, total = saldos[cliente]
                     item = f"{cliente} - {count} ticket{'s' if count > 1 else ''} - {total:.2f}€"
                     color = 'red' if count > 3 else 'orange' if count > 1 else 'black'
                 else:
@@ -1843,30 +1872,14 @@ class MainWindow(Tk):
             self.keyboard_view.actualizar_info(mensaje)
         
         elif filtro == 'pendientes':
-            # Solo clientes con tickets pendientes
-            recibos_pendientes = self.data_manager.receipts_pending
-            
-            # Agrupar por cliente y contar tickets
-            clientes_dict = {}
-            for recibo in recibos_pendientes:
-                nombre_cliente = recibo.nombre
-                if nombre_cliente not in clientes_dict:
-                    clientes_dict[nombre_cliente] = {
-                        'count': 0,
-                        'total': 0.0
-                    }
-                clientes_dict[nombre_cliente]['count'] += 1
-                clientes_dict[nombre_cliente]['total'] += recibo.calcular_total()
+            # Solo clientes con tickets pendientes (ya agrupados y ordenados)
+            saldos = self.data_manager.obtener_saldos_clientes()
             
             # Crear lista formateada
             items = []
             colores = []
             
-            for nombre_cliente in sorted(clientes_dict.keys()):
-                info = clientes_dict[nombre_cliente]
-                tickets_count = info['count']
-                total = info['total']
-                
+            for nombre_cliente, tickets_count, total in saldos:
                 # Formato: "Nombre Cliente - 3 tickets - 45.50€"
                 item = f"{nombre_cliente} - {tickets_count} ticket{'s' if tickets_count > 1 else ''} - {total:.2f}€"
                 items.append(item)
@@ -1892,7 +1905,9 @@ class MainWindow(Tk):
         elif filtro == 'pagados':
             # Clientes sin tickets pendientes
             todos_clientes = self.data_manager.customers.obtener_todos()
-            clientes_con_tickets = set(r.nombre for r in self.data_manager.receipts_pending)
+            clientes_con_tickets = {
+                cliente for cliente, _, _ in self.data_manager.obtener_saldos_clientes()
+            }
             
             clientes_sin_tickets = [c for c in todos_clientes if c not in clientes_con_tickets]
             
@@ -1932,9 +1947,16 @@ class MainWindow(Tk):
         recibo = recibos_cliente[0]
         self.receipt_controller.establecer_recibo_actual(recibo)
         
-        # Eliminar de pendientes (se volverá a guardar si no se paga)
-        self.data_manager.eliminar_recibo_pendiente(recibo.fecha)
-        self.data_manager.guardar_datos_generales()
+        # Quitar de pendientes. Donde se puede, el recibo sigue en la base de
+        # datos: al volver a guardarlo solo se escriben sus cambios y al
+        # cobrarlo se borra
+        retirar = getattr(self.data_manager, 'retirar_recibo_pendiente', None)
+        if retirar is not None:
+            retirar(recibo.fecha)
+        else:
+            # Se volverá a guardar si no se paga
+            self.data_manager.eliminar_recibo_pendiente(recibo.fecha)
+            self.data_manager.guardar_datos_generales()
         
         # Actualizar ticket en pantalla
         self._actualizar_ticket()
@@ -2239,9 +2261,6 @@ class MainWindow(Tk):
         self.marcos_productos[idx1], self.marcos_productos[idx2] = \
             self.marcos_productos[idx2], self.marcos_productos[idx1]
         
-        # Intercambiar en la base de datos
-        self._intercambiar_productos_db(nombre1, nombre2)
-        
         # CORRECCIÓN: REACTIVAR ambos productos (estaban desactivados)
         if not self.producto_reordenar_1.invertido:
             self.producto_reordenar_1.invertir_colores()
@@ -2251,6 +2270,10 @@ class MainWindow(Tk):
         # Limpiar selecciones
         self.producto_reordenar_1 = None
         self.producto_reordenar_2 = None
+        
+        # Intercambiar en la base de datos (el aviso de cambios puede
+        # redibujar el panel, por eso va después de tocar los marcos)
+        self._intercambiar_productos_db(nombre1, nombre2)
 
     def _intercambiar_productos_db(self, nombre1: str, nombre2: str) -> None:
         """
@@ -2260,6 +2283,13 @@ class MainWindow(Tk):
             nombre1: Nombre del primer producto
             nombre2: Nombre del segundo producto
         """
+        # Con posiciones en la base de datos basta con actualizar dos filas
+        intercambiar = getattr(self.data_manager.products, 'intercambiar_productos', None)
+        if intercambiar is not None:
+            if intercambiar(nombre1, nombre2):
+                print(f"Productos intercambiados: {nombre1} ↔ {nombre2}")
+            return
+        
         # Obtener todos los productos
         todos_productos = self.data_manager.products.obtener_todos()
         
@@ -2278,10 +2308,11 @@ class MainWindow(Tk):
             todos_productos[idx1], todos_productos[idx2] = \
                 todos_productos[idx2], todos_productos[idx1]
             
-            # Limpiar y recargar productos en el gestor
-            self.data_manager.products.limpiar()
-            for producto in todos_productos:
-                self.data_manager.products.agregar_producto(producto)
+            # Limpiar y recargar productos en el gestor (una sola transacción)
+            with self.data_manager.batch():
+                self.data_manager.products.limpiar()
+                for producto in todos_productos:
+                    self.data_manager.products.agregar_producto(producto)
             
             # Guardar en disco
             self.data_manager.guardar_datos_generales()
@@ -2300,6 +2331,8 @@ class MainWindow(Tk):
                 self.data_manager.guardar_recibos_anuales(
                     self.receipt_controller.receipt_manager
                 )
+                # Forzar el volcado de los commits pendientes
+                self.data_manager.cerrar()
             except Exception as e:
                 print(f"Error al guardar datos: {e}")
             